@@ -289,6 +289,14 @@ try:
     db.setup()
     logger.info("Database initialized successfully")
     
+    # 🗑️ پاک‌سازی file_id های قدیمی delivery cache
+    removed = db.cleanup_old_delivery_entries(config.DELIVERY_CACHE_TTL_DAYS)
+    if removed:
+        logger.info(f"Delivery cache: removed {removed} expired entries")
+    removed = db.cleanup_expired_api_cache()
+    if removed:
+        logger.info(f"API cache: removed {removed} expired entries")
+    
     def cleanup_database():
         try:
             if db:
@@ -566,6 +574,15 @@ async def main():
             except Exception as e:
                 logger.warning(f"⚠️ Health Monitor غیرفعال شد: {e}")
             
+            # 🎚️ Start Adaptive Concurrency Controller
+            try:
+                from plugins.adaptive_concurrency import adaptive_concurrency
+                task = asyncio.create_task(adaptive_concurrency.start())
+                background_tasks.append(task)
+                logger.info("✅ Adaptive concurrency controller started")
+            except Exception as e:
+                logger.warning(f"⚠️ Adaptive concurrency غیرفعال شد: {e}")
+            
             # 🧠 Start Memory Monitor
             logger.info("🔄 تلاش برای راه‌اندازی Memory Monitor...")
             try:
@@ -605,6 +622,13 @@ async def main():
                 await asyncio.gather(*background_tasks, return_exceptions=True)
                 logger.info("✅ Background tasks متوقف شدند")
             
+            # Stop job queue workers and flush the durable queue (running jobs return to queued)
+            try:
+                from plugins.job_queue import shutdown_job_queue
+                await shutdown_job_queue()
+            except Exception as e:
+                logger.warning(f"خطا در توقف صف job ها: {e}")
+            
             # Stop Cookie Validator
             try:
                 logger.info("🍪 در حال توقف Cookie Validator...")
@@ -613,6 +637,41 @@ async def main():
             except Exception as e:
                 logger.warning(f"خطا در توقف Cookie Validator: {e}")
             
+            # Close shared HTTP session
+            try:
+                from plugins.http_client import http_client
+                await http_client.close()
+            except Exception as e:
+                logger.warning(f"خطا در بستن HTTP session: {e}")
+            
+            # Stop parallel upload connections
+            try:
+                from plugins.part_uploader import upload_pool
+                await upload_pool.stop()
+            except Exception as e:
+                logger.warning(f"خطا در توقف upload pool: {e}")
+            
+            # Stop running ffmpeg jobs
+            try:
+                from plugins.ffmpeg_runner import ffmpeg_runner
+                await ffmpeg_runner.cancel_all()
+            except Exception as e:
+                logger.warning(f"خطا در توقف پروسه‌های ffmpeg: {e}")
+            
+            # Close pooled yt-dlp instances (saves cookie jars)
+            try:
+                from plugins.ytdlp_pool import ytdlp_pool
+                ytdlp_pool.close_all()
+            except Exception as e:
+                logger.warning(f"خطا در بستن yt-dlp pool: {e}")
+            
+            # Stop yt-dlp worker processes
+            try:
+                from plugins.ytdlp_process_pool import ytdlp_process_pool
+                ytdlp_process_pool.close()
+            except Exception as e:
+                logger.warning(f"خطا در توقف worker های yt-dlp: {e}")
+            
             # Stop client
             try:
                 logger.info("🔌 در حال توقف Client...")
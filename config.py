@@ -1,5 +1,6 @@
 import os
 import sys
+import tempfile
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -128,6 +129,68 @@ RECOVER_JOBS_ON_STARTUP = str(os.environ.get("RECOVER_JOBS_ON_STARTUP", "false")
 # If recovery is enabled, control whether to notify users for recovered items
 RECOVERY_NOTIFY_USERS = str(os.environ.get("RECOVERY_NOTIFY_USERS", "false")).strip().lower() in ("1", "true", "yes")
 
+
+# ============================================================
+# JOB QUEUE (FAIR SCHEDULING)
+# ============================================================
+# Deficit round-robin over per-user queues; weight = relative share of workers per tier
+# format: "admin=4,premium=2,default=1"
+JOB_QUEUE_TIER_WEIGHTS = {
+    'default': 1.0,
+    'premium': 2.0,
+    'admin': 4.0,
+}
+for _item in os.environ.get("JOB_QUEUE_TIER_WEIGHTS", "").split(","):
+    if "=" in _item:
+        _name, _weight = _item.split("=", 1)
+        try:
+            JOB_QUEUE_TIER_WEIGHTS[_name.strip().lower()] = max(0.1, float(_weight))
+        except ValueError:
+            print(f"WARNING: Invalid JOB_QUEUE_TIER_WEIGHTS entry: {_item}")
+# Shortest-expected-job-first: estimated seconds forgiven per second waited (aging), cost ceiling,
+# and the DRR quantum (expected seconds a weight-1 user may consume per round)
+JOB_AGING_RATE = float(os.environ.get("JOB_AGING_RATE", "1.0"))
+JOB_COST_CAP = float(os.environ.get("JOB_COST_CAP", "900"))
+JOB_COST_QUANTUM = float(os.environ.get("JOB_COST_QUANTUM", "60"))
+# Per-user tier overrides, format: "123456=premium,789=premium" (admins are always 'admin')
+JOB_QUEUE_USER_TIERS = {}
+for _item in os.environ.get("JOB_QUEUE_USER_TIERS", "").split(","):
+    if "=" in _item:
+        _uid, _tier = _item.split("=", 1)
+        if _uid.strip().isdigit():
+            JOB_QUEUE_USER_TIERS[int(_uid)] = _tier.strip().lower()
+        else:
+            print(f"WARNING: Invalid JOB_QUEUE_USER_TIERS entry: {_item}")
+# Durable queue (job_queue table): lease length, heartbeat period and group-commit window
+# for non-critical state writes (status/progress), all in seconds
+JOB_LEASE_SECONDS = float(os.environ.get("JOB_LEASE_SECONDS", "90"))
+JOB_HEARTBEAT_INTERVAL = float(os.environ.get("JOB_HEARTBEAT_INTERVAL", "30"))
+JOB_COMMIT_INTERVAL = float(os.environ.get("JOB_COMMIT_INTERVAL", "0.5"))
+
+
+# ============================================================
+# ADAPTIVE CONCURRENCY
+# ============================================================
+# AIMD controller that resizes the download slots at runtime from measured
+# bandwidth, event-loop lag, RSS / memory pressure and free disk.
+# MAX_CONCURRENT_DOWNLOADS (env) stays the starting point; when the operator sets it explicitly
+# it is also the default ceiling (the controller may shrink below it, never grow past it)
+# unless ADAPTIVE_CONCURRENCY_MAX is set too.
+ADAPTIVE_CONCURRENCY_ENABLED = os.environ.get("ADAPTIVE_CONCURRENCY_ENABLED", "true").lower() == "true"
+_pinned_downloads = os.environ.get("MAX_CONCURRENT_DOWNLOADS", "").strip()
+_pinned_downloads = max(1, int(_pinned_downloads)) if _pinned_downloads.isdigit() else None
+ADAPTIVE_CONCURRENCY_MIN = max(1, int(os.environ.get("ADAPTIVE_CONCURRENCY_MIN", "2")))
+if _pinned_downloads is not None and "ADAPTIVE_CONCURRENCY_MAX" not in os.environ:
+    ADAPTIVE_CONCURRENCY_MIN = min(ADAPTIVE_CONCURRENCY_MIN, _pinned_downloads)
+    ADAPTIVE_CONCURRENCY_MAX = _pinned_downloads
+else:
+    ADAPTIVE_CONCURRENCY_MAX = max(ADAPTIVE_CONCURRENCY_MIN, int(os.environ.get("ADAPTIVE_CONCURRENCY_MAX", "48")))
+ADAPTIVE_CONCURRENCY_INTERVAL = max(5.0, float(os.environ.get("ADAPTIVE_CONCURRENCY_INTERVAL", "30")))
+# Guard rails: any of these forces a multiplicative decrease
+ADAPTIVE_MAX_RSS_MB = int(os.environ.get("ADAPTIVE_MAX_RSS_MB", "2048"))
+ADAPTIVE_MAX_MEMORY_PERCENT = float(os.environ.get("ADAPTIVE_MAX_MEMORY_PERCENT", "85"))
+ADAPTIVE_MAX_LOOP_LAG = float(os.environ.get("ADAPTIVE_MAX_LOOP_LAG", "0.5"))
+
 youtube_next_fetch = 1  # time in minute
 
 EDIT_TIME = 5
@@ -150,11 +213,106 @@ TELEGRAM_THROTTLING = {
 }
 
 
+# ============================================================
+# HTTP CLIENT POOL
+# ============================================================
+# session مشترک aiohttp برای همه دانلودها (keep-alive + کش DNS)
+HTTP_POOL_LIMIT = int(os.environ.get("HTTP_POOL_LIMIT", "100"))
+HTTP_LIMIT_PER_HOST = int(os.environ.get("HTTP_LIMIT_PER_HOST", "16"))
+HTTP_DNS_TTL = int(os.environ.get("HTTP_DNS_TTL", "300"))  # seconds
+HTTP_KEEPALIVE_TIMEOUT = float(os.environ.get("HTTP_KEEPALIVE_TIMEOUT", "30"))
+
+
+# ============================================================
+# PARALLEL UPLOAD CONFIGURATION
+# ============================================================
+# آپلود همزمان قطعات (saveBigFilePart) روی چند اتصال media برای فایل‌های بزرگ
+PARALLEL_UPLOAD_ENABLED = str(os.environ.get("PARALLEL_UPLOAD_ENABLED", "true")).strip().lower() in ("1", "true", "yes")
+PARALLEL_UPLOAD_MIN_SIZE_MB = int(os.environ.get("PARALLEL_UPLOAD_MIN_SIZE_MB", "20"))
+PARALLEL_UPLOAD_CONNECTIONS = max(1, int(os.environ.get("PARALLEL_UPLOAD_CONNECTIONS", "4")))  # media-DC sessions
+PARALLEL_UPLOAD_PARTS_IN_FLIGHT = max(1, int(os.environ.get("PARALLEL_UPLOAD_PARTS_IN_FLIGHT", "8")))
+
+
+# ============================================================
+# MEDIA PROBE (FFPROBE)
+# ============================================================
+# سرویس async برای ffprobe/thumbnail با محدودیت همزمانی و کش نتایج
+MEDIA_PROBE_CONCURRENCY = max(1, int(os.environ.get("MEDIA_PROBE_CONCURRENCY", "4")))
+MEDIA_PROBE_TIMEOUT = float(os.environ.get("MEDIA_PROBE_TIMEOUT", "10"))  # seconds per ffprobe call
+MEDIA_PROBE_CACHE_SIZE = int(os.environ.get("MEDIA_PROBE_CACHE_SIZE", "256"))
+
+# ============================================================
+# FFMPEG RUNNER
+# ============================================================
+# همه پروسه‌های ffmpeg (remux/merge/audio/thumbnail) از یک pool با سقف CPU عبور می‌کنند
+FFMPEG_MAX_CONCURRENT = max(1, int(os.environ.get("FFMPEG_MAX_CONCURRENT", str(max(1, (os.cpu_count() or 2) // 2)))))
+FFMPEG_NICE = int(os.environ.get("FFMPEG_NICE", "10"))  # 0 = disabled
+FFMPEG_IONICE = str(os.environ.get("FFMPEG_IONICE", "true")).strip().lower() in ("1", "true", "yes")  # idle-ish disk priority
+FFMPEG_JOB_TIMEOUT = float(os.environ.get("FFMPEG_JOB_TIMEOUT", "1800"))  # seconds
+# stream copy وقتی codec ها برای تلگرام مناسب‌اند (m4a/opus بدون تبدیل به mp3، merge بدون encode صدا)
+TRANSCODE_PASSTHROUGH = str(os.environ.get("TRANSCODE_PASSTHROUGH", "true")).strip().lower() in ("1", "true", "yes")
+TRANSCODE_AUDIO_BITRATE = os.environ.get("TRANSCODE_AUDIO_BITRATE", "192k")  # mp3 when transcoding is needed
+TRANSCODE_MERGE_AUDIO_BITRATE = os.environ.get("TRANSCODE_MERGE_AUDIO_BITRATE", "128k")  # aac in mp4
+
+# ============================================================
+# YT-DLP POOL
+# ============================================================
+# نمونه‌های YoutubeDL بر اساس profile (کوکی، player_client، ...) گرم نگه داشته می‌شوند
+YTDLP_POOL_ENABLED = str(os.environ.get("YTDLP_POOL_ENABLED", "true")).strip().lower() in ("1", "true", "yes")
+YTDLP_POOL_MAX_IDLE = int(os.environ.get("YTDLP_POOL_MAX_IDLE", "4"))  # idle instances per profile
+YTDLP_POOL_MAX_USES = int(os.environ.get("YTDLP_POOL_MAX_USES", "50"))  # recycle after N jobs
+YTDLP_POOL_MAX_AGE = int(os.environ.get("YTDLP_POOL_MAX_AGE", "1800"))  # recycle after N seconds
+# player JS / signature cache, persisted across restarts
+YTDLP_CACHE_DIR = os.environ.get("YTDLP_CACHE_DIR", "./data/yt-dlp-cache")
+# اجرای extract/download یوتیوب در worker process ها (خارج از GIL پروسه اصلی)
+YTDLP_PROCESS_POOL_ENABLED = str(os.environ.get("YTDLP_PROCESS_POOL_ENABLED", "false")).strip().lower() in ("1", "true", "yes")
+YTDLP_PROCESS_WORKERS = int(os.environ.get("YTDLP_PROCESS_WORKERS", "2"))
+YTDLP_PROCESS_MAX_JOBS = int(os.environ.get("YTDLP_PROCESS_MAX_JOBS", "25"))  # recycle worker after N jobs
+YTDLP_PROCESS_COOLDOWN = int(os.environ.get("YTDLP_PROCESS_COOLDOWN", "60"))  # thread fallback after pool failure
+# سهم worker ها از FFMPEG_MAX_CONCURRENT (semaphore جدا)؛ بقیه برای FFmpegRunner پروسه اصلی می‌ماند.
+# هر طرف حداقل ۱ slot دارد، پس با FFMPEG_MAX_CONCURRENT=1 سقف واقعی ۲ است
+YTDLP_PROCESS_FFMPEG_SLOTS = max(1, FFMPEG_MAX_CONCURRENT // 2) if YTDLP_PROCESS_POOL_ENABLED else 0
+
+# ============================================================
+# SEGMENTED DOWNLOAD
+# ============================================================
+# لینک‌های مستقیم CDN با چند اتصال Range همزمان دانلود می‌شوند (اگر سرور پشتیبانی کند)
+SEGMENTED_DOWNLOAD_ENABLED = str(os.environ.get("SEGMENTED_DOWNLOAD_ENABLED", "true")).strip().lower() in ("1", "true", "yes")
+SEGMENTED_MIN_SIZE_MB = float(os.environ.get("SEGMENTED_MIN_SIZE_MB", "8"))  # smaller files: single stream
+SEGMENTED_PIECE_SIZE_MB = float(os.environ.get("SEGMENTED_PIECE_SIZE_MB", "2"))
+SEGMENTED_INITIAL_CONNECTIONS = int(os.environ.get("SEGMENTED_INITIAL_CONNECTIONS", "2"))
+SEGMENTED_MAX_CONNECTIONS = int(os.environ.get("SEGMENTED_MAX_CONNECTIONS", "6"))  # grown while throughput improves
+
+# ============================================================
+# JOB WORKSPACES
+# ============================================================
+# هر job یک پوشه یکتا دارد و حجم مورد انتظارش قبل از شروع روی دیسک رزرو می‌شود
+WORKSPACE_ROOT = os.environ.get("WORKSPACE_ROOT", os.path.join(tempfile.gettempdir(), "bot_jobs"))
+WORKSPACE_MIN_FREE_MB = int(os.environ.get("WORKSPACE_MIN_FREE_MB", "1024"))  # headroom never reserved
+WORKSPACE_DEFAULT_RESERVE_MB = int(os.environ.get("WORKSPACE_DEFAULT_RESERVE_MB", "50"))  # size unknown
+WORKSPACE_WAIT_TIMEOUT = int(os.environ.get("WORKSPACE_WAIT_TIMEOUT", "120"))  # queue, then reject
+
 # ============================================================
 # YOUTUBE CONFIGURATION
 # ============================================================
 # با توجه به نتایج عملی، فایل نهایی معمولاً حدود 30-35% از مجموع ویدیو+صدا است
 YOUTUBE_FILESIZE_CORRECTION_FACTOR = float(os.environ.get("YOUTUBE_FILESIZE_CORRECTION_FACTOR", "0.30"))
+# کش اطلاعات ویدیو (کلید: video id) بین کاربران
+YOUTUBE_INFO_CACHE_TTL = int(os.environ.get("YOUTUBE_INFO_CACHE_TTL", "1800"))  # fresh period
+YOUTUBE_INFO_STALE_TTL = int(os.environ.get("YOUTUBE_INFO_STALE_TTL", "3600"))  # served stale while refreshing
+# entries never outlive the signed googlevideo URLs (expire=...) minus this margin
+YOUTUBE_INFO_EXPIRY_MARGIN = int(os.environ.get("YOUTUBE_INFO_EXPIRY_MARGIN", "900"))
+# دانلودهای ناتمام (.part) برای ادامه با Range نگه داشته می‌شوند تا این مدت
+YOUTUBE_PARTIAL_TTL = int(os.environ.get("YOUTUBE_PARTIAL_TTL", "21600"))
+# پاسخ دو مرحله‌ای: کارت پیش‌نمایش (oEmbed + thumbnail از i.ytimg.com) قبل از استخراج کامل
+YOUTUBE_PREVIEW_ENABLED = str(os.environ.get("YOUTUBE_PREVIEW_ENABLED", "true")).strip().lower() in ("1", "true", "yes")
+YOUTUBE_PREVIEW_TIMEOUT = float(os.environ.get("YOUTUBE_PREVIEW_TIMEOUT", "3"))  # oEmbed wait before the plain status message
+YOUTUBE_PREVIEW_CACHE_TTL = int(os.environ.get("YOUTUBE_PREVIEW_CACHE_TTL", "86400"))
+# دانلود حدسی محتمل‌ترین کیفیت در زمانی که کیبورد کیفیت‌ها نمایش داده می‌شود
+YOUTUBE_PREFETCH_ENABLED = str(os.environ.get("YOUTUBE_PREFETCH_ENABLED", "false")).strip().lower() in ("1", "true", "yes")
+YOUTUBE_PREFETCH_MAX_ACTIVE = int(os.environ.get("YOUTUBE_PREFETCH_MAX_ACTIVE", "2"))  # concurrent prefetches
+YOUTUBE_PREFETCH_MAX_MB = int(os.environ.get("YOUTUBE_PREFETCH_MAX_MB", "150"))  # skip larger formats
+YOUTUBE_PREFETCH_MIN_SHARE = float(os.environ.get("YOUTUBE_PREFETCH_MIN_SHARE", "0.5"))  # global choice share
 
 
 # ============================================================
@@ -173,6 +331,50 @@ RAPIDAPI_RATE_WINDOW = int(os.environ.get("RAPIDAPI_RATE_WINDOW", "60"))  # 60 s
 print(f"✅ RapidAPI Rate Limit: {RAPIDAPI_RATE_LIMIT} requests per {RAPIDAPI_RATE_WINDOW} seconds")
 
 
+# ============================================================
+# API RESPONSE CACHE (RAPIDAPI / INSTAGRAM)
+# ============================================================
+# کش مشترک پاسخ‌های API برای جلوگیری از مصرف سهمیه روی لینک‌های تکراری
+API_CACHE_ENABLED = str(os.environ.get("API_CACHE_ENABLED", "true")).strip().lower() in ("1", "true", "yes")
+API_CACHE_MAX_ENTRIES = int(os.environ.get("API_CACHE_MAX_ENTRIES", "1000"))
+API_CACHE_PERSIST = str(os.environ.get("API_CACHE_PERSIST", "true")).strip().lower() in ("1", "true", "yes")
+API_CACHE_NEGATIVE_TTL = int(os.environ.get("API_CACHE_NEGATIVE_TTL", "900"))  # private/deleted answers
+# Per-platform TTL in seconds, format: "instagram=300,tiktok=600"
+# (لینک‌های CDN امضا شده‌اند و منقضی می‌شوند؛ TTL باید از عمر آن‌ها کمتر باشد)
+API_CACHE_TTLS = {
+    'default': 600,
+    'instagram': 300,
+    'tiktok': 600,
+    'spotify': 3600,
+    'soundcloud': 1800,
+}
+for _item in os.environ.get("API_CACHE_TTLS", "").split(","):
+    if "=" in _item:
+        _name, _ttl = _item.split("=", 1)
+        try:
+            API_CACHE_TTLS[_name.strip().lower()] = int(_ttl)
+        except ValueError:
+            print(f"WARNING: Invalid API_CACHE_TTLS entry: {_item}")
+
+
+# ============================================================
+# DELIVERY CACHE (TELEGRAM FILE_ID REUSE)
+# ============================================================
+# ارسال مجدد فایل‌های قبلاً آپلود شده با file_id به جای دانلود+آپلود دوباره
+DELIVERY_CACHE_ENABLED = str(os.environ.get("DELIVERY_CACHE_ENABLED", "true")).strip().lower() in ("1", "true", "yes")
+DELIVERY_CACHE_MAX_ENTRIES = int(os.environ.get("DELIVERY_CACHE_MAX_ENTRIES", "2000"))  # in-memory LRU size
+DELIVERY_CACHE_TTL_DAYS = int(os.environ.get("DELIVERY_CACHE_TTL_DAYS", "30"))
+# Optional private channel (bot must be admin) for mirroring uploaded media
+STORAGE_CHANNEL_ID = os.environ.get("STORAGE_CHANNEL_ID")
+
+if STORAGE_CHANNEL_ID:
+    try:
+        STORAGE_CHANNEL_ID = int(STORAGE_CHANNEL_ID)
+    except (ValueError, TypeError):
+        print("WARNING: STORAGE_CHANNEL_ID must be a valid integer, storage mirroring disabled")
+        STORAGE_CHANNEL_ID = None
+
+
 # ============================================================
 # CONFIGURATION SUMMARY
 # ============================================================
@@ -187,4 +389,16 @@ print(f"✅ RapidAPI Key: {'Set' if RAPIDAPI_KEY else 'Missing'}")
 print(f"✅ Cookie Directory: {COOKIE_BASE_DIR}")
 print(f"✅ FFmpeg Path: {FFMPEG_PATH}")
 print(f"✅ Proxy: {'Enabled' if PROXY_HOST else 'Disabled'}")
+print(f"✅ Parallel Upload: {'Enabled' if PARALLEL_UPLOAD_ENABLED else 'Disabled'} ({PARALLEL_UPLOAD_CONNECTIONS} connections, {PARALLEL_UPLOAD_PARTS_IN_FLIGHT} parts in flight)")
+print(f"✅ FFmpeg Runner: {FFMPEG_MAX_CONCURRENT} concurrent jobs{f' ({YTDLP_PROCESS_FFMPEG_SLOTS} in yt-dlp workers)' if YTDLP_PROCESS_FFMPEG_SLOTS else ''} (nice {FFMPEG_NICE}, ionice: {'on' if FFMPEG_IONICE else 'off'})")
+print(f"✅ Transcode Policy: {'stream copy when compatible' if TRANSCODE_PASSTHROUGH else 'always transcode'}")
+print(f"✅ yt-dlp Pool: {'enabled' if YTDLP_POOL_ENABLED else 'disabled'} ({YTDLP_POOL_MAX_IDLE} idle/profile, cache: {YTDLP_CACHE_DIR})")
+print(f"✅ yt-dlp Workers: {f'{YTDLP_PROCESS_WORKERS} processes (recycle after {YTDLP_PROCESS_MAX_JOBS} jobs)' if YTDLP_PROCESS_POOL_ENABLED else 'disabled (threads)'}")
+print(f"✅ Job Queue: fair SJF scheduling (weights: {', '.join(f'{k}={v:g}' for k, v in JOB_QUEUE_TIER_WEIGHTS.items())}, aging {JOB_AGING_RATE:g}, lease {JOB_LEASE_SECONDS:g}s)")
+print(f"✅ Adaptive Concurrency: {f'enabled ({ADAPTIVE_CONCURRENCY_MIN}-{ADAPTIVE_CONCURRENCY_MAX} slots, every {ADAPTIVE_CONCURRENCY_INTERVAL:g}s)' if ADAPTIVE_CONCURRENCY_ENABLED else 'disabled (static)'}")
+print(f"✅ Workspaces: {WORKSPACE_ROOT} (min free {WORKSPACE_MIN_FREE_MB}MB, wait {WORKSPACE_WAIT_TIMEOUT}s)")
+print(f"✅ YouTube Preview: {f'enabled (oEmbed timeout {YOUTUBE_PREVIEW_TIMEOUT}s)' if YOUTUBE_PREVIEW_ENABLED else 'disabled'}")
+print(f"✅ YouTube Prefetch: {f'enabled ({YOUTUBE_PREFETCH_MAX_ACTIVE} active, max {YOUTUBE_PREFETCH_MAX_MB}MB)' if YOUTUBE_PREFETCH_ENABLED else 'disabled'}")
+print(f"✅ API Cache: {'Enabled' if API_CACHE_ENABLED else 'Disabled'} (max {API_CACHE_MAX_ENTRIES}, persist: {'on' if API_CACHE_PERSIST else 'off'})")
+print(f"✅ Delivery Cache: {'Enabled' if DELIVERY_CACHE_ENABLED else 'Disabled'} (storage channel: {'Set' if STORAGE_CHANNEL_ID else 'None'})")
 print("=" * 70)
@@ -0,0 +1,244 @@
+"""
+Adaptive Concurrency - کنترلر AIMD برای ظرفیت slot های دانلود
+ظرفیت قبلاً یک بار هنگام import از cpu_count × 4 ثابت می‌شد و به پهنای باند واقعی،
+فشار حافظه یا دیسک واکنش نشان نمی‌داد.
+
+هر ADAPTIVE_CONCURRENCY_INTERVAL ثانیه:
+- guard rail ها (RSS، درصد حافظه سیستم، تأخیر event loop، فضای دیسک workspace) →
+  کاهش ضربی (× DECREASE_FACTOR) و چند دوره توقف افزایش
+- تقاضا (منتظر slot یا همه slot ها مشغول) و منابع سالم → افزایش جمعی (+1)
+- گرادیان: اگر slot اضافه‌شده استفاده شد ولی پهنای باند (bytes/s شبکه) بیشتر نشد،
+  لینک اشباع است و افزایش برگردانده می‌شود
+- ظرفیت همیشه بین ADAPTIVE_CONCURRENCY_MIN و ADAPTIVE_CONCURRENCY_MAX می‌ماند
+
+Pyrogram workers و ThreadPoolExecutor های استخراج در زمان اجرا قابل تغییر اندازه نیستند؛
+کنترلر فقط slot های دانلود (concurrency.set_capacity) را تنظیم می‌کند.
+"""
+
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Optional
+
+from plugins.logger_config import get_logger
+from plugins import concurrency
+from plugins.workspace_manager import workspace_manager
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+try:
+    from config import (
+        ADAPTIVE_CONCURRENCY_ENABLED, ADAPTIVE_CONCURRENCY_MIN, ADAPTIVE_CONCURRENCY_MAX,
+        ADAPTIVE_CONCURRENCY_INTERVAL, ADAPTIVE_MAX_RSS_MB, ADAPTIVE_MAX_MEMORY_PERCENT,
+        ADAPTIVE_MAX_LOOP_LAG,
+    )
+except Exception:
+    ADAPTIVE_CONCURRENCY_ENABLED = True
+    ADAPTIVE_CONCURRENCY_MIN = 2
+    ADAPTIVE_CONCURRENCY_MAX = 48
+    ADAPTIVE_CONCURRENCY_INTERVAL = 30.0
+    ADAPTIVE_MAX_RSS_MB = 2048
+    ADAPTIVE_MAX_MEMORY_PERCENT = 85.0
+    ADAPTIVE_MAX_LOOP_LAG = 0.5
+
+logger = get_logger('adaptive_concurrency')
+
+MB = 1024 * 1024
+DECREASE_FACTOR = 0.75
+INCREASE_STEP = 1
+COOLDOWN_TICKS = 2       # دوره‌های بدون افزایش بعد از هر کاهش
+MIN_GAIN = 0.03          # حداقل رشد پهنای باند برای نگه داشتن slot اضافه
+LAG_PROBE = 0.1          # ثانیه
+DECISION_HISTORY = 20
+
+
+class AdaptiveConcurrencyController:
+    """تنظیم ظرفیت slot های دانلود بر اساس بازخورد منابع"""
+
+    def __init__(self, min_capacity: int = ADAPTIVE_CONCURRENCY_MIN,
+                 max_capacity: int = ADAPTIVE_CONCURRENCY_MAX,
+                 interval: float = ADAPTIVE_CONCURRENCY_INTERVAL):
+        self.min_capacity = max(1, min_capacity)
+        self.max_capacity = max(self.min_capacity, max_capacity)
+        self.interval = interval
+        self.is_running = False
+        self.decisions = deque(maxlen=DECISION_HISTORY)
+        self.last_sample: dict = {}
+        self._process = psutil.Process(os.getpid()) if psutil else None
+        self._net_bytes: Optional[int] = None
+        self._net_time = 0.0
+        self._cooldown = 0
+        self._probe: Optional[dict] = None  # افزایش قبلی که باید سنجیده شود
+        self.stats = {
+            'ticks': 0,
+            'increases': 0,
+            'decreases': 0,
+            'reverted': 0,
+            'guards': {},
+        }
+
+    # ---------------------------------------------------------------- #
+    # سنجش
+
+    def _bandwidth(self) -> Optional[float]:
+        """bytes/s شبکه (دریافت + ارسال) از نمونه قبلی"""
+        if psutil is None:
+            return None
+        try:
+            counters = psutil.net_io_counters()
+        except Exception:
+            return None
+        now = time.monotonic()
+        total = counters.bytes_recv + counters.bytes_sent
+        previous, previous_time = self._net_bytes, self._net_time
+        self._net_bytes, self._net_time = total, now
+        if previous is None or now <= previous_time:
+            return None
+        return max(0, total - previous) / (now - previous_time)
+
+    async def _loop_lag(self) -> float:
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        await asyncio.sleep(LAG_PROBE)
+        return max(0.0, loop.time() - start - LAG_PROBE)
+
+    async def sample(self) -> dict:
+        queue = concurrency.get_queue_stats()
+        sample = {
+            'capacity': queue['capacity'],
+            'active': queue['active'],
+            'waiting': queue['waiting'],
+            'bandwidth': self._bandwidth(),
+            'loop_lag': await self._loop_lag(),
+            'rss_mb': None,
+            'memory_percent': None,
+            'disk_low': not workspace_manager.fits(1),
+            'disk_tight': not workspace_manager.fits(),
+        }
+        if psutil is not None:
+            try:
+                sample['rss_mb'] = self._process.memory_info().rss / MB
+                sample['memory_percent'] = psutil.virtual_memory().percent
+            except Exception:
+                pass
+        return sample
+
+    # ---------------------------------------------------------------- #
+    # تصمیم
+
+    @staticmethod
+    def _guard(sample: dict) -> Optional[str]:
+        if sample['rss_mb'] is not None and sample['rss_mb'] > ADAPTIVE_MAX_RSS_MB:
+            return 'rss'
+        if sample['memory_percent'] is not None and sample['memory_percent'] > ADAPTIVE_MAX_MEMORY_PERCENT:
+            return 'memory'
+        if sample['loop_lag'] > ADAPTIVE_MAX_LOOP_LAG:
+            return 'loop_lag'
+        if sample['disk_low']:
+            return 'disk'
+        return None
+
+    def decide(self, sample: dict) -> tuple:
+        """(ظرفیت جدید، دلیل)؛ دلیل None یعنی بدون تغییر"""
+        capacity = sample['capacity']
+        guard = self._guard(sample)
+        if guard:
+            self._probe = None
+            self._cooldown = COOLDOWN_TICKS
+            self.stats['guards'][guard] = self.stats['guards'].get(guard, 0) + 1
+            target = max(self.min_capacity, int(capacity * DECREASE_FACTOR))
+            return target, (guard if target != capacity else None)
+
+        probe, self._probe = self._probe, None
+        if probe and sample['bandwidth'] is not None and probe['bandwidth']:
+            # slot اضافه فقط وقتی سنجیده می‌شود که واقعاً استفاده شده باشد
+            if sample['active'] > probe['from'] and sample['bandwidth'] < probe['bandwidth'] * (1 + MIN_GAIN):
+                self._cooldown = COOLDOWN_TICKS
+                self.stats['reverted'] += 1
+                return max(self.min_capacity, probe['from']), 'bandwidth_plateau'
+
+        if self._cooldown > 0:
+            self._cooldown -= 1
+            return capacity, None
+
+        demand = sample['waiting'] > 0 or sample['active'] >= capacity
+        if demand and not sample['disk_tight'] and capacity < self.max_capacity:
+            self._probe = {'from': capacity, 'bandwidth': sample['bandwidth']}
+            return min(self.max_capacity, capacity + INCREASE_STEP), 'demand'
+        if capacity > self.max_capacity or capacity < self.min_capacity:
+            return min(self.max_capacity, max(self.min_capacity, capacity)), 'bounds'
+        return capacity, None
+
+    async def tick(self) -> Optional[dict]:
+        sample = await self.sample()
+        self.last_sample = sample
+        self.stats['ticks'] += 1
+        target, reason = self.decide(sample)
+        if reason is None or target == sample['capacity']:
+            return None
+        concurrency.set_capacity(target)
+        if target > sample['capacity']:
+            self.stats['increases'] += 1
+        else:
+            self.stats['decreases'] += 1
+        decision = {
+            'time': time.time(),
+            'from': sample['capacity'],
+            'to': target,
+            'reason': reason,
+            'active': sample['active'],
+            'waiting': sample['waiting'],
+            'bandwidth_mbps': (sample['bandwidth'] or 0) / MB,
+            'rss_mb': sample['rss_mb'],
+            'memory_percent': sample['memory_percent'],
+            'loop_lag': sample['loop_lag'],
+        }
+        self.decisions.append(decision)
+        log = logger.warning if target < sample['capacity'] else logger.info
+        log(f"🎚️ Download slots {sample['capacity']} → {target} ({reason}; active {sample['active']}, "
+            f"waiting {sample['waiting']}, {decision['bandwidth_mbps']:.1f}MB/s, lag {sample['loop_lag']:.2f}s)")
+        return decision
+
+    async def start(self):
+        """حلقه کنترلر (به صورت background task در bot.py)"""
+        if not ADAPTIVE_CONCURRENCY_ENABLED or self.is_running:
+            return
+        self.is_running = True
+        if not self.min_capacity <= concurrency.MAX_CONCURRENT_DOWNLOADS <= self.max_capacity:
+            concurrency.set_capacity(min(self.max_capacity, max(self.min_capacity, concurrency.MAX_CONCURRENT_DOWNLOADS)))
+        logger.info(f"✅ Adaptive concurrency started ({self.min_capacity}-{self.max_capacity} slots, "
+                    f"start {concurrency.MAX_CONCURRENT_DOWNLOADS}, psutil: {'yes' if psutil else 'no'})")
+        self._bandwidth()  # نمونه پایه
+        try:
+            while self.is_running:
+                await asyncio.sleep(self.interval)
+                try:
+                    await self.tick()
+                except Exception as e:
+                    logger.error(f"Adaptive concurrency tick failed: {e}")
+        finally:
+            self.is_running = False
+
+    def stop(self):
+        self.is_running = False
+
+    def get_stats(self) -> dict:
+        return {
+            **self.stats,
+            'enabled': ADAPTIVE_CONCURRENCY_ENABLED,
+            'running': self.is_running,
+            'capacity': concurrency.MAX_CONCURRENT_DOWNLOADS,
+            'min': self.min_capacity,
+            'max': self.max_capacity,
+            'cooldown': self._cooldown,
+            'last_sample': dict(self.last_sample),
+            'decisions': list(self.decisions),
+        }
+
+
+# 🔥 Global instance
+adaptive_concurrency = AdaptiveConcurrencyController()
@@ -6,8 +6,23 @@ from pyrogram.types import Message
 from plugins.admin import ADMIN
 from plugins.simple_metrics import metrics
 from plugins.concurrency import get_queue_stats
+from plugins.http_client import http_client
+from plugins.rapidapi_client import rapidapi_client
+from plugins.segmented_download import segmented_downloader
+from plugins.media_probe import media_probe
+from plugins.ffmpeg_runner import ffmpeg_runner
+from plugins.transcode_policy import transcode_policy
+from plugins.ytdlp_pool import ytdlp_pool
+from plugins.ytdlp_process_pool import ytdlp_process_pool
+from plugins.workspace_manager import workspace_manager
+from plugins.youtube_prefetch import youtube_prefetcher
+from plugins.job_queue import get_job_queue
+from plugins.job_cost import job_cost_model
+from plugins.pipeline_stages import get_pipeline_stats
+from plugins.adaptive_concurrency import adaptive_concurrency
 import psutil
 import os
+import time
 
 
 @Client.on_message(filters.command("stats") & filters.user(ADMIN))
@@ -54,18 +69,124 @@ async def show_stats_command(client: Client, message: Message):
                 text += f"• آپلود: {stats['avg_upload_time']:.1f}s\n"
             text += "\n"
         
+        # زمان پاسخ یوتیوب: اولین پاسخ (کارت پیش‌نمایش) و نمایش کیبورد
+        latency = stats.get('latency_stats', {})
+        if latency.get('youtube_keyboard'):
+            first, keyboard = latency.get('youtube_first_response', {}), latency['youtube_keyboard']
+            text += "⚡ **پاسخ یوتیوب:**\n"
+            if first:
+                text += f"• اولین پاسخ: {first['avg']:.2f}s (p95 {first['p95']:.2f}s)\n"
+            text += f"• کیبورد کیفیت‌ها: {keyboard['avg']:.2f}s (p95 {keyboard['p95']:.2f}s)\n\n"
+        
         # صف دانلود
         text += "🔄 **صف دانلود:**\n"
         text += f"• ظرفیت: {queue_stats['capacity']}\n"
         text += f"• فعال: {queue_stats['active']}\n"
         text += f"• در انتظار: {queue_stats['waiting']}\n"
-        text += f"• آزاد: {queue_stats['available']}\n\n"
+        text += f"• آزاد: {queue_stats['available']}\n"
+        adaptive = adaptive_concurrency.get_stats()
+        if adaptive['enabled']:
+            text += f"• ظرفیت تطبیقی: {adaptive['min']}-{adaptive['max']} | ↑{adaptive['increases']} ↓{adaptive['decreases']} (برگشت {adaptive['reverted']}) — /concurrency\n"
+        job_queue = get_job_queue()
+        if job_queue:
+            jq_stats = job_queue.get_stats()
+            text += f"• صف job ها: {jq_stats['depth']} ({jq_stats['users']} کاربر، {jq_stats['parked_users']} منتظر سهمیه) | حداکثر: {jq_stats['max_depth']}\n"
+            text += f"• انتظار: میانگین {jq_stats['avg_wait']:.1f}s | " + " ".join(
+                f"{label}:{count}" for label, count in jq_stats['wait_histogram'].items() if count
+            ) + "\n"
+            for tier, ts in jq_stats['tiers'].items():
+                text += f"  ◦ {tier}: {ts['dispatched']} job (انتظار {ts['avg_wait']:.1f}s)\n"
+            text += f"• lane ها: " + " | ".join(
+                f"{lane}: {count} در صف/{jq_stats['lane_dispatched'].get(lane, 0)} اجرا"
+                for lane, count in jq_stats['lanes'].items()
+            ) + f" | میانگین هزینه: {jq_stats['avg_cost']:.0f}s\n"
+            store = jq_stats['store']
+            text += (f"• صف ماندگار: {store['commits']} commit (میانگین {store['avg_batch']:.1f} تغییر) | "
+                     f"claim: {store['claims']} (تداخل {store['claim_conflicts']}) | "
+                     f"ادامه از مرحله: {store['resumed_stages']} | بازیابی: {store['recovered']}\n")
+        pipeline = get_pipeline_stats()
+        text += "🧩 مراحل: " + " | ".join(
+            f"{name} {st['active']}/{st['capacity']} ({st['utilization']:.0f}%، صف {st['waiting']}، انتظار {st['avg_wait']:.1f}s)"
+            for name, st in pipeline['stages'].items()
+        ) + "\n"
+        if pipeline['bottleneck']:
+            text += f"• گلوگاه: {pipeline['bottleneck']}\n"
+        cost_stats = job_cost_model.get_stats()
+        text += f"• مدل هزینه: {cost_stats['estimates']} تخمین ({cost_stats['known_size_rate']:.0f}% با حجم معلوم) | سرعت: " + ", ".join(
+            f"{platform} {mbps}MB/s" for platform, mbps in cost_stats['throughput'].items()
+        ) + "\n"
+        text += "\n"
+        
+        # HTTP connection pool
+        http_stats = http_client.get_stats()
+        text += "🌐 **HTTP Pool:**\n"
+        text += f"• درخواست‌ها: {http_stats['requests']} (خطا: {http_stats['errors']})\n"
+        text += f"• اتصال‌ها: {http_stats['in_use']} فعال | {http_stats['idle']} آزاد\n"
+        text += f"• استفاده مجدد: {http_stats['reuse_rate']:.0f}% | DNS cache hit: {http_stats['dns_cache_hits']}\n"
+        seg_stats = segmented_downloader.get_stats()
+        text += f"• چند اتصالی: {seg_stats['segmented']} فایل (میانگین {seg_stats['avg_connections']:.1f} اتصال، {seg_stats['avg_speed_mbps']:.1f} MB/s) | بدون Range: {seg_stats['no_range']} | fallback: {seg_stats['failed']}\n\n"
+        
+        # کش‌ها
+        if stats.get('cache_stats'):
+            text += "🗃️ **کش‌ها:**\n"
+            for name, cstats in stats['cache_stats'].items():
+                total = cstats['hits'] + cstats['misses']
+                rate = (cstats['hits'] / total * 100) if total else 0
+                text += f"• {name}: {cstats['hits']}/{total} hit ({rate:.0f}%)\n"
+            text += "\n"
+        
+        # ffprobe
+        probe_stats = media_probe.get_stats()
+        text += "🎞️ **Media Probe:**\n"
+        text += f"• ffprobe: {probe_stats['probes']} (میانگین {probe_stats['avg_probe_time']:.2f}s | timeout: {probe_stats['timeouts']})\n"
+        text += f"• کش: {probe_stats['cache_hits']} | رد شده (metadata موجود): {probe_stats['skipped_known']}\n\n"
+        
+        # ffmpeg
+        ff_stats = ffmpeg_runner.get_stats()
+        text += "🎬 **FFmpeg:**\n"
+        text += f"• در حال اجرا: {ff_stats['running']}/{ff_stats['max_concurrent']} | صف: {ff_stats['queued']}\n"
+        text += f"• job ها: {ff_stats['jobs']} (خطا: {ff_stats['failed']} | timeout: {ff_stats['timeouts']}) | انتظار: {ff_stats['avg_wait']:.2f}s\n"
+        for kind, ks in sorted(ff_stats['kinds'].items(), key=lambda x: x[1]['total_time'], reverse=True)[:4]:
+            text += f"  ◦ {kind}: {ks['count']}× avg {ks['avg_time']:.1f}s (max {ks['max_time']:.1f}s)\n"
+        tc_stats = transcode_policy.get_stats()
+        text += f"• بدون encode: {tc_stats['copy'] + tc_stats['remux']}/{tc_stats['jobs']} ({tc_stats['copy_rate']:.0f}%) | transcode: {tc_stats['transcode']}\n"
+        text += f"• CPU: صرفه‌جویی ~{tc_stats['cpu_saved']:.0f}s | مصرف {tc_stats['cpu_spent']:.0f}s\n"
+        text += "\n"
+        
+        # yt-dlp pool
+        pool_stats = ytdlp_pool.get_stats()
+        text += "♻️ **yt-dlp Pool:**\n"
+        text += f"• checkout: {pool_stats['checkouts']} | گرم: {pool_stats['warm_hits']} ({pool_stats['warm_rate']:.0f}%)\n"
+        text += f"• ساخته شده: {pool_stats['created']} | بازیافت: {pool_stats['recycled']} | دور انداخته: {pool_stats['discarded']} | idle: {pool_stats['idle']}\n"
+        proc_stats = ytdlp_process_pool.get_stats()
+        if proc_stats['enabled']:
+            state = "سالم" if proc_stats['healthy'] else "thread (fallback)"
+            text += f"• worker ها: {proc_stats['workers']} ({state}) | process: {proc_stats['process_jobs']} (میانگین {proc_stats['avg_process_time']:.1f}s) | thread: {proc_stats['thread_jobs']}\n"
+        pf_stats = youtube_prefetcher.get_stats()
+        if pf_stats['enabled']:
+            text += f"• Prefetch: {pf_stats['started']} شروع | hit: {pf_stats['hits']}/{pf_stats['hits'] + pf_stats['misses']} ({pf_stats['hit_rate']:.0f}%) | جلوتر: {pf_stats['saved_seconds']:.0f}s\n"
+            text += f"  ◦ لغو: {pf_stats['cancelled']} | منقضی: {pf_stats['expired']} | هدر رفته: {pf_stats['wasted_mb']:.0f} MB | رد شده: {pf_stats['skipped']}\n"
+        text += "\n"
+        
+        # RapidAPI quota
+        api_stats = rapidapi_client.get_stats()
+        quota = api_stats['quota']
+        text += "🔑 **RapidAPI:**\n"
+        text += f"• فراخوانی‌ها: {api_stats['calls']} (خطا: {api_stats['errors']} | 429: {api_stats['throttled']})\n"
+        text += f"• میانگین پاسخ: {api_stats['avg_latency']:.2f}s\n"
+        if quota['quota_remaining'] is not None:
+            text += f"• سهمیه: {quota['quota_remaining']}/{quota['quota_limit'] or '?'} (reset: {quota['quota_reset_in']}s)\n\n"
+        else:
+            text += f"• پنجره محلی: {quota['current']}/{quota['limit']} در {quota['window']}s\n\n"
         
         # منابع سیستم
         text += "💻 **منابع سیستم:**\n"
         text += f"• CPU: {cpu_percent:.1f}%\n"
         text += f"• RAM: {stats['memory_mb']:.0f} MB / {memory.total / 1024 / 1024:.0f} MB ({memory.percent:.1f}%)\n"
-        text += f"• Disk: {disk.used / 1024 / 1024 / 1024:.1f} GB / {disk.total / 1024 / 1024 / 1024:.1f} GB ({disk.percent:.1f}%)\n\n"
+        text += f"• Disk: {disk.used / 1024 / 1024 / 1024:.1f} GB / {disk.total / 1024 / 1024 / 1024:.1f} GB ({disk.percent:.1f}%)\n"
+        ws_stats = workspace_manager.get_stats()
+        text += f"• Workspace: {ws_stats['active']} فعال | رزرو: {ws_stats['reserved_mb']:.0f} MB (نوشته نشده: {ws_stats['outstanding_mb']:.0f} MB، اوج: {ws_stats['peak_reserved_mb']:.0f} MB)\n"
+        text += f"• پذیرش دیسک: صف: {ws_stats['queued']} | منتظر مانده: {ws_stats['waited']} (میانگین {ws_stats['avg_wait']:.1f}s) | رد شده: {ws_stats['rejected']}\n\n"
         
         # آمار پلتفرم‌ها
         if stats['platform_stats']:
@@ -83,6 +204,39 @@ async def show_stats_command(client: Client, message: Message):
         await message.reply_text(f"❌ خطا در دریافت آمار: {e}")
 
 
+@Client.on_message(filters.command("concurrency") & filters.user(ADMIN))
+async def adaptive_concurrency_command(client: Client, message: Message):
+    """
+    وضعیت کنترلر ظرفیت تطبیقی و آخرین تصمیم‌های آن
+    """
+    try:
+        stats = adaptive_concurrency.get_stats()
+        queue_stats = get_queue_stats()
+        text = "🎚️ **ظرفیت تطبیقی دانلود**\n\n"
+        text += f"• وضعیت: {'فعال' if stats['running'] else ('غیرفعال' if not stats['enabled'] else 'متوقف')}\n"
+        text += f"• ظرفیت فعلی: {stats['capacity']} (بازه {stats['min']}-{stats['max']})\n"
+        text += f"• فعال/منتظر: {queue_stats['active']}/{queue_stats['waiting']}\n"
+        text += f"• افزایش: {stats['increases']} | کاهش: {stats['decreases']} | برگشت (اشباع باند): {stats['reverted']}\n"
+        if stats['guards']:
+            text += "• guard rail ها: " + ", ".join(f"{name}={count}" for name, count in stats['guards'].items()) + "\n"
+        sample = stats['last_sample']
+        if sample:
+            text += "\n📏 **آخرین نمونه:**\n"
+            if sample.get('bandwidth') is not None:
+                text += f"• پهنای باند: {sample['bandwidth'] / (1024 * 1024):.1f} MB/s\n"
+            if sample.get('rss_mb') is not None:
+                text += f"• RSS: {sample['rss_mb']:.0f}MB | RAM سیستم: {sample['memory_percent']:.0f}%\n"
+            text += f"• تأخیر event loop: {sample['loop_lag'] * 1000:.0f}ms | دیسک: {'کم' if sample['disk_low'] else ('محدود' if sample['disk_tight'] else 'کافی')}\n"
+        if stats['decisions']:
+            text += "\n🧾 **آخرین تصمیم‌ها:**\n"
+            for decision in reversed(stats['decisions'][-8:]):
+                when = time.strftime('%H:%M:%S', time.localtime(decision['time']))
+                text += f"• {when}: {decision['from']} → {decision['to']} ({decision['reason']}، {decision['bandwidth_mbps']:.1f}MB/s)\n"
+        await message.reply_text(text)
+    except Exception as e:
+        await message.reply_text(f"❌ خطا در دریافت وضعیت: {e}")
+
+
 @Client.on_message(filters.command("health") & filters.user(ADMIN))
 async def health_check_command(client: Client, message: Message):
     """
@@ -14,7 +14,9 @@ from pyrogram.enums import ParseMode
 from plugins.logger_config import get_logger
 from plugins.aparat_handler import video_cache
 from plugins.sqlite_db_wrapper import DB
-import yt_dlp
+from plugins.delivery_cache import delivery_cache, canonical_media_id
+from plugins.ytdlp_pool import ytdlp_pool
+from plugins.workspace_manager import workspace_manager
 
 logger = get_logger('aparat_callback')
 
@@ -30,8 +32,8 @@ def format_size(bytes_size: int) -> str:
     return f"{bytes_size} B"
 
 
-async def download_aparat_video(url: str, quality: str) -> dict:
-    """دانلود ویدیو از آپارات با کیفیت مشخص"""
+async def download_aparat_video(url: str, quality: str, download_dir: str = 'downloads') -> dict:
+    """دانلود ویدیو از آپارات با کیفیت مشخص (download_dir: workspace همین job)"""
     try:
         logger.info(f"Downloading Aparat video: quality={quality}")
         
@@ -39,7 +41,7 @@ async def download_aparat_video(url: str, quality: str) -> dict:
         ydl_opts = {
             'quiet': True,
             'no_warnings': True,
-            'outtmpl': 'downloads/aparat_%(id)s.%(ext)s',
+            'outtmpl': os.path.join(download_dir, 'aparat_%(id)s.%(ext)s'),
         }
         
         # Set format based on quality
@@ -52,7 +54,7 @@ async def download_aparat_video(url: str, quality: str) -> dict:
         loop = asyncio.get_event_loop()
         
         def _download():
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            with ytdlp_pool.checkout(ydl_opts, name='aparat_download') as ydl:
                 info = ydl.extract_info(url, download=True)
                 file_path = ydl.prepare_filename(info)
                 return {
@@ -77,6 +79,7 @@ async def handle_aparat_quality_selection(client: Client, call: CallbackQuery):
     start_time = time.time()
     user_id = call.from_user.id
     data = call.data
+    workspace = None
     
     logger.info(f"Aparat quality selection from user {user_id}: {data}")
     
@@ -113,6 +116,31 @@ async def handle_aparat_quality_selection(client: Client, call: CallbackQuery):
         
         await call.answer()
         
+        reply_to_id = call.message.reply_to_message.id if call.message.reply_to_message else None
+        
+        # ⚡ Delivery cache: ارسال با file_id اگر قبلاً آپلود شده
+        media_id = canonical_media_id('aparat', video_info['url'])
+        if await delivery_cache.deliver(
+            client,
+            chat_id=call.message.chat.id,
+            platform='aparat',
+            media_id=media_id,
+            format_id=selected_quality,
+            reply_to_message_id=reply_to_id
+        ):
+            try:
+                await call.message.delete()
+            except Exception:
+                pass
+            try:
+                from datetime import datetime
+                DB().increment_request(user_id, datetime.now().isoformat())
+            except Exception as e:
+                logger.error(f"Failed to update stats: {e}")
+            video_cache.pop(user_id, None)
+            logger.info(f"Aparat delivered from cache in {time.time() - start_time:.2f}s")
+            return
+        
         # Update message to show download started
         await call.edit_message_text(
             f"⬇️ **در حال دانلود...**\n\n"
@@ -122,11 +150,15 @@ async def handle_aparat_quality_selection(client: Client, call: CallbackQuery):
             parse_mode=ParseMode.MARKDOWN
         )
         
+        # 📁 پوشه اختصاصی + رزرو فضا (ویدیو و صدا تا پایان merge کنار فایل خروجی می‌مانند)
+        workspace = await workspace_manager.acquire('aparat', quality_info.get('filesize') or 0, factor=2.0)
+        
         # Download video
         try:
             download_result = await download_aparat_video(
                 video_info['url'],
-                selected_quality
+                selected_quality,
+                workspace.path
             )
         except Exception as e:
             await call.edit_message_text(
@@ -172,16 +204,25 @@ async def handle_aparat_quality_selection(client: Client, call: CallbackQuery):
             if isinstance(duration, float):
                 duration = int(duration)
             
-            await client.send_video(
+            sent = await client.send_video(
                 chat_id=call.message.chat.id,
                 video=file_path,
                 caption=caption,
                 parse_mode=ParseMode.HTML,
                 duration=duration,
                 supports_streaming=True,
-                reply_to_message_id=call.message.reply_to_message.id if call.message.reply_to_message else None
+                reply_to_message_id=reply_to_id
             )
             
+            # 💾 ذخیره file_id برای درخواست‌های بعدی
+            try:
+                await delivery_cache.remember(
+                    client, 'aparat', media_id, selected_quality, sent,
+                    caption=caption, media_type='video'
+                )
+            except Exception as e:
+                logger.warning(f"Delivery cache store failed: {e}")
+            
             # Delete status message
             await call.message.delete()
             
@@ -229,6 +270,8 @@ async def handle_aparat_quality_selection(client: Client, call: CallbackQuery):
             )
         except:
             pass
+    finally:
+        workspace_manager.release(workspace)
 
 
 print("✅ Aparat Callback Handler loaded")
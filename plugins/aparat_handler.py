@@ -15,7 +15,7 @@ from pyrogram.enums import ParseMode
 from plugins.db_wrapper import DB
 from plugins.logger_config import get_logger
 from plugins.start import join  # 🔒 Import فیلتر عضویت اسپانسری
-import yt_dlp
+from plugins.ytdlp_pool import ytdlp_pool
 
 # Initialize logger
 logger = get_logger('aparat_handler')
@@ -90,7 +90,7 @@ async def extract_aparat_info(url: str) -> dict:
         loop = asyncio.get_event_loop()
         
         def _extract():
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            with ytdlp_pool.checkout(ydl_opts, name='aparat_info') as ydl:
                 return ydl.extract_info(url, download=False)
         
         info = await loop.run_in_executor(None, _extract)
@@ -212,19 +212,20 @@ async def download_thumbnail(url: str) -> str:
     try:
         import aiohttp
         import tempfile
+        from plugins.http_client import http_client
         
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, timeout=10) as response:
-                if response.status == 200:
-                    content = await response.read()
-                    
-                    temp_file = tempfile.NamedTemporaryFile(suffix='.jpg', delete=False)
-                    temp_file.write(content)
-                    temp_file.close()
-                    
-                    logger.info(f"Thumbnail downloaded: {temp_file.name}")
-                    return temp_file.name
-        
+        session = http_client.session()
+        async with session.get(url, timeout=aiohttp.ClientTimeout(total=10)) as response:
+            if response.status == 200:
+                content = await response.read()
+                
+                temp_file = tempfile.NamedTemporaryFile(suffix='.jpg', delete=False)
+                temp_file.write(content)
+                temp_file.close()
+                
+                logger.info(f"Thumbnail downloaded: {temp_file.name}")
+                return temp_file.name
+
         return None
     except Exception as e:
         logger.error(f"Thumbnail download error: {e}")
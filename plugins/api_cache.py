@@ -0,0 +1,213 @@
+"""
+API Response Cache - کش مشترک پاسخ‌های RapidAPI / Instagram
+کلید: (platform, شناسه نرمال شده لینک/shortcode)
+
+- LRU محدود در حافظه با TTL جدا برای هر پلتفرم (API_CACHE_TTLS)
+- کش منفی برای پاسخ‌های دائمی (صفحه خصوصی، پست حذف شده)
+- اختیاری: ماندگاری در جدول api_response_cache در SQLite
+"""
+
+import copy
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+from plugins.logger_config import get_logger
+from plugins.sqlite_db_wrapper import DB
+from plugins.delivery_cache import canonical_media_id
+from plugins.insta_stats import insta_stats
+from plugins.simple_metrics import metrics
+from config import (
+    API_CACHE_ENABLED, API_CACHE_MAX_ENTRIES, API_CACHE_PERSIST,
+    API_CACHE_NEGATIVE_TTL, API_CACHE_TTLS,
+)
+
+logger = get_logger('api_cache')
+
+# پاسخ‌هایی که با تکرار درخواست تغییر نمی‌کنند (ارزش کش منفی دارند)
+PERMANENT_ERROR_MARKERS = (
+    'private',
+    'restricted personal page',
+    'follow the account',
+    'not found',
+    'no media',
+    'deleted',
+    'removed',
+    'does not exist',
+    'not_found',
+    'private_account',
+)
+
+
+def is_permanent_error(error: Any) -> bool:
+    """آیا خطای API دائمی است (خصوصی/حذف شده) و می‌توان آن را کش کرد؟"""
+    text = str(error or '').lower()
+    if not text:
+        return False
+    # خطاهای شبکه/سهمیه موقتی‌اند
+    if any(m in text for m in ('timeout', 'network error', 'rate limit', 'quota', '429')):
+        return False
+    return any(marker in text for marker in PERMANENT_ERROR_MARKERS)
+
+
+class ApiResponseCache:
+    """کش پاسخ API با LRU، TTL per-platform و کش منفی"""
+
+    def __init__(self, max_entries: int = API_CACHE_MAX_ENTRIES,
+                 enabled: bool = API_CACHE_ENABLED, persist: bool = API_CACHE_PERSIST):
+        self.enabled = enabled
+        self.persist = persist
+        self.max_entries = max(1, max_entries)
+        self._lru: "OrderedDict[str, dict]" = OrderedDict()
+        self.stats = {
+            'hits': 0,
+            'negative_hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'negative_stores': 0,
+            'evictions': 0,
+            'expired': 0,
+        }
+        logger.info(f"✅ ApiResponseCache initialized (enabled={enabled}, max_entries={self.max_entries}, "
+                    f"persist={persist})")
+
+    @staticmethod
+    def make_key(platform: str, url: str) -> str:
+        platform = (platform or 'unknown').lower()
+        return f"{platform}:{canonical_media_id(platform, url)}"
+
+    @staticmethod
+    def ttl_for(platform: str) -> int:
+        return int(API_CACHE_TTLS.get((platform or '').lower(), API_CACHE_TTLS.get('default', 600)))
+
+    # ---------------- Lookup ----------------
+
+    def get(self, platform: str, url: str) -> Optional[dict]:
+        """
+        دریافت entry معتبر
+        Returns: {'data': ..., 'negative': bool} (data کپی مستقل است) یا None
+        """
+        if not self.enabled or not url:
+            return None
+
+        platform = (platform or 'unknown').lower()
+        key = self.make_key(platform, url)
+        now = time.time()
+
+        entry = self._lru.get(key)
+        if entry is None and self.persist:
+            entry = self._load(key)
+            if entry is not None:
+                self._remember_in_memory(key, entry)
+
+        if entry is not None and entry['expires_at'] <= now:
+            self.stats['expired'] += 1
+            self._lru.pop(key, None)
+            entry = None
+
+        self._record(platform, entry)
+        if entry is None:
+            return None
+
+        self._lru.move_to_end(key)
+        return {'data': copy.deepcopy(entry['data']), 'negative': entry['negative']}
+
+    def _load(self, key: str) -> Optional[dict]:
+        try:
+            row = DB().get_api_cache_entry(key)
+        except Exception as e:
+            logger.warning(f"API cache DB lookup failed: {e}")
+            return None
+        if not row or row.get('expires_at', 0) <= time.time():
+            return None
+        try:
+            data = json.loads(row['payload'])
+        except Exception:
+            return None
+        return {'data': data, 'negative': bool(row.get('negative')), 'expires_at': row['expires_at']}
+
+    def _record(self, platform: str, entry: Optional[dict]):
+        """به‌روزرسانی شمارنده‌ها در insta_stats و simple_metrics"""
+        if entry is None:
+            self.stats['misses'] += 1
+        elif entry['negative']:
+            self.stats['negative_hits'] += 1
+        else:
+            self.stats['hits'] += 1
+
+        try:
+            metrics.log_cache('api', hit=entry is not None)
+            if platform == 'instagram':
+                if entry is not None:
+                    insta_stats.log_cache_hit()
+                else:
+                    insta_stats.log_cache_miss()
+        except Exception:
+            pass
+
+    # ---------------- Store ----------------
+
+    def put(self, platform: str, url: str, data: Any, ttl: Optional[int] = None):
+        """ذخیره پاسخ موفق"""
+        self._store(platform, url, data, negative=False, ttl=ttl)
+
+    def put_negative(self, platform: str, url: str, data: Any, ttl: Optional[int] = None):
+        """ذخیره پاسخ دائمی ناموفق (خصوصی/حذف شده)"""
+        self._store(platform, url, data, negative=True,
+                    ttl=ttl if ttl is not None else API_CACHE_NEGATIVE_TTL)
+
+    def _store(self, platform: str, url: str, data: Any, negative: bool, ttl: Optional[int]):
+        if not self.enabled or not url:
+            return
+        platform = (platform or 'unknown').lower()
+        key = self.make_key(platform, url)
+        ttl = self.ttl_for(platform) if ttl is None else ttl
+        if ttl <= 0:
+            return
+        entry = {
+            'data': copy.deepcopy(data),
+            'negative': negative,
+            'expires_at': time.time() + ttl,
+        }
+        self._remember_in_memory(key, entry)
+        self.stats['negative_stores' if negative else 'stores'] += 1
+
+        if self.persist:
+            try:
+                DB().save_api_cache_entry(key, platform, json.dumps(data, ensure_ascii=False),
+                                          negative, entry['expires_at'])
+            except Exception as e:
+                logger.warning(f"API cache DB save failed: {e}")
+        logger.debug(f"API cache stored: {key} (negative={negative}, ttl={ttl}s)")
+
+    def _remember_in_memory(self, key: str, entry: dict):
+        self._lru[key] = entry
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    def invalidate(self, platform: str, url: str):
+        """حذف entry (مثلاً وقتی لینک CDN کش شده 403 داد)"""
+        key = self.make_key(platform, url)
+        self._lru.pop(key, None)
+        if self.persist:
+            try:
+                DB().delete_api_cache_entry(key)
+            except Exception as e:
+                logger.warning(f"API cache DB delete failed: {e}")
+        logger.info(f"🗑️ API cache invalidated: {key}")
+
+    def get_stats(self) -> dict:
+        lookups = self.stats['hits'] + self.stats['negative_hits'] + self.stats['misses']
+        hit_rate = ((self.stats['hits'] + self.stats['negative_hits']) / lookups * 100) if lookups else 0.0
+        return {
+            **self.stats,
+            'entries': len(self._lru),
+            'hit_rate': hit_rate,
+        }
+
+
+# Global instance
+api_cache = ApiResponseCache()
@@ -1,6 +1,12 @@
 import os
+import time
 import asyncio
-from typing import Dict
+import heapq
+import itertools
+from typing import Callable, Dict, List, Optional
+
+from plugins.job_cost import priority_key
+from plugins.pipeline_stages import StageMeter
 
 # 🔥 بهینه‌سازی برای production: افزایش capacity
 # محاسبه خودکار بر اساس CPU cores
@@ -16,23 +22,74 @@ MAX_CONCURRENT_DOWNLOADS = int(os.getenv('MAX_CONCURRENT_DOWNLOADS', str(DEFAULT
 
 print(f"Concurrency initialized: {MAX_CONCURRENT_DOWNLOADS} concurrent downloads")
 
-_download_semaphore = asyncio.Semaphore(MAX_CONCURRENT_DOWNLOADS)
+# منتظرهای slot به ترتیب lane و سپس کوتاه‌ترین job (با aging)، نه FIFO
+_slot_waiters: list = []  # heap: (lane, aged cost, seq, future)
+_slot_seq = itertools.count()
+# هزینه منتظرهایی که تخمین ندارند (ثانیه)
+DEFAULT_SLOT_COST = 60.0
 
 _active = 0
 _waiting = 0
 _user_active: Dict[str, int] = {}
+_user_release_listeners: List[Callable] = []
+# مرحله fetch پایپ‌لاین: slot فقط تا پایان دانلود نگه داشته می‌شود (آپلود → upload_pool)
+fetch_meter = StageMeter('fetch', MAX_CONCURRENT_DOWNLOADS)
 
-async def acquire_slot():
+async def acquire_slot(cost: Optional[float] = None, lane: str = 'normal'):
+    """
+    گرفتن slot دانلود؛ وقتی ظرفیت پر است منتظرها به ترتیب lane (admin، retry، normal)
+    و سپس هزینه تخمینی (job_cost، با aging) سرویس می‌گیرند
+    """
     global _waiting, _active
+    if _active < MAX_CONCURRENT_DOWNLOADS and not _slot_waiters:
+        _active += 1
+        fetch_meter.update(_active)
+        return
+
+    fut = asyncio.get_running_loop().create_future()
+    lane_rank, aged_cost = priority_key(DEFAULT_SLOT_COST if cost is None else cost, lane)
+    heapq.heappush(_slot_waiters, (lane_rank, aged_cost, next(_slot_seq), fut))
     _waiting += 1
-    await _download_semaphore.acquire()
-    _waiting -= 1
-    _active += 1
+    fetch_meter.update(_active, _waiting)
+    queued_at = time.monotonic()
+    try:
+        await fut
+        fetch_meter.record_wait(time.monotonic() - queued_at)
+    except asyncio.CancelledError:
+        if fut.done() and not fut.cancelled():
+            # slot تحویل شده بود ولی منتظر لغو شد → به نفر بعدی می‌رسد
+            _active = max(0, _active - 1)
+            _dispatch_slots()
+        raise
+    finally:
+        _waiting -= 1
+        fetch_meter.update(_active, _waiting)
+
+def _dispatch_slots():
+    global _active
+    while _active < MAX_CONCURRENT_DOWNLOADS and _slot_waiters:
+        fut = heapq.heappop(_slot_waiters)[-1]
+        if fut.done():
+            continue  # منتظر لغو شده
+        _active += 1
+        fut.set_result(None)
+    fetch_meter.update(_active)
 
 def release_slot():
     global _active
     _active = max(0, _active - 1)
-    _download_semaphore.release()
+    _dispatch_slots()
+
+def set_capacity(capacity: int) -> int:
+    """
+    تغییر ظرفیت slot های دانلود در زمان اجرا (کنترلر adaptive_concurrency)
+    با کاهش، slot های فعال قطع نمی‌شوند؛ فقط تا رسیدن به ظرفیت جدید slot تازه داده نمی‌شود
+    """
+    global MAX_CONCURRENT_DOWNLOADS
+    MAX_CONCURRENT_DOWNLOADS = max(1, int(capacity))
+    fetch_meter.set_capacity(MAX_CONCURRENT_DOWNLOADS)
+    _dispatch_slots()
+    return MAX_CONCURRENT_DOWNLOADS
 
 def get_queue_stats() -> Dict[str, int]:
     available = max(0, MAX_CONCURRENT_DOWNLOADS - _active)
@@ -61,7 +118,58 @@ def release_user(user_id) -> None:
             _user_active[key] = new
         else:
             _user_active.pop(key, None)
+    for listener in _user_release_listeners:
+        try:
+            listener(user_id)
+        except Exception:
+            pass
+
+
+def add_user_release_listener(callback: Callable) -> None:
+    """callback(user_id) بعد از هر release_user (مثلاً برای برداشتن کاربر از حالت انتظار صف)"""
+    _user_release_listeners.append(callback)
 
 
 def get_user_active(user_id) -> int:
-    return _user_active.get(str(user_id), 0)
\ No newline at end of file
+    return _user_active.get(str(user_id), 0)
+
+# ============================================================
+# ALBUM / GALLERY ITEM CONCURRENCY
+# ============================================================
+# دانلود همزمان آیتم‌های یک آلبوم: محدودیت per-request + محدودیت سراسری
+ALBUM_ITEMS_PER_REQUEST = int(os.getenv('ALBUM_ITEMS_PER_REQUEST', '4'))
+MAX_CONCURRENT_ITEM_DOWNLOADS = int(os.getenv('MAX_CONCURRENT_ITEM_DOWNLOADS', str(MAX_CONCURRENT_DOWNLOADS * 2)))
+
+_item_semaphore = asyncio.Semaphore(MAX_CONCURRENT_ITEM_DOWNLOADS)
+_items_active = 0
+
+
+async def gather_items(func, items, per_request: int = ALBUM_ITEMS_PER_REQUEST) -> list:
+    """
+    اجرای func(idx, item) برای همه آیتم‌ها به صورت همزمان (idx از 1 شروع می‌شود)
+    نتایج به ترتیب اصلی آیتم‌ها برگردانده می‌شوند؛ خطای هر آیتم به جای نتیجه‌اش قرار می‌گیرد.
+    """
+    local_semaphore = asyncio.Semaphore(max(1, per_request))
+
+    async def _run(idx, item):
+        global _items_active
+        async with local_semaphore:
+            async with _item_semaphore:
+                _items_active += 1
+                try:
+                    return await func(idx, item)
+                finally:
+                    _items_active -= 1
+
+    return await asyncio.gather(
+        *(_run(idx, item) for idx, item in enumerate(items, start=1)),
+        return_exceptions=True
+    )
+
+
+def get_item_stats() -> Dict[str, int]:
+    return {
+        'capacity': MAX_CONCURRENT_ITEM_DOWNLOADS,
+        'per_request': ALBUM_ITEMS_PER_REQUEST,
+        'active': _items_active,
+    }
@@ -12,7 +12,7 @@ import logging
 from datetime import datetime
 from typing import Optional, Tuple
 from pyrogram import Client
-import yt_dlp
+from plugins.ytdlp_pool import ytdlp_pool
 
 # Configure logger
 os.makedirs('./logs', exist_ok=True)
@@ -150,7 +150,7 @@ class CookieValidator:
             loop = asyncio.get_event_loop()
             
             def _extract():
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                with ytdlp_pool.checkout(ydl_opts, name='cookie_validator') as ydl:
                     info = ydl.extract_info(self.test_video_url, download=False)
                 return info
             
@@ -0,0 +1,381 @@
+"""
+Delivery Cache - ارسال مجدد فایل‌های آپلود شده با file_id تلگرام
+وقتی یک کاربر ویدیو/کیفیتی را دریافت کرد، file_id آن ذخیره می‌شود تا
+درخواست‌های بعدی (از هر کاربری) بدون دانلود و آپلود مجدد و در چند میلی‌ثانیه ارسال شوند.
+
+کلید کش: (platform, canonical media id, format/quality)
+- لایه اول: LRU در حافظه
+- لایه دوم: جدول delivery_cache در SQLite
+- اختیاری: کپی در کانال خصوصی ذخیره‌سازی (STORAGE_CHANNEL_ID)
+"""
+
+import re
+import json
+import time
+from collections import OrderedDict
+from typing import Optional, List, Dict, Any
+from urllib.parse import urlparse
+
+from pyrogram.types import InputMediaPhoto, InputMediaVideo
+from plugins.logger_config import get_logger
+from plugins.sqlite_db_wrapper import DB
+from config import (
+    DELIVERY_CACHE_ENABLED, DELIVERY_CACHE_MAX_ENTRIES,
+    DELIVERY_CACHE_TTL_DAYS, STORAGE_CHANNEL_ID,
+)
+
+logger = get_logger('delivery_cache')
+
+# خطاهایی که یعنی file_id دیگر معتبر نیست و باید از کش حذف شود
+STALE_FILE_ID_MARKERS = (
+    'FILE_REFERENCE_EXPIRED',
+    'FILE_REFERENCE_INVALID',
+    'FILE_ID_INVALID',
+    'MEDIA_EMPTY',
+    'MEDIA_INVALID',
+    'MESSAGE_ID_INVALID',
+    'CHANNEL_INVALID',
+    'CHANNEL_PRIVATE',
+)
+
+_YOUTUBE_ID_RE = re.compile(r'(?:v=|youtu\.be/|shorts/|embed/|live/)([A-Za-z0-9_-]{11})')
+_APARAT_ID_RE = re.compile(r'aparat\.com/v/([\w\-]+)', re.IGNORECASE)
+_INSTAGRAM_ID_RE = re.compile(r'instagram\.com/(?:[\w.]+/)?(?:p|reel|reels|tv|igtv)/([A-Za-z0-9_-]+)', re.IGNORECASE)
+_TIKTOK_ID_RE = re.compile(r'tiktok\.com/.*?/video/(\d+)', re.IGNORECASE)
+
+
+def canonical_media_id(platform: str, url: str) -> str:
+    """استخراج شناسه یکتای رسانه از URL (مستقل از query string و فرم لینک)"""
+    platform = (platform or '').lower()
+    url = (url or '').strip()
+
+    patterns = {
+        'youtube': _YOUTUBE_ID_RE,
+        'aparat': _APARAT_ID_RE,
+        'instagram': _INSTAGRAM_ID_RE,
+        'tiktok': _TIKTOK_ID_RE,
+    }
+    pattern = patterns.get(platform)
+    if pattern:
+        match = pattern.search(url)
+        if match:
+            return match.group(1)
+
+    # Fallback: host + path بدون query/fragment
+    try:
+        parsed = urlparse(url if '://' in url else f'https://{url}')
+        host = (parsed.netloc or '').lower()
+        if host.startswith('www.') or host.startswith('m.'):
+            host = host.split('.', 1)[1]
+        return f"{host}{parsed.path.rstrip('/')}"
+    except Exception:
+        return url.split('?')[0].rstrip('/')
+
+
+def _is_stale_error(error: Exception) -> bool:
+    """آیا خطای تلگرام به معنی نامعتبر بودن file_id است؟"""
+    if isinstance(error, ValueError):
+        # Pyrogram هنگام decode کردن file_id خراب ValueError می‌دهد
+        return True
+    error_str = str(error).upper()
+    return any(marker in error_str for marker in STALE_FILE_ID_MARKERS)
+
+
+def _extract_items(sent: Any) -> List[Dict[str, str]]:
+    """
+    استخراج file_id ها از پیام(های) ارسال شده
+    ورودی: Message پایروگرام، لیست Message (media group) یا نتیجه Bot API (dict)
+    """
+    if sent is None or sent is True or sent is False:
+        return []
+
+    messages = sent if isinstance(sent, (list, tuple)) else [sent]
+    items = []
+    for msg in messages:
+        # Bot API result dict
+        if isinstance(msg, dict):
+            msg = msg.get('result', msg)
+            for media_type in ('video', 'audio', 'document', 'animation', 'voice'):
+                media = msg.get(media_type) if isinstance(msg, dict) else None
+                if media and media.get('file_id'):
+                    items.append({'type': media_type, 'file_id': media['file_id']})
+                    break
+            else:
+                photos = msg.get('photo') if isinstance(msg, dict) else None
+                if photos:
+                    items.append({'type': 'photo', 'file_id': photos[-1]['file_id']})
+            continue
+
+        for media_type in ('video', 'audio', 'document', 'animation', 'voice', 'photo'):
+            media = getattr(msg, media_type, None)
+            file_id = getattr(media, 'file_id', None) if media else None
+            if file_id:
+                items.append({'type': media_type, 'file_id': file_id})
+                break
+    return items
+
+
+class DeliveryCache:
+    """کش تحویل: نگاشت (platform, media_id, format) به file_id تلگرام"""
+
+    def __init__(self, max_entries: int = DELIVERY_CACHE_MAX_ENTRIES,
+                 enabled: bool = DELIVERY_CACHE_ENABLED,
+                 storage_chat_id: Optional[int] = STORAGE_CHANNEL_ID):
+        self.enabled = enabled
+        self.max_entries = max(1, max_entries)
+        self.storage_chat_id = storage_chat_id
+        self._lru: "OrderedDict[str, dict]" = OrderedDict()
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'invalidations': 0,
+            'send_errors': 0,
+            'storage_mirrors': 0,
+        }
+        logger.info(f"✅ DeliveryCache initialized (enabled={enabled}, max_entries={self.max_entries}, "
+                    f"storage_channel={'set' if storage_chat_id else 'none'})")
+
+    @staticmethod
+    def make_key(platform: str, media_id: str, format_id: str = '') -> str:
+        return f"{(platform or '').lower()}:{media_id}:{format_id or 'default'}"
+
+    # ---------------- Lookup / store ----------------
+
+    def get(self, platform: str, media_id: str, format_id: str = '') -> Optional[dict]:
+        """دریافت entry از LRU یا دیتابیس"""
+        if not self.enabled or not media_id:
+            return None
+
+        key = self.make_key(platform, media_id, format_id)
+        entry = self._lru.get(key)
+        if entry is not None:
+            self._lru.move_to_end(key)
+            return entry
+
+        try:
+            row = DB().get_delivery_entry(key)
+        except Exception as e:
+            logger.warning(f"Delivery cache DB lookup failed: {e}")
+            return None
+        if not row:
+            return None
+
+        try:
+            row['items'] = json.loads(row.get('items') or '[]')
+        except Exception:
+            row['items'] = []
+        if not row['items']:
+            return None
+
+        self._remember_in_memory(key, row)
+        return row
+
+    def _remember_in_memory(self, key: str, entry: dict):
+        self._lru[key] = entry
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+
+    def invalidate(self, platform: str, media_id: str, format_id: str = ''):
+        """حذف entry (مثلاً وقتی تلگرام file_id را رد کرد)"""
+        key = self.make_key(platform, media_id, format_id)
+        self._lru.pop(key, None)
+        self.stats['invalidations'] += 1
+        try:
+            DB().delete_delivery_entry(key)
+        except Exception as e:
+            logger.warning(f"Delivery cache DB delete failed: {e}")
+        logger.info(f"🗑️ Delivery cache invalidated: {key}")
+
+    async def remember(self, client, platform: str, media_id: str, format_id: str,
+                       sent: Any, caption: Optional[str] = None, media_type: str = '') -> bool:
+        """
+        ذخیره file_id پیام(های) ارسال شده
+        sent: Message، لیست Message یا نتیجه Bot API
+        """
+        if not self.enabled or not media_id:
+            return False
+
+        items = _extract_items(sent)
+        if not items:
+            logger.debug(f"Nothing to cache for {platform}:{media_id} (no file_id in sent message)")
+            return False
+
+        storage_chat_id = None
+        storage_message_id = None
+        # 📦 کپی در کانال ذخیره‌سازی برای پایداری file_id (فقط تک‌فایلی)
+        if self.storage_chat_id and len(items) == 1 and not isinstance(sent, (list, tuple, dict)):
+            try:
+                mirrored = await client.copy_message(
+                    chat_id=self.storage_chat_id,
+                    from_chat_id=sent.chat.id,
+                    message_id=sent.id,
+                    disable_notification=True
+                )
+                storage_chat_id = self.storage_chat_id
+                storage_message_id = mirrored.id
+                self.stats['storage_mirrors'] += 1
+            except Exception as e:
+                logger.warning(f"Storage channel mirror failed: {e}")
+
+        key = self.make_key(platform, media_id, format_id)
+        entry = {
+            'cache_key': key,
+            'platform': (platform or '').lower(),
+            'media_id': media_id,
+            'format_id': format_id or 'default',
+            'media_type': media_type or items[0]['type'],
+            'items': items,
+            'caption': caption,
+            'storage_chat_id': storage_chat_id,
+            'storage_message_id': storage_message_id,
+        }
+        self._remember_in_memory(key, entry)
+        self.stats['stores'] += 1
+
+        try:
+            DB().save_delivery_entry(
+                cache_key=key,
+                platform=entry['platform'],
+                media_id=media_id,
+                format_id=entry['format_id'],
+                media_type=entry['media_type'],
+                items=json.dumps(items),
+                caption=caption,
+                storage_chat_id=storage_chat_id,
+                storage_message_id=storage_message_id
+            )
+        except Exception as e:
+            logger.warning(f"Delivery cache DB save failed: {e}")
+
+        logger.info(f"💾 Delivery cached: {key} ({len(items)} item(s))")
+        return True
+
+    # ---------------- Delivery ----------------
+
+    async def deliver(self, client, chat_id: int, platform: str, media_id: str, format_id: str = '',
+                      caption: Optional[str] = None, reply_to_message_id: Optional[int] = None) -> bool:
+        """
+        تلاش برای ارسال از کش
+        Returns:
+            True اگر ارسال از کش انجام شد، False اگر باید مسیر عادی دانلود طی شود
+        """
+        if not self.enabled or not media_id:
+            return False
+
+        entry = self.get(platform, media_id, format_id)
+        if not entry:
+            self.stats['misses'] += 1
+            return False
+
+        key = entry.get('cache_key') or self.make_key(platform, media_id, format_id)
+        text = caption if caption is not None else entry.get('caption')
+        items = entry['items']
+        start = time.perf_counter()
+
+        try:
+            if len(items) == 1:
+                await client.send_cached_media(
+                    chat_id=chat_id,
+                    file_id=items[0]['file_id'],
+                    caption=text or '',
+                    reply_to_message_id=reply_to_message_id
+                )
+            else:
+                media_group = []
+                for idx, item in enumerate(items[:10]):
+                    item_caption = (text or '') if idx == 0 else ''
+                    if item['type'] == 'video':
+                        media_group.append(InputMediaVideo(media=item['file_id'], caption=item_caption))
+                    else:
+                        media_group.append(InputMediaPhoto(media=item['file_id'], caption=item_caption))
+                await client.send_media_group(
+                    chat_id=chat_id,
+                    media=media_group,
+                    reply_to_message_id=reply_to_message_id
+                )
+        except Exception as e:
+            if not _is_stale_error(e):
+                # خطای موقت (FloodWait، شبکه و ...): کش را نگه دار، مسیر عادی را برو
+                self.stats['send_errors'] += 1
+                logger.warning(f"Delivery cache send failed for {key}: {e}")
+                return False
+
+            logger.warning(f"Stale file_id for {key}: {e}")
+            # 🔄 تلاش از طریق کپی کانال ذخیره‌سازی
+            if entry.get('storage_chat_id') and entry.get('storage_message_id'):
+                try:
+                    copied = await client.copy_message(
+                        chat_id=chat_id,
+                        from_chat_id=entry['storage_chat_id'],
+                        message_id=entry['storage_message_id'],
+                        caption=text or '',
+                        reply_to_message_id=reply_to_message_id
+                    )
+                    # file_id تازه را جایگزین کن
+                    fresh_items = _extract_items(copied)
+                    if fresh_items:
+                        entry['items'] = fresh_items
+                        try:
+                            DB().save_delivery_entry(
+                                cache_key=key,
+                                platform=entry.get('platform', platform),
+                                media_id=media_id,
+                                format_id=entry.get('format_id', format_id or 'default'),
+                                media_type=entry.get('media_type', ''),
+                                items=json.dumps(fresh_items),
+                                caption=entry.get('caption'),
+                                storage_chat_id=entry['storage_chat_id'],
+                                storage_message_id=entry['storage_message_id']
+                            )
+                        except Exception as db_error:
+                            logger.warning(f"Delivery cache DB refresh failed: {db_error}")
+                    self._record_hit(key, start)
+                    return True
+                except Exception as copy_error:
+                    logger.warning(f"Storage channel copy failed for {key}: {copy_error}")
+
+            self.invalidate(platform, media_id, format_id)
+            self.stats['misses'] += 1
+            return False
+
+        self._record_hit(key, start)
+        return True
+
+    def _record_hit(self, key: str, start: float):
+        elapsed = time.perf_counter() - start
+        self.stats['hits'] += 1
+        try:
+            DB().touch_delivery_entry(key)
+        except Exception:
+            pass
+        logger.info(f"⚡ Delivery cache HIT: {key} (sent in {elapsed * 1000:.0f}ms)")
+
+        # لاگ خلاصه هر 50 hit
+        if self.stats['hits'] % 50 == 0:
+            logger.info(f"📊 Delivery cache stats: {self.get_stats()}")
+
+    # ---------------- Maintenance / stats ----------------
+
+    def cleanup_old_entries(self, days: int = DELIVERY_CACHE_TTL_DAYS) -> int:
+        """حذف entry های قدیمی از دیتابیس"""
+        self._lru.clear()
+        try:
+            return DB().cleanup_old_delivery_entries(days)
+        except Exception as e:
+            logger.warning(f"Delivery cache cleanup failed: {e}")
+            return 0
+
+    def get_stats(self) -> dict:
+        lookups = self.stats['hits'] + self.stats['misses']
+        hit_rate = (self.stats['hits'] / lookups * 100) if lookups > 0 else 0
+        return {
+            **self.stats,
+            'memory_entries': len(self._lru),
+            'hit_rate': hit_rate,
+        }
+
+
+# 🔥 Global delivery cache instance
+delivery_cache = DeliveryCache()
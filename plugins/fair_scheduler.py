@@ -0,0 +1,305 @@
+"""
+Fair Scheduler - زمان‌بندی منصفانه job ها بین کاربران (Deficit Round-Robin)
+JobQueue قبلاً یک صف FIFO مشترک داشت: کاربری که ده لینک پشت هم می‌فرستاد همه را
+جلوی بقیه قرار می‌داد، و اگر به سقف دانلود همزمانش رسیده بود worker ها job او را
+مدام برمی‌داشتند، دوباره در صف می‌گذاشتند و 0.5s می‌خوابیدند.
+
+- هر کاربر صف جداگانه دارد؛ کاربرهای دارای job به نوبت (DRR) سرویس می‌گیرند و
+  سهم هر نوبت برابر وزن tier کاربر است (JOB_QUEUE_TIER_WEIGHTS)
+- کاربری که به سقف همزمانی رسیده از چرخه کنار می‌رود و با release_user برمی‌گردد
+  (بدون requeue و sleep)
+- موقعیت در صف با شمارنده‌های هر کاربر/lane و مجموع وزن‌ها در O(1) تخمین زده می‌شود
+  (ترتیب ورود؛ جابه‌جایی SJF داخل صف یک کاربر در تخمین دیده نمی‌شود)
+- هیستوگرام عمق صف (هنگام ورود) و زمان انتظار (هنگام شروع) در get_stats
+- هزینه DRR هر job زمان تخمینی آن (job_cost) است: job های کوچک کاربرهای دیگر جلوی
+  job های سنگین می‌افتند و کسری (deficit) انباشته هر نوبت مانع گرسنگی job های بزرگ است؛
+  صف هر کاربر هم کوتاه‌ترین-کار-اول با aging مرتب می‌شود
+- lane های admin و retry قبل از چرخه DRR سرویس می‌گیرند
+"""
+
+import asyncio
+import bisect
+import heapq
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Hashable, List, Optional
+
+from plugins.logger_config import get_logger
+from plugins.concurrency import reserve_user, add_user_release_listener
+from plugins.job_cost import LANES, priority_key
+
+try:
+    from config import JOB_QUEUE_TIER_WEIGHTS, JOB_QUEUE_USER_TIERS
+except Exception:
+    JOB_QUEUE_TIER_WEIGHTS = {'default': 1.0, 'premium': 2.0, 'admin': 4.0}
+    JOB_QUEUE_USER_TIERS = {}
+
+try:
+    from config import JOB_COST_QUANTUM
+except Exception:
+    JOB_COST_QUANTUM = 60.0
+
+try:
+    from config import ADMIN
+except Exception:
+    ADMIN = []
+
+logger = get_logger('fair_scheduler')
+
+# مرزهای هیستوگرام (بازه‌ها: کمتر از هر مرز، و آخری: بیشتر یا مساوی آخرین مرز)
+WAIT_BUCKETS = (1, 5, 15, 30, 60, 120, 300)          # ثانیه
+DEPTH_BUCKETS = (1, 2, 5, 10, 20, 50)                 # تعداد job در صف
+
+
+def _bucket_labels(bounds, unit: str = '') -> list:
+    labels = [f"<{bounds[0]}{unit}"]
+    labels += [f"{lo}-{hi}{unit}" for lo, hi in zip(bounds, bounds[1:])]
+    labels.append(f"≥{bounds[-1]}{unit}")
+    return labels
+
+
+class _Entry:
+    __slots__ = ('key', 'user', 'item', 'cost', 'lane', 'seq', 'enqueued', 'order')
+
+    def __init__(self, key: Hashable, user: str, item: Any, cost: float, lane: str, seq: int):
+        self.key = key
+        self.user = user
+        self.item = item
+        self.cost = cost  # ثانیه‌های تخمینی (job_cost)
+        self.lane = lane
+        self.seq = seq
+        self.enqueued = time.monotonic()
+        self.order = (*priority_key(cost, lane, self.enqueued), seq)
+
+    def __lt__(self, other: '_Entry') -> bool:
+        return self.order < other.order
+
+
+class FairScheduler:
+    """صف‌های جداگانه هر کاربر + Deficit Round-Robin وزن‌دار"""
+
+    def __init__(self, tier_weights: Optional[Dict[str, float]] = None,
+                 user_tiers: Optional[Dict[int, str]] = None, quantum: float = JOB_COST_QUANTUM):
+        self.tier_weights = dict(tier_weights or JOB_QUEUE_TIER_WEIGHTS)
+        self.user_tiers = dict(user_tiers or JOB_QUEUE_USER_TIERS)
+        self.quantum = max(quantum, 1.0)  # ثانیه تخمینی سهم هر نوبت برای وزن 1
+        self._queues: Dict[str, List[_Entry]] = {}  # heap هر کاربر (SJF + aging)
+        # lane های اولویت‌دار (admin، retry) خارج از چرخه DRR؛ لیست مرتب
+        self._lanes: Dict[str, List[_Entry]] = {lane: [] for lane in LANES if lane != 'normal'}
+        self._ring: Deque[str] = deque()      # کاربرهای دارای job که قابل سرویس‌اند
+        self._parked: set = set()              # کاربرهای دارای job که به سقف همزمانی رسیده‌اند
+        self._deficit: Dict[str, float] = {}
+        self._pushed: Dict[str, int] = {}      # seq بعدی هر کاربر
+        self._served: Dict[str, int] = {}      # تعداد job های خارج شده از صف هر کاربر
+        self._lane_pushed: Dict[str, int] = {lane: 0 for lane in self._lanes}
+        self._lane_served: Dict[str, int] = {lane: 0 for lane in self._lanes}
+        self._entries: Dict[Hashable, _Entry] = {}
+        self._backlogged_weight = 0.0
+        self._wakeup = asyncio.Event()
+        self.stats = {
+            'enqueued': 0,
+            'dispatched': 0,
+            'parked': 0,
+            'max_depth': 0,
+            'wait_time_total': 0.0,
+            'cost_total': 0.0,
+        }
+        self._lane_dispatched: Dict[str, int] = {lane: 0 for lane in LANES}
+        self._wait_hist = [0] * (len(WAIT_BUCKETS) + 1)
+        self._depth_hist = [0] * (len(DEPTH_BUCKETS) + 1)
+        self._tier_dispatched: Dict[str, int] = {}
+        self._tier_wait: Dict[str, float] = {}
+        add_user_release_listener(self._on_user_release)
+
+    # ---------------------------------------------------------------- #
+    # tier و وزن
+
+    def tier(self, user_id) -> str:
+        try:
+            uid = int(user_id)
+        except (TypeError, ValueError):
+            return 'default'
+        if uid in ADMIN:
+            return 'admin'
+        return self.user_tiers.get(uid, 'default')
+
+    def weight(self, user_id) -> float:
+        tier = self.tier(user_id)
+        return self.tier_weights.get(tier, self.tier_weights.get('default', 1.0))
+
+    # ---------------------------------------------------------------- #
+    # صف
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def push(self, user_id, item: Any, key: Hashable, cost: float = 60.0, lane: str = 'normal') -> int:
+        """
+        افزودن job؛ موقعیت تخمینی را برمی‌گرداند
+            cost: ثانیه‌های تخمینی (job_cost_model.estimate)
+            lane: 'admin' / 'retry' (قبل از بقیه) یا 'normal' (چرخه DRR)
+        """
+        user = str(user_id)
+        depth = len(self._entries)
+        self._depth_hist[bisect.bisect_right(DEPTH_BUCKETS, depth)] += 1
+
+        if lane in self._lanes:
+            seq = self._lane_pushed[lane]
+            self._lane_pushed[lane] = seq + 1
+            entry = _Entry(key, user, item, max(cost, 0.1), lane, seq)
+            bisect.insort(self._lanes[lane], entry)
+        else:
+            seq = self._pushed.get(user, 0)
+            self._pushed[user] = seq + 1
+            entry = _Entry(key, user, item, max(cost, 0.1), 'normal', seq)
+            queue = self._queues.get(user)
+            if queue is None:
+                queue = self._queues[user] = []
+                self._deficit[user] = 0.0
+                self._backlogged_weight += self.weight(user)
+                self._ring.append(user)
+            heapq.heappush(queue, entry)
+        self._entries[key] = entry
+
+        self.stats['enqueued'] += 1
+        self.stats['max_depth'] = max(self.stats['max_depth'], len(self._entries))
+        self._wakeup.set()
+        return self.position(key)
+
+    def position(self, key: Hashable) -> int:
+        """
+        موقعیت تخمینی (1 = نفر بعدی) در O(1):
+        lane های اولویت‌دار + job های جلوتر همین کاربر + سهم بقیه کاربرهای منتظر در نوبت‌هایی که تا آن زمان می‌گذرد
+        job های جلوتر با ترتیب ورود شمرده می‌شوند (seq - served)؛ job کوتاه‌تری که بعداً
+        آمده و طبق SJF جلو می‌افتد در تخمین نیست — دقت فدای O(1) بودن در هر ویرایش پیام وضعیت
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return 0
+        if entry.lane != 'normal':
+            lanes_ahead = 0
+            for lane, items in self._lanes.items():  # تعداد lane ها ثابت است
+                if lane == entry.lane:
+                    ahead = min(max(0, entry.seq - self._lane_served[lane]), len(items) - 1)
+                    return lanes_ahead + ahead + 1
+                lanes_ahead += len(items)
+        lanes_ahead = sum(len(items) for items in self._lanes.values())
+        queued = len(self._queues.get(entry.user, ()))
+        ahead = min(max(0, entry.seq - self._served.get(entry.user, 0)), queued - 1)
+        weight = self.weight(entry.user)
+        others = max(0.0, self._backlogged_weight - weight)
+        estimate = lanes_ahead + ahead + 1 + int((ahead / weight + 0.5) * others)
+        return min(estimate, len(self._entries))
+
+    def _retire_user(self, user: str):
+        """کاربر دیگر job در صف ندارد"""
+        self._queues.pop(user, None)
+        self._deficit.pop(user, None)
+        self._parked.discard(user)
+        self._backlogged_weight = max(0.0, self._backlogged_weight - self.weight(user))
+        if self._pushed.get(user) == self._served.get(user):
+            self._pushed.pop(user, None)
+            self._served.pop(user, None)
+
+    def _next_priority(self) -> Optional[_Entry]:
+        """اولین job قابل سرویس lane های admin/retry (کاربر به سقف همزمانی نرسیده باشد)"""
+        for lane, items in self._lanes.items():
+            for idx, entry in enumerate(items):
+                if reserve_user(entry.user):
+                    del items[idx]
+                    self._lane_served[lane] += 1
+                    return entry
+        return None
+
+    def _next(self) -> Optional[_Entry]:
+        """انتخاب job بعدی (lane ها، سپس DRR)؛ سهمیه همزمانی کاربر همین‌جا رزرو می‌شود"""
+        entry = self._next_priority()
+        if entry is not None:
+            return entry
+        while self._ring:
+            user = self._ring[0]
+            queue = self._queues[user]
+            head = queue[0]
+            if self._deficit[user] < head.cost:
+                # شروع نوبت جدید این کاربر (کسری انباشته = aging بین کاربرها)
+                self._deficit[user] += self.weight(user) * self.quantum
+                if self._deficit[user] < head.cost:
+                    self._ring.rotate(-1)
+                    continue
+            if not reserve_user(user):
+                # سقف همزمانی: تا release_user همین کاربر از چرخه خارج می‌شود
+                self._ring.popleft()
+                self._parked.add(user)
+                self.stats['parked'] += 1
+                continue
+
+            heapq.heappop(queue)
+            self._deficit[user] -= head.cost
+            self._served[user] = self._served.get(user, 0) + 1
+            if not queue:
+                self._ring.popleft()
+                self._retire_user(user)
+            elif self._deficit[user] < queue[0].cost:
+                self._ring.rotate(-1)  # پایان نوبت
+            return head
+        return None
+
+    def _on_user_release(self, user_id):
+        user = str(user_id)
+        if user in self._parked:
+            self._parked.discard(user)
+            self._ring.append(user)
+            self._wakeup.set()
+        elif any(self._lanes.values()):
+            self._wakeup.set()
+
+    async def get(self) -> Any:
+        """
+        job بعدی (منتظر می‌ماند تا job قابل سرویس برسد)
+        سهمیه کاربر (reserve_user) گرفته شده؛ بعد از پایان کار release_user صدا زده شود.
+        """
+        while True:
+            entry = self._next()
+            if entry is not None:
+                self._entries.pop(entry.key, None)
+                self._record_dispatch(entry)
+                return entry.item
+            self._wakeup.clear()
+            await self._wakeup.wait()
+
+    def _record_dispatch(self, entry: _Entry):
+        waited = time.monotonic() - entry.enqueued
+        tier = self.tier(entry.user)
+        self.stats['dispatched'] += 1
+        self.stats['wait_time_total'] += waited
+        self.stats['cost_total'] += entry.cost
+        self._lane_dispatched[entry.lane] += 1
+        self._wait_hist[bisect.bisect_right(WAIT_BUCKETS, waited)] += 1
+        self._tier_dispatched[tier] = self._tier_dispatched.get(tier, 0) + 1
+        self._tier_wait[tier] = self._tier_wait.get(tier, 0.0) + waited
+        if waited > 60:
+            logger.info(f"⏳ Job {entry.key} of user {entry.user} ({tier}) waited {waited:.0f}s in queue")
+
+    # ---------------------------------------------------------------- #
+
+    def get_stats(self) -> dict:
+        dispatched = self.stats['dispatched']
+        return {
+            **self.stats,
+            'depth': len(self._entries),
+            'users': len(self._queues),
+            'parked_users': len(self._parked),
+            'lanes': {lane: len(items) for lane, items in self._lanes.items()},
+            'lane_dispatched': dict(self._lane_dispatched),
+            'avg_cost': self.stats['cost_total'] / dispatched if dispatched else 0.0,
+            'avg_wait': self.stats['wait_time_total'] / dispatched if dispatched else 0.0,
+            'wait_histogram': dict(zip(_bucket_labels(WAIT_BUCKETS, 's'), self._wait_hist)),
+            'depth_histogram': dict(zip(_bucket_labels(DEPTH_BUCKETS), self._depth_hist)),
+            'tiers': {
+                tier: {
+                    'dispatched': count,
+                    'avg_wait': self._tier_wait.get(tier, 0.0) / count if count else 0.0,
+                }
+                for tier, count in self._tier_dispatched.items()
+            },
+        }
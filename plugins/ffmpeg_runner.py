@@ -0,0 +1,380 @@
+"""
+FFmpeg Runner - اجرای متمرکز پروسه‌های ffmpeg
+- سقف همزمانی بر اساس CPU (FFMPEG_MAX_CONCURRENT) مشترک بین کدهای async و
+  postprocessor های yt-dlp که در thread اجرا می‌شوند
+- وقتی ytdlp_process_pool فعال است YTDLP_PROCESS_FFMPEG_SLOTS از این سقف به worker ها
+  داده می‌شود (semaphore خودشان) و این pool فقط باقی‌مانده را دارد
+- اولویت پایین با nice/ionice تا merge ها event loop و آپلودها را گرسنه نگذارند
+- timeout و لغو (terminate → kill) با حذف خروجی ناقص
+- آمار زمان هر نوع job، زمان انتظار در صف و عمق صف
+"""
+
+import asyncio
+import itertools
+import os
+import shutil
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+from plugins.logger_config import get_logger, get_performance_logger
+from plugins.pipeline_stages import StageMeter
+
+try:
+    from config import FFMPEG_MAX_CONCURRENT, FFMPEG_NICE, FFMPEG_IONICE, FFMPEG_JOB_TIMEOUT
+except Exception:
+    FFMPEG_MAX_CONCURRENT = max(1, (os.cpu_count() or 2) // 2)
+    FFMPEG_NICE = 10
+    FFMPEG_IONICE = True
+    FFMPEG_JOB_TIMEOUT = 1800.0
+
+try:
+    from config import YTDLP_PROCESS_FFMPEG_SLOTS
+except Exception:
+    YTDLP_PROCESS_FFMPEG_SLOTS = 0
+
+logger = get_logger('ffmpeg_runner')
+performance_logger = get_performance_logger()
+
+# postprocessor های yt-dlp که ffmpeg اجرا می‌کنند (MoveFiles و ... فقط فایل جابجا می‌کنند)
+YTDLP_FFMPEG_POSTPROCESSORS = ('Merger', 'ExtractAudio', 'VideoConvertor', 'VideoRemuxer')
+
+STDERR_TAIL_CHARS = 500
+
+
+def resolve_tools() -> Tuple[str, str]:
+    """پیدا کردن مسیر ffmpeg و ffprobe (FFMPEG_PATH از env یا config، سپس PATH)"""
+    ffmpeg_path = os.environ.get('FFMPEG_PATH')
+    if not ffmpeg_path:
+        try:
+            from config import FFMPEG_PATH as CFG_FFMPEG
+            ffmpeg_path = CFG_FFMPEG
+        except Exception:
+            ffmpeg_path = None
+
+    ffprobe_path = None
+    ffmpeg_exe = None
+    if ffmpeg_path and os.path.exists(ffmpeg_path):
+        ffmpeg_exe = ffmpeg_path
+        cand = os.path.join(os.path.dirname(ffmpeg_path), 'ffprobe.exe' if os.name == 'nt' else 'ffprobe')
+        if os.path.exists(cand):
+            ffprobe_path = cand
+    if not ffprobe_path:
+        ffprobe_path = shutil.which('ffprobe') or 'ffprobe'
+    if not ffmpeg_exe:
+        ffmpeg_exe = shutil.which('ffmpeg') or 'ffmpeg'
+    return ffmpeg_exe, ffprobe_path
+
+
+class _Waiter:
+    __slots__ = ('loop', 'future', 'granted')
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.future = loop.create_future()
+        self.granted = False
+
+
+class SlotPool:
+    """
+    شمارنده ظرفیت thread-safe که هم با await و هم به صورت blocking (در thread) گرفته می‌شود
+    """
+
+    def __init__(self, limit: int, meter: Optional[StageMeter] = None):
+        self.limit = max(1, limit)
+        self.in_use = 0
+        self.thread_waiting = 0
+        self.meter = meter
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._async_waiters: "deque[_Waiter]" = deque()
+
+    def _note(self):
+        # زیر self._lock صدا زده می‌شود
+        if self.meter is not None:
+            self.meter.update(self.in_use, self.queued)
+
+    @property
+    def queued(self) -> int:
+        return len(self._async_waiters) + self.thread_waiting
+
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self.in_use < self.limit and not self._async_waiters:
+                self.in_use += 1
+                self._note()
+                return
+            waiter = _Waiter(loop)
+            self._async_waiters.append(waiter)
+            self._note()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            with self._lock:
+                granted = waiter.granted
+                if not granted:
+                    try:
+                        self._async_waiters.remove(waiter)
+                    except ValueError:
+                        pass
+                    self._note()
+            if granted:
+                self.release()
+            raise
+
+    def acquire_blocking(self):
+        with self._cond:
+            self.thread_waiting += 1
+            self._note()
+            try:
+                while self.in_use >= self.limit:
+                    self._cond.wait()
+                self.in_use += 1
+            finally:
+                self.thread_waiting -= 1
+                self._note()
+
+    def release(self):
+        with self._lock:
+            # slot مستقیماً به اولین منتظر async منتقل می‌شود
+            while self._async_waiters:
+                waiter = self._async_waiters.popleft()
+                if waiter.future.done():
+                    continue
+                waiter.granted = True
+                waiter.loop.call_soon_threadsafe(self._wake, waiter.future)
+                self._note()
+                return
+            self.in_use = max(0, self.in_use - 1)
+            self._note()
+            self._cond.notify()
+
+    @staticmethod
+    def _wake(future: asyncio.Future):
+        if not future.done():
+            future.set_result(True)
+
+
+class _PostprocessorGate:
+    """
+    hook برای postprocessor_hooks در yt-dlp: هر postprocessor مبتنی بر ffmpeg
+    قبل از شروع یک slot از pool می‌گیرد (داخل thread دانلود، به صورت blocking)
+    """
+
+    def __init__(self, runner: "FFmpegRunner"):
+        self.runner = runner
+        self.held = False
+        self.name = None
+        self.started = 0.0
+
+    def hook(self, d: dict):
+        name = d.get('postprocessor') or ''
+        if name not in YTDLP_FFMPEG_POSTPROCESSORS:
+            return
+        status = d.get('status')
+        if status == 'started' and not self.held:
+            queued_at = time.time()
+            self.runner.slots.acquire_blocking()
+            self.held = True
+            self.name = name
+            self.started = time.time()
+            self.runner.stats['wait_total'] += self.started - queued_at
+        elif status == 'finished' and self.held:
+            self._finish('ok')
+
+    def _finish(self, status: str):
+        self.held = False
+        self.runner.slots.release()
+        self.runner._record(f"ytdlp:{self.name}", status, time.time() - self.started, 0.0)
+
+    def close(self):
+        # postprocessor با خطا تمام شد و hook مرحله finished اجرا نشد
+        if self.held:
+            self._finish('failed')
+
+
+class FFmpegRunner:
+    """اجرای ffmpeg با سقف همزمانی، اولویت پایین، timeout و آمار"""
+
+    def __init__(self, max_concurrent: int = max(1, FFMPEG_MAX_CONCURRENT - YTDLP_PROCESS_FFMPEG_SLOTS), nice: int = FFMPEG_NICE,
+                 ionice: bool = FFMPEG_IONICE, timeout: float = FFMPEG_JOB_TIMEOUT):
+        self.slots = SlotPool(max_concurrent, StageMeter('postprocess', max_concurrent))
+        self.nice = nice
+        self.ionice = ionice
+        self.timeout = timeout
+        self._ffmpeg: Optional[str] = None
+        self._prefix: Optional[List[str]] = None
+        self._job_ids = itertools.count(1)
+        self._running: Dict[int, dict] = {}
+        self.kind_stats: Dict[str, dict] = {}
+        self.stats = {
+            'jobs': 0,
+            'failed': 0,
+            'timeouts': 0,
+            'cancelled': 0,
+            'wait_total': 0.0,
+        }
+        logger.info(f"✅ FFmpegRunner initialized (max_concurrent={self.slots.limit}, nice={nice}, ionice={ionice})")
+
+    @property
+    def ffmpeg_path(self) -> str:
+        if self._ffmpeg is None:
+            self._ffmpeg = resolve_tools()[0]
+        return self._ffmpeg
+
+    def _priority_prefix(self) -> List[str]:
+        """پیشوند nice/ionice (فقط روی سیستم‌هایی که این ابزارها را دارند)"""
+        if self._prefix is None:
+            prefix = []
+            if os.name == 'posix':
+                if self.ionice and shutil.which('ionice'):
+                    prefix += ['ionice', '-c', '2', '-n', '7']
+                if self.nice and shutil.which('nice'):
+                    prefix += ['nice', '-n', str(self.nice)]
+            self._prefix = prefix
+        return self._prefix
+
+    def _record(self, kind: str, status: str, elapsed: float, wait: float):
+        self.stats['jobs'] += 1
+        if status == 'failed':
+            self.stats['failed'] += 1
+        elif status == 'timeout':
+            self.stats['timeouts'] += 1
+        elif status == 'cancelled':
+            self.stats['cancelled'] += 1
+
+        ks = self.kind_stats.setdefault(kind, {'count': 0, 'failed': 0, 'total_time': 0.0, 'max_time': 0.0})
+        ks['count'] += 1
+        if status != 'ok':
+            ks['failed'] += 1
+        ks['total_time'] += elapsed
+        ks['max_time'] = max(ks['max_time'], elapsed)
+        performance_logger.info(f"[FFMPEG] {kind}: {status} in {elapsed:.2f}s (queued {wait:.2f}s)")
+
+    @staticmethod
+    async def _terminate(proc):
+        if proc.returncode is not None:
+            return
+        try:
+            proc.terminate()
+            await asyncio.wait_for(proc.wait(), timeout=5)
+        except ProcessLookupError:
+            pass
+        except asyncio.TimeoutError:
+            try:
+                proc.kill()
+            except ProcessLookupError:
+                pass
+            await proc.wait()
+
+    async def run(self, args: List[str], kind: str = 'ffmpeg', timeout: Optional[float] = None,
+                  output_path: Optional[str] = None) -> Tuple[int, str]:
+        """
+        اجرای ffmpeg با آرگومان‌های داده شده (بدون نام برنامه)
+        Returns: (returncode, انتهای stderr)
+        در timeout خطای asyncio.TimeoutError و در لغو CancelledError بالا می‌رود؛
+        در هر دو حالت پروسه متوقف و output_path ناقص حذف می‌شود.
+        """
+        timeout = timeout or self.timeout
+        queued_at = time.time()
+        await self.slots.acquire()
+        wait = time.time() - queued_at
+        self.stats['wait_total'] += wait
+
+        job_id = next(self._job_ids)
+        cmd = self._priority_prefix() + [self.ffmpeg_path, '-hide_banner', '-nostdin', *args]
+        start = time.time()
+        status = 'failed'
+        proc = None
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.PIPE
+            )
+            self._running[job_id] = {'kind': kind, 'proc': proc, 'started': start}
+            try:
+                _, stderr = await asyncio.wait_for(proc.communicate(), timeout=timeout)
+            except asyncio.TimeoutError:
+                status = 'timeout'
+                logger.error(f"❌ ffmpeg {kind} timeout after {timeout}s")
+                raise
+            except asyncio.CancelledError:
+                status = 'cancelled'
+                raise
+            status = 'ok' if proc.returncode == 0 else 'failed'
+            tail = stderr.decode('utf-8', errors='ignore')[-STDERR_TAIL_CHARS:] if stderr else ''
+            if proc.returncode != 0:
+                logger.warning(f"⚠️ ffmpeg {kind} exited with {proc.returncode}: {tail}")
+            return proc.returncode, tail
+        finally:
+            if proc is not None:
+                await asyncio.shield(self._terminate(proc))
+            self._running.pop(job_id, None)
+            self.slots.release()
+            if status != 'ok' and output_path and os.path.exists(output_path):
+                try:
+                    os.unlink(output_path)
+                except OSError:
+                    pass
+            self._record(kind, status, time.time() - start, wait)
+
+    # ---------------- Common jobs ----------------
+
+    async def remux_faststart(self, src: str, dst: str, timeout: Optional[float] = None) -> bool:
+        """کپی stream ها به MP4 با moov در ابتدای فایل (بدون encode)"""
+        returncode, _ = await self.run(
+            ['-y', '-i', src, '-c', 'copy', '-movflags', '+faststart', dst],
+            kind='remux', timeout=timeout, output_path=dst
+        )
+        return returncode == 0 and os.path.exists(dst) and os.path.getsize(dst) > 0
+
+    async def thumbnail(self, src: str, dst: str, timeout: float = 8.0) -> bool:
+        """ساخت thumbnail کوچک (320px) از ثانیه 1"""
+        returncode, _ = await self.run(
+            ['-y', '-ss', '1', '-i', src, '-vframes', '1', '-vf', 'scale=320:-2',
+             '-q:v', '5', '-f', 'image2', dst],
+            kind='thumbnail', timeout=timeout, output_path=dst
+        )
+        return returncode == 0 and os.path.exists(dst) and os.path.getsize(dst) > 0
+
+    @contextmanager
+    def postprocessor_gate(self):
+        """
+        برای دانلودهای yt-dlp (داخل thread):
+            with ffmpeg_runner.postprocessor_gate() as gate:
+                opts['postprocessor_hooks'] = [gate.hook]
+        """
+        gate = _PostprocessorGate(self)
+        try:
+            yield gate
+        finally:
+            gate.close()
+
+    async def cancel_all(self):
+        """توقف همه پروسه‌های در حال اجرا (هنگام shutdown)"""
+        for job in list(self._running.values()):
+            await self._terminate(job['proc'])
+
+    def get_stats(self) -> dict:
+        jobs = self.stats['jobs']
+        now = time.time()
+        return {
+            **self.stats,
+            'max_concurrent': self.slots.limit,
+            'running': self.slots.in_use,
+            'queued': self.slots.queued,
+            'avg_wait': self.stats['wait_total'] / jobs if jobs else 0.0,
+            'longest_running': max((now - j['started'] for j in self._running.values()), default=0.0),
+            'kinds': {
+                kind: {**ks, 'avg_time': ks['total_time'] / ks['count'] if ks['count'] else 0.0}
+                for kind, ks in self.kind_stats.items()
+            },
+        }
+
+
+# 🔥 Global instance
+ffmpeg_runner = FFmpegRunner()
@@ -0,0 +1,203 @@
+"""
+HTTP Client - لایه مشترک aiohttp برای کل ربات
+یک ClientSession طولانی‌مدت با keep-alive، محدودیت اتصال per-host و کش DNS،
+به همراه header profile های هر پلتفرم و آمار استفاده از pool.
+"""
+
+import aiohttp
+from typing import Dict, Optional
+from plugins.logger_config import get_logger
+
+try:
+    from config import HTTP_POOL_LIMIT, HTTP_LIMIT_PER_HOST, HTTP_DNS_TTL, HTTP_KEEPALIVE_TIMEOUT
+except Exception:
+    HTTP_POOL_LIMIT = 100
+    HTTP_LIMIT_PER_HOST = 16
+    HTTP_DNS_TTL = 300
+    HTTP_KEEPALIVE_TIMEOUT = 30
+
+logger = get_logger('http_client')
+
+
+# ============================================================
+# HEADER PROFILES
+# ============================================================
+HEADER_PROFILES: Dict[str, Dict[str, str]] = {
+    'default': {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+        'Accept': '*/*',
+        'Accept-Language': 'en-US,en;q=0.9',
+        'Accept-Encoding': 'gzip, deflate, br',
+        'DNT': '1',
+        'Connection': 'keep-alive'
+    },
+    'spotify': {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+        'Accept': 'audio/mpeg,audio/ogg,audio/wav,audio/*;q=0.9,*/*;q=0.8',
+        'Accept-Language': 'en-US,en;q=0.9',
+        'Accept-Encoding': 'gzip, deflate, br',
+        'DNT': '1',
+        'Connection': 'keep-alive',
+        'Upgrade-Insecure-Requests': '1',
+        'Sec-Fetch-Dest': 'audio',
+        'Sec-Fetch-Mode': 'no-cors',
+        'Sec-Fetch-Site': 'cross-site'
+    },
+    'tiktok': {
+        'User-Agent': 'Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 Mobile/15E148 Safari/604.1',
+        'Accept': 'video/webm,video/ogg,video/*;q=0.9,application/ogg;q=0.7,audio/*;q=0.6,*/*;q=0.5',
+        'Accept-Language': 'en-US,en;q=0.9',
+        'Accept-Encoding': 'gzip, deflate, br',
+        'DNT': '1',
+        'Connection': 'keep-alive',
+        'Upgrade-Insecure-Requests': '1',
+        'Sec-Fetch-Dest': 'video',
+        'Sec-Fetch-Mode': 'no-cors',
+        'Sec-Fetch-Site': 'cross-site'
+    },
+    'instagram': {
+        'User-Agent': 'Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 Mobile/15E148 Safari/604.1',
+        'Accept': 'video/webm,video/ogg,video/*;q=0.9,application/ogg;q=0.7,audio/*;q=0.6,*/*;q=0.5',
+        'Accept-Language': 'en-US,en;q=0.9',
+        'Accept-Encoding': 'gzip, deflate, br',
+        'DNT': '1',
+        'Connection': 'keep-alive',
+        'Upgrade-Insecure-Requests': '1',
+        'Sec-Fetch-Dest': 'video',
+        'Sec-Fetch-Mode': 'no-cors',
+        'Sec-Fetch-Site': 'cross-site',
+        'Referer': 'https://www.instagram.com/',
+        'Origin': 'https://www.instagram.com'
+    },
+}
+
+
+def detect_profile(url: str) -> str:
+    """تشخیص header profile مناسب از روی URL"""
+    u = (url or '').lower()
+    if 'spotify' in u or 'zm.io.vn' in u:
+        return 'spotify'
+    if 'tiktok' in u:
+        return 'tiktok'
+    if 'instagram' in u or 'cdninstagram' in u or 'fbcdn.net' in u:
+        return 'instagram'
+    return 'default'
+
+
+def headers_for(url: Optional[str] = None, profile: Optional[str] = None) -> Dict[str, str]:
+    """کپی headers برای یک profile (یا profile تشخیص داده شده از URL)"""
+    name = profile or detect_profile(url or '')
+    return dict(HEADER_PROFILES.get(name, HEADER_PROFILES['default']))
+
+
+# ============================================================
+# SHARED SESSION
+# ============================================================
+class HttpClient:
+    """
+    مدیریت ClientSession مشترک
+    session به صورت lazy در event loop جاری ساخته می‌شود؛ timeout را هر فراخوانی
+    خودش روی request تنظیم می‌کند.
+    """
+
+    def __init__(self):
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._connector: Optional[aiohttp.TCPConnector] = None
+        self.host_requests: Dict[str, int] = {}
+        self.stats = {
+            'requests': 0,
+            'errors': 0,
+            'connections_created': 0,
+            'connections_reused': 0,
+            'dns_cache_hits': 0,
+            'dns_cache_misses': 0,
+            'sessions_created': 0,
+        }
+
+    def _build_trace_config(self) -> aiohttp.TraceConfig:
+        trace = aiohttp.TraceConfig()
+
+        async def on_request_start(session, ctx, params):
+            self.stats['requests'] += 1
+            host = params.url.host or 'unknown'
+            self.host_requests[host] = self.host_requests.get(host, 0) + 1
+
+        async def on_request_exception(session, ctx, params):
+            self.stats['errors'] += 1
+
+        async def on_connection_create_end(session, ctx, params):
+            self.stats['connections_created'] += 1
+
+        async def on_connection_reuseconn(session, ctx, params):
+            self.stats['connections_reused'] += 1
+
+        async def on_dns_cache_hit(session, ctx, params):
+            self.stats['dns_cache_hits'] += 1
+
+        async def on_dns_cache_miss(session, ctx, params):
+            self.stats['dns_cache_misses'] += 1
+
+        trace.on_request_start.append(on_request_start)
+        trace.on_request_exception.append(on_request_exception)
+        trace.on_connection_create_end.append(on_connection_create_end)
+        trace.on_connection_reuseconn.append(on_connection_reuseconn)
+        trace.on_dns_cache_hit.append(on_dns_cache_hit)
+        trace.on_dns_cache_miss.append(on_dns_cache_miss)
+        return trace
+
+    def session(self) -> aiohttp.ClientSession:
+        """دریافت session مشترک (نباید با async with بسته شود)"""
+        if self._session is None or self._session.closed:
+            self._connector = aiohttp.TCPConnector(
+                limit=HTTP_POOL_LIMIT,
+                limit_per_host=HTTP_LIMIT_PER_HOST,
+                ttl_dns_cache=HTTP_DNS_TTL,
+                use_dns_cache=True,
+                keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+                enable_cleanup_closed=True,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=self._connector,
+                # کوکی‌های پاسخ بین کاربران/درخواست‌ها به اشتراک گذاشته نشوند
+                cookie_jar=aiohttp.DummyCookieJar(),
+                timeout=aiohttp.ClientTimeout(total=None, connect=30, sock_read=120),
+                trace_configs=[self._build_trace_config()],
+            )
+            self.stats['sessions_created'] += 1
+            logger.info(
+                f"✅ Shared HTTP session created (limit={HTTP_POOL_LIMIT}, "
+                f"per_host={HTTP_LIMIT_PER_HOST}, dns_ttl={HTTP_DNS_TTL}s)"
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            logger.info(f"🔌 Shared HTTP session closed: {self.get_stats()}")
+        self._session = None
+        self._connector = None
+
+    def get_stats(self) -> dict:
+        in_use = 0
+        idle = 0
+        connector = self._connector
+        if connector is not None and not connector.closed:
+            try:
+                in_use = len(getattr(connector, '_acquired', ()))
+                idle = sum(len(v) for v in getattr(connector, '_conns', {}).values())
+            except Exception:
+                pass
+        created = self.stats['connections_created']
+        reused = self.stats['connections_reused']
+        top_hosts = sorted(self.host_requests.items(), key=lambda x: x[1], reverse=True)[:5]
+        return {
+            **self.stats,
+            'in_use': in_use,
+            'idle': idle,
+            'reuse_rate': (reused / (created + reused) * 100) if (created + reused) else 0.0,
+            'top_hosts': top_hosts,
+        }
+
+
+# 🔥 Global instance
+http_client = HttpClient()
@@ -9,8 +9,6 @@ Phase 1 Fix: Use secure cookie path from config
 import os
 import time
 import asyncio
-import http.client
-import json
 import logging
 from typing import Optional, Dict, Tuple
 from datetime import datetime
@@ -23,7 +21,13 @@ from plugins.db_wrapper import DB
 from plugins.logger_config import get_logger
 from plugins.start import join
 from plugins.insta_stats import insta_stats
-import yt_dlp
+from plugins.delivery_cache import delivery_cache, canonical_media_id
+from plugins.single_flight import SingleFlight
+from plugins.concurrency import gather_items
+from plugins.rapidapi_client import rapidapi_client, RapidAPIQuotaExceeded
+from plugins.api_cache import api_cache
+from plugins.ytdlp_pool import ytdlp_pool
+from plugins.workspace_manager import workspace_manager
 
 # ============================================================
 # PHASE 1 SECURITY FIX: Import secure cookie path from config
@@ -46,7 +50,6 @@ except ImportError as e:
 RAPIDAPI_KEY = os.getenv('RAPIDAPI_KEY')
 if not RAPIDAPI_KEY:
     logger.warning("[INSTA] RAPIDAPI_KEY not set in environment! Instagram API will not work.")
-RAPIDAPI_HOST = "social-download-all-in-one.p.rapidapi.com"
 
 # Timeouts
 API_TIMEOUT = 10
@@ -62,10 +65,20 @@ class InstaFetcher:
         self.cookie_file = COOKIE_FILE
         self.last_api_call = 0  # برای rate limiting
         self.min_api_interval = 1.0  # حداقل 1 ثانیه بین هر request
-        self.api_cache = {}  # Cache برای API responses
-        self.cache_ttl = 60  # 1 دقیقه TTL (کاهش از 5 دقیقه برای URL های تازه‌تر)
+        self._flight = SingleFlight('insta_fetch')  # ادغام درخواست‌های همزمان یک پست
         
     async def fetch(self, url: str, user_id: int, message: Message) -> Tuple[bool, Optional[Dict], Optional[str]]:
+        """
+        دانلود از Instagram؛ درخواست‌های همزمان برای یک پست به یک fetch متصل می‌شوند
+        (پیام وضعیت فقط برای درخواست اول به‌روزرسانی می‌شود)
+        
+        Returns:
+            (success, data, error_message)
+        """
+        key = canonical_media_id('instagram', url)
+        return await self._flight.do(key, self._fetch, url, user_id, message, copy_result=True)
+    
+    async def _fetch(self, url: str, user_id: int, message: Message) -> Tuple[bool, Optional[Dict], Optional[str]]:
         """
         دانلود از Instagram با استراتژی بهینه شده
         
@@ -152,21 +165,14 @@ class InstaFetcher:
     async def _try_api(self, url: str, message: Message) -> Tuple[bool, Optional[Dict], Optional[str]]:
         """Layer 1: تلاش با API با retry mechanism و cache"""
         
-        # بررسی cache
-        cache_key = url.split('?')[0]  # بدون query params
-        now = time.time()
-        
-        if cache_key in self.api_cache:
-            cached_data, cached_time = self.api_cache[cache_key]
-            if now - cached_time < self.cache_ttl:
-                logger.info(f"[INSTA] Using cached API response (age: {int(now - cached_time)}s)")
-                insta_stats.log_cache_hit()
-                return True, cached_data, None
-            else:
-                # Cache منقضی شده
-                del self.api_cache[cache_key]
-                logger.debug("[INSTA] Cache expired, fetching fresh data")
-                insta_stats.log_cache_miss()
+        # بررسی cache مشترک (کلید: shortcode پست)
+        cached = api_cache.get('instagram', url)
+        if cached is not None:
+            if cached['negative']:
+                logger.info(f"[INSTA] Using cached negative API response: {cached['data']}")
+                return False, None, cached['data']
+            logger.info("[INSTA] Using cached API response")
+            return True, cached['data'], None
         
         # تنظیمات retry
         max_retries = 2  # تعداد کل تلاش‌ها (اولی + 1 retry)
@@ -177,6 +183,7 @@ class InstaFetcher:
         for attempt in range(max_retries):
             try:
                 # Rate limiting: حداقل 1 ثانیه بین هر API call
+                now = time.time()
                 time_since_last = now - self.last_api_call
                 if time_since_last < self.min_api_interval:
                     wait_time = self.min_api_interval - time_since_last
@@ -200,17 +207,10 @@ class InstaFetcher:
                 # کمی delay برای نمایش پیام
                 await asyncio.sleep(0.5)
                 
-                # ساخت payload
-                payload = json.dumps({"url": url})
-                
-                # ارسال request
-                loop = asyncio.get_running_loop()
-                result = await asyncio.wait_for(
-                    loop.run_in_executor(None, self._api_request_sync, payload),
-                    timeout=API_TIMEOUT
-                )
+                # ارسال request (async، اتصال keep-alive مشترک + سهمیه واقعی RapidAPI)
+                data = await rapidapi_client.autolink(url, timeout=API_TIMEOUT)
                 
-                if not result:
+                if not data:
                     last_error = "API response empty"
                     logger.warning(f"[INSTA] API attempt {attempt + 1}/{max_retries} failed: empty response")
                     
@@ -222,9 +222,6 @@ class InstaFetcher:
                     else:
                         return False, None, last_error
                 
-                # Parse response
-                data = json.loads(result)
-                
                 # بررسی خطاها
                 if data.get('error'):
                     error_msg = self._parse_api_error(data)
@@ -234,6 +231,7 @@ class InstaFetcher:
                     # برای برخی خطاها retry نکن (مثل private_account)
                     if error_msg in ["private_account", "not_found"]:
                         logger.info(f"[INSTA] Error '{error_msg}' is not retryable, stopping")
+                        api_cache.put_negative('instagram', url, error_msg)
                         return False, None, error_msg
                     
                     # اگر تلاش آخر نبود، delay بده و retry کن
@@ -260,10 +258,14 @@ class InstaFetcher:
                 
                 # موفق! ذخیره در cache
                 logger.info(f"[INSTA] API attempt {attempt + 1}/{max_retries} SUCCESS")
-                self.api_cache[cache_key] = (data, time.time())
-                logger.debug(f"[INSTA] Cached API response for {cache_key}")
+                api_cache.put('instagram', url, data)
                 return True, data, None
                 
+            except RapidAPIQuotaExceeded as e:
+                # سهمیه تمام شده؛ retry فایده ندارد (لایه yt-dlp امتحان می‌شود)
+                logger.warning(f"[INSTA] {e}")
+                return False, None, "api_quota_exceeded"
+            
             except asyncio.TimeoutError:
                 last_error = "API timeout"
                 logger.error(f"[INSTA] API attempt {attempt + 1}/{max_retries} timeout")
@@ -291,32 +293,6 @@ class InstaFetcher:
         # اگر از loop خارج شدیم بدون return (نباید اتفاق بیفته)
         return False, None, last_error or "API failed after all retries"
     
-    def _api_request_sync(self, payload: str) -> Optional[str]:
-        """ارسال request به API (sync)"""
-        try:
-            conn = http.client.HTTPSConnection(RAPIDAPI_HOST, timeout=API_TIMEOUT)
-            
-            headers = {
-                'x-rapidapi-key': self.api_key,
-                'x-rapidapi-host': RAPIDAPI_HOST,
-                'Content-Type': 'application/json'
-            }
-            
-            conn.request("POST", "/v1/social/autolink", payload, headers)
-            res = conn.getresponse()
-            data = res.read()
-            
-            return data.decode("utf-8")
-            
-        except Exception as e:
-            logger.error(f"[INSTA] API request error: {e}")
-            return None
-        finally:
-            try:
-                conn.close()
-            except:
-                pass
-    
     def _parse_api_error(self, data: Dict) -> str:
         """Parse کردن خطای API"""
         try:
@@ -364,7 +340,7 @@ class InstaFetcher:
             loop = asyncio.get_running_loop()
             
             def _extract():
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                with ytdlp_pool.checkout(ydl_opts, name='instagram_info') as ydl:
                     return ydl.extract_info(url, download=False)
             
             info = await asyncio.wait_for(
@@ -584,6 +560,26 @@ async def handle_instagram_link(client: Client, message: Message):
     )
     
     try:
+        # ⚡ Delivery cache: اگر این پست قبلاً ارسال شده، با file_id بفرست
+        if await delivery_cache.deliver(
+            client,
+            chat_id=message.chat.id,
+            platform='instagram',
+            media_id=canonical_media_id('instagram', url),
+            reply_to_message_id=message.id
+        ):
+            try:
+                await status_msg.delete()
+            except Exception:
+                pass
+            db.update_request_status(
+                request_id=request_id,
+                status='success',
+                processing_time=time.time() - start_time
+            )
+            logger.info(f"[INSTA] Delivered from cache in {time.time() - start_time:.2f}s")
+            return
+        
         # تلاش برای دانلود
         success, data, error = await insta_fetcher.fetch(url, user_id, status_msg)
         
@@ -751,6 +747,7 @@ async def _download_and_send(
     fetcher: 'InstaFetcher' = None
 ):
     """دانلود و ارسال فایل"""
+    workspace = None
     try:
         # اگر fetcher پاس نشده، از global instance استفاده کن
         if fetcher is None:
@@ -790,142 +787,171 @@ async def _download_and_send(
             )
         
         # دانلود همه medias با yt-dlp
-        import tempfile
         import aiohttp
         from pyrogram.types import InputMediaPhoto, InputMediaVideo
+        from plugins.http_client import http_client
         
         downloaded_files = []
         
-        # دانلود هر media (فقط image و video، نه audio)
-        for idx, media in enumerate(visual_medias, 1):
+        # Headers
+        headers = {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+            'Referer': 'https://www.instagram.com/',
+        }
+        
+        # Cookies - یک بار برای کل درخواست (استفاده از http.cookiejar برای parse درست)
+        cookies = {}
+        if os.path.exists(COOKIE_FILE):
             try:
-                download_url = media.get('url')
-                if not download_url:
-                    logger.warning(f"[INSTA] No URL for media {idx}")
-                    continue
-                
-                media_type = media.get('type', 'video')
-                file_ext = media.get('extension', 'mp4' if media_type == 'video' else 'jpg')
-                
-                # نمایش progress برای کاربر (فقط برای آلبوم‌ها)
-                if total_medias > 1:
-                    try:
-                        await status_msg.edit_text(
-                            f"📸 **Instagram Gallery**\n\n"
-                            f"📥 در حال دانلود {idx}/{total_medias}\n"
-                            f"{'▓' * idx}{'░' * (total_medias - idx)}\n\n"
-                            f"⏳ لطفاً صبر کنید..."
-                        )
-                    except:
-                        pass
-                
-                # Logging دقیق برای هر media
-                logger.info(f"[INSTA] Downloading {idx}/{total_medias}: type={media_type}, ext={file_ext}, url_len={len(download_url)}")
-                
-                # Headers
-                headers = {
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-                    'Referer': 'https://www.instagram.com/',
-                }
-                
-                # Cookies - استفاده از http.cookiejar برای parse درست
-                cookies = {}
-                if os.path.exists(COOKIE_FILE):
-                    try:
-                        import http.cookiejar
-                        cookie_jar = http.cookiejar.MozillaCookieJar(COOKIE_FILE)
-                        cookie_jar.load(ignore_discard=True, ignore_expires=True)
-                        
-                        # تبدیل به dict برای aiohttp
-                        for cookie in cookie_jar:
-                            if 'instagram.com' in cookie.domain:
-                                cookies[cookie.name] = cookie.value
-                        
-                        logger.info(f"[INSTA] Loaded {len(cookies)} cookies from file")
-                    except Exception as e:
-                        logger.warning(f"[INSTA] Failed to load cookies: {e}")
-                        # Fallback به روش قدیمی
-                        try:
-                            with open(COOKIE_FILE, 'r') as f:
-                                for line in f:
-                                    if line.startswith('#') or not line.strip():
-                                        continue
-                                    parts = line.strip().split('\t')
-                                    if len(parts) >= 7:
-                                        cookies[parts[5]] = parts[6]
-                        except:
-                            pass
-                
-                # دانلود با retry برای 403 و chunk-based برای فایل‌های بزرگ
-                max_retries = 3
-                download_success = False
+                import http.cookiejar
+                cookie_jar = http.cookiejar.MozillaCookieJar(COOKIE_FILE)
+                cookie_jar.load(ignore_discard=True, ignore_expires=True)
                 
-                for retry in range(max_retries):
-                    try:
-                        # Timeout پویا: ابتدا HEAD request برای گرفتن سایز
-                        timeout_seconds = 60  # default
-                        try:
-                            async with aiohttp.ClientSession() as head_session:
-                                async with head_session.head(download_url, headers=headers, cookies=cookies, timeout=aiohttp.ClientTimeout(total=5)) as head_resp:
-                                    content_length = head_resp.headers.get('Content-Length')
-                                    if content_length:
-                                        file_size_mb = int(content_length) / (1024 * 1024)
-                                        # 2 ثانیه به ازای هر MB + 30 ثانیه base
-                                        timeout_seconds = max(60, int(file_size_mb * 2) + 30)
-                                        logger.info(f"[INSTA] Media {idx} size: {file_size_mb:.1f}MB, timeout: {timeout_seconds}s")
-                        except Exception as head_error:
-                            logger.debug(f"[INSTA] HEAD request failed, using default timeout: {head_error}")
-                            timeout_seconds = 120  # fallback برای حالتی که HEAD fail بشه
-                        
-                        timeout = aiohttp.ClientTimeout(total=timeout_seconds)
-                        async with aiohttp.ClientSession(timeout=timeout) as session:
-                            async with session.get(download_url, headers=headers, cookies=cookies) as resp:
-                                if resp.status == 200:
-                                    # دانلود chunk-based برای جلوگیری از OOM
-                                    with tempfile.NamedTemporaryFile(delete=False, suffix=f'.{file_ext}') as tmp_file:
-                                        chunk_size = 1024 * 1024  # 1MB chunks
-                                        async for chunk in resp.content.iter_chunked(chunk_size):
-                                            tmp_file.write(chunk)
-                                        
-                                        downloaded_files.append({
-                                            'path': tmp_file.name,
-                                            'type': media_type
-                                        })
-                                        logger.info(f"[INSTA] Downloaded media {idx}/{total_medias} ({os.path.getsize(tmp_file.name) / 1024 / 1024:.1f}MB)")
-                                        download_success = True
-                                        break
-                                elif resp.status == 403 and retry < max_retries - 1:
-                                    # 403: URL منقضی شده، دوباره fetch کن
-                                    logger.error(f"[INSTA] 403 Details: media={idx}, retry={retry+1}/{max_retries}, has_cookies={bool(cookies)}, url_starts={download_url[:50]}")
-                                    logger.warning(f"[INSTA] 403 on media {idx}, retry {retry+1}/{max_retries}")
-                                    await asyncio.sleep(1.5 * (retry + 1))
-                                    
-                                    # دوباره fetch کن برای URL تازه
-                                    success_refetch, data_refetch, _ = await fetcher.fetch(message.text.strip(), message.from_user.id, status_msg)
-                                    if success_refetch and data_refetch:
-                                        # فقط visual medias رو بگیر (مثل اول)
-                                        medias_refetch = data_refetch.get('medias', [])
-                                        visual_medias_refetch = [m for m in medias_refetch if m.get('type') in ['image', 'video']]
-                                        if idx <= len(visual_medias_refetch):
-                                            download_url = visual_medias_refetch[idx-1].get('url')
-                                            logger.info(f"[INSTA] Got fresh URL for media {idx}")
-                                else:
-                                    logger.warning(f"[INSTA] Download failed {idx}: {resp.status}")
-                                    break
-                    except Exception as e:
-                        logger.error(f"[INSTA] Download error media {idx}, retry {retry+1}: {e}")
-                        if retry < max_retries - 1:
-                            await asyncio.sleep(1.0 * (retry + 1))
+                # تبدیل به dict برای aiohttp
+                for cookie in cookie_jar:
+                    if 'instagram.com' in cookie.domain:
+                        cookies[cookie.name] = cookie.value
                 
-                if not download_success:
-                    logger.error(
-                        f"[INSTA] Failed to download media {idx} after {max_retries} retries - "
-                        f"has_cookies={bool(cookies)}, url_length={len(download_url)}"
-                    )
-                            
+                logger.info(f"[INSTA] Loaded {len(cookies)} cookies from file")
             except Exception as e:
-                logger.error(f"[INSTA] Error downloading media {idx}: {e}")
-                continue
+                logger.warning(f"[INSTA] Failed to load cookies: {e}")
+                # Fallback به روش قدیمی
+                try:
+                    with open(COOKIE_FILE, 'r') as f:
+                        for line in f:
+                            if line.startswith('#') or not line.strip():
+                                continue
+                            parts = line.strip().split('\t')
+                            if len(parts) >= 7:
+                                cookies[parts[5]] = parts[6]
+                except:
+                    pass
+        
+        progress_state = {'done': 0, 'last_edit': 0.0}
+        
+        async def _report_item_done():
+            """نمایش progress برای کاربر (فقط برای آلبوم‌ها، با محدودیت نرخ ویرایش)"""
+            progress_state['done'] += 1
+            done = progress_state['done']
+            if total_medias <= 1:
+                return
+            now = time.time()
+            if done < total_medias and now - progress_state['last_edit'] < 1.5:
+                return
+            progress_state['last_edit'] = now
+            try:
+                await status_msg.edit_text(
+                    f"📸 **Instagram Gallery**\n\n"
+                    f"📥 دانلود شده {done}/{total_medias}\n"
+                    f"{'▓' * done}{'░' * (total_medias - done)}\n\n"
+                    f"⏳ لطفاً صبر کنید..."
+                )
+            except:
+                pass
+        
+        # session مشترک کل ربات (reuse اتصال‌ها بین آیتم‌ها و درخواست‌ها)
+        session = http_client.session()
+        
+        async def _preflight(idx, media):
+            """Timeout پویا و حجم (برای رزرو دیسک): HEAD request برای گرفتن سایز"""
+            download_url = media.get('url')
+            if not download_url:
+                return 60, 0
+            try:
+                async with session.head(download_url, headers=headers, cookies=cookies, timeout=aiohttp.ClientTimeout(total=5)) as head_resp:
+                    content_length = head_resp.headers.get('Content-Length')
+                    if content_length:
+                        file_size_mb = int(content_length) / (1024 * 1024)
+                        # 2 ثانیه به ازای هر MB + 30 ثانیه base
+                        timeout_seconds = max(60, int(file_size_mb * 2) + 30)
+                        logger.info(f"[INSTA] Media {idx} size: {file_size_mb:.1f}MB, timeout: {timeout_seconds}s")
+                        return timeout_seconds, int(content_length)
+                return 60, 0  # default
+            except Exception as head_error:
+                logger.debug(f"[INSTA] HEAD request failed, using default timeout: {head_error}")
+                return 120, 0  # fallback برای حالتی که HEAD fail بشه
+        
+        # ⚡ HEAD همه آیتم‌ها به صورت موازی
+        preflight = await asyncio.gather(
+            *(_preflight(idx, media) for idx, media in enumerate(visual_medias, 1))
+        )
+        item_timeouts = [timeout for timeout, _ in preflight]
+        
+        # 📁 پوشه اختصاصی این درخواست + رزرو حجم کل آلبوم روی دیسک
+        workspace = await workspace_manager.acquire('instagram', sum(size for _, size in preflight))
+        
+        async def _download_item(idx, media):
+            download_url = media.get('url')
+            if not download_url:
+                logger.warning(f"[INSTA] No URL for media {idx}")
+                return None
+            
+            media_type = media.get('type', 'video')
+            file_ext = media.get('extension', 'mp4' if media_type == 'video' else 'jpg')
+            
+            # Logging دقیق برای هر media
+            logger.info(f"[INSTA] Downloading {idx}/{total_medias}: type={media_type}, ext={file_ext}, url_len={len(download_url)}")
+            
+            timeout = aiohttp.ClientTimeout(total=item_timeouts[idx - 1])
+            
+            # دانلود با retry برای 403 و chunk-based برای فایل‌های بزرگ
+            max_retries = 3
+            
+            for retry in range(max_retries):
+                try:
+                    async with session.get(download_url, headers=headers, cookies=cookies, timeout=timeout) as resp:
+                        if resp.status == 200:
+                            # دانلود chunk-based برای جلوگیری از OOM
+                            item_path = workspace.file(f"{idx}.{file_ext}")
+                            with open(item_path, 'wb') as item_file:
+                                chunk_size = 1024 * 1024  # 1MB chunks
+                                async for chunk in resp.content.iter_chunked(chunk_size):
+                                    item_file.write(chunk)
+                            
+                            logger.info(f"[INSTA] Downloaded media {idx}/{total_medias} ({os.path.getsize(item_path) / 1024 / 1024:.1f}MB)")
+                            await _report_item_done()
+                            return {
+                                'path': item_path,
+                                'type': media_type
+                            }
+                        elif resp.status == 403 and retry < max_retries - 1:
+                            # 403: URL منقضی شده، دوباره fetch کن
+                            logger.error(f"[INSTA] 403 Details: media={idx}, retry={retry+1}/{max_retries}, has_cookies={bool(cookies)}, url_starts={download_url[:50]}")
+                            logger.warning(f"[INSTA] 403 on media {idx}, retry {retry+1}/{max_retries}")
+                            await asyncio.sleep(1.5 * (retry + 1))
+                            
+                            # دوباره fetch کن برای URL تازه (درخواست‌های همزمان ادغام می‌شوند)
+                            api_cache.invalidate('instagram', message.text.strip())
+                            success_refetch, data_refetch, _ = await fetcher.fetch(message.text.strip(), message.from_user.id, status_msg)
+                            if success_refetch and data_refetch:
+                                # فقط visual medias رو بگیر (مثل اول)
+                                medias_refetch = data_refetch.get('medias', [])
+                                visual_medias_refetch = [m for m in medias_refetch if m.get('type') in ['image', 'video']]
+                                if idx <= len(visual_medias_refetch):
+                                    download_url = visual_medias_refetch[idx-1].get('url')
+                                    logger.info(f"[INSTA] Got fresh URL for media {idx}")
+                        else:
+                            logger.warning(f"[INSTA] Download failed {idx}: {resp.status}")
+                            break
+                except Exception as e:
+                    logger.error(f"[INSTA] Download error media {idx}, retry {retry+1}: {e}")
+                    if retry < max_retries - 1:
+                        await asyncio.sleep(1.0 * (retry + 1))
+            
+            logger.error(
+                f"[INSTA] Failed to download media {idx} after {max_retries} retries - "
+                f"has_cookies={bool(cookies)}, url_length={len(download_url)}"
+            )
+            return None
+        
+        # ⚡ دانلود همزمان (محدودیت per-request و سراسری)، ترتیب اصلی gallery حفظ می‌شود
+        item_results = await gather_items(_download_item, visual_medias)
+
+        for idx, res in enumerate(item_results, 1):
+            if isinstance(res, Exception):
+                logger.error(f"[INSTA] Error downloading media {idx}: {res}")
+            elif res:
+                downloaded_files.append(res)
         
         if not downloaded_files:
             # اگر هیچ فایلی دانلود نشد، سعی کن با yt-dlp مستقیم دانلود کنی
@@ -935,13 +961,10 @@ async def _download_and_send(
             temp_dir = None
             
             try:
-                import yt_dlp
                 import glob
-                import uuid
                 
-                # استفاده از UUID برای جلوگیری از conflict
-                unique_id = uuid.uuid4().hex[:8]
-                temp_dir = f'temp_insta_{unique_id}'
+                # زیرپوشه yt-dlp داخل workspace همین درخواست
+                temp_dir = os.path.join(workspace.path, 'ytdlp')
                 os.makedirs(temp_dir, exist_ok=True)
                 
                 ydl_opts = {
@@ -955,7 +978,7 @@ async def _download_and_send(
                 
                 # اجرای async برای جلوگیری از blocking
                 def _ytdlp_download():
-                    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                    with ytdlp_pool.checkout(ydl_opts, name='instagram_download') as ydl:
                         return ydl.extract_info(original_url, download=True)
                 
                 loop = asyncio.get_event_loop()
@@ -1027,12 +1050,13 @@ async def _download_and_send(
                 f"✅ دانلود شده توسط @DirectTubeBot"
             )
         
+        sent = None
         try:
             # اگه فقط یک فایل هست، معمولی بفرست
             if len(downloaded_files) == 1:
                 file_info = downloaded_files[0]
                 if file_info['type'] == 'video':
-                    await message.reply_video(
+                    sent = await message.reply_video(
                         video=file_info['path'],
                         caption=caption,
                         parse_mode=ParseMode.MARKDOWN
@@ -1041,7 +1065,7 @@ async def _download_and_send(
                     # برای عکس: تبدیل به JPG اگر فرمت مشکل داره یا سایز بزرگه
                     photo_path = file_info['path']
                     try:
-                        await message.reply_photo(
+                        sent = await message.reply_photo(
                             photo=photo_path,
                             caption=caption,
                             parse_mode=ParseMode.MARKDOWN
@@ -1078,7 +1102,7 @@ async def _download_and_send(
                             logger.info(f"[INSTA] Converted to JPG: {os.path.getsize(jpg_path)/1024/1024:.1f}MB")
                             
                             # ارسال JPG
-                            await message.reply_photo(
+                            sent = await message.reply_photo(
                                 photo=jpg_path,
                                 caption=caption,
                                 parse_mode=ParseMode.MARKDOWN
@@ -1155,7 +1179,7 @@ async def _download_and_send(
                 
                 # ارسال Media Group (حداکثر 10 تا)
                 try:
-                    await message.reply_media_group(media=media_group[:10])
+                    sent = await message.reply_media_group(media=media_group[:10])
                     sent_count = len(media_group[:10])
                 except Exception as e:
                     logger.error(f"[INSTA] Media group send failed: {e}")
@@ -1176,6 +1200,15 @@ async def _download_and_send(
             
             logger.info(f"[INSTA] Sent {sent_count} medias as group")
             
+            # 💾 ذخیره file_id ها برای درخواست‌های بعدی همین پست
+            try:
+                await delivery_cache.remember(
+                    client, 'instagram', canonical_media_id('instagram', original_url), '',
+                    sent, caption=caption
+                )
+            except Exception as e:
+                logger.warning(f"[INSTA] Delivery cache store failed: {e}")
+            
         except Exception as e:
             logger.error(f"[INSTA] Failed to send media group: {e}")
             raise
@@ -1203,23 +1236,6 @@ async def _download_and_send(
         # کمی صبر کن تا upload کامل بشه (جلوگیری از race condition)
         await asyncio.sleep(1.5)
         
-        # Cleanup: حذف فایل‌های موقت در هر صورت
-        for file_info in downloaded_files:
-            try:
-                if os.path.exists(file_info['path']):
-                    os.unlink(file_info['path'])
-                    logger.debug(f"[INSTA] Cleaned up: {file_info['path']}")
-            except Exception as cleanup_error:
-                logger.warning(f"[INSTA] Cleanup failed for {file_info['path']}: {cleanup_error}")
-        
-        # حذف دایرکتوری‌های موقت yt-dlp
-        try:
-            import glob
-            temp_dirs = glob.glob('temp_insta_*')
-            for temp_dir in temp_dirs:
-                if os.path.isdir(temp_dir):
-                    import shutil
-                    shutil.rmtree(temp_dir, ignore_errors=True)
-                    logger.debug(f"[INSTA] Cleaned up temp dir: {temp_dir}")
-        except:
-            pass
+        # Cleanup: حذف workspace همین درخواست (فایل‌ها + پوشه yt-dlp) و آزاد کردن رزرو
+        # (قبلاً همه temp_insta_* ها پاک می‌شد که فایل درخواست‌های همزمان را هم حذف می‌کرد)
+        workspace_manager.release(workspace)
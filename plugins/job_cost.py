@@ -0,0 +1,130 @@
+"""
+Job Cost Model - تخمین زمان هر job برای زمان‌بندی کوتاه‌ترین-کار-اول (SJF)
+همه job ها و منتظرهای acquire_slot یکسان بودند؛ یک صوت 5MB پشت سه ویدیوی 1.5GB
+1080p منتظر می‌ماند.
+
+- هزینه = سربار ثابت پلتفرم + حجم / سرعت (MB/s)؛ حجم از filesize استخراج/API،
+  در نبود آن از duration × bitrate نوع رسانه و در آخر از پیش‌فرض پلتفرم/نوع
+- سرعت هر پلتفرم از job های تمام‌شده (EWMA) به‌روز می‌شود
+- priority_key: اولویت SJF با aging؛ هزینه به ازای هر ثانیه انتظار JOB_AGING_RATE
+  ثانیه کم می‌شود، پس کلید ثابت cost + rate × زمان ورود است و ترتیب heap عوض نمی‌شود
+- lane ها با اولویت مطلق: admin، retry، normal
+"""
+
+import time
+from typing import Dict, Optional, Tuple
+
+from plugins.logger_config import get_logger
+
+try:
+    from config import JOB_AGING_RATE, JOB_COST_CAP
+except Exception:
+    JOB_AGING_RATE = 1.0
+    JOB_COST_CAP = 900.0
+
+logger = get_logger('job_cost')
+
+MB = 1024 * 1024
+LANES = ('admin', 'retry', 'normal')
+_LANE_RANK = {lane: rank for rank, lane in enumerate(LANES)}
+
+# حجم پیش‌فرض (MB) وقتی filesize و duration معلوم نیست
+DEFAULT_SIZE_MB = {
+    ('youtube', 'video'): 120.0,
+    ('youtube', 'audio'): 6.0,
+    ('instagram', 'video'): 12.0,
+    ('instagram', 'image'): 1.0,
+    ('default', 'audio'): 8.0,
+    ('default', 'image'): 1.0,
+    ('default', 'video'): 25.0,
+}
+# MB بر ثانیه رسانه برای تخمین از duration
+BITRATE_MB_PER_SEC = {'video': 0.25, 'audio': 0.02, 'image': 0.0}
+# سربار ثابت (استخراج، probe، شروع آپلود) به ثانیه
+OVERHEAD_SECONDS = {'youtube': 6.0, 'default': 3.0}
+# سرعت اولیه دانلود+آپلود (MB/s)؛ با اندازه‌گیری به‌روز می‌شود
+DEFAULT_THROUGHPUT = {'youtube': 6.0, 'default': 4.0}
+THROUGHPUT_EWMA = 0.2
+SIZE_KEYS = ('filesize', 'filesize_approx', 'size', 'content_length')
+
+
+def _media_kind(media_type: Optional[str]) -> str:
+    media_type = (media_type or 'video').lower()
+    if media_type in ('audio', 'music'):
+        return 'audio'
+    if media_type in ('image', 'photo'):
+        return 'image'
+    return 'video'
+
+
+def media_size(media: Optional[dict]) -> int:
+    """حجم اعلام‌شده در پاسخ API/yt-dlp (بایت) یا 0"""
+    for key in SIZE_KEYS:
+        try:
+            value = int((media or {}).get(key) or 0)
+        except (TypeError, ValueError):
+            continue
+        if value > 0:
+            return value
+    return 0
+
+
+def priority_key(cost: float, lane: str = 'normal', enqueued: Optional[float] = None) -> Tuple[int, float]:
+    """
+    کلید مرتب‌سازی (کوچک‌تر = زودتر): lane و سپس SJF با aging
+    enqueued باید از time.monotonic() باشد
+    """
+    enqueued = time.monotonic() if enqueued is None else enqueued
+    return _LANE_RANK.get(lane, len(LANES) - 1), min(cost, JOB_COST_CAP) + JOB_AGING_RATE * enqueued
+
+
+class JobCostModel:
+    """تخمین ثانیه‌های مورد انتظار هر job"""
+
+    def __init__(self):
+        self.throughput: Dict[str, float] = dict(DEFAULT_THROUGHPUT)
+        self.stats = {
+            'estimates': 0,
+            'known_size': 0,
+            'observed': 0,
+        }
+
+    def estimate(self, platform: str = 'default', media_type: str = 'video',
+                 filesize: int = 0, duration: float = 0) -> float:
+        """هزینه تخمینی (ثانیه)"""
+        platform = (platform or 'default').lower()
+        kind = _media_kind(media_type)
+        self.stats['estimates'] += 1
+        if filesize and filesize > 0:
+            size_mb = filesize / MB
+            self.stats['known_size'] += 1
+        elif duration and duration > 0 and BITRATE_MB_PER_SEC[kind]:
+            size_mb = duration * BITRATE_MB_PER_SEC[kind]
+        else:
+            size_mb = DEFAULT_SIZE_MB.get((platform, kind)) or DEFAULT_SIZE_MB[('default', kind)]
+        throughput = self.throughput.get(platform) or self.throughput['default']
+        overhead = OVERHEAD_SECONDS.get(platform, OVERHEAD_SECONDS['default'])
+        return overhead + size_mb / max(throughput, 0.1)
+
+    def observe(self, platform: str, nbytes: int, seconds: float):
+        """ثبت سرعت واقعی job تمام‌شده (دانلود+آپلود)"""
+        if not nbytes or seconds <= 0:
+            return
+        platform = (platform or 'default').lower()
+        overhead = OVERHEAD_SECONDS.get(platform, OVERHEAD_SECONDS['default'])
+        measured = (nbytes / MB) / max(seconds - overhead, 1.0)
+        current = self.throughput.get(platform, self.throughput['default'])
+        self.throughput[platform] = current + THROUGHPUT_EWMA * (measured - current)
+        self.stats['observed'] += 1
+
+    def get_stats(self) -> dict:
+        estimates = self.stats['estimates']
+        return {
+            **self.stats,
+            'known_size_rate': (self.stats['known_size'] / estimates * 100) if estimates else 0.0,
+            'throughput': {k: round(v, 2) for k, v in self.throughput.items()},
+        }
+
+
+# 🔥 Global instance
+job_cost_model = JobCostModel()
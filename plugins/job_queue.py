@@ -1,8 +1,8 @@
 import os
+import time
 import asyncio
-from collections import deque
 from dataclasses import dataclass
-from typing import Optional, Deque
+from typing import Optional
 
 from pyrogram.types import Message
 from plugins.logger_config import get_logger
@@ -10,7 +10,11 @@ from plugins.sqlite_db_wrapper import DB
 from plugins.youtube_downloader import youtube_downloader
 from plugins.youtube_uploader import youtube_uploader
 from plugins.concurrency import acquire_slot, release_slot, get_queue_stats, MAX_CONCURRENT_DOWNLOADS
-from plugins.concurrency import reserve_user, release_user
+from plugins.concurrency import release_user
+from plugins.fair_scheduler import FairScheduler
+from plugins.job_cost import job_cost_model
+from plugins.pipeline_stages import upload_pool
+from plugins.job_store import JobStore, JobStoreError
 from config import RECOVER_JOBS_ON_STARTUP, RECOVERY_NOTIFY_USERS
 
 logger = get_logger('job_queue')
@@ -30,14 +34,29 @@ class DownloadJob:
     caption: str
     message: Optional[Message]
     client: any  # Pyrogram Client
+    filesize: int = 0  # حجم اعلام‌شده yt-dlp (0 = نامعلوم)
+    attempt: int = 0
+    cost: float = 0.0  # ثانیه‌های تخمینی (job_cost)
+    stage: str = 'queued'  # 'queued' | 'fetched' (فایل دانلودشده در artifact)
+    artifact: str = ''
+    run_at: float = 0.0  # unix time؛ قبل از آن claim نمی‌شود (backoff / lease دیگر)
+
+
+MAX_ATTEMPTS = 3
+BACKOFF_BASE = 1.0
+FINISH_RETRY_MAX = 60.0  # seconds between attempts to persist a finished job
 
 
 class JobQueue:
     def __init__(self, max_workers: Optional[int] = None):
         self.max_workers = max_workers or MAX_CONCURRENT_DOWNLOADS
-        self.queue: asyncio.Queue[DownloadJob] = asyncio.Queue()
-        self.pending: Deque[int] = deque()  # store job_ids to compute positions
+        # صف جداگانه هر کاربر با نوبت‌دهی منصفانه (DRR) به جای FIFO مشترک
+        self.scheduler = FairScheduler()
         self.workers: list[asyncio.Task] = []
+        # job هایی که مرحله fetch را تمام کرده‌اند و در upload_pool هستند
+        self.uploads: set[asyncio.Task] = set()
+        # جدول job_queue: claim اتمی، lease و group commit تغییرهای وضعیت
+        self.store = JobStore()
         self.running = False
 
     async def start(self):
@@ -45,65 +64,136 @@ class JobQueue:
             return
         self.running = True
         logger.info(f"Starting JobQueue with {self.max_workers} workers")
+        self.store.start()
         for i in range(self.max_workers):
             task = asyncio.create_task(self._worker_loop(i))
             self.workers.append(task)
 
     async def stop(self):
         self.running = False
-        for t in self.workers:
+        for t in [*self.workers, *self.uploads]:
             try:
                 t.cancel()
             except Exception:
                 pass
         self.workers.clear()
+        self.uploads.clear()
+        # job های در حال اجرا بدون مصرف attempt به صف برمی‌گردند
+        self.store.close()
+
+    def _lane(self, job: DownloadJob) -> str:
+        if job.attempt > 0:
+            return 'retry'
+        return 'admin' if self.scheduler.tier(job.user_id) == 'admin' else 'normal'
+
+    async def enqueue(self, job: DownloadJob, persist: bool = True) -> int:
+        """
+        persist=False برای job هایی که ردیف job_queue دارند (retry، بازیابی بعد از restart)
+        job با run_at آینده تا آن زمان وارد scheduler نمی‌شود (موقعیت 0)
+        """
+        if not job.cost:
+            job.cost = job_cost_model.estimate('youtube', job.media_type, job.filesize)
+        if persist:
+            await self.store.add(job, self._lane(job), MAX_ATTEMPTS)
+        self.store.set_status(job.job_id, 'pending')
+        delay = job.run_at - time.time()
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay, self._requeue, job)
+            logger.info(f"Deferred job {job.job_id} by user {job.user_id} for {delay:.0f}s")
+            return 0
+        return self._push(job)
 
-    async def enqueue(self, job: DownloadJob) -> int:
-        # Persist as queued/pending
-        try:
-            DB().update_job_status(job.job_id, 'pending')
-        except Exception:
-            pass
-        self.pending.append(job.job_id)
-        await self.queue.put(job)
-        position = self.get_position(job.job_id)
-        logger.info(f"Enqueued job {job.job_id} by user {job.user_id} at position {position}")
+    def _push(self, job: DownloadJob) -> int:
+        lane = self._lane(job)
+        position = self.scheduler.push(job.user_id, job, key=job.job_id, cost=job.cost, lane=lane)
+        logger.info(f"Enqueued job {job.job_id} by user {job.user_id} at position {position} "
+                    f"(cost≈{job.cost:.0f}s, lane={lane})")
         return position
 
+    def _requeue(self, job: DownloadJob):
+        """تلاش بعدی در lane مخصوص retry (بدون نگه داشتن slot در زمان backoff)"""
+        if not self.running:
+            return
+        self._push(job)
+
+    def _defer(self, job: DownloadJob, state: Optional[dict]):
+        """claim ناموفق: job تمام‌شده رها می‌شود، بقیه در موعد next_run_at / انقضای lease برمی‌گردند"""
+        if not state or state['state'] not in ('queued', 'leased'):
+            logger.info(f"Dropped job {job.job_id}: already {state['state'] if state else 'missing'}")
+            return
+        job.run_at = max(state['next_run_at'] or 0, state['lease_expires_at'] or 0) + 0.1
+        asyncio.get_running_loop().call_later(max(1.0, job.run_at - time.time()), self._requeue, job)
+
     def get_position(self, job_id: int) -> int:
-        try:
-            return list(self.pending).index(job_id) + 1
-        except ValueError:
-            return 0
+        """موقعیت تخمینی job در صف (0 = در صف نیست)"""
+        return self.scheduler.position(job_id)
+
+    def get_stats(self) -> dict:
+        return {
+            **self.scheduler.get_stats(),
+            'workers': self.max_workers,
+            'uploading': len(self.uploads),
+            'running': self.running,
+            'store': self.store.get_stats(),
+        }
 
     async def _worker_loop(self, worker_id: int):
         logger.info(f"Worker-{worker_id} started")
         while True:
-            job: DownloadJob = await self.queue.get()
-            # Remove from pending
-            try:
-                self.pending.remove(job.job_id)
-            except ValueError:
-                pass
-
-            # Enforce per-user concurrency limit; requeue if user over quota
-            if not reserve_user(job.user_id):
-                self.pending.append(job.job_id)
-                await self.queue.put(job)
-                await asyncio.sleep(0.5)
+            # سهمیه همزمانی کاربر (reserve_user) توسط scheduler گرفته شده است
+            job: DownloadJob = await self.scheduler.get()
+            # claim اتمی در job_queue: job در حال اجرا توسط نمونه دیگر یا job تمام‌شده اجرا نمی‌شود
+            claimed, state = self.store.claim(job.job_id)
+            if not claimed:
+                release_user(job.user_id)
+                self._defer(job, state)
+                continue
+            job.attempt = state['attempts'] - 1
+            if state['attempts'] > state['max_attempts']:
+                # crash مکرر وسط همین job (lease آزاد نشده و attempt ها مصرف شده‌اند)
+                await self._finish(job.job_id, False, 'too many attempts')
+                release_user(job.user_id)
+                logger.error(f"Job {job.job_id} abandoned after {state['max_attempts']} attempts")
                 continue
 
-            await acquire_slot()
+            await acquire_slot(cost=job.cost, lane=self._lane(job))
+            # worker (و slot دانلود) فقط تا پایان مرحله fetch مشغول است؛
+            # آپلود در task جدا و upload_pool ادامه پیدا می‌کند
+            fetched = asyncio.get_running_loop().create_future()
+            task = asyncio.create_task(self._run_job(worker_id, job, fetched))
+            self.uploads.add(task)
+            task.add_done_callback(self.uploads.discard)
             try:
-                await self._process_job(worker_id, job)
-            except asyncio.CancelledError:
-                raise
-            except Exception as e:
-                logger.error(f"Worker-{worker_id} error processing job {job.job_id}: {e}")
+                await fetched
             finally:
                 release_slot()
-                release_user(job.user_id)
-                self.queue.task_done()
+
+    async def _run_job(self, worker_id: int, job: DownloadJob, fetched: asyncio.Future):
+        try:
+            await self._process_job(worker_id, job, fetched)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Worker-{worker_id} error processing job {job.job_id}: {e}")
+        finally:
+            if not fetched.done():
+                fetched.set_result(None)
+            release_user(job.user_id)
+
+    async def _finish(self, job_id: int, ok: bool, error: str = ''):
+        """
+        ثبت پایان job تا وقتی commit شود؛ اگر ثبت نشود ردیف leased می‌ماند و بعد از
+        restart دوباره اجرا (و فایل دوباره ارسال) می‌شود
+        """
+        delay = BACKOFF_BASE
+        while True:
+            try:
+                await self.store.finish(job_id, ok, error)
+                return
+            except JobStoreError as e:
+                logger.error(f"Job {job_id}: finish not persisted ({e}), retrying in {delay:g}s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, FINISH_RETRY_MAX)
 
     async def _safe_edit(self, message: Optional[Message], text: str):
         if not message:
@@ -114,81 +204,98 @@ class JobQueue:
             # Ignore edit errors to keep pipeline resilient
             pass
 
-    async def _process_job(self, worker_id: int, job: DownloadJob):
-        max_attempts = 3
-        backoff_base = 1.0
-
-        for attempt in range(max_attempts):
-            try:
-                DB().update_job_status(job.job_id, 'downloading')
-                await self._safe_edit(job.message,
-                    f"🚀 شروع دانلود روی سرور\n\n"
-                    f"🏷️ عنوان: {job.title}\n"
-                    f"📌 وضعیت: در حال دانلود...\n"
-                    f"📍 موقعیت شما در صف: {self.get_position(job.job_id) or 1}\n"
-                    f"🧵 Worker: #{worker_id}\n"
-                )
-
-                progress = 0
-                start_time = asyncio.get_running_loop().time()
-
-                def status_hook(d):
-                    nonlocal progress
-                    if d.get('status') == 'downloading':
-                        try:
-                            if 'total_bytes' in d and d.get('total_bytes'):
-                                progress = int((d['downloaded_bytes'] / d['total_bytes']) * 100)
-                            elif 'total_bytes_estimate' in d and d.get('total_bytes_estimate'):
-                                progress = int((d['downloaded_bytes'] / d['total_bytes_estimate']) * 100)
-                            else:
-                                progress = max(progress, 1)
-                            DB().update_job_progress(job.job_id, progress)
-                        except Exception:
-                            pass
-
-                async def progress_display():
-                    last = -1
-                    while True:
-                        await asyncio.sleep(2)
-                        if progress == last:
-                            # Skip redundant edits
-                            continue
-                        last = progress
-                        elapsed = int(asyncio.get_running_loop().time() - start_time)
-                        await self._safe_edit(job.message,
-                            f"📥 دانلود در حال انجام\n\n"
-                            f"🏷️ عنوان: {job.title}\n"
-                            f"📊 پیشرفت: {progress}%\n"
-                            f"⏱️ زمان سپری شده: {elapsed}s\n"
-                        )
-                        if progress >= 100:
-                            break
-
-                progress_task = asyncio.create_task(progress_display())
-                
-                # Download with new system
-                safe_title = "".join(c for c in job.title if c.isalnum() or c in (' ', '-', '_')).strip()[:50]
-                filename = f"{safe_title}.mp4" if job.media_type == 'video' else f"{safe_title}.m4a"
-                
+    async def _process_job(self, worker_id: int, job: DownloadJob, fetched: asyncio.Future):
+        """
+        یک تلاش؛ در صورت خطا job بعد از backoff دوباره در lane retry صف می‌شود
+        fetched بعد از پایان دانلود resolve می‌شود تا worker سراغ job بعدی برود
+        """
+        attempt = job.attempt
+        downloaded_file = None
+        try:
+            self.store.set_status(job.job_id, 'downloading')
+            await self._safe_edit(job.message,
+                f"🚀 شروع دانلود روی سرور\n\n"
+                f"🏷️ عنوان: {job.title}\n"
+                f"📌 وضعیت: در حال دانلود...\n"
+                f"📍 موقعیت شما در صف: {self.get_position(job.job_id) or 1}\n"
+                f"🧵 Worker: #{worker_id}\n"
+            )
+
+            progress = 0
+            start_time = asyncio.get_running_loop().time()
+            started = time.monotonic()
+
+            def status_hook(d):
+                nonlocal progress
+                if d.get('status') == 'downloading':
+                    try:
+                        if 'total_bytes' in d and d.get('total_bytes'):
+                            progress = int((d['downloaded_bytes'] / d['total_bytes']) * 100)
+                        elif 'total_bytes_estimate' in d and d.get('total_bytes_estimate'):
+                            progress = int((d['downloaded_bytes'] / d['total_bytes_estimate']) * 100)
+                        else:
+                            progress = max(progress, 1)
+                        self.store.set_progress(job.job_id, progress)
+                    except Exception:
+                        pass
+
+            async def progress_display():
+                last = -1
+                while True:
+                    await asyncio.sleep(2)
+                    if progress == last:
+                        # Skip redundant edits
+                        continue
+                    last = progress
+                    elapsed = int(asyncio.get_running_loop().time() - start_time)
+                    await self._safe_edit(job.message,
+                        f"📥 دانلود در حال انجام\n\n"
+                        f"🏷️ عنوان: {job.title}\n"
+                        f"📊 پیشرفت: {progress}%\n"
+                        f"⏱️ زمان سپری شده: {elapsed}s\n"
+                    )
+                    if progress >= 100:
+                        break
+
+            progress_task = asyncio.create_task(progress_display())
+            
+            # Download with new system
+            safe_title = "".join(c for c in job.title if c.isalnum() or c in (' ', '-', '_')).strip()[:50]
+            filename = f"{safe_title}.mp4" if job.media_type == 'video' else f"{safe_title}.m4a"
+            
+            if job.stage == 'fetched' and job.artifact and os.path.exists(job.artifact):
+                # مرحله fetch قبلاً (قبل از restart یا در تلاش قبلی) کامل شده است
+                downloaded_file = job.artifact
+                self.store.stats['resumed_stages'] += 1
+                logger.info(f"Job {job.job_id}: resuming upload of {downloaded_file}")
+            else:
                 downloaded_file = await youtube_downloader.download(
                     url=job.url,
                     format_string=job.format_id,
                     output_filename=filename,
                     progress_callback=None
                 )
-                progress_task.cancel()
-
-                if not downloaded_file or not os.path.exists(downloaded_file):
-                    raise Exception("دانلود ناموفق بود")
-
-                DB().update_job_status(job.job_id, 'uploading')
-                await self._safe_edit(job.message,
-                    f"📤 در حال آپلود به تلگرام\n\n"
-                    f"🏷️ عنوان: {job.title}\n"
-                    f"⏳ لطفاً چند لحظه صبر کنید..."
-                )
-
-                # Upload with new system
+            progress_task.cancel()
+
+            if not downloaded_file or not os.path.exists(downloaded_file):
+                raise Exception("دانلود ناموفق بود")
+            file_size = os.path.getsize(downloaded_file)
+            if job.stage != 'fetched':
+                job.stage, job.artifact = 'fetched', downloaded_file
+                await self.store.mark_stage(job.job_id, 'fetched', downloaded_file)
+            if not fetched.done():
+                fetched.set_result(None)
+
+            self.store.set_status(job.job_id, 'uploading')
+            await self._safe_edit(job.message,
+                f"📤 در حال آپلود به تلگرام\n\n"
+                f"🏷️ عنوان: {job.title}\n"
+                f"⏳ لطفاً چند لحظه صبر کنید..."
+            )
+
+            # Upload with new system
+            upload_started = await upload_pool.acquire()
+            try:
                 ok = await youtube_uploader.upload_with_streaming(
                     client=job.client,
                     chat_id=job.user_id,
@@ -198,69 +305,85 @@ class JobQueue:
                     title=job.title,
                     progress_callback=None
                 )
-                
-                if not ok:
-                    raise Exception("آپلود ناموفق بود")
-
-                # 🔥 Robust Cleanup با fallback
-                cleanup_success = False
+            finally:
+                upload_pool.release(upload_started)
+            
+            if not ok:
+                raise Exception("آپلود ناموفق بود")
+            # فایل تحویل شده؛ از اینجا خطا نباید به retry (و ارسال دوباره) برسد
+            await self._finish(job.job_id, True)
+            job_cost_model.observe('youtube', file_size, time.monotonic() - started)
+
+            # 🔥 Robust Cleanup با fallback
+            cleanup_success = False
+            try:
+                youtube_downloader.cleanup(downloaded_file)
+                cleanup_success = True
+                logger.info(f"Cleanup successful for job {job.job_id}")
+            except Exception as e:
+                logger.error(f"Primary cleanup failed for job {job.job_id}: {e}")
+                # 🔥 Fallback: Force cleanup
                 try:
+                    if os.path.exists(downloaded_file):
+                        os.remove(downloaded_file)
+                        cleanup_success = True
+                        logger.info(f"Fallback cleanup successful for job {job.job_id}")
+                    
+                    # پاک‌سازی فایل‌های مرتبط (thumbnail, etc)
+                    base_path = os.path.splitext(downloaded_file)[0]
+                    for ext in ['.jpg', '.png', '.webp', '_thumb.jpg']:
+                        related_file = base_path + ext
+                        if os.path.exists(related_file):
+                            try:
+                                os.remove(related_file)
+                            except:
+                                pass
+                except Exception as e2:
+                    logger.error(f"Fallback cleanup also failed for job {job.job_id}: {e2}")
+            
+            if not cleanup_success:
+                logger.warning(f"⚠️ File cleanup failed for job {job.job_id}, file may remain: {downloaded_file}")
+            downloaded_file = None
+
+            await self._safe_edit(job.message,
+                f"✅ فایل با موفقیت ارسال شد\n\n"
+                f"🏷️ {job.title}\n"
+            )
+            # پاک‌سازی UI: حذف پیام وضعیت پس از ارسال فایل
+            try:
+                await job.message.delete()
+            except Exception:
+                pass
+            logger.info(f"Worker-{worker_id} completed job {job.job_id}")
+
+        except Exception as e:
+            logger.error(f"Worker-{worker_id} attempt {attempt+1}/{MAX_ATTEMPTS} failed for job {job.job_id}: {e}")
+            # Backoff and retry: slot آزاد می‌شود و job بعد از delay در lane retry برمی‌گردد
+            # (اگر دانلود کامل شده بود فایل نگه داشته می‌شود و تلاش بعدی فقط آپلود است)
+            if attempt < MAX_ATTEMPTS - 1:
+                if downloaded_file and job.stage != 'fetched':
                     youtube_downloader.cleanup(downloaded_file)
-                    cleanup_success = True
-                    logger.info(f"Cleanup successful for job {job.job_id}")
-                except Exception as e:
-                    logger.error(f"Primary cleanup failed for job {job.job_id}: {e}")
-                    # 🔥 Fallback: Force cleanup
-                    try:
-                        if os.path.exists(downloaded_file):
-                            os.remove(downloaded_file)
-                            cleanup_success = True
-                            logger.info(f"Fallback cleanup successful for job {job.job_id}")
-                        
-                        # پاک‌سازی فایل‌های مرتبط (thumbnail, etc)
-                        base_path = os.path.splitext(downloaded_file)[0]
-                        for ext in ['.jpg', '.png', '.webp', '_thumb.jpg']:
-                            related_file = base_path + ext
-                            if os.path.exists(related_file):
-                                try:
-                                    os.remove(related_file)
-                                except:
-                                    pass
-                    except Exception as e2:
-                        logger.error(f"Fallback cleanup also failed for job {job.job_id}: {e2}")
-                
-                if not cleanup_success:
-                    logger.warning(f"⚠️ File cleanup failed for job {job.job_id}, file may remain: {downloaded_file}")
-
-                DB().update_job_status(job.job_id, 'completed')
-                DB().update_job_progress(job.job_id, 100)
-                await self._safe_edit(job.message,
-                    f"✅ فایل با موفقیت ارسال شد\n\n"
-                    f"🏷️ {job.title}\n"
-                )
-                # پاک‌سازی UI: حذف پیام وضعیت پس از ارسال فایل
+                job.attempt = attempt + 1
+                job.run_at = time.time() + BACKOFF_BASE * (2 ** attempt)
                 try:
-                    await job.message.delete()
-                except Exception:
-                    pass
-                logger.info(f"Worker-{worker_id} completed job {job.job_id}")
-                return
-
-            except Exception as e:
-                logger.error(f"Worker-{worker_id} attempt {attempt+1}/{max_attempts} failed for job {job.job_id}: {e}")
-                # Backoff and retry
-                if attempt < max_attempts - 1:
-                    delay = backoff_base * (2 ** attempt)
-                    await asyncio.sleep(delay)
-                    continue
-                # Final failure
-                DB().update_job_status(job.job_id, 'error')
-                await self._safe_edit(job.message,
-                    f"❌ خطا در پردازش\n\n"
-                    f"🏷️ {job.title}\n"
-                    f"پیام: {str(e)}\n"
-                )
+                    await self.store.retry(job.job_id, job.run_at, str(e))
+                except JobStoreError as store_error:
+                    # ردیف هنوز leased این پروسه است و claim نمی‌شود؛ بعد از restart دوباره اجرا می‌شود
+                    logger.error(f"Job {job.job_id}: retry not persisted ({store_error}), left for recovery")
+                    return
+                await self.enqueue(job, persist=False)
                 return
+            # Final failure
+            # آزادسازی سهم این job از فایل مشترک (single-flight)
+            if downloaded_file:
+                youtube_downloader.cleanup(downloaded_file)
+            await self._finish(job.job_id, False, str(e))
+            await self._safe_edit(job.message,
+                f"❌ خطا در پردازش\n\n"
+                f"🏷️ {job.title}\n"
+                f"پیام: {str(e)}\n"
+            )
+            return
 
 
 _global_queue: Optional[JobQueue] = None
@@ -284,34 +407,56 @@ def get_job_queue() -> JobQueue:
     return _global_queue
 
 
+async def shutdown_job_queue():
+    """توقف worker ها و commit نهایی صف ماندگار (در cleanup ربات)"""
+    if _global_queue is not None:
+        await _global_queue.stop()
+
+
+async def _notify_recovered(client, uid, title):
+    if not RECOVERY_NOTIFY_USERS:
+        return None
+    try:
+        return await client.send_message(uid, f"🔁 بازیابی وظیفه دانلود: {title}\n\nدر صف قرار گرفتید")
+    except Exception:
+        return None
+
+
 async def _recover_incomplete_jobs(client):
     db = DB()
     try:
-        # Recover queued/pending or in-progress jobs
-        cursor_status = ['pending', 'downloading', 'uploading']
         recovered = []
-        for st in cursor_status:
-            rows = db.cursor.execute('SELECT id, user_id, url, title, format_id FROM jobs WHERE status = ? ORDER BY created_at ASC', (st,)).fetchall() or []
-            for r in rows:
-                jid, uid, url, title, format_id = r
-                msg = None
-                if RECOVERY_NOTIFY_USERS:
-                    try:
-                        msg = await client.send_message(uid, f"🔁 بازیابی وظیفه دانلود: {title}\n\nدر صف قرار گرفتید")
-                    except Exception:
-                        msg = None
-                job = DownloadJob(job_id=jid, user_id=uid, url=url, title=title, format_id=format_id, media_type='video', caption=f"🎬 {title}", message=msg, client=client)
-                pos = await _global_queue.enqueue(job)
-                recovered.append((jid, pos))
+        # صف ماندگار: payload، stage/artifact و attempts از job_queue؛ job های lease شده
+        # توسط نمونه زنده دیگر بعد از انقضای lease دوباره claim می‌شوند
+        for row in _global_queue.store.recoverable():
+            payload = row['payload']
+            title = payload.get('title', '')
+            msg = await _notify_recovered(client, row['user_id'], title)
+            job = DownloadJob(
+                job_id=row['job_id'], user_id=row['user_id'], url=payload.get('url', ''), title=title,
+                format_id=payload.get('format_id', ''), media_type=payload.get('media_type', 'video'),
+                caption=payload.get('caption') or f"🎬 {title}", message=msg, client=client,
+                filesize=payload.get('filesize') or 0, attempt=row['attempts'], cost=row['cost'] or 0.0,
+                stage=row['stage'] or 'queued', artifact=row['artifact'] or '',
+                run_at=max(row['next_run_at'] or 0, (row['lease_expires_at'] or 0) if row['state'] == 'leased' else 0),
+            )
+            pos = await _global_queue.enqueue(job, persist=False)
+            recovered.append((job.job_id, pos))
+        # job های قدیمی جدول jobs که قبل از job_queue ساخته شده‌اند
+        for jid, uid, url, title, format_id in db.get_unqueued_active_jobs():
+            msg = await _notify_recovered(client, uid, title)
+            job = DownloadJob(job_id=jid, user_id=uid, url=url, title=title, format_id=format_id, media_type='video', caption=f"🎬 {title}", message=msg, client=client)
+            pos = await _global_queue.enqueue(job)
+            recovered.append((jid, pos))
         if recovered:
             logger.info(f"Recovered {len(recovered)} jobs")
     except Exception as e:
         logger.error(f"Recovery error: {e}")
 
 
-async def enqueue_download_job(client, message: Message, user_id: int, url: str, title: str, format_id: str, media_type: str, caption: str) -> int:
+async def enqueue_download_job(client, message: Message, user_id: int, url: str, title: str, format_id: str, media_type: str, caption: str, filesize: int = 0) -> int:
     db = DB()
     job_id = db.create_job(user_id=user_id, url=url, title=title, format_id=format_id, status='pending')
-    job = DownloadJob(job_id=job_id, user_id=user_id, url=url, title=title, format_id=format_id, media_type=media_type, caption=caption, message=message, client=client)
+    job = DownloadJob(job_id=job_id, user_id=user_id, url=url, title=title, format_id=format_id, media_type=media_type, caption=caption, message=message, client=client, filesize=filesize or 0)
     pos = await _global_queue.enqueue(job)
     return pos
\ No newline at end of file
@@ -0,0 +1,323 @@
+"""
+Job Store - صف ماندگار job ها در SQLite (جدول job_queue)
+JobQueue قبلاً job ها را فقط در حافظه نگه می‌داشت؛ بعد از crash فقط status جدول jobs
+باقی می‌ماند و هر تغییر وضعیت یک DB() و commit جدا بود.
+
+- هر job یک ردیف با payload، lane/cost، attempts، next_run_at و lease دارد
+- worker قبل از شروع job را با یک UPDATE شرطی claim می‌کند (state=queued و موعد رسیده،
+  یا lease منقضی) → دو worker/نمونه هرگز یک job را همزمان اجرا نمی‌کنند
+- lease همه job های این پروسه با یک heartbeat دوره‌ای تمدید می‌شود
+- group commit: تغییرات در صف حافظه جمع و با یک commit روی یک اتصال ثابت نوشته می‌شوند؛
+  تغییرهای حیاتی (durable=True) منتظر commit دسته‌ای می‌مانند که حداکثر
+  DURABLE_COMMIT_DELAY بعد انجام می‌شود، بقیه (progress، status) تا JOB_COMMIT_INTERVAL
+- commit ناموفق (database is locked، ...) دسته را به ابتدای صف برمی‌گرداند و با backoff
+  تکرار می‌کند؛ بعد از FLUSH_MAX_RETRIES هر تغییر جدا commit می‌شود تا یک دستور خراب
+  بقیه را نبرد. نوشتن durable که ثبت نشد JobStoreError می‌دهد
+- stage (queued → fetched) و artifact ذخیره می‌شوند؛ بعد از restart اگر فایل دانلود
+  هنوز روی دیسک باشد دوباره دانلود نمی‌شود
+"""
+
+import asyncio
+import json
+import os
+import socket
+import time
+import uuid
+from typing import List, Optional, Tuple
+
+from plugins.logger_config import get_logger
+from plugins.sqlite_db_wrapper import DB
+
+try:
+    from config import JOB_LEASE_SECONDS, JOB_HEARTBEAT_INTERVAL, JOB_COMMIT_INTERVAL
+except Exception:
+    JOB_LEASE_SECONDS = 90.0
+    JOB_HEARTBEAT_INTERVAL = 30.0
+    JOB_COMMIT_INTERVAL = 0.5
+
+logger = get_logger('job_store')
+
+DURABLE_COMMIT_DELAY = 0.01  # نوشتن‌های حیاتی هم‌زمان در یک commit جمع می‌شوند
+FINISHED_RETENTION = 7 * 86400
+FLUSH_MAX_RETRIES = 5
+FLUSH_BACKOFF_BASE = 0.5  # seconds, doubled per failed commit
+FLUSH_BACKOFF_MAX = 10.0
+
+PAYLOAD_FIELDS = ('url', 'title', 'format_id', 'media_type', 'caption', 'filesize')
+
+_INSERT = '''INSERT OR IGNORE INTO job_queue
+    (job_id, user_id, payload, lane, cost, state, stage, max_attempts, next_run_at, created_at, updated_at)
+    VALUES (?, ?, ?, ?, ?, 'queued', 'queued', ?, ?, ?, ?)'''
+_CLAIM = '''UPDATE job_queue
+    SET state = 'leased', lease_owner = ?, lease_expires_at = ?, heartbeat_at = ?,
+        attempts = attempts + 1, updated_at = ?
+    WHERE job_id = ?
+      AND ((state = 'queued' AND next_run_at <= ?) OR (state = 'leased' AND lease_expires_at < ?))'''
+_HEARTBEAT = '''UPDATE job_queue SET lease_expires_at = ?, heartbeat_at = ?
+    WHERE lease_owner = ? AND state = 'leased\''''
+_STAGE = '''UPDATE job_queue SET stage = ?, artifact = ?, updated_at = ?
+    WHERE job_id = ? AND lease_owner = ?'''
+_RETRY = '''UPDATE job_queue
+    SET state = 'queued', lane = 'retry', lease_owner = NULL, lease_expires_at = 0,
+        next_run_at = ?, last_error = ?, updated_at = ?
+    WHERE job_id = ? AND lease_owner = ?'''
+_FINISH = '''UPDATE job_queue
+    SET state = ?, lease_owner = NULL, lease_expires_at = 0, last_error = ?, updated_at = ?
+    WHERE job_id = ? AND lease_owner = ?'''
+_RELEASE = '''UPDATE job_queue SET state = 'queued', lease_owner = NULL, lease_expires_at = 0,
+        attempts = MAX(0, attempts - 1), updated_at = ?
+    WHERE lease_owner = ? AND state = 'leased\''''
+_JOB_STATUS = 'UPDATE jobs SET status = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?'
+_JOB_PROGRESS = 'UPDATE jobs SET progress = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?'
+_ABANDON = '''UPDATE job_queue SET state = 'queued', lease_owner = NULL, lease_expires_at = 0, updated_at = ?
+    WHERE lease_owner = ? AND state = 'leased\''''
+
+
+class JobStoreError(Exception):
+    """نوشتن durable بعد از همه تلاش‌ها commit نشد"""
+
+
+class JobStore:
+    """لایه ماندگاری JobQueue با claim اتمی، lease و group commit"""
+
+    def __init__(self, lease_seconds: float = JOB_LEASE_SECONDS,
+                 heartbeat_interval: float = JOB_HEARTBEAT_INTERVAL,
+                 commit_interval: float = JOB_COMMIT_INTERVAL):
+        self.lease_seconds = max(10.0, lease_seconds)
+        self.heartbeat_interval = min(max(1.0, heartbeat_interval), self.lease_seconds / 2)
+        self.commit_interval = max(DURABLE_COMMIT_DELAY, commit_interval)
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._db: Optional[DB] = None  # یک اتصال ثابت برای همه نوشتن‌ها
+        # (query, params, future) — future فقط برای نوشتن‌های durable
+        self._pending: List[Tuple[str, tuple, Optional[asyncio.Future]]] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._flush_at = 0.0
+        self._retry_at = 0.0  # تا این زمان (loop.time) flush بعد از commit ناموفق انجام نمی‌شود
+        self._failures = 0
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        self.stats = {
+            'commits': 0,
+            'statements': 0,
+            'failed_commits': 0,
+            'dropped_writes': 0,
+            'claims': 0,
+            'claim_conflicts': 0,
+            'heartbeats': 0,
+            'recovered': 0,
+            'resumed_stages': 0,
+        }
+
+    @property
+    def db(self) -> DB:
+        if self._db is None:
+            self._db = DB()
+        return self._db
+
+    # ---------------------------------------------------------------- #
+    # group commit
+
+    def _queue(self, query: str, params: tuple, delay: float, fut: Optional[asyncio.Future] = None) -> None:
+        self._pending.append((query, params, fut))
+        self._schedule(delay)
+
+    def _schedule(self, delay: float) -> None:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return  # close() بعد از توقف loop؛ چیزی برای زمان‌بندی نیست
+        # در backoff بعد از commit ناموفق، نوشتن‌های جدید flush را جلو نمی‌اندازند
+        flush_at = max(loop.time() + delay, self._retry_at)
+        if self._flush_handle is None or flush_at < self._flush_at:
+            if self._flush_handle is not None:
+                self._flush_handle.cancel()
+            self._flush_at = flush_at
+            self._flush_handle = loop.call_at(flush_at, self.flush)
+
+    def _write(self, query: str, params: tuple, durable: bool = False) -> Optional[asyncio.Future]:
+        """
+        ثبت یک تغییر؛ با durable=True یک future برمی‌گرداند که بعد از commit دسته resolve می‌شود
+        (یا اگر تغییر بعد از همه تلاش‌ها ثبت نشد JobStoreError می‌دهد)
+        """
+        if not durable:
+            self._queue(query, params, self.commit_interval)
+            return None
+        fut = asyncio.get_running_loop().create_future()
+        self._queue(query, params, DURABLE_COMMIT_DELAY, fut)
+        return fut
+
+    def flush(self, extra: Optional[List[Tuple[str, tuple]]] = None) -> Optional[list]:
+        """
+        commit همه تغییرهای در انتظار (+ extra) در یک تراکنش؛ rowcount های extra را برمی‌گرداند
+        در صورت شکست، تغییرهای در انتظار (نه extra) برای تلاش بعدی به ابتدای صف برمی‌گردند
+        """
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        statements = [(query, params) for query, params, _ in batch] + list(extra or ())
+        if not statements:
+            return []
+        rowcounts = self.db.execute_job_batch(statements)
+        if rowcounts is not None:
+            self.stats['commits'] += 1
+            self.stats['statements'] += len(statements)
+            self._failures = 0
+            self._retry_at = 0.0
+            self._resolve(batch)
+            return rowcounts[len(batch):]
+
+        self.stats['failed_commits'] += 1
+        self._failures += 1
+        logger.error(f"❌ Job store commit failed ({len(statements)} statements, attempt {self._failures})")
+        if self._failures > FLUSH_MAX_RETRIES:
+            self._commit_each(batch)
+        elif batch:
+            self._pending[:0] = batch
+            delay = min(FLUSH_BACKOFF_MAX, FLUSH_BACKOFF_BASE * 2 ** (self._failures - 1))
+            try:
+                self._retry_at = asyncio.get_running_loop().time() + delay
+            except RuntimeError:
+                pass
+            self._schedule(delay)
+        return None
+
+    def _commit_each(self, batch: list) -> None:
+        """آخرین تلاش: هر تغییر در تراکنش جدا تا فقط دستورهای خراب از دست بروند"""
+        self._failures = 0
+        self._retry_at = 0.0
+        for query, params, fut in batch:
+            if self.db.execute_job_batch([(query, params)]) is not None:
+                self.stats['commits'] += 1
+                self.stats['statements'] += 1
+                self._resolve([(query, params, fut)])
+                continue
+            self.stats['dropped_writes'] += 1
+            logger.error(f"❌ Dropped job store write: {query.split()[0]} {params!r:.120}")
+            if fut is not None and not fut.done():
+                fut.set_exception(JobStoreError(f"job store write not committed: {query.split()[0]}"))
+
+    @staticmethod
+    def _resolve(batch: list) -> None:
+        for _, _, fut in batch:
+            if fut is not None and not fut.done():
+                fut.set_result(True)
+
+    # ---------------------------------------------------------------- #
+    # API
+
+    async def add(self, job, lane: str, max_attempts: int) -> None:
+        now = time.time()
+        payload = json.dumps({field: getattr(job, field) for field in PAYLOAD_FIELDS}, ensure_ascii=False)
+        await self._write(
+            _INSERT, (job.job_id, job.user_id, payload, lane, job.cost, max_attempts, now, now, now), durable=True
+        )
+
+    def claim(self, job_id: int) -> Tuple[bool, Optional[dict]]:
+        """
+        claim اتمی (همراه با تغییرهای در انتظار در همان تراکنش)
+        خروجی: (موفق، وضعیت ردیف) — وضعیت برای تصمیم‌گیری وقتی claim نشد
+        """
+        now = time.time()
+        rowcounts = self.flush([(_CLAIM, (self.owner, now + self.lease_seconds, now, now, job_id, now, now))])
+        claimed = bool(rowcounts and rowcounts[0] == 1)
+        state = self.db.get_queue_job(job_id) or None
+        if claimed:
+            self.stats['claims'] += 1
+        else:
+            self.stats['claim_conflicts'] += 1
+        return claimed, state
+
+    def set_status(self, job_id: int, status: str):
+        self._write(_JOB_STATUS, (status, job_id))
+
+    def set_progress(self, job_id: int, progress: int):
+        self._write(_JOB_PROGRESS, (progress, job_id))
+
+    async def mark_stage(self, job_id: int, stage: str, artifact: str = '') -> None:
+        await self._write(_STAGE, (stage, artifact, time.time(), job_id, self.owner), durable=True)
+
+    async def retry(self, job_id: int, run_at: float, error: str) -> None:
+        self._write(_JOB_STATUS, ('pending', job_id))
+        await self._write(_RETRY, (run_at, error[:500], time.time(), job_id, self.owner), durable=True)
+
+    async def finish(self, job_id: int, ok: bool, error: str = '') -> None:
+        self._write(_JOB_STATUS, ('completed' if ok else 'error', job_id))
+        if ok:
+            self._write(_JOB_PROGRESS, (100, job_id))
+        await self._write(
+            _FINISH, ('done' if ok else 'failed', error[:500] or None, time.time(), job_id, self.owner), durable=True
+        )
+
+    def _is_stale_owner(self, owner: Optional[str]) -> bool:
+        """lease متعلق به پروسه قبلی همین میزبان است (crash/restart) و لازم نیست منقضی شدنش را صبر کنیم"""
+        if not owner or owner == self.owner:
+            return False
+        host, _, rest = owner.partition(':')
+        pid = rest.partition(':')[0]
+        if host != socket.gethostname() or not pid.isdigit():
+            return False
+        if int(pid) == os.getpid():
+            return True  # همان pid با نمونه جدید (مثلاً pid 1 در container)
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return True
+        except OSError:
+            return False
+        return False
+
+    def recoverable(self) -> list:
+        """ردیف‌های queued/leased همراه با payload بازشده؛ lease های پروسه‌های مرده آزاد می‌شوند"""
+        self.flush()
+        rows = self.db.get_recoverable_queue_jobs()
+        stale = {row['lease_owner'] for row in rows
+                 if row['state'] == 'leased' and self._is_stale_owner(row['lease_owner'])}
+        if stale:
+            now = time.time()
+            self.flush([(_ABANDON, (now, owner)) for owner in stale])
+            for row in rows:
+                if row['lease_owner'] in stale:
+                    row.update(state='queued', lease_owner=None, lease_expires_at=0)
+            logger.info(f"♻️ Released leases of {len(stale)} dead worker process(es)")
+        for row in rows:
+            try:
+                row['payload'] = json.loads(row['payload'] or '{}')
+            except ValueError:
+                row['payload'] = {}
+        self.stats['recovered'] += len(rows)
+        return rows
+
+    # ---------------------------------------------------------------- #
+    # lease
+
+    def start(self):
+        if self._heartbeat_task is None or self._heartbeat_task.done():
+            self._heartbeat_task = asyncio.create_task(self._heartbeat_loop())
+        try:
+            self.db.purge_finished_queue_jobs(time.time() - FINISHED_RETENTION)
+        except Exception as e:
+            logger.debug(f"Queue purge skipped: {e}")
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            now = time.time()
+            # یک UPDATE برای همه lease های این پروسه (کسی منتظر نتیجه نیست، فقط commit سریع)
+            self._queue(_HEARTBEAT, (now + self.lease_seconds, now, self.owner), DURABLE_COMMIT_DELAY)
+            self.stats['heartbeats'] += 1
+
+    def close(self):
+        """توقف heartbeat، برگرداندن job های در حال اجرا به صف (بدون مصرف attempt) و commit نهایی"""
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            self._heartbeat_task = None
+        self.flush([(_RELEASE, (time.time(), self.owner))])
+
+    def get_stats(self) -> dict:
+        commits = self.stats['commits']
+        return {
+            **self.stats,
+            'pending_writes': len(self._pending),
+            'avg_batch': self.stats['statements'] / commits if commits else 0.0,
+            'owner': self.owner,
+        }
@@ -0,0 +1,280 @@
+"""
+Media Probe - سرویس async برای ffprobe و ساخت thumbnail
+- اجرای ffprobe به صورت subprocess غیرمسدودکننده با timeout (thumbnail از طریق ffmpeg_runner)
+- محدودیت همزمانی (MEDIA_PROBE_CONCURRENCY)
+- کش نتایج با کلید (path, size, mtime)
+- اگر width/height/duration از yt-dlp یا API آمده باشد، ffprobe اجرا نمی‌شود
+"""
+
+import asyncio
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from plugins.logger_config import get_logger, get_performance_logger
+from plugins.ffmpeg_runner import ffmpeg_runner, resolve_tools
+
+try:
+    from config import MEDIA_PROBE_CONCURRENCY, MEDIA_PROBE_TIMEOUT, MEDIA_PROBE_CACHE_SIZE
+except Exception:
+    MEDIA_PROBE_CONCURRENCY = 4
+    MEDIA_PROBE_TIMEOUT = 10.0
+    MEDIA_PROBE_CACHE_SIZE = 256
+
+logger = get_logger('media_probe')
+performance_logger = get_performance_logger()
+
+THUMBNAIL_TIMEOUT = 8.0
+
+
+def _empty_metadata() -> dict:
+    return {
+        'duration': 0,
+        'width': 0,
+        'height': 0,
+        'has_video': False,
+        'has_audio': False,
+        'video_codec': None,
+        'audio_codec': None
+    }
+
+
+def has_known_metadata(known: Optional[dict]) -> bool:
+    """آیا width/height/duration از قبل (yt-dlp info یا پاسخ API) موجود است؟"""
+    if not known:
+        return False
+    try:
+        return all(int(float(known.get(k) or 0)) > 0 for k in ('width', 'height', 'duration'))
+    except (TypeError, ValueError):
+        return False
+
+
+class MediaProbe:
+    """اجرای ffprobe با semaphore، timeout و کش (path, size, mtime)"""
+
+    def __init__(self, concurrency: int = MEDIA_PROBE_CONCURRENCY,
+                 timeout: float = MEDIA_PROBE_TIMEOUT, cache_size: int = MEDIA_PROBE_CACHE_SIZE):
+        self.timeout = timeout
+        self.cache_size = max(1, cache_size)
+        self._semaphore = asyncio.Semaphore(max(1, concurrency))
+        self._cache: "OrderedDict[tuple, dict]" = OrderedDict()
+        self._tools: Optional[Tuple[str, str]] = None
+        self.stats = {
+            'probes': 0,
+            'cache_hits': 0,
+            'skipped_known': 0,
+            'timeouts': 0,
+            'errors': 0,
+            'probe_time_total': 0.0,
+            'thumbnails': 0,
+            'thumbnail_failures': 0,
+        }
+        logger.info(f"✅ MediaProbe initialized (concurrency={concurrency}, timeout={timeout}s)")
+
+    @property
+    def tools(self) -> Tuple[str, str]:
+        if self._tools is None:
+            self._tools = resolve_tools()
+        return self._tools
+
+    @staticmethod
+    def _cache_key(file_path: str) -> Optional[tuple]:
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            return None
+        return (os.path.abspath(file_path), st.st_size, st.st_mtime_ns)
+
+    async def _run(self, cmd: list, timeout: float) -> Tuple[Optional[int], bytes]:
+        """اجرای subprocess بدون مسدود کردن event loop؛ در timeout پروسه kill می‌شود"""
+        async with self._semaphore:
+            proc = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+            try:
+                stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout=timeout)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                try:
+                    proc.kill()
+                except ProcessLookupError:
+                    pass
+                await proc.wait()
+                raise
+            if proc.returncode != 0 and stderr:
+                logger.debug(f"{os.path.basename(cmd[0])} stderr: {stderr.decode('utf-8', errors='ignore')[:300]}")
+            return proc.returncode, stdout
+
+    async def probe(self, file_path: str, known: Optional[dict] = None) -> dict:
+        """
+        استخراج duration/width/height/has_video/has_audio/codec ها
+        known: metadata موجود (مثلاً info dict yt-dlp)؛ اگر کامل باشد ffprobe اجرا نمی‌شود.
+        در صورت خطا dict خالی برمی‌گرداند.
+        """
+        if has_known_metadata(known):
+            self.stats['skipped_known'] += 1
+            metadata = _empty_metadata()
+            metadata.update(
+                duration=int(float(known['duration'])),
+                width=int(known['width']),
+                height=int(known['height']),
+                has_video=True,
+                has_audio=bool(known.get('has_audio', True)),
+            )
+            return metadata
+
+        key = self._cache_key(file_path)
+        if key is None:
+            logger.error(f"❌ File not found: {file_path}")
+            return {}
+
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._cache.move_to_end(key)
+            self.stats['cache_hits'] += 1
+            return dict(cached)
+
+        _, ffprobe_path = self.tools
+        cmd = [
+            ffprobe_path, '-v', 'error',
+            '-show_entries', 'format=duration:stream=width,height,codec_type,codec_name,duration',
+            '-of', 'json',
+            file_path
+        ]
+
+        self.stats['probes'] += 1
+        start = time.time()
+        try:
+            returncode, stdout = await self._run(cmd, self.timeout)
+        except asyncio.TimeoutError:
+            self.stats['timeouts'] += 1
+            logger.error(f"❌ ffprobe timeout after {self.timeout}s: {os.path.basename(file_path)}")
+            return {}
+        except Exception as e:
+            self.stats['errors'] += 1
+            logger.error(f"❌ ffprobe failed to start: {e}")
+            return {}
+        finally:
+            elapsed = time.time() - start
+            self.stats['probe_time_total'] += elapsed
+
+        if returncode != 0 or not stdout:
+            self.stats['errors'] += 1
+            logger.error(f"❌ ffprobe failed with return code {returncode}")
+            return {}
+
+        try:
+            data = json.loads(stdout.decode('utf-8', errors='ignore'))
+        except json.JSONDecodeError as e:
+            self.stats['errors'] += 1
+            logger.error(f"❌ ffprobe JSON decode error: {e}")
+            return {}
+
+        metadata = self._parse(data)
+        performance_logger.info(
+            f"[PROBE] {os.path.basename(file_path)}: {metadata['width']}x{metadata['height']}, "
+            f"{metadata['duration']}s in {elapsed:.2f}s"
+        )
+
+        # هم metadata موجود را حفظ کن و هم جاهای خالی را پر کن
+        if known:
+            for k in ('duration', 'width', 'height'):
+                if not metadata.get(k) and known.get(k):
+                    metadata[k] = int(float(known[k]))
+
+        self._cache[key] = metadata
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return dict(metadata)
+
+    @staticmethod
+    def _parse(data: dict) -> dict:
+        metadata = _empty_metadata()
+        format_data = data.get('format', {}) or {}
+        try:
+            metadata['duration'] = int(float(format_data.get('duration') or 0))
+        except (TypeError, ValueError):
+            pass
+
+        for stream in data.get('streams', []) or []:
+            codec_type = stream.get('codec_type', '')
+            if codec_type == 'video':
+                metadata['has_video'] = True
+                metadata['video_codec'] = metadata['video_codec'] or stream.get('codec_name')
+                if stream.get('width') and not metadata['width']:
+                    metadata['width'] = int(stream['width'])
+                if stream.get('height') and not metadata['height']:
+                    metadata['height'] = int(stream['height'])
+                if not metadata['duration'] and stream.get('duration'):
+                    try:
+                        metadata['duration'] = int(float(stream['duration']))
+                    except (TypeError, ValueError):
+                        pass
+            elif codec_type == 'audio':
+                metadata['has_audio'] = True
+                metadata['audio_codec'] = metadata['audio_codec'] or stream.get('codec_name')
+        return metadata
+
+    async def thumbnail(self, file_path: str, timeout: float = THUMBNAIL_TIMEOUT) -> Optional[str]:
+        """ساخت thumbnail کوچک (320px) کنار فایل؛ اگر از قبل وجود داشته باشد همان را برمی‌گرداند"""
+        if not file_path or not os.path.exists(file_path):
+            return None
+
+        thumb_path = file_path.rsplit('.', 1)[0] + '_thumb.jpg'
+        if os.path.exists(thumb_path) and os.path.getsize(thumb_path) > 0:
+            return thumb_path
+
+        start = time.time()
+        try:
+            created = await ffmpeg_runner.thumbnail(file_path, thumb_path, timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"❌ Thumbnail generation timeout after {timeout}s")
+            created = False
+        except Exception as e:
+            logger.error(f"❌ Thumbnail generation error: {e}")
+            created = False
+
+        if created:
+            self.stats['thumbnails'] += 1
+            logger.info(f"✅ Thumbnail created in {time.time() - start:.2f}s: {os.path.basename(thumb_path)}")
+            return thumb_path
+
+        self.stats['thumbnail_failures'] += 1
+        return None
+
+    async def video_metadata(self, file_path: str, known: Optional[dict] = None,
+                             with_thumbnail: bool = True) -> dict:
+        """width/height/duration + thumbnail برای ارسال ویدیو به تلگرام"""
+        if not file_path or not os.path.exists(file_path):
+            return {'width': 0, 'height': 0, 'duration': 0, 'thumbnail': None}
+
+        if with_thumbnail:
+            metadata, thumb_path = await asyncio.gather(
+                self.probe(file_path, known),
+                self.thumbnail(file_path)
+            )
+        else:
+            metadata, thumb_path = await self.probe(file_path, known), None
+
+        return {
+            'width': metadata.get('width') or None,
+            'height': metadata.get('height') or None,
+            'duration': metadata.get('duration') or 0,
+            'thumbnail': thumb_path
+        }
+
+    def get_stats(self) -> dict:
+        probes = self.stats['probes']
+        return {
+            **self.stats,
+            'avg_probe_time': self.stats['probe_time_total'] / probes if probes else 0.0,
+            'cached_entries': len(self._cache),
+        }
+
+
+# 🔥 Global instance
+media_probe = MediaProbe()
@@ -7,6 +7,8 @@ import requests
 import aiohttp
 import asyncio
 from plugins import constant
+from plugins.http_client import http_client, headers_for
+from plugins.segmented_download import segmented_downloader
 
 PATH = constant.PATH
 AUTO_DELETE_SECONDS = 120
@@ -233,67 +235,9 @@ async def download_stream_to_file(url, out_path, chunk_size=64*1024, headers=Non
     Returns (file_path, total_size) for compatibility with download_file_simple.
     """
     try:
-        # تشخیص platform برای انتخاب headers مناسب
-        platform_headers = {
-            'spotify': {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-                'Accept': 'audio/mpeg,audio/ogg,audio/wav,audio/*;q=0.9,*/*;q=0.8',
-                'Accept-Language': 'en-US,en;q=0.9',
-                'Accept-Encoding': 'gzip, deflate, br',
-                'DNT': '1',
-                'Connection': 'keep-alive',
-                'Upgrade-Insecure-Requests': '1',
-                'Sec-Fetch-Dest': 'audio',
-                'Sec-Fetch-Mode': 'no-cors',
-                'Sec-Fetch-Site': 'cross-site'
-            },
-            'tiktok': {
-                'User-Agent': 'Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 Mobile/15E148 Safari/604.1',
-                'Accept': 'video/webm,video/ogg,video/*;q=0.9,application/ogg;q=0.7,audio/*;q=0.6,*/*;q=0.5',
-                'Accept-Language': 'en-US,en;q=0.9',
-                'Accept-Encoding': 'gzip, deflate, br',
-                'DNT': '1',
-                'Connection': 'keep-alive',
-                'Upgrade-Insecure-Requests': '1',
-                'Sec-Fetch-Dest': 'video',
-                'Sec-Fetch-Mode': 'no-cors',
-                'Sec-Fetch-Site': 'cross-site'
-            },
-            'instagram': {
-                'User-Agent': 'Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 Mobile/15E148 Safari/604.1',
-                'Accept': 'video/webm,video/ogg,video/*;q=0.9,application/ogg;q=0.7,audio/*;q=0.6,*/*;q=0.5',
-                'Accept-Language': 'en-US,en;q=0.9',
-                'Accept-Encoding': 'gzip, deflate, br',
-                'DNT': '1',
-                'Connection': 'keep-alive',
-                'Upgrade-Insecure-Requests': '1',
-                'Sec-Fetch-Dest': 'video',
-                'Sec-Fetch-Mode': 'no-cors',
-                'Sec-Fetch-Site': 'cross-site',
-                'Referer': 'https://www.instagram.com/',
-                'Origin': 'https://www.instagram.com'
-            }
-        }
-        
-        # Use custom headers if provided
+        # Use custom headers if provided, otherwise the platform profile detected from URL
         if headers is None:
-            # تشخیص platform از URL
-            if 'spotify' in url.lower() or 'zm.io.vn' in url.lower():
-                headers = platform_headers['spotify']
-            elif 'tiktok' in url.lower():
-                headers = platform_headers['tiktok']
-            elif 'instagram' in url.lower() or 'cdninstagram' in url.lower() or 'fbcdn.net' in url.lower():
-                headers = platform_headers['instagram']
-            else:
-                # Default headers برای سایر platformها
-                headers = {
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-                    'Accept': '*/*',
-                    'Accept-Language': 'en-US,en;q=0.9',
-                    'Accept-Encoding': 'gzip, deflate, br',
-                    'DNT': '1',
-                    'Connection': 'keep-alive'
-                }
+            headers = headers_for(url)
         
         # تنظیمات timeout بهتر برای platformهای مختلف
         if 'spotify' in url.lower() or 'zm.io.vn' in url.lower():
@@ -301,65 +245,70 @@ async def download_stream_to_file(url, out_path, chunk_size=64*1024, headers=Non
         else:
             timeout = aiohttp.ClientTimeout(total=30, connect=10)
         
+        # فایل‌های بزرگ با چند اتصال Range (در صورت پشتیبانی سرور)
+        segmented_size = await segmented_downloader.download(url, out_path, headers=headers)
+        if segmented_size:
+            return out_path, segmented_size
+        
         # تلاش چندباره برای دانلود در صورت خطاهای سرور
         max_retries = 3
         for attempt in range(max_retries):
             try:
-                async with aiohttp.ClientSession(timeout=timeout) as session:
-                    async with session.get(url, headers=headers, allow_redirects=True) as response:
-                        # بررسی دقیق‌تر status code
-                        if response.status == 403:
-                            raise Exception(f"403 Forbidden: دسترسی به فایل محدود شده است")
-                        elif response.status == 404:
-                            raise Exception(f"404 Not Found: فایل یافت نشد")
-                        elif response.status == 429:
-                            raise Exception(f"429 Too Many Requests: تعداد درخواست‌ها زیاد است")
-                        elif response.status in [502, 503, 504]:
-                            # خطاهای سرور - قابل تلاش مجدد
-                            if attempt < max_retries - 1:
-                                print(f"Server error {response.status}, retrying in {2 * (attempt + 1)} seconds...")
-                                await asyncio.sleep(2 * (attempt + 1))
-                                continue
-                            else:
-                                raise Exception(f"HTTP {response.status}: سرور در دسترس نیست")
-                        elif response.status >= 400:
-                            raise Exception(f"HTTP {response.status}: خطا در دریافت فایل")
-                        
-                        response.raise_for_status()
-                        
-                        # Get content length
-                        total_size = int(response.headers.get('Content-Length', 0))
-                        
-                        # بررسی اینکه آیا فایل خالی است
-                        if total_size == 0:
-                            # تلاش برای دانلود حتی بدون Content-Length
-                            print(f"Warning: No Content-Length header, attempting download anyway")
-                        
-                        # Stream download to file
-                        downloaded_size = 0
-                        with open(out_path, 'wb') as f:
-                            async for chunk in response.content.iter_chunked(chunk_size):
-                                if not chunk:
-                                    break
-                                f.write(chunk)
-                                downloaded_size += len(chunk)
-                        
-                        # بررسی اینکه آیا فایل دانلود شده است
-                        if downloaded_size == 0:
-                            if attempt < max_retries - 1:
-                                print(f"Empty file downloaded, retrying in {2 * (attempt + 1)} seconds...")
-                                await asyncio.sleep(2 * (attempt + 1))
-                                continue
-                            else:
-                                raise Exception("فایل دانلود شده خالی است")
-                        
-                        # اگر total_size صفر بود، از downloaded_size استفاده کن
-                        if total_size == 0:
-                            total_size = downloaded_size
-                        
-                        print(f"Download completed: {downloaded_size} bytes")
-                        return out_path, total_size
-                        
+                session = http_client.session()
+                async with session.get(url, headers=headers, allow_redirects=True, timeout=timeout) as response:
+                    # بررسی دقیق‌تر status code
+                    if response.status == 403:
+                        raise Exception(f"403 Forbidden: دسترسی به فایل محدود شده است")
+                    elif response.status == 404:
+                        raise Exception(f"404 Not Found: فایل یافت نشد")
+                    elif response.status == 429:
+                        raise Exception(f"429 Too Many Requests: تعداد درخواست‌ها زیاد است")
+                    elif response.status in [502, 503, 504]:
+                        # خطاهای سرور - قابل تلاش مجدد
+                        if attempt < max_retries - 1:
+                            print(f"Server error {response.status}, retrying in {2 * (attempt + 1)} seconds...")
+                            await asyncio.sleep(2 * (attempt + 1))
+                            continue
+                        else:
+                            raise Exception(f"HTTP {response.status}: سرور در دسترس نیست")
+                    elif response.status >= 400:
+                        raise Exception(f"HTTP {response.status}: خطا در دریافت فایل")
+                    
+                    response.raise_for_status()
+                    
+                    # Get content length
+                    total_size = int(response.headers.get('Content-Length', 0))
+                    
+                    # بررسی اینکه آیا فایل خالی است
+                    if total_size == 0:
+                        # تلاش برای دانلود حتی بدون Content-Length
+                        print(f"Warning: No Content-Length header, attempting download anyway")
+                    
+                    # Stream download to file
+                    downloaded_size = 0
+                    with open(out_path, 'wb') as f:
+                        async for chunk in response.content.iter_chunked(chunk_size):
+                            if not chunk:
+                                break
+                            f.write(chunk)
+                            downloaded_size += len(chunk)
+                    
+                    # بررسی اینکه آیا فایل دانلود شده است
+                    if downloaded_size == 0:
+                        if attempt < max_retries - 1:
+                            print(f"Empty file downloaded, retrying in {2 * (attempt + 1)} seconds...")
+                            await asyncio.sleep(2 * (attempt + 1))
+                            continue
+                        else:
+                            raise Exception("فایل دانلود شده خالی است")
+                    
+                    # اگر total_size صفر بود، از downloaded_size استفاده کن
+                    if total_size == 0:
+                        total_size = downloaded_size
+                    
+                    print(f"Download completed: {downloaded_size} bytes")
+                    return out_path, total_size
+                    
             except aiohttp.ClientError as e:
                 if attempt < max_retries - 1:
                     print(f"Network error, retrying in {2 * (attempt + 1)} seconds: {e}")
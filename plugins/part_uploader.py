@@ -0,0 +1,386 @@
+"""
+Part Uploader - آپلود مستقیم قطعات فایل به تلگرام (upload.saveFilePart / saveBigFilePart)
+قطعات به صورت همزمان روی چند اتصال media ارسال می‌شوند؛ منبع می‌تواند فایل روی دیسک
+یا stream در حال دانلود (PipeBuffer) باشد.
+"""
+
+import asyncio
+import hashlib
+import inspect
+import os
+import time
+from typing import Awaitable, Callable, List, Optional
+
+from pyrogram import raw, types, utils
+from pyrogram.errors import FloodWait
+from pyrogram.session import Session
+from plugins.logger_config import get_logger, get_performance_logger
+
+try:
+    from config import PARALLEL_UPLOAD_CONNECTIONS, PARALLEL_UPLOAD_PARTS_IN_FLIGHT
+except Exception:
+    PARALLEL_UPLOAD_CONNECTIONS = 4
+    PARALLEL_UPLOAD_PARTS_IN_FLIGHT = 8
+
+logger = get_logger('part_uploader')
+performance_logger = get_performance_logger()
+
+# محدودیت‌های MTProto: حداکثر 512KB برای هر قطعه، فایل‌های >10MB باید big باشند
+PART_SIZE = 512 * 1024
+BIG_FILE_THRESHOLD = 10 * 1024 * 1024
+MAX_PART_RETRIES = 3
+
+
+def total_parts_for(file_size: int) -> int:
+    """تعداد قطعات لازم برای فایلی با اندازه مشخص"""
+    return max(1, (file_size + PART_SIZE - 1) // PART_SIZE)
+
+
+class UploadSessionPool:
+    """
+    مجموعه اتصال‌های media به DC اصلی ربات برای ارسال همزمان قطعات
+    اتصال‌ها یک بار ساخته و بین آپلودها دوباره استفاده می‌شوند.
+    """
+
+    def __init__(self, size: int = PARALLEL_UPLOAD_CONNECTIONS):
+        self.size = max(1, size)
+        self._sessions: List[Session] = []
+        self._client = None
+        self._lock = asyncio.Lock()
+        self._unavailable = False
+        self.stats = {
+            'parts': 0,
+            'retries': 0,
+            'part_time_total': 0.0,
+            'uploads': 0,
+        }
+
+    async def _ensure(self, client):
+        if self._sessions and self._client is client:
+            return
+        async with self._lock:
+            if self._sessions and self._client is client:
+                return
+            await self.stop()
+            dc_id = await client.storage.dc_id()
+            auth_key = await client.storage.auth_key()
+            test_mode = await client.storage.test_mode()
+            for _ in range(self.size):
+                session = Session(client, dc_id, auth_key, test_mode, is_media=True)
+                await session.start()
+                self._sessions.append(session)
+            self._client = client
+            logger.info(f"✅ Upload session pool started: {len(self._sessions)} media connections (DC {dc_id})")
+
+    async def invoke(self, client, query, slot: int = 0):
+        """ارسال query روی اتصال slot (در صورت عدم دسترسی به pool، از client اصلی)"""
+        if not self._unavailable:
+            try:
+                await self._ensure(client)
+            except Exception as e:
+                self._unavailable = True
+                logger.warning(f"⚠️ Upload session pool unavailable, using main connection: {e}")
+        if not self._sessions:
+            return await client.invoke(query)
+        return await self._sessions[slot % len(self._sessions)].invoke(query)
+
+    async def stop(self):
+        sessions, self._sessions = self._sessions, []
+        self._client = None
+        for session in sessions:
+            try:
+                await session.stop()
+            except Exception:
+                pass
+
+    def get_stats(self) -> dict:
+        parts = self.stats['parts']
+        return {
+            **self.stats,
+            'connections': len(self._sessions),
+            'avg_part_time': self.stats['part_time_total'] / parts if parts else 0.0,
+        }
+
+
+async def _save_part(client, file_id: int, index: int, total_parts: int,
+                     data: bytes, is_big: bool, slot: int = 0):
+    """ارسال یک قطعه با retry محدود (فقط همین قطعه تکرار می‌شود، روی اتصال بعدی)"""
+    attempt = 0
+    while True:
+        try:
+            if is_big:
+                query = raw.functions.upload.SaveBigFilePart(
+                    file_id=file_id, file_part=index,
+                    file_total_parts=total_parts, bytes=data
+                )
+            else:
+                query = raw.functions.upload.SaveFilePart(
+                    file_id=file_id, file_part=index, bytes=data
+                )
+            ok = await upload_pool.invoke(client, query, slot + attempt)
+            if not ok:
+                raise RuntimeError(f"Telegram rejected part {index}")
+            return
+        except FloodWait as e:
+            attempt += 1
+            upload_pool.stats['retries'] += 1
+            if attempt > MAX_PART_RETRIES:
+                raise
+            await asyncio.sleep(int(getattr(e, 'value', 5)))
+        except Exception as e:
+            attempt += 1
+            upload_pool.stats['retries'] += 1
+            if attempt > MAX_PART_RETRIES:
+                raise
+            logger.warning(f"⚠️ Part {index} failed (attempt {attempt}): {e}")
+            await asyncio.sleep(0.5 * attempt)
+
+
+async def _report_progress(progress: Optional[Callable], current: int, total: int):
+    if not progress:
+        return
+    try:
+        if asyncio.iscoroutinefunction(progress):
+            await progress(current, total)
+        else:
+            progress(current, total)
+    except Exception:
+        pass  # ignore callback errors
+
+
+async def upload_parts(client, read_part: Callable[[int], Awaitable[bytes]],
+                       file_size: int, file_name: str,
+                       progress: Optional[Callable] = None,
+                       parts_in_flight: int = PARALLEL_UPLOAD_PARTS_IN_FLIGHT):
+    """
+    آپلود فایل به صورت قطعه‌به‌قطعه با چند قطعه همزمان روی pool اتصال‌ها
+
+    Args:
+        read_part: coroutine که با index قطعه (به ترتیب) صدا زده می‌شود و
+                   دقیقاً PART_SIZE بایت (یا کمتر برای قطعه آخر) برمی‌گرداند
+        file_size: اندازه کل فایل (باید از قبل مشخص باشد)
+        parts_in_flight: حداکثر قطعات در حال ارسال (حافظه مصرفی ≈ 2 × این عدد × 512KB)
+
+    Returns:
+        raw.types.InputFile / InputFileBig برای استفاده در send_uploaded_file
+    """
+    if file_size <= 0:
+        raise ValueError("file_size must be known for part upload")
+
+    is_big = file_size > BIG_FILE_THRESHOLD
+    total_parts = total_parts_for(file_size)
+    file_id = client.rnd_id()
+    md5_sum = hashlib.md5() if not is_big else None
+    workers_count = max(1, min(parts_in_flight, total_parts))
+
+    start_time = time.time()
+    state = {'uploaded': 0}
+    part_times: List[float] = []
+    errors: List[BaseException] = []
+    queue: asyncio.Queue = asyncio.Queue(maxsize=workers_count)
+
+    async def worker(slot: int):
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            if errors:
+                continue  # بعد از خطا فقط صف را خالی می‌کنیم تا producer گیر نکند
+            index, data = item
+            part_start = time.time()
+            try:
+                await _save_part(client, file_id, index, total_parts, data, is_big, slot)
+            except Exception as e:
+                errors.append(e)
+                continue
+            part_time = time.time() - part_start
+            upload_pool.stats['parts'] += 1
+            upload_pool.stats['part_time_total'] += part_time
+            part_times.append(part_time)
+            performance_logger.debug(
+                f"part_upload file={file_id} part={index}/{total_parts} slot={slot} "
+                f"size={len(data)} time={part_time:.3f}s"
+            )
+            state['uploaded'] += len(data)
+            await _report_progress(progress, min(state['uploaded'], file_size), file_size)
+
+    tasks = [asyncio.create_task(worker(slot)) for slot in range(workers_count)]
+    try:
+        for index in range(total_parts):
+            if errors:
+                raise errors[0]
+            data = await read_part(index)
+            if not data:
+                raise IOError(f"Source ended early at part {index}/{total_parts}")
+            if md5_sum is not None:
+                md5_sum.update(data)
+            await queue.put((index, data))
+        for _ in tasks:
+            await queue.put(None)
+        await asyncio.gather(*tasks)
+        if errors:
+            raise errors[0]
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+    elapsed = time.time() - start_time
+    upload_pool.stats['uploads'] += 1
+    performance_logger.info(
+        f"Part upload completed: {file_name} {file_size / (1024*1024):.2f}MB "
+        f"in {elapsed:.2f}s ({total_parts} parts, {workers_count} in flight, "
+        f"{(file_size / (1024*1024)) / elapsed if elapsed > 0 else 0:.2f}MB/s)"
+    )
+    if part_times:
+        part_times.sort()
+        performance_logger.info(
+            f"Part timings: {file_name} min={part_times[0]:.3f}s "
+            f"avg={sum(part_times) / len(part_times):.3f}s "
+            f"p95={part_times[min(len(part_times) - 1, int(len(part_times) * 0.95))]:.3f}s "
+            f"max={part_times[-1]:.3f}s"
+        )
+
+    if is_big:
+        return raw.types.InputFileBig(id=file_id, parts=total_parts, name=file_name)
+    return raw.types.InputFile(
+        id=file_id, parts=total_parts, name=file_name,
+        md5_checksum=md5_sum.hexdigest()
+    )
+
+
+def _reply_kwargs(reply_to_message_id: Optional[int]) -> dict:
+    """سازگاری با لایه‌های مختلف Pyrogram (reply_to_msg_id در برابر reply_to)"""
+    if not reply_to_message_id:
+        return {}
+    params = inspect.signature(raw.functions.messages.SendMedia.__init__).parameters
+    if 'reply_to' in params and hasattr(raw.types, 'InputReplyToMessage'):
+        return {'reply_to': raw.types.InputReplyToMessage(reply_to_msg_id=reply_to_message_id)}
+    return {'reply_to_msg_id': reply_to_message_id}
+
+
+async def send_uploaded_file(client, chat_id, input_file, file_name: str,
+                             media_type: str = "document", caption: str = "",
+                             duration: int = 0, width: int = 0, height: int = 0,
+                             title: Optional[str] = None, performer: Optional[str] = None,
+                             thumb: Optional[str] = None,
+                             reply_to_message_id: Optional[int] = None,
+                             disable_notification: bool = None,
+                             **kwargs) -> Optional[types.Message]:
+    """
+    ارسال پیام با فایلی که قبلاً قطعه‌به‌قطعه آپلود شده
+    معادل send_video / send_audio / send_document برای InputFile آماده
+    None یعنی پیام ارسال شده ولی Message در دسترس نیست؛ خطا یعنی ارسال نشد و
+    می‌توان همین input_file را دوباره فرستاد (بدون آپلود مجدد قطعات)
+    """
+    mime_type = client.guess_mime_type(file_name) or "application/octet-stream"
+    attributes = [raw.types.DocumentAttributeFilename(file_name=os.path.basename(file_name))]
+
+    if media_type == "video":
+        attributes.insert(0, raw.types.DocumentAttributeVideo(
+            duration=int(duration or 0), w=int(width or 0), h=int(height or 0),
+            supports_streaming=True
+        ))
+        if not mime_type.startswith("video/"):
+            mime_type = "video/mp4"
+    elif media_type == "audio":
+        attributes.insert(0, raw.types.DocumentAttributeAudio(
+            duration=int(duration or 0), title=title, performer=performer
+        ))
+        if not mime_type.startswith("audio/"):
+            mime_type = "audio/mpeg"
+
+    media = raw.types.InputMediaUploadedDocument(
+        mime_type=mime_type,
+        file=input_file,
+        thumb=await client.save_file(thumb) if thumb and os.path.exists(thumb) else None,
+        attributes=attributes
+    )
+
+    text = await utils.parse_text_entities(client, caption or "", kwargs.get('parse_mode'), None)
+
+    # random_id ثابت: اگر تلاش قبلی به سرور رسیده باشد تکرار آن RANDOM_ID_DUPLICATE می‌گیرد نه پیام دوم
+    r = await _send_media(client, raw.functions.messages.SendMedia(
+        peer=await client.resolve_peer(chat_id),
+        media=media,
+        silent=disable_notification or None,
+        random_id=client.rnd_id(),
+        **_reply_kwargs(reply_to_message_id),
+        **text
+    ))
+    if r is None:
+        return None
+
+    try:
+        for update in r.updates:
+            if isinstance(update, (raw.types.UpdateNewMessage,
+                                   raw.types.UpdateNewChannelMessage,
+                                   raw.types.UpdateNewScheduledMessage)):
+                return await types.Message._parse(
+                    client, update.message,
+                    {u.id: u for u in r.users},
+                    {c.id: c for c in r.chats},
+                    is_scheduled=isinstance(update, raw.types.UpdateNewScheduledMessage)
+                )
+    except Exception as e:
+        # پیام ارسال شده؛ فقط ساختن Message ناموفق بود
+        logger.warning(f"⚠️ Sent media but could not parse message: {e}")
+    return None
+
+
+async def _send_media(client, query):
+    """SendMedia با retry محدود؛ None یعنی تلاش قبلی همین پیام را فرستاده است"""
+    attempt = 0
+    while True:
+        try:
+            return await client.invoke(query)
+        except FloodWait as e:
+            attempt += 1
+            if attempt > MAX_PART_RETRIES:
+                raise
+            await asyncio.sleep(int(getattr(e, 'value', 5)))
+        except Exception as e:
+            if attempt and getattr(e, 'ID', None) == 'RANDOM_ID_DUPLICATE':
+                return None
+            attempt += 1
+            if attempt > MAX_PART_RETRIES:
+                raise
+            logger.warning(f"⚠️ SendMedia failed (attempt {attempt}): {e}")
+            await asyncio.sleep(0.5 * attempt)
+
+
+async def upload_file_parallel(client, chat_id, file_path: str, media_type: str = "document",
+                               caption: str = "", progress: Optional[Callable] = None,
+                               **kwargs) -> Optional[types.Message]:
+    """
+    آپلود فایل روی دیسک با قطعات همزمان و ارسال پیام
+    kwargs همان پارامترهای send_uploaded_file هستند (duration, thumb, reply_to_message_id, ...)
+    """
+    file_name = kwargs.pop('file_name', None) or os.path.basename(file_path)
+    input_file = await upload_file_parts(client, file_path, file_name, progress=progress)
+    return await send_uploaded_file(
+        client, chat_id, input_file, file_name, media_type, caption=caption, **kwargs
+    )
+
+
+async def upload_file_parts(client, file_path: str, file_name: Optional[str] = None,
+                            progress: Optional[Callable] = None):
+    """
+    فقط مرحله آپلود قطعات فایل روی دیسک (بدون ارسال پیام)
+    خطای این مرحله یعنی چیزی ارسال نشده و fallback به مسیر عادی امن است
+    """
+    file_size = os.path.getsize(file_path)
+    file_name = file_name or os.path.basename(file_path)
+
+    loop = asyncio.get_running_loop()
+    with open(file_path, 'rb') as f:
+        async def read_part(index: int) -> bytes:
+            # قطعه‌ها به ترتیب خوانده می‌شوند؛ خواندن دیسک در executor تا event loop بلاک نشود
+            return await loop.run_in_executor(None, f.read, PART_SIZE)
+
+        return await upload_parts(client, read_part, file_size, file_name, progress=progress)
+
+
+# 🔥 Global instance
+upload_pool = UploadSessionPool()
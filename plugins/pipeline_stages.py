@@ -0,0 +1,184 @@
+"""
+Pipeline Stages - pool های جدا برای مراحل دانلود، پردازش (ffmpeg) و آپلود
+یک slot از acquire_slot در کل دانلود، merge و آپلود نگه داشته می‌شد؛ آپلود کند تلگرام
+slot دانلود را بیکار نگه می‌داشت و وقتی آپلودها اشباع بودند دانلود جدیدی شروع نمی‌شد.
+
+- fetch: slot های concurrency.acquire_slot؛ بلافاصله بعد از پایان دانلود آزاد می‌شود
+- postprocess: SlotPool ffmpeg_runner (سقف CPU، مشترک با postprocessor های yt-dlp)
+- upload: upload_pool با ظرفیت TELEGRAM_THROTTLING['max_concurrent_transmissions']
+- هر مرحله یک StageMeter دارد: utilization (میانگین slot های مشغول / ظرفیت در پنجره
+  اخیر)، صف و زمان انتظار؛ bottleneck() مرحله اشباع را نشان می‌دهد
+"""
+
+import asyncio
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+
+from plugins.logger_config import get_logger
+
+try:
+    from config import TELEGRAM_THROTTLING
+except Exception:
+    TELEGRAM_THROTTLING = {'max_concurrent_transmissions': 4}
+
+logger = get_logger('pipeline_stages')
+
+UTILIZATION_WINDOW = 300.0  # ثانیه
+SAMPLE_INTERVAL = 5.0
+BOTTLENECK_UTILIZATION = 0.8
+STAGE_ORDER = ('fetch', 'postprocess', 'upload')
+
+_meters: Dict[str, 'StageMeter'] = {}
+
+
+class StageMeter:
+    """اندازه‌گیری اشغال یک مرحله (thread-safe؛ postprocess از thread های yt-dlp هم به‌روز می‌شود)"""
+
+    def __init__(self, name: str, capacity: int):
+        self.name = name
+        self.capacity = max(1, capacity)
+        self.active = 0
+        self.waiting = 0
+        self._lock = threading.Lock()
+        self._busy = 0.0  # انتگرال slot های مشغول در زمان (slot-second)
+        self._last = time.monotonic()
+        self._samples = deque([(self._last, 0.0)])
+        self.stats = {
+            'completed': 0,
+            'waited': 0,
+            'wait_time_total': 0.0,
+            'service_time_total': 0.0,
+            'peak_waiting': 0,
+        }
+        _meters[name] = self
+
+    def _advance(self) -> float:
+        now = time.monotonic()
+        self._busy += self.active * (now - self._last)
+        self._last = now
+        if now - self._samples[-1][0] >= SAMPLE_INTERVAL:
+            self._samples.append((now, self._busy))
+            while len(self._samples) > 1 and now - self._samples[1][0] >= UTILIZATION_WINDOW:
+                self._samples.popleft()
+        return now
+
+    def update(self, active: int, waiting: Optional[int] = None):
+        """ثبت تعداد slot های مشغول/منتظر بعد از هر تغییر"""
+        with self._lock:
+            self._advance()
+            self.active = active
+            if waiting is not None:
+                self.waiting = waiting
+                if waiting > self.stats['peak_waiting']:
+                    self.stats['peak_waiting'] = waiting
+
+    def record_wait(self, seconds: float):
+        with self._lock:
+            if seconds > 0.001:
+                self.stats['waited'] += 1
+                self.stats['wait_time_total'] += seconds
+
+    def record_service(self, seconds: float):
+        with self._lock:
+            self.stats['completed'] += 1
+            self.stats['service_time_total'] += seconds
+
+    def set_capacity(self, capacity: int):
+        with self._lock:
+            self._advance()
+            self.capacity = max(1, capacity)
+
+    def utilization(self) -> float:
+        """سهم ظرفیت مشغول در UTILIZATION_WINDOW اخیر (0..1)"""
+        with self._lock:
+            now = self._advance()
+            start, busy = self._samples[0]
+            span = now - start
+            if span <= 0:
+                return min(1.0, self.active / self.capacity)
+            return min(1.0, (self._busy - busy) / (span * self.capacity))
+
+    def get_stats(self) -> dict:
+        utilization = self.utilization()
+        waited = self.stats['waited']
+        completed = self.stats['completed']
+        return {
+            **self.stats,
+            'capacity': self.capacity,
+            'active': self.active,
+            'waiting': self.waiting,
+            'utilization': utilization * 100,
+            'avg_wait': self.stats['wait_time_total'] / waited if waited else 0.0,
+            'avg_service': self.stats['service_time_total'] / completed if completed else 0.0,
+        }
+
+
+class StagePool:
+    """pool محدود یک مرحله با صف FIFO و StageMeter"""
+
+    def __init__(self, name: str, capacity: int):
+        self.meter = StageMeter(name, capacity)
+        self._semaphore = asyncio.Semaphore(self.meter.capacity)
+        self._active = 0
+        self._waiting = 0
+
+    async def acquire(self) -> float:
+        """گرفتن slot؛ زمان شروع را برمی‌گرداند (برای release)"""
+        queued_at = time.monotonic()
+        self._waiting += 1
+        self.meter.update(self._active, self._waiting)
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._waiting -= 1
+        self._active += 1
+        started = time.monotonic()
+        self.meter.update(self._active, self._waiting)
+        self.meter.record_wait(started - queued_at)
+        return started
+
+    def release(self, started: Optional[float] = None):
+        self._semaphore.release()
+        self._active = max(0, self._active - 1)
+        self.meter.update(self._active, self._waiting)
+        if started is not None:
+            self.meter.record_service(time.monotonic() - started)
+
+    @asynccontextmanager
+    async def slot(self):
+        """
+            async with upload_pool.slot():
+                await client.send_video(...)
+        """
+        started = await self.acquire()
+        try:
+            yield
+        finally:
+            self.release(started)
+
+
+def bottleneck() -> Optional[str]:
+    """مرحله‌ای که صف دارد یا بیشترین اشغال را دارد (None اگر هیچ مرحله‌ای اشباع نیست)"""
+    best, best_key = None, (False, BOTTLENECK_UTILIZATION)
+    for name, meter in _meters.items():
+        key = (meter.waiting > 0, meter.utilization())
+        if key >= best_key:
+            best, best_key = name, key
+    return best
+
+
+def get_pipeline_stats() -> dict:
+    return {
+        'stages': {
+            name: _meters[name].get_stats()
+            for name in sorted(_meters, key=lambda n: STAGE_ORDER.index(n) if n in STAGE_ORDER else len(STAGE_ORDER))
+        },
+        'bottleneck': bottleneck(),
+    }
+
+
+# 🔥 Global instance
+upload_pool = StagePool('upload', int(TELEGRAM_THROTTLING.get('max_concurrent_transmissions', 4)))
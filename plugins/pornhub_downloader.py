@@ -11,7 +11,8 @@ import concurrent.futures
 from typing import Optional
 
 from plugins.logger_config import get_logger
-import yt_dlp
+from plugins.ffmpeg_runner import ffmpeg_runner
+from plugins.ytdlp_pool import ytdlp_pool
 
 logger = get_logger('pornhub_downloader')
 
@@ -53,7 +54,7 @@ class PornhubDownloader:
             loop = asyncio.get_running_loop()
             
             def _extract():
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                with ytdlp_pool.checkout(ydl_opts, name='pornhub_info') as ydl:
                     return ydl.extract_info(url, download=False)
             
             info = await loop.run_in_executor(_executor, _extract)
@@ -155,8 +156,10 @@ class PornhubDownloader:
                             except:
                                 pass
                         
-                        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                            ydl.download([url])
+                        # merge از pool مشترک ffmpeg slot می‌گیرد
+                        with ffmpeg_runner.postprocessor_gate() as gate:
+                            with ytdlp_pool.checkout({**ydl_opts, 'postprocessor_hooks': [gate.hook]}, name='pornhub_download') as ydl:
+                                ydl.download([url])
                         
                         # بررسی موفقیت
                         if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
@@ -14,6 +14,7 @@ from pyrogram.enums import ParseMode
 from plugins.db_wrapper import DB
 from plugins.logger_config import get_logger
 from plugins.start import join  # 🔒 Import فیلتر عضویت اسپانسری
+from plugins.workspace_manager import workspace_manager, Workspace
 from radiojavanapi import Client as RJClient
 import requests
 from urllib.parse import urlparse
@@ -33,20 +34,16 @@ def sanitize_filename(filename: str) -> str:
     return re.sub(r'[<>:"/\\|?*]', '', filename)
 
 
-async def download_file(url: str, filename: str, download_dir: str = "downloads") -> str:
-    """دانلود فایل از URL"""
+async def download_file(url: str, filename: str, workspace: Workspace) -> str:
+    """دانلود فایل از URL داخل workspace همین درخواست"""
     try:
-        # ایجاد پوشه downloads اگر وجود ندارد
-        if not os.path.exists(download_dir):
-            os.makedirs(download_dir)
-        
         # دریافت پسوند فایل از URL
         parsed_url = urlparse(url)
         file_extension = os.path.splitext(parsed_url.path)[1] or '.mp3'
         
         # ایجاد مسیر کامل فایل
         full_filename = f"{filename}{file_extension}"
-        file_path = os.path.join(download_dir, full_filename)
+        file_path = workspace.file(full_filename)
         
         logger.info(f"Downloading: {full_filename}")
         
@@ -58,6 +55,11 @@ async def download_file(url: str, filename: str, download_dir: str = "downloads"
         )
         response.raise_for_status()
         
+        # رزرو حجم واقعی قبل از نوشتن روی دیسک
+        content_length = response.headers.get('Content-Length')
+        if content_length and content_length.isdigit():
+            await workspace_manager.reserve(workspace, int(content_length))
+        
         # ذخیره فایل
         def _save_file():
             with open(file_path, 'wb') as file:
@@ -125,6 +127,7 @@ def format_number(num: int) -> str:
 @Client.on_message(filters.private & filters.regex(RADIOJAVAN_REGEX) & join)
 async def radiojavan_handler(client: Client, message: Message):
     """Handler اصلی برای لینک‌های رادیو جوان"""
+    workspace = None
     try:
         text = message.text.strip()
         
@@ -171,7 +174,8 @@ async def radiojavan_handler(client: Client, message: Message):
         
         # دانلود فایل
         filename = sanitize_filename(f"{song_info['artist']} - {song_info['name']}")
-        file_path = await download_file(download_url, filename)
+        workspace = await workspace_manager.acquire('radiojavan')
+        file_path = await download_file(download_url, filename, workspace)
         
         # بروزرسانی پیام وضعیت
         await status_msg.edit_text(
@@ -204,14 +208,6 @@ async def radiojavan_handler(client: Client, message: Message):
         # حذف پیام وضعیت
         await status_msg.delete()
         
-        # حذف فایل محلی
-        try:
-            if os.path.exists(file_path):
-                os.remove(file_path)
-                logger.info(f"Deleted local file: {file_path}")
-        except Exception as e:
-            logger.warning(f"Failed to delete local file: {e}")
-        
         # ثبت آمار
         try:
             db = DB()
@@ -232,6 +228,9 @@ async def radiojavan_handler(client: Client, message: Message):
             )
         except:
             pass
+    finally:
+        # حذف فایل محلی (در موفقیت و خطا)
+        workspace_manager.release(workspace)
 
 
 print("✅ RadioJavan Handler loaded")
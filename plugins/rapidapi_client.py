@@ -0,0 +1,240 @@
+"""
+RapidAPI Client - کلاینت async برای social-download-all-in-one
+از session مشترک (keep-alive) استفاده می‌کند و header های quota/rate-limit پاسخ را
+به RapidAPIRateLimiter می‌دهد تا throttle بر اساس سهمیه واقعی انجام شود.
+"""
+
+import asyncio
+import json
+import time
+from collections import deque
+from typing import Optional
+
+import aiohttp
+from config import RAPIDAPI_KEY, RAPIDAPI_RATE_LIMIT, RAPIDAPI_RATE_WINDOW
+from plugins.http_client import http_client
+from plugins.logger_config import get_logger
+
+logger = get_logger('rapidapi_client')
+
+RAPIDAPI_HOST = "social-download-all-in-one.p.rapidapi.com"
+AUTOLINK_URL = f"https://{RAPIDAPI_HOST}/v1/social/autolink"
+
+# تعداد درخواستی که از سهمیه واقعی کنار گذاشته می‌شود (برای درخواست‌های در حال اجرا)
+QUOTA_RESERVE = 1
+# حداکثر انتظار برای reset سهمیه؛ بیشتر از این یعنی سهمیه تمام شده و باید خطا داد
+MAX_QUOTA_WAIT = 30
+
+
+class RapidAPIQuotaExceeded(Exception):
+    """سهمیه RapidAPI تمام شده و reset آن دور است"""
+
+
+# ============================================================
+# PHASE 1 SECURITY FIX: RAPIDAPI RATE LIMITER
+# ============================================================
+class RapidAPIRateLimiter:
+    """
+    Simple rate limiter for RapidAPI calls to prevent quota exhaustion.
+    Uses a sliding window algorithm to track requests.
+
+    وقتی header های x-ratelimit-* از پاسخ‌ها دریافت شده باشند، سهمیه واقعی
+    (remaining / reset) به جای پنجره حدسی استفاده می‌شود.
+    """
+    def __init__(self, max_requests: int = RAPIDAPI_RATE_LIMIT, window_seconds: int = RAPIDAPI_RATE_WINDOW):
+        self.max_requests = max_requests
+        self.window_seconds = window_seconds
+        self.requests = deque()  # (timestamp, success)
+        self._lock = asyncio.Lock()
+        # Provider quota telemetry
+        self.quota_limit: Optional[int] = None
+        self.quota_remaining: Optional[int] = None
+        self.quota_reset_at: float = 0.0
+        self.quota_updated_at: float = 0.0
+        logger.info(f"✅ RapidAPI Rate Limiter initialized: {max_requests} req/{window_seconds}s")
+
+    def _quota_known(self, now: float) -> bool:
+        """آیا اطلاعات سهمیه واقعی هنوز معتبر است؟"""
+        if self.quota_remaining is None:
+            return False
+        if self.quota_reset_at and now >= self.quota_reset_at:
+            return False
+        return now - self.quota_updated_at < max(self.window_seconds, 300)
+
+    def update_quota(self, remaining: Optional[int], limit: Optional[int] = None,
+                     reset_seconds: Optional[float] = None):
+        """ثبت سهمیه گزارش شده توسط provider"""
+        now = time.time()
+        if remaining is not None:
+            self.quota_remaining = max(0, remaining)
+        if limit is not None:
+            self.quota_limit = limit
+        if reset_seconds is not None:
+            self.quota_reset_at = now + max(0.0, reset_seconds)
+        elif self.quota_reset_at <= now:
+            self.quota_reset_at = now + self.window_seconds
+        self.quota_updated_at = now
+
+    def update_from_headers(self, headers, status: int = 200):
+        """خواندن header های rate-limit پاسخ RapidAPI"""
+        def _num(*names):
+            for name in names:
+                value = headers.get(name)
+                if value is None:
+                    continue
+                try:
+                    return float(value)
+                except (TypeError, ValueError):
+                    continue
+            return None
+
+        remaining = _num('x-ratelimit-requests-remaining', 'x-ratelimit-remaining')
+        limit = _num('x-ratelimit-requests-limit', 'x-ratelimit-limit')
+        reset = _num('x-ratelimit-requests-reset', 'x-ratelimit-reset', 'retry-after')
+
+        if status == 429 and remaining is None:
+            remaining = 0
+        if remaining is None and limit is None:
+            return
+
+        self.update_quota(
+            int(remaining) if remaining is not None else None,
+            int(limit) if limit is not None else None,
+            reset
+        )
+        if self.quota_remaining is not None and self.quota_remaining <= QUOTA_RESERVE:
+            logger.warning(
+                f"⚠️ RapidAPI quota low: {self.quota_remaining}/{self.quota_limit} "
+                f"(reset in {max(0, self.quota_reset_at - time.time()):.0f}s)"
+            )
+
+    async def acquire(self) -> bool:
+        """
+        Try to acquire permission to make an API call.
+        Returns True if allowed, False if rate limit exceeded.
+        """
+        async with self._lock:
+            now = time.time()
+
+            # Remove old requests outside the window
+            while self.requests and self.requests[0][0] < now - self.window_seconds:
+                self.requests.popleft()
+
+            if self._quota_known(now):
+                # سهمیه واقعی provider
+                if self.quota_remaining <= QUOTA_RESERVE:
+                    wait_time = self.quota_reset_at - now
+                    logger.warning(f"⏱ Provider quota exhausted. Reset in {wait_time:.1f}s")
+                    return False
+                self.quota_remaining -= 1  # کاهش خوش‌بینانه تا پاسخ بعدی
+            elif len(self.requests) >= self.max_requests:
+                # Check if we're at the limit
+                oldest = self.requests[0][0]
+                wait_time = self.window_seconds - (now - oldest)
+                logger.warning(f"⏱ Rate limit reached. Need to wait {wait_time:.1f}s")
+                return False
+
+            # Add this request
+            self.requests.append((now, True))
+            logger.debug(f"✅ API call allowed ({len(self.requests)}/{self.max_requests})")
+            return True
+
+    async def wait_if_needed(self):
+        """
+        Wait until we can make an API call (blocking version).
+        اگر reset سهمیه بیش از MAX_QUOTA_WAIT ثانیه دور باشد RapidAPIQuotaExceeded می‌دهد.
+        """
+        while not await self.acquire():
+            now = time.time()
+            if self._quota_known(now):
+                wait_time = max(1, self.quota_reset_at - now)
+                if wait_time > MAX_QUOTA_WAIT:
+                    raise RapidAPIQuotaExceeded(f"RapidAPI quota exhausted, resets in {wait_time:.0f}s")
+            else:
+                oldest = self.requests[0][0] if self.requests else now
+                wait_time = max(1, self.window_seconds - (now - oldest))
+            logger.info(f"⏱ Rate limit: waiting {wait_time:.1f}s...")
+            await asyncio.sleep(wait_time)
+
+    def get_stats(self) -> dict:
+        """Get current rate limiter statistics."""
+        now = time.time()
+        # Count recent requests
+        recent = [r for r in self.requests if r[0] > now - self.window_seconds]
+        quota_known = self._quota_known(now)
+        return {
+            'current': len(recent),
+            'limit': self.max_requests,
+            'window': self.window_seconds,
+            'available': self.quota_remaining if quota_known else self.max_requests - len(recent),
+            'source': 'provider' if quota_known else 'window',
+            'quota_limit': self.quota_limit,
+            'quota_remaining': self.quota_remaining,
+            'quota_reset_in': max(0, int(self.quota_reset_at - now)) if self.quota_reset_at else None,
+        }
+
+
+# ============================================================
+# ASYNC CLIENT
+# ============================================================
+class RapidAPIClient:
+    """کلاینت async برای endpoint /v1/social/autolink"""
+
+    def __init__(self, api_key: Optional[str] = RAPIDAPI_KEY, limiter: Optional[RapidAPIRateLimiter] = None):
+        self.api_key = api_key
+        self.limiter = limiter or rapidapi_limiter
+        self.stats = {
+            'calls': 0,
+            'errors': 0,
+            'throttled': 0,  # پاسخ‌های 429
+            'latency_total': 0.0,
+        }
+
+    async def autolink(self, url: str, timeout: float = 12.0) -> dict:
+        """
+        ارسال لینک به API و برگرداندن پاسخ JSON
+        قبل از ارسال منتظر rate limiter می‌ماند (ممکن است RapidAPIQuotaExceeded بدهد).
+        timeout فقط شامل خود درخواست HTTP است، نه انتظار rate limiter.
+        """
+        await self.limiter.wait_if_needed()
+
+        headers = {
+            'x-rapidapi-key': self.api_key or '',
+            'x-rapidapi-host': RAPIDAPI_HOST,
+            'Content-Type': "application/json"
+        }
+
+        self.stats['calls'] += 1
+        start = time.time()
+        try:
+            session = http_client.session()
+            async with session.post(
+                AUTOLINK_URL,
+                data=json.dumps({"url": url}),
+                headers=headers,
+                timeout=aiohttp.ClientTimeout(total=timeout)
+            ) as resp:
+                self.limiter.update_from_headers(resp.headers, resp.status)
+                if resp.status == 429:
+                    self.stats['throttled'] += 1
+                body = await resp.text()
+        except Exception:
+            self.stats['errors'] += 1
+            raise
+        finally:
+            self.stats['latency_total'] += time.time() - start
+
+        return json.loads(body)
+
+    def get_stats(self) -> dict:
+        calls = self.stats['calls']
+        return {
+            **self.stats,
+            'avg_latency': self.stats['latency_total'] / calls if calls else 0.0,
+            'quota': self.limiter.get_stats(),
+        }
+
+
+# Global instances
+rapidapi_limiter = RapidAPIRateLimiter()
+rapidapi_client = RapidAPIClient()
@@ -0,0 +1,306 @@
+"""
+Segmented Download - دانلود چند اتصالی (Range) برای لینک‌های مستقیم CDN
+CDN ها (TikTok، Spotify، Pinterest، صوت مستقیم یوتیوب) سرعت هر اتصال را محدود می‌کنند؛
+با تقسیم فایل به بازه‌ها و دریافت همزمان آن‌ها در یک فایل از پیش رزرو شده،
+سرعت به پهنای باند واقعی نزدیک‌تر می‌شود.
+
+- اولین قطعه همان درخواست بررسی Range است (HEAD روی بسیاری از CDN ها قابل اعتماد نیست)
+- تعداد اتصال از SEGMENTED_INITIAL_CONNECTIONS شروع و تا وقتی سرعت بهتر شود زیاد می‌شود
+- هر قطعه چند بار تلاش مجدد دارد؛ در پایان حجم کل بررسی می‌شود
+- اگر سرور Range را نادیده بگیرد همان پاسخ تک اتصالی نوشته می‌شود؛ در خطا None برمی‌گرداند
+  تا فراخواننده از مسیر تک اتصالی (و مدیریت خطای) خودش استفاده کند
+"""
+
+import asyncio
+import os
+import re
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import aiohttp
+
+from plugins.http_client import http_client, headers_for
+from plugins.logger_config import get_logger, get_performance_logger
+
+try:
+    from config import (
+        SEGMENTED_DOWNLOAD_ENABLED, SEGMENTED_MIN_SIZE_MB, SEGMENTED_PIECE_SIZE_MB,
+        SEGMENTED_INITIAL_CONNECTIONS, SEGMENTED_MAX_CONNECTIONS,
+    )
+except Exception:
+    SEGMENTED_DOWNLOAD_ENABLED = True
+    SEGMENTED_MIN_SIZE_MB = 8
+    SEGMENTED_PIECE_SIZE_MB = 2
+    SEGMENTED_INITIAL_CONNECTIONS = 2
+    SEGMENTED_MAX_CONNECTIONS = 6
+
+logger = get_logger('segmented_download')
+performance_logger = get_performance_logger()
+
+CONTENT_RANGE_RE = re.compile(r'bytes\s+(\d+)-(\d+)/(\d+|\*)')
+PIECE_RETRIES = 3
+ADAPT_INTERVAL = 1.0  # seconds between throughput samples
+ADAPT_GAIN = 1.10  # یک اتصال اضافه فقط اگر سرعت حداقل 10% بهتر شده باشد
+READ_CHUNK = 256 * 1024
+
+
+class SegmentedDownloader:
+    """دانلود Range موازی با تطبیق تعداد اتصال بر اساس سرعت اندازه‌گیری شده"""
+
+    def __init__(self, enabled: bool = SEGMENTED_DOWNLOAD_ENABLED,
+                 min_size_mb: float = SEGMENTED_MIN_SIZE_MB, piece_size_mb: float = SEGMENTED_PIECE_SIZE_MB,
+                 initial_connections: int = SEGMENTED_INITIAL_CONNECTIONS,
+                 max_connections: int = SEGMENTED_MAX_CONNECTIONS):
+        self.enabled = enabled
+        self.min_size = int(min_size_mb * 1024 * 1024)
+        self.piece_size = max(256 * 1024, int(piece_size_mb * 1024 * 1024))
+        self.max_connections = max(1, max_connections)
+        self.initial_connections = max(1, min(initial_connections, self.max_connections))
+        self.stats = {
+            'attempts': 0,
+            'segmented': 0,
+            'no_range': 0,
+            'too_small': 0,
+            'failed': 0,
+            'piece_retries': 0,
+            'bytes': 0,
+            'connections_total': 0,
+            'time_total': 0.0,
+        }
+
+    @staticmethod
+    def _range_headers(headers: Dict[str, str], start: int, end: int) -> Dict[str, str]:
+        h = dict(headers)
+        h['Range'] = f'bytes={start}-{end}'
+        # بازه‌ها روی بایت‌های خام هستند
+        h['Accept-Encoding'] = 'identity'
+        return h
+
+    async def _fetch_piece(self, url: str, headers: Dict[str, str], fd: int, start: int, end: int,
+                           timeout: aiohttp.ClientTimeout, on_bytes: Callable[[int], None]) -> int:
+        """دریافت یک بازه و نوشتن با pwrite در محل خودش؛ بایت‌های نوشته شده را برمی‌گرداند"""
+        session = http_client.session()
+        async with session.get(url, headers=self._range_headers(headers, start, end),
+                               allow_redirects=True, timeout=timeout) as response:
+            if response.status != 206:
+                raise IOError(f"HTTP {response.status} for range {start}-{end}")
+            match = CONTENT_RANGE_RE.match(response.headers.get('Content-Range', ''))
+            if not match or int(match.group(1)) != start:
+                raise IOError(f"Unexpected Content-Range for {start}-{end}: {response.headers.get('Content-Range')}")
+            offset = await self._stream_body(response, fd, start, end, on_bytes)
+        if offset != end + 1:
+            raise IOError(f"Short range {start}-{end}: got {offset - start} bytes")
+        return offset - start
+
+    @staticmethod
+    async def _report(progress_callback: Optional[Callable], downloaded: int, total: int):
+        if not progress_callback:
+            return
+        try:
+            result = progress_callback(downloaded, total)
+            if asyncio.iscoroutine(result):
+                await result
+        except Exception:
+            pass
+
+    async def _stream_body(self, response, fd: int, offset: int, limit: Optional[int],
+                           on_bytes: Callable[[int], None], progress_callback: Optional[Callable] = None,
+                           total: int = 0) -> int:
+        """
+        نوشتن بدنه پاسخ از offset؛ limit = آخرین بایت مجاز (None برای نامحدود)
+        progress_callback فقط برای مسیر تک اتصالی داده می‌شود (هر ADAPT_INTERVAL ثانیه)
+        """
+        last_report = time.time()
+        async for chunk in response.content.iter_chunked(READ_CHUNK):
+            if limit is not None and offset + len(chunk) > limit + 1:
+                raise IOError(f"Range overflow at {offset}")
+            os.pwrite(fd, chunk, offset)
+            offset += len(chunk)
+            on_bytes(len(chunk))
+            if progress_callback and total > 0 and time.time() - last_report >= ADAPT_INTERVAL:
+                last_report = time.time()
+                await self._report(progress_callback, offset, total)
+        return offset
+
+    async def download(self, url: str, file_path: str, headers: Optional[Dict[str, str]] = None,
+                       progress_callback: Optional[Callable] = None,
+                       timeout: Optional[aiohttp.ClientTimeout] = None) -> Optional[int]:
+        """
+        دانلود به file_path؛ اولین قطعه همان درخواست بررسی Range است (بدون round-trip اضافه)
+        - 206: بقیه قطعه‌ها با چند اتصال (فایل‌های کوچک‌تر از SEGMENTED_MIN_SIZE_MB با یک اتصال)
+        - 200: سرور Range را نادیده گرفته → همان پاسخ تک اتصالی تا انتها نوشته می‌شود
+        progress_callback(downloaded, total) می‌تواند sync یا async باشد.
+        خروجی: حجم فایل در صورت موفقیت؛ None یعنی فراخواننده از مسیر تک اتصالی خودش استفاده کند
+        (خطای HTTP، پاسخ فشرده یا شکست دانلود).
+        """
+        if not self.enabled:
+            return None
+        headers = dict(headers) if headers is not None else headers_for(url)
+        timeout = timeout or aiohttp.ClientTimeout(total=None, connect=30, sock_read=60)
+        self.stats['attempts'] += 1
+
+        state = {'downloaded': 0, 'written': 0, 'error': None}
+        start_time = time.time()
+
+        def on_bytes(n: int):
+            state['downloaded'] += n
+
+        fd = os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        workers: List[asyncio.Task] = []
+        try:
+            first_end = self.piece_size - 1
+            session = http_client.session()
+            async with session.get(url, headers=self._range_headers(headers, 0, first_end),
+                                   allow_redirects=True, timeout=timeout) as response:
+                encoding = response.headers.get('Content-Encoding', 'identity')
+                if response.status not in (200, 206) or encoding not in ('', 'identity'):
+                    self.stats['no_range'] += 1
+                    self._discard(workers, fd, file_path)
+                    return None
+
+                if response.status == 200:
+                    # بدون پشتیبانی Range: همین پاسخ کامل است
+                    self.stats['no_range'] += 1
+                    expected = int(response.headers.get('Content-Length', 0) or 0)
+                    size = await self._stream_body(response, fd, 0, None, on_bytes, progress_callback, expected)
+                    if expected and size != expected:
+                        raise IOError(f"Incomplete download: {size}/{expected} bytes")
+                    os.close(fd)
+                    await self._report(progress_callback, size, size)
+                    return size
+
+                match = CONTENT_RANGE_RE.match(response.headers.get('Content-Range', ''))
+                if not match or int(match.group(1)) != 0 or match.group(3) == '*':
+                    raise IOError(f"Unexpected Content-Range: {response.headers.get('Content-Range')}")
+                total = int(match.group(3))
+                final_url = str(response.url)
+                # رزرو فضای کل فایل از ابتدا
+                try:
+                    os.posix_fallocate(fd, 0, total)
+                except (AttributeError, OSError):
+                    os.ftruncate(fd, total)
+                first_end = min(first_end, total - 1)
+                if await self._stream_body(response, fd, 0, first_end, on_bytes) != first_end + 1:
+                    raise IOError("Short first range")
+                state['written'] = first_end + 1
+
+            pieces: List[Tuple[int, int]] = [
+                (start, min(start + self.piece_size, total) - 1)
+                for start in range(first_end + 1, total, self.piece_size)
+            ]
+            queue: "asyncio.Queue[Tuple[int, int, int]]" = asyncio.Queue()
+            for start, end in pieces:
+                queue.put_nowait((start, end, 0))
+
+            async def worker():
+                while state['error'] is None:
+                    try:
+                        start, end, tries = queue.get_nowait()
+                    except asyncio.QueueEmpty:
+                        return
+                    try:
+                        written = await self._fetch_piece(final_url, headers, fd, start, end, timeout, on_bytes)
+                        state['written'] += written
+                    except asyncio.CancelledError:
+                        raise
+                    except Exception as e:
+                        if tries + 1 >= PIECE_RETRIES:
+                            state['error'] = e
+                            return
+                        self.stats['piece_retries'] += 1
+                        logger.debug(f"Piece {start}-{end} failed ({e}), retrying")
+                        queue.put_nowait((start, end, tries + 1))
+
+            segmented = total >= self.min_size
+            if not segmented:
+                self.stats['too_small'] += 1
+            initial = self.initial_connections if segmented else 1
+            for _ in range(min(initial, len(pieces))):
+                workers.append(asyncio.create_task(worker()))
+
+            best_rate = 0.0
+            last_bytes = state['downloaded']
+            last_sample = time.time()
+            growing = segmented
+            while True:
+                pending = [w for w in workers if not w.done()]
+                if not pending:
+                    break
+                await asyncio.wait(pending, timeout=ADAPT_INTERVAL)
+                now = time.time()
+                rate = (state['downloaded'] - last_bytes) / max(now - last_sample, 1e-3)
+                last_bytes, last_sample = state['downloaded'], now
+                await self._report(progress_callback, state['downloaded'], total)
+                if not growing or state['error'] is not None:
+                    continue
+                active = sum(1 for w in workers if not w.done())
+                if rate > best_rate * ADAPT_GAIN and active < self.max_connections and queue.qsize() > 0:
+                    best_rate = rate
+                    workers.append(asyncio.create_task(worker()))
+                else:
+                    # اتصال قبلی سرعت را بهتر نکرد → همین تعداد کافی است
+                    growing = False
+                    best_rate = max(best_rate, rate)
+
+            await asyncio.gather(*workers)
+            if state['error'] is not None:
+                raise state['error']
+        except Exception as e:
+            self.stats['failed'] += 1
+            logger.warning(f"⚠️ Range download failed, falling back to single stream: {e}")
+            self._discard(workers, fd, file_path)
+            return None
+        except BaseException:
+            self._discard(workers, fd, file_path)
+            raise
+        else:
+            os.close(fd)
+
+        size = os.path.getsize(file_path)
+        if state['written'] != total or size != total:
+            self.stats['failed'] += 1
+            logger.warning(f"⚠️ Range download size mismatch ({state['written']}/{size}/{total}), falling back")
+            self._remove(file_path)
+            return None
+
+        elapsed = time.time() - start_time
+        if segmented:
+            self.stats['segmented'] += 1
+            self.stats['bytes'] += total
+            self.stats['connections_total'] += len(workers)
+            self.stats['time_total'] += elapsed
+            performance_logger.info(
+                f"[SEGMENTED] {total / (1024 * 1024):.1f}MB in {elapsed:.2f}s "
+                f"({total / (1024 * 1024) / elapsed if elapsed > 0 else 0:.2f} MB/s, {len(workers)} connections)"
+            )
+        await self._report(progress_callback, total, total)
+        return total
+
+    def _discard(self, workers: List[asyncio.Task], fd: int, file_path: str):
+        for w in workers:
+            w.cancel()
+        try:
+            os.close(fd)
+        except OSError:
+            pass
+        self._remove(file_path)
+
+    @staticmethod
+    def _remove(file_path: str):
+        try:
+            os.unlink(file_path)
+        except OSError:
+            pass
+
+    def get_stats(self) -> dict:
+        segmented = self.stats['segmented']
+        return {
+            **self.stats,
+            'avg_connections': self.stats['connections_total'] / segmented if segmented else 0.0,
+            'avg_speed_mbps': (self.stats['bytes'] / (1024 * 1024)) / self.stats['time_total']
+            if self.stats['time_total'] > 0 else 0.0,
+        }
+
+
+# 🔥 Global instance
+segmented_downloader = SegmentedDownloader()
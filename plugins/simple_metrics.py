@@ -26,6 +26,12 @@ class SimpleMetrics:
         # Per-platform stats
         self.platform_stats = {}
         
+        # Cache hit/miss counters (per cache name)
+        self.cache_stats = {}
+        
+        # Latency samples (per name، مثلاً زمان اولین پاسخ)
+        self.latencies = {}
+        
         # Recent requests (برای محاسبه rate)
         self.recent_requests = deque(maxlen=1000)
         
@@ -79,6 +85,32 @@ class SimpleMetrics:
         if duration > 0:
             self.upload_times.append(duration)
     
+    def log_cache(self, name: str, hit: bool):
+        """ثبت hit/miss یک کش"""
+        if name not in self.cache_stats:
+            self.cache_stats[name] = {'hits': 0, 'misses': 0}
+        self.cache_stats[name]['hits' if hit else 'misses'] += 1
+    
+    def log_latency(self, name: str, duration: float):
+        """ثبت یک نمونه زمان (ثانیه) برای name"""
+        if name not in self.latencies:
+            self.latencies[name] = deque(maxlen=200)
+        self.latencies[name].append(duration)
+    
+    def _latency_stats(self) -> Dict:
+        result = {}
+        for name, samples in self.latencies.items():
+            if not samples:
+                continue
+            ordered = sorted(samples)
+            result[name] = {
+                'count': len(ordered),
+                'avg': sum(ordered) / len(ordered),
+                'p50': ordered[len(ordered) // 2],
+                'p95': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+            }
+        return result
+    
     def log_error(self, platform: str = "unknown"):
         """ثبت یک خطا"""
         self.total_errors += 1
@@ -119,7 +151,9 @@ class SimpleMetrics:
             'avg_upload_time': avg_upload_time,
             'cpu_percent': cpu_percent,
             'memory_mb': memory_mb,
-            'platform_stats': self.platform_stats
+            'platform_stats': self.platform_stats,
+            'cache_stats': self.cache_stats,
+            'latency_stats': self._latency_stats()
         }
     
     def _log_summary(self):
@@ -0,0 +1,90 @@
+"""
+Single-Flight - ادغام درخواست‌های یکسان همزمان
+وقتی چند کاربر همزمان یک لینک/کیفیت را درخواست می‌کنند، فقط یک عملیات واقعی
+(دانلود، درخواست API، ...) اجرا می‌شود و همه منتظرها همان نتیجه را دریافت می‌کنند.
+"""
+
+import asyncio
+import copy
+from typing import Any, Awaitable, Callable, Dict
+from plugins.logger_config import get_logger
+
+logger = get_logger('single_flight')
+
+
+class SingleFlight:
+    """
+    اجرای یک‌باره عملیات برای هر کلید در حال اجرا
+
+    عملیات در یک Task مستقل اجرا می‌شود؛ لغو شدن یکی از منتظرها
+    عملیات مشترک را برای بقیه لغو نمی‌کند.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[str, asyncio.Task] = {}
+        self._waiters: Dict[str, int] = {}
+        self.stats = {
+            'executions': 0,   # عملیات واقعی اجرا شده
+            'coalesced': 0,    # درخواست‌هایی که به عملیات در حال اجرا متصل شدند
+        }
+
+    async def do(self, key: str, func: Callable[..., Awaitable[Any]], *args,
+                 copy_result: bool = False, **kwargs) -> Any:
+        """
+        اجرای func(*args, **kwargs) یا اتصال به اجرای در حال انجام با همین key
+
+        Args:
+            key: کلید یکتای عملیات (مثلاً url + format)
+            func: coroutine function
+            copy_result: اگر True باشد هر منتظر یک کپی مستقل (deepcopy) از نتیجه می‌گیرد
+        """
+        task = self._calls.get(key)
+        if task is None:
+            self.stats['executions'] += 1
+            task = asyncio.ensure_future(func(*args, **kwargs))
+            self._calls[key] = task
+            task.add_done_callback(lambda t, k=key: self._on_done(k, t))
+        else:
+            self.stats['coalesced'] += 1
+            logger.info(f"[{self.name}] Coalesced onto in-flight call: {key} "
+                        f"(waiters: {self._waiters.get(key, 0) + 1})")
+
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            result = await asyncio.shield(task)
+        finally:
+            remaining = self._waiters.get(key, 1) - 1
+            if remaining > 0:
+                self._waiters[key] = remaining
+            else:
+                self._waiters.pop(key, None)
+
+        return copy.deepcopy(result) if copy_result else result
+
+    def _on_done(self, key: str, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            self._calls.pop(key, None)
+        # جلوگیری از هشدار "Task exception was never retrieved" وقتی همه منتظرها لغو شده‌اند
+        if not task.cancelled() and task.exception() is not None:
+            logger.debug(f"[{self.name}] In-flight call failed: {key}: {task.exception()}")
+
+    def in_flight(self, key: str) -> bool:
+        return key in self._calls
+
+    def waiters(self, key: str) -> int:
+        """تعداد منتظرهای فعلی عملیات در حال اجرای key"""
+        return self._waiters.get(key, 0)
+
+    async def wait(self, key: str):
+        """صبر تا پایان عملیات در حال اجرای key (بدون دریافت نتیجه)"""
+        task = self._calls.get(key)
+        if task is not None:
+            await asyncio.wait({task})
+
+    def get_stats(self) -> dict:
+        return {
+            **self.stats,
+            'in_flight': len(self._calls),
+            'waiters': sum(self._waiters.values()),
+        }
@@ -3,6 +3,7 @@ import os
 import threading
 import contextvars
 import asyncio
+import time
 from datetime import datetime, date
 from datetime import datetime as _dt, timedelta as _td
 from .db_path_manager import db_path_manager
@@ -159,6 +160,30 @@ class DB:
                 )"""
             )
 
+            # Create job_queue table (durable queue: leases, attempts, resumable stages)
+            self.cursor.execute(
+                """CREATE TABLE IF NOT EXISTS job_queue (
+                    job_id INTEGER PRIMARY KEY,
+                    user_id INTEGER NOT NULL,
+                    payload TEXT NOT NULL,
+                    lane TEXT NOT NULL DEFAULT 'normal',
+                    cost REAL NOT NULL DEFAULT 0,
+                    state TEXT NOT NULL DEFAULT 'queued',
+                    stage TEXT NOT NULL DEFAULT 'queued',
+                    artifact TEXT NOT NULL DEFAULT '',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    max_attempts INTEGER NOT NULL DEFAULT 3,
+                    next_run_at REAL NOT NULL DEFAULT 0,
+                    lease_owner TEXT,
+                    lease_expires_at REAL NOT NULL DEFAULT 0,
+                    heartbeat_at REAL NOT NULL DEFAULT 0,
+                    last_error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )"""
+            )
+            self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_job_queue_state ON job_queue(state, next_run_at)")
+
             # Create cookies table for YouTube cookie pool
             self.cursor.execute(
                 """CREATE TABLE IF NOT EXISTS cookies (
@@ -215,7 +240,39 @@ class DB:
             self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_failed_requests_status ON failed_requests(status)")
             self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_failed_requests_user ON failed_requests(user_id)")
             self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_failed_requests_created ON failed_requests(created_at)")
-            
+
+            # Create delivery_cache table (Telegram file_id reuse across users)
+            self.cursor.execute(
+                """CREATE TABLE IF NOT EXISTS delivery_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    platform TEXT NOT NULL,
+                    media_id TEXT NOT NULL,
+                    format_id TEXT NOT NULL DEFAULT '',
+                    media_type TEXT NOT NULL DEFAULT '',
+                    items TEXT NOT NULL,
+                    caption TEXT,
+                    storage_chat_id INTEGER,
+                    storage_message_id INTEGER,
+                    hits INTEGER NOT NULL DEFAULT 0,
+                    created_at TEXT NOT NULL,
+                    last_used_at TEXT
+                )"""
+            )
+            self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_delivery_cache_created ON delivery_cache(created_at)")
+
+            # Create api_response_cache table (RapidAPI / Instagram responses, survives restarts)
+            self.cursor.execute(
+                """CREATE TABLE IF NOT EXISTS api_response_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    platform TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    negative INTEGER NOT NULL DEFAULT 0,
+                    expires_at REAL NOT NULL,
+                    created_at TEXT NOT NULL
+                )"""
+            )
+            self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_api_response_cache_expires ON api_response_cache(expires_at)")
+
             # Insert default waiting messages if they don't exist
             self.cursor.execute(
                 """INSERT OR IGNORE INTO waiting_messages (platform, message_type, message_content) 
@@ -608,6 +665,74 @@ class DB:
             print(f"Failed to get user jobs: {error}")
             return []
     
+    # --- Durable job queue operations ---
+    def execute_job_batch(self, statements: list) -> list | None:
+        """Run (query, params) statements in one transaction; returns rowcounts or None on failure"""
+        try:
+            rowcounts = []
+            for query, params in statements:
+                self.cursor.execute(query, params)
+                rowcounts.append(self.cursor.rowcount)
+            self.mydb.commit()
+            return rowcounts
+        except sqlite3.Error as error:
+            print(f"Failed to commit job batch: {error}")
+            try:
+                self.mydb.rollback()
+            except sqlite3.Error:
+                pass
+            return None
+
+    def get_recoverable_queue_jobs(self) -> list:
+        """Queued or leased rows of the durable job queue (oldest first)"""
+        try:
+            query = "SELECT * FROM job_queue WHERE state IN ('queued', 'leased') ORDER BY created_at ASC"
+            self.cursor.execute(query)
+            rows = self.cursor.fetchall()
+            columns = [description[0] for description in self.cursor.description]
+            return [dict(zip(columns, row)) for row in rows]
+        except sqlite3.Error as error:
+            print(f"Failed to load queued jobs: {error}")
+            return []
+
+    def get_queue_job(self, job_id: int) -> dict:
+        """Lease/attempt state of one durable queue row"""
+        try:
+            query = '''SELECT state, stage, lease_owner, lease_expires_at, next_run_at, attempts, max_attempts
+                       FROM job_queue WHERE job_id = ?'''
+            self.cursor.execute(query, (job_id,))
+            row = self.cursor.fetchone()
+            if row:
+                columns = [description[0] for description in self.cursor.description]
+                return dict(zip(columns, row))
+            return {}
+        except sqlite3.Error as error:
+            print(f"Failed to get queue job: {error}")
+            return {}
+
+    def get_unqueued_active_jobs(self) -> list:
+        """Unfinished jobs that have no durable queue row (created before the queue table existed)"""
+        try:
+            query = '''SELECT id, user_id, url, title, format_id FROM jobs
+                       WHERE status IN ('pending', 'downloading', 'uploading')
+                         AND id NOT IN (SELECT job_id FROM job_queue)
+                       ORDER BY created_at ASC'''
+            return self.cursor.execute(query).fetchall() or []
+        except sqlite3.Error as error:
+            print(f"Failed to load unqueued jobs: {error}")
+            return []
+
+    def purge_finished_queue_jobs(self, older_than: float) -> int:
+        """Delete done/failed queue rows last updated before older_than (unix time)"""
+        try:
+            query = "DELETE FROM job_queue WHERE state IN ('done', 'failed') AND updated_at < ?"
+            self.cursor.execute(query, (older_than,))
+            self.mydb.commit()
+            return self.cursor.rowcount
+        except sqlite3.Error as error:
+            print(f"Failed to purge queue jobs: {error}")
+            return 0
+
     # --- Message recovery operations ---
     def get_last_update_id(self) -> int:
         """Get last processed update_id"""
@@ -829,4 +954,140 @@ class DB:
                 stats[status] = int(row[0] or 0) if row else 0
         except sqlite3.Error as e:
             print(f"Failed to get failed requests stats: {e}")
-        return stats
\ No newline at end of file
+        return stats
+    # --- Delivery cache operations (Telegram file_id reuse) ---
+    def get_delivery_entry(self, cache_key: str) -> dict:
+        """Get cached delivery (file_ids) by cache key"""
+        try:
+            q = ('SELECT cache_key, platform, media_id, format_id, media_type, items, caption, '
+                 'storage_chat_id, storage_message_id, hits, created_at, last_used_at '
+                 'FROM delivery_cache WHERE cache_key = ?')
+            self.cursor.execute(q, (cache_key,))
+            r = self.cursor.fetchone()
+            if not r:
+                return {}
+            return {
+                'cache_key': r[0],
+                'platform': r[1],
+                'media_id': r[2],
+                'format_id': r[3],
+                'media_type': r[4],
+                'items': r[5],
+                'caption': r[6],
+                'storage_chat_id': r[7],
+                'storage_message_id': r[8],
+                'hits': r[9],
+                'created_at': r[10],
+                'last_used_at': r[11]
+            }
+        except sqlite3.Error as e:
+            print(f"Failed to get delivery entry: {e}")
+            return {}
+
+    def save_delivery_entry(self, cache_key: str, platform: str, media_id: str, format_id: str,
+                            media_type: str, items: str, caption: str = None,
+                            storage_chat_id: int = None, storage_message_id: int = None) -> bool:
+        """Insert or replace a cached delivery"""
+        try:
+            now = _dt.now().isoformat(timespec='seconds')
+            q = ('INSERT OR REPLACE INTO delivery_cache '
+                 '(cache_key, platform, media_id, format_id, media_type, items, caption, '
+                 'storage_chat_id, storage_message_id, hits, created_at, last_used_at) '
+                 'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 0, ?, ?)')
+            self.cursor.execute(q, (cache_key, platform, media_id, format_id, media_type, items, caption,
+                                    storage_chat_id, storage_message_id, now, now))
+            self.mydb.commit()
+            return True
+        except sqlite3.Error as e:
+            print(f"Failed to save delivery entry: {e}")
+            return False
+
+    def touch_delivery_entry(self, cache_key: str) -> None:
+        """Increment hit counter of a cached delivery"""
+        try:
+            now = _dt.now().isoformat(timespec='seconds')
+            q = 'UPDATE delivery_cache SET hits = hits + 1, last_used_at = ? WHERE cache_key = ?'
+            self.cursor.execute(q, (now, cache_key))
+            self.mydb.commit()
+        except sqlite3.Error as e:
+            print(f"Failed to touch delivery entry: {e}")
+
+    def delete_delivery_entry(self, cache_key: str) -> bool:
+        """Delete a cached delivery (e.g. stale file_id)"""
+        try:
+            self.cursor.execute('DELETE FROM delivery_cache WHERE cache_key = ?', (cache_key,))
+            self.mydb.commit()
+            return True
+        except sqlite3.Error as e:
+            print(f"Failed to delete delivery entry: {e}")
+            return False
+
+    # --- API response cache operations ---
+    def get_api_cache_entry(self, cache_key: str) -> dict:
+        """Get a cached API response by cache key (expired rows are returned too)"""
+        try:
+            q = ('SELECT cache_key, platform, payload, negative, expires_at, created_at '
+                 'FROM api_response_cache WHERE cache_key = ?')
+            self.cursor.execute(q, (cache_key,))
+            r = self.cursor.fetchone()
+            if not r:
+                return {}
+            return {
+                'cache_key': r[0],
+                'platform': r[1],
+                'payload': r[2],
+                'negative': bool(r[3]),
+                'expires_at': r[4],
+                'created_at': r[5]
+            }
+        except sqlite3.Error as e:
+            print(f"Failed to get api cache entry: {e}")
+            return {}
+
+    def save_api_cache_entry(self, cache_key: str, platform: str, payload: str,
+                             negative: bool, expires_at: float) -> bool:
+        """Insert or replace a cached API response"""
+        try:
+            now = _dt.now().isoformat(timespec='seconds')
+            q = ('INSERT OR REPLACE INTO api_response_cache '
+                 '(cache_key, platform, payload, negative, expires_at, created_at) '
+                 'VALUES (?, ?, ?, ?, ?, ?)')
+            self.cursor.execute(q, (cache_key, platform, payload, 1 if negative else 0, expires_at, now))
+            self.mydb.commit()
+            return True
+        except sqlite3.Error as e:
+            print(f"Failed to save api cache entry: {e}")
+            return False
+
+    def delete_api_cache_entry(self, cache_key: str) -> bool:
+        """Delete a cached API response"""
+        try:
+            self.cursor.execute('DELETE FROM api_response_cache WHERE cache_key = ?', (cache_key,))
+            self.mydb.commit()
+            return True
+        except sqlite3.Error as e:
+            print(f"Failed to delete api cache entry: {e}")
+            return False
+
+    def cleanup_expired_api_cache(self) -> int:
+        """Delete expired API responses"""
+        try:
+            self.cursor.execute('DELETE FROM api_response_cache WHERE expires_at < ?', (time.time(),))
+            deleted_count = self.cursor.rowcount
+            self.mydb.commit()
+            return deleted_count
+        except sqlite3.Error as e:
+            print(f"Failed to cleanup api cache: {e}")
+            return 0
+
+    def cleanup_old_delivery_entries(self, days: int = 30) -> int:
+        """Delete cached deliveries older than specified days"""
+        try:
+            cutoff_date = (_dt.now() - _td(days=days)).isoformat(timespec='seconds')
+            self.cursor.execute('DELETE FROM delivery_cache WHERE created_at < ?', (cutoff_date,))
+            deleted_count = self.cursor.rowcount
+            self.mydb.commit()
+            return deleted_count
+        except sqlite3.Error as e:
+            print(f"Failed to cleanup delivery cache: {e}")
+            return 0
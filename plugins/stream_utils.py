@@ -7,8 +7,8 @@ import io
 import os
 import requests
 import shutil
-import subprocess
 import json
+from collections import deque
 from typing import BinaryIO, Union, Optional
 # youtube_helpers removed - using new system
 from plugins.logger_config import get_logger, get_performance_logger
@@ -17,6 +17,12 @@ import time
 from concurrent.futures import ThreadPoolExecutor
 from config import TELEGRAM_THROTTLING
 from plugins.media_utils import send_advertisement
+from plugins.part_uploader import PART_SIZE, upload_parts, send_uploaded_file
+from plugins.http_client import http_client
+from plugins.segmented_download import segmented_downloader
+
+# حداکثر داده بافر شده بین دانلود و آپلود (backpressure)
+PIPE_BUFFER_BYTES = 16 * 1024 * 1024
 
 
 class StreamBuffer(io.BytesIO):
@@ -28,6 +34,86 @@ class StreamBuffer(io.BytesIO):
         self.name = name
 
 
+class PipeBuffer:
+    """
+    بافر async محدود بین دانلود (producer) و آپلود (consumer)
+    producer با write() می‌نویسد و وقتی بافر پر است منتظر می‌ماند (backpressure)،
+    consumer با read(n) دقیقاً n بایت (یا باقیمانده در پایان) می‌خواند.
+    """
+    def __init__(self, name: str, max_buffer_bytes: int = PIPE_BUFFER_BYTES):
+        self.name = name
+        self.max_buffer_bytes = max_buffer_bytes
+        self.total_size: Optional[int] = None
+        self._size_known = asyncio.Event()
+        self._cond = asyncio.Condition()
+        self._chunks = deque()
+        self._buffered = 0
+        self._eof = False
+        self._aborted = False
+        self._error: Optional[BaseException] = None
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.producer_waits = 0
+
+    def set_total_size(self, size: Optional[int]):
+        """اعلام اندازه فایل (None یعنی نامشخص → مسیر دیسک)"""
+        self.total_size = size or None
+        self._size_known.set()
+
+    async def wait_for_size(self) -> Optional[int]:
+        await self._size_known.wait()
+        return self.total_size
+
+    async def write(self, data: bytes):
+        async with self._cond:
+            while self._buffered >= self.max_buffer_bytes and not self._aborted:
+                self.producer_waits += 1
+                await self._cond.wait()
+            if self._aborted:
+                raise ConnectionAbortedError(f"Pipe consumer aborted: {self.name}")
+            self._chunks.append(data)
+            self._buffered += len(data)
+            self.bytes_in += len(data)
+            self._cond.notify_all()
+
+    async def close(self, error: Optional[BaseException] = None):
+        """پایان داده از سمت producer (با خطا در صورت شکست دانلود)"""
+        async with self._cond:
+            self._eof = True
+            self._error = error
+            self._cond.notify_all()
+        self._size_known.set()
+
+    async def abort(self):
+        """توقف از سمت consumer - write بعدی producer خطا می‌دهد"""
+        async with self._cond:
+            self._aborted = True
+            self._cond.notify_all()
+
+    async def read(self, n: int) -> bytes:
+        async with self._cond:
+            while self._buffered < n and not self._eof:
+                await self._cond.wait()
+            if self._error is not None:
+                raise self._error
+
+            parts = []
+            needed = n
+            while needed > 0 and self._chunks:
+                chunk = self._chunks.popleft()
+                if len(chunk) > needed:
+                    self._chunks.appendleft(chunk[needed:])
+                    chunk = chunk[:needed]
+                parts.append(chunk)
+                needed -= len(chunk)
+
+            data = b"".join(parts)
+            self._buffered -= len(data)
+            self.bytes_out += len(data)
+            self._cond.notify_all()
+            return data
+
+
 async def download_to_memory_stream(url: str, max_size_mb: int = 50, headers=None) -> Optional[StreamBuffer]:
     """
     Download file directly to memory for small files (< max_size_mb)
@@ -48,34 +134,35 @@ async def download_to_memory_stream(url: str, max_size_mb: int = 50, headers=Non
         
         # Dynamic timeout based on expected file size
         timeout_seconds = min(60, max(15, max_size_mb * 2))
-        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=timeout_seconds)) as session:
-            async with session.get(url, headers=headers, allow_redirects=True) as response:
-                response.raise_for_status()
-                
-                # Check content length
-                content_length = response.headers.get('content-length')
-                if content_length:
-                    size_mb = int(content_length) / (1024 * 1024)
-                    if size_mb > max_size_mb:
-                        return None  # File too large for memory streaming
-                
-                # Extract filename from URL or use default
-                filename = url.split('/')[-1].split('?')[0] or 'media_file'
-                
-                # Create memory buffer
-                buffer = StreamBuffer(filename)
-                
-                # Stream content to memory
-                async for chunk in response.content.iter_chunked(64 * 1024):
-                    buffer.write(chunk)
-                    # Safety check for memory usage
-                    if buffer.tell() > max_size_mb * 1024 * 1024:
-                        buffer.close()
-                        return None
-                
-                buffer.seek(0)  # Reset position for reading
-                return buffer
-                
+        session = http_client.session()
+        async with session.get(url, headers=headers, allow_redirects=True,
+                               timeout=aiohttp.ClientTimeout(total=timeout_seconds)) as response:
+            response.raise_for_status()
+            
+            # Check content length
+            content_length = response.headers.get('content-length')
+            if content_length:
+                size_mb = int(content_length) / (1024 * 1024)
+                if size_mb > max_size_mb:
+                    return None  # File too large for memory streaming
+            
+            # Extract filename from URL or use default
+            filename = url.split('/')[-1].split('?')[0] or 'media_file'
+            
+            # Create memory buffer
+            buffer = StreamBuffer(filename)
+            
+            # Stream content to memory
+            async for chunk in response.content.iter_chunked(64 * 1024):
+                buffer.write(chunk)
+                # Safety check for memory usage
+                if buffer.tell() > max_size_mb * 1024 * 1024:
+                    buffer.close()
+                    return None
+            
+            buffer.seek(0)  # Reset position for reading
+            return buffer
+            
     except Exception as e:
         print(f"Memory streaming error: {e}")
         return None
@@ -139,40 +226,54 @@ async def download_with_progress_callback(url: str, file_path: str, progress_cal
             'Upgrade-Insecure-Requests': '1',
         }
         
+        # فایل‌های بزرگ با چند اتصال Range (در صورت پشتیبانی سرور)
+        def _segmented_progress(downloaded, total):
+            if progress_callback:
+                progress_callback({
+                    'status': 'downloading',
+                    'downloaded_bytes': downloaded,
+                    'total_bytes': total,
+                    'speed': 0,
+                    'eta': 0
+                })
+        
+        if await segmented_downloader.download(url, file_path, headers=headers, progress_callback=_segmented_progress):
+            return file_path
+        
         # Start with a reasonable timeout, will be adjusted based on actual file size
-        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=120)) as session:
-            async with session.get(url, headers=headers) as response:
-                response.raise_for_status()
-                
-                total_size = int(response.headers.get('content-length', 0))
-                total_size_mb = total_size / (1024 * 1024) if total_size > 0 else 0
-                downloaded = 0
-                
-                # Optimize chunk size based on file size
-                chunk_size = optimize_chunk_size(total_size_mb)
-                
-                with open(file_path, 'wb') as f:
-                    async for chunk in response.content.iter_chunked(chunk_size):
-                        f.write(chunk)
-                        downloaded += len(chunk)
-                        
-                        # Call progress callback if provided
-                        if progress_callback and total_size > 0:
-                            try:
-                                # Format progress data for YouTube callback
-                                progress_data = {
-                                    'status': 'downloading',
-                                    'downloaded_bytes': downloaded,
-                                    'total_bytes': total_size,
-                                    'speed': 0,
-                                    'eta': 0
-                                }
-                                progress_callback(progress_data)
-                            except Exception:
-                                pass  # Don't let progress callback errors stop download
-                
-                return file_path
-                
+        session = http_client.session()
+        async with session.get(url, headers=headers, timeout=aiohttp.ClientTimeout(total=120)) as response:
+            response.raise_for_status()
+            
+            total_size = int(response.headers.get('content-length', 0))
+            total_size_mb = total_size / (1024 * 1024) if total_size > 0 else 0
+            downloaded = 0
+            
+            # Optimize chunk size based on file size
+            chunk_size = optimize_chunk_size(total_size_mb)
+            
+            with open(file_path, 'wb') as f:
+                async for chunk in response.content.iter_chunked(chunk_size):
+                    f.write(chunk)
+                    downloaded += len(chunk)
+                    
+                    # Call progress callback if provided
+                    if progress_callback and total_size > 0:
+                        try:
+                            # Format progress data for YouTube callback
+                            progress_data = {
+                                'status': 'downloading',
+                                'downloaded_bytes': downloaded,
+                                'total_bytes': total_size,
+                                'speed': 0,
+                                'eta': 0
+                            }
+                            progress_callback(progress_data)
+                        except Exception:
+                            pass  # Don't let progress callback errors stop download
+            
+            return file_path
+            
     except Exception as e:
         print(f"Download with progress error: {e}")
         raise
@@ -235,222 +336,22 @@ async def throttled_upload_with_retry(upload_func, max_retries=None, base_delay=
 
 
 # 🔥 تابع جدید برای استخراج metadata
-def extract_video_metadata(file_path: str) -> dict:
+async def extract_video_metadata(file_path: str, known: Optional[dict] = None) -> dict:
     """
-    استخراج metadata کامل از ویدیو با ffprobe و لاگ‌گیری کامل
+    استخراج metadata ویدیو از طریق media_probe (ffprobe async با کش)
+    known: width/height/duration موجود از yt-dlp یا API؛ در صورت کامل بودن ffprobe اجرا نمی‌شود
     """
-    logger = get_logger('stream_utils')
-    
-    try:
-        logger.info(f"📊 Starting metadata extraction for: {os.path.basename(file_path)}")
-        
-        # بررسی وجود فایل
-        if not os.path.exists(file_path):
-            logger.error(f"❌ File not found: {file_path}")
-            return {}
-        
-        file_size_mb = os.path.getsize(file_path) / (1024 * 1024)
-        logger.info(f"📁 File size: {file_size_mb:.2f} MB")
-        
-        # پیدا کردن ffprobe
-        ffprobe_path = os.environ.get('FFMPEG_PATH', 'ffmpeg').replace('ffmpeg', 'ffprobe')
-        logger.info(f"🔍 Initial ffprobe path: {ffprobe_path}")
-        
-        if not os.path.exists(ffprobe_path):
-            ffprobe_path = shutil.which('ffprobe') or 'ffprobe'
-            logger.info(f"🔍 ffprobe from PATH: {ffprobe_path}")
-        
-        if not ffprobe_path or not os.path.exists(ffprobe_path):
-            logger.error("❌ ffprobe not found")
-            return {}
-        
-        cmd = [
-            ffprobe_path, '-v', 'error',
-            '-show_entries', 'format=duration:stream=width,height,codec_type,duration',
-            '-of', 'json',
-            file_path
-        ]
-        
-        logger.info(f"🔧 ffprobe command: {' '.join(cmd)}")
-        
-        start_time = time.time()
-        result = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', errors='ignore', timeout=10)
-        end_time = time.time()
-        
-        logger.info(f"⏱️ ffprobe execution time: {end_time - start_time:.2f}s")
-        logger.info(f"🔍 ffprobe return code: {result.returncode}")
-        
-        if result.stderr:
-            logger.warning(f"⚠️ ffprobe stderr: {result.stderr}")
-        
-        if result.returncode == 0:
-            try:
-                data = json.loads(result.stdout)
-                logger.info(f"📋 Raw ffprobe data: {data}")
-            except json.JSONDecodeError as e:
-                logger.error(f"❌ JSON decode error: {e}")
-                return {}
-            
-            metadata = {
-                'duration': 0,
-                'width': 0,
-                'height': 0,
-                'has_video': False,
-                'has_audio': False
-            }
-            
-            format_data = data.get('format', {})
-            logger.info(f"📊 Format data: {format_data}")
-            
-            if 'duration' in format_data:
-                try:
-                    metadata['duration'] = int(float(format_data['duration']))
-                    logger.info(f"⏱️ Duration from format: {metadata['duration']}s")
-                except Exception as e:
-                    logger.warning(f"⚠️ Duration parsing error: {e}")
-            
-            streams = data.get('streams', [])
-            logger.info(f"🎬 Found {len(streams)} streams")
-            
-            for i, stream in enumerate(streams):
-                codec_type = stream.get('codec_type', '')
-                logger.info(f"🔍 Stream {i}: type={codec_type}, data={stream}")
-                
-                if codec_type == 'video':
-                    metadata['has_video'] = True
-                    if 'width' in stream and not metadata['width']:
-                        metadata['width'] = int(stream['width'])
-                        logger.info(f"📐 Width: {metadata['width']}")
-                    if 'height' in stream and not metadata['height']:
-                        metadata['height'] = int(stream['height'])
-                        logger.info(f"📐 Height: {metadata['height']}")
-                    if not metadata['duration'] and 'duration' in stream:
-                        try:
-                            metadata['duration'] = int(float(stream['duration']))
-                            logger.info(f"⏱️ Duration from video stream: {metadata['duration']}s")
-                        except Exception as e:
-                            logger.warning(f"⚠️ Stream duration parsing error: {e}")
-                
-                elif codec_type == 'audio':
-                    metadata['has_audio'] = True
-                    logger.info("🔊 Audio stream detected")
-            
-            logger.info(f"✅ Final metadata: {metadata}")
-            print(f"📊 Metadata extracted: {metadata}")
-            return metadata
-        else:
-            logger.error(f"❌ ffprobe failed with return code {result.returncode}")
-            logger.error(f"❌ ffprobe stderr: {result.stderr}")
-            print(f"❌ ffprobe failed: {result.stderr}")
-            return {}
-            
-    except subprocess.TimeoutExpired:
-        logger.error("❌ ffprobe timeout after 10 seconds")
-        print("❌ Metadata extraction timeout")
-        return {}
-    except Exception as e:
-        logger.error(f"❌ Metadata extraction error: {e}")
-        print(f"❌ Metadata extraction error: {e}")
-        return {}
+    from plugins.media_probe import media_probe
+    return await media_probe.probe(file_path, known)
 
 
 # 🔥 تابع جدید برای ساخت thumbnail
-def generate_thumbnail(file_path: str) -> str:
+async def generate_thumbnail(file_path: str) -> Optional[str]:
     """
-    ساخت سریع thumbnail از ویدیو با لاگ‌گیری کامل
+    ساخت سریع thumbnail از ویدیو (ffmpeg async)
     """
-    logger = get_logger('stream_utils')
-    
-    try:
-        logger.info(f"🎬 Starting thumbnail generation for: {os.path.basename(file_path)}")
-        
-        # بررسی اینکه آیا thumbnail قبلاً وجود دارد
-        thumb_path = file_path.rsplit('.', 1)[0] + '_thumb.jpg'
-        if os.path.exists(thumb_path) and os.path.getsize(thumb_path) > 0:
-            logger.info(f"✅ Existing thumbnail found: {thumb_path}")
-            return thumb_path
-        
-        # پیدا کردن FFmpeg
-        ffmpeg_path = os.environ.get('FFMPEG_PATH')
-        logger.info(f"🔍 FFMPEG_PATH from env: {ffmpeg_path}")
-        
-        if not ffmpeg_path:
-            try:
-                from config import FFMPEG_PATH as CFG_FFMPEG
-                ffmpeg_path = CFG_FFMPEG
-                logger.info(f"🔍 FFMPEG_PATH from config: {ffmpeg_path}")
-            except Exception as e:
-                logger.warning(f"⚠️ Could not load FFMPEG_PATH from config: {e}")
-                ffmpeg_path = None
-        
-        if not ffmpeg_path or not os.path.exists(ffmpeg_path):
-            ffmpeg_path = shutil.which('ffmpeg')
-            logger.info(f"🔍 FFmpeg from PATH: {ffmpeg_path}")
-        
-        if not ffmpeg_path:
-            logger.error("❌ FFmpeg not found in any location")
-            print("❌ FFmpeg not found, skipping thumbnail")
-            return None
-        
-        # بررسی دسترسی به فایل ورودی
-        if not os.path.exists(file_path):
-            logger.error(f"❌ Input file not found: {file_path}")
-            return None
-        
-        file_size_mb = os.path.getsize(file_path) / (1024 * 1024)
-        logger.info(f"📊 Input file size: {file_size_mb:.2f} MB")
-        
-        # دستور بهینه‌سازی شده برای سرعت بالا
-        cmd = [
-            ffmpeg_path, '-y',
-            '-ss', '1',  # کاهش زمان seek
-            '-i', file_path,
-            '-vframes', '1',
-            '-vf', 'scale=320:-2',  # سایز کوچک‌تر برای سرعت
-            '-q:v', '5',  # کیفیت متوسط برای سرعت
-            '-f', 'image2',
-            thumb_path
-        ]
-        
-        logger.info(f"🔧 FFmpeg command: {' '.join(cmd)}")
-        
-        # timeout کوتاه‌تر برای جلوگیری از کندی
-        start_time = time.time()
-        result = subprocess.run(cmd, capture_output=True, timeout=8, 
-                              encoding='utf-8', errors='ignore')
-        end_time = time.time()
-        
-        logger.info(f"⏱️ FFmpeg execution time: {end_time - start_time:.2f}s")
-        logger.info(f"🔍 FFmpeg return code: {result.returncode}")
-        
-        if result.stdout:
-            logger.info(f"📝 FFmpeg stdout: {result.stdout}")
-        if result.stderr:
-            logger.warning(f"⚠️ FFmpeg stderr: {result.stderr}")
-        
-        if result.returncode == 0 and os.path.exists(thumb_path) and os.path.getsize(thumb_path) > 0:
-            thumb_size = os.path.getsize(thumb_path)
-            logger.info(f"✅ Thumbnail created successfully: {thumb_path} ({thumb_size} bytes)")
-            print(f"✅ Thumbnail created successfully ({thumb_size} bytes)")
-            return thumb_path
-        else:
-            logger.error(f"❌ Thumbnail generation failed - return code: {result.returncode}")
-            if os.path.exists(thumb_path):
-                thumb_size = os.path.getsize(thumb_path)
-                logger.error(f"❌ Thumbnail file exists but size is: {thumb_size} bytes")
-            print(f"❌ Thumbnail generation failed (return code: {result.returncode})")
-            if result.stderr:
-                print(f"   FFmpeg error: {result.stderr[:200]}")
-            return None
-            
-    except subprocess.TimeoutExpired:
-        logger.error("❌ Thumbnail generation timeout after 8 seconds")
-        print("❌ Thumbnail generation timeout")
-        return None
-    except Exception as e:
-        logger.error(f"❌ Thumbnail generation error: {e}")
-        print(f"❌ Thumbnail error: {e}")
-        return None
+    from plugins.media_probe import media_probe
+    return await media_probe.thumbnail(file_path)
 
 
 # 🔥 تابع smart_upload_strategy اصلاح شده
@@ -474,7 +375,8 @@ async def smart_upload_strategy(client, chat_id: int, file_path: str, media_type
         try:
             # استخراج سریع metadata
             metadata_start = time.time()
-            metadata = extract_video_metadata(file_path)
+            known = {k: kwargs.get(k) for k in ('width', 'height', 'duration')}
+            metadata = await extract_video_metadata(file_path, known)
             metadata_time = time.time() - metadata_start
             
             logger.info(f"⏱️ Metadata extraction took: {metadata_time:.2f}s")
@@ -496,7 +398,7 @@ async def smart_upload_strategy(client, chat_id: int, file_path: str, media_type
             if 'thumb' not in kwargs:
                 logger.info("🖼️ Generating thumbnail...")
                 thumb_start = time.time()
-                thumb_path = generate_thumbnail(file_path)
+                thumb_path = await generate_thumbnail(file_path)
                 thumb_time = time.time() - thumb_start
                 
                 logger.info(f"⏱️ Thumbnail generation took: {thumb_time:.2f}s")
@@ -549,11 +451,12 @@ async def smart_upload_strategy(client, chat_id: int, file_path: str, media_type
     try:
         # آپلود مستقیم بدون retry اضافی برای سرعت بالا
         total_start = time.time()
-        await perform_upload()
+        sent = await perform_upload()
         total_time = time.time() - total_start
         
         logger.info(f"🎉 Smart upload successful! Total time: {total_time:.2f}s")
-        return True
+        # پیام ارسال شده برگردانده می‌شود (برای delivery cache)
+        return sent or True
         
     except Exception as e:
         logger.error(f"❌ Smart upload failed: {e}")
@@ -563,11 +466,11 @@ async def smart_upload_strategy(client, chat_id: int, file_path: str, media_type
         try:
             logger.info("🔄 Retrying upload after 0.5s...")
             await asyncio.sleep(0.5)
-            await perform_upload()
+            sent = await perform_upload()
             
             total_time = time.time() - total_start
             logger.info(f"✅ Smart upload retry successful! Total time: {total_time:.2f}s")
-            return True
+            return sent or True
             
         except Exception as e2:
             logger.error(f"❌ Smart upload retry failed: {e2}")
@@ -643,7 +546,7 @@ async def direct_youtube_upload(client, chat_id: int, url: str, quality_info: di
         
         # Extract robust metadata and thumbnail for better Telegram display
         from plugins.universal_downloader import _extract_video_metadata as _extract_video_metadata_local
-        video_meta = _extract_video_metadata_local(downloaded_file)
+        video_meta = await _extract_video_metadata_local(downloaded_file)
         duration = video_meta.get('duration', 0) or None
         width = video_meta.get('width', 0) or None
         height = video_meta.get('height', 0) or None
@@ -678,17 +581,14 @@ async def direct_youtube_upload(client, chat_id: int, url: str, quality_info: di
         
         # Cleanup
         try:
-            os.unlink(downloaded_file)
-            temp_dir = os.path.dirname(downloaded_file)
+            # فایل و workspace آن (با آزاد شدن رزرو دیسک) توسط downloader حذف می‌شوند
+            youtube_downloader.cleanup(downloaded_file)
             # Remove generated thumbnail if present
             if 'thumb_to_cleanup' in locals() and thumb_to_cleanup and os.path.exists(thumb_to_cleanup):
                 try:
                     os.unlink(thumb_to_cleanup)
                 except Exception:
                     pass
-            if os.path.exists(temp_dir) and os.path.basename(temp_dir).startswith('tmp'):
-                import shutil as _sh
-                _sh.rmtree(temp_dir, ignore_errors=True)
         except Exception as cleanup_err:
             stream_utils_logger.warning(f"⚠️ Cleanup failed: {cleanup_err}")
         
@@ -709,11 +609,11 @@ async def direct_youtube_upload(client, chat_id: int, url: str, quality_info: di
     
     try:
         timeout = aiohttp.ClientTimeout(total=8)
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            async with session.request('HEAD', direct_url, headers={'User-Agent': 'Mozilla/5.0'}) as resp:
-                content_length = int(resp.headers.get('Content-Length') or 0)
-                content_type = resp.headers.get('Content-Type', '')
-                
+        session = http_client.session()
+        async with session.request('HEAD', direct_url, headers={'User-Agent': 'Mozilla/5.0'}, timeout=timeout) as resp:
+            content_length = int(resp.headers.get('Content-Length') or 0)
+            content_type = resp.headers.get('Content-Type', '')
+            
         header_check_time = time.time() - header_check_start
         file_size_mb = content_length / (1024 * 1024) if content_length > 0 else 0
         
@@ -833,12 +733,8 @@ async def direct_youtube_upload(client, chat_id: int, url: str, quality_info: di
                     if ffmpeg_path and content_is_mp4:
                         remuxed_path = temp_path + ".mp4"
                         remux_start = time.time()
-                        import subprocess
-                        result = subprocess.run(
-                            [ffmpeg_path, '-y', '-i', temp_path, '-c', 'copy', '-movflags', '+faststart', remuxed_path],
-                            stdout=subprocess.PIPE, stderr=subprocess.PIPE
-                        )
-                        if result.returncode == 0 and os.path.exists(remuxed_path) and os.path.getsize(remuxed_path) > 0:
+                        from plugins.ffmpeg_runner import ffmpeg_runner
+                        if await ffmpeg_runner.remux_faststart(temp_path, remuxed_path):
                             remux_time = time.time() - remux_start
                             stream_utils_logger.info(f"🎞️ Remuxed to faststart in {remux_time:.2f}s")
                             upload_source_path = remuxed_path
@@ -936,12 +832,8 @@ async def direct_youtube_upload(client, chat_id: int, url: str, quality_info: di
                         # Clean up downloaded file
                         cleanup_start = time.time()
                         try:
-                            os.unlink(downloaded_file)
-                            # Also clean up the temp directory if it exists
-                            temp_dir = os.path.dirname(downloaded_file)
-                            if os.path.exists(temp_dir) and os.path.basename(temp_dir).startswith('tmp'):
-                                import shutil
-                                shutil.rmtree(temp_dir, ignore_errors=True)
+                            # فایل و workspace آن (با آزاد شدن رزرو دیسک) توسط downloader حذف می‌شوند
+                            youtube_downloader.cleanup(downloaded_file)
                             cleanup_time = time.time() - cleanup_start
                             stream_utils_logger.info(f"🧹 Fallback cleanup completed in {cleanup_time:.3f}s")
                         except Exception as cleanup_err:
@@ -974,80 +866,94 @@ async def concurrent_download_upload(client, chat_id: int, download_url: str, fi
     """
     دانلود و آپلود همزمان برای حداکثر کارایی
     Downloads and uploads simultaneously using streaming
+
+    اگر سرور Content-Length بدهد، داده از طریق PipeBuffer مستقیماً قطعه‌به‌قطعه
+    به تلگرام آپلود می‌شود (بدون فایل موقت). در غیر این صورت فایل ابتدا
+    روی دیسک دانلود و سپس آپلود می‌شود.
     """
     logger = get_logger('stream_utils')
     performance_logger = get_performance_logger()
     
     start_time = time.time()
+    temp_path = None
+    download_task = None
     
     try:
-        # ایجاد یک فایل موقت برای streaming
+        # مسیر موقت فقط برای حالت fallback (اندازه نامشخص) استفاده می‌شود
         with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file_name)[1]) as temp_file:
             temp_path = temp_file.name
+        
+        pipe = PipeBuffer(file_name)
+        download_task = asyncio.create_task(
+            _stream_download_to_file(download_url, temp_path, progress_callback, chunk_size, pipe=pipe)
+        )
+        
+        total_size = await pipe.wait_for_size()
+        
+        if total_size:
+            # ⚡ Fast path: آپلود همزمان از روی stream
+            logger.info(f"Pipe-through upload: {file_name} ({total_size / (1024*1024):.2f}MB)")
             
-            # شروع دانلود در background
-            download_task = asyncio.create_task(
-                _stream_download_to_file(download_url, temp_path, progress_callback, chunk_size)
-            )
+            async def read_part(index: int) -> bytes:
+                return await pipe.read(PART_SIZE)
+            
+            try:
+                input_file = await upload_parts(client, read_part, total_size, file_name)
+            except Exception:
+                await pipe.abort()
+                raise
             
-            # صبر کردن تا حداقل 5MB دانلود شود قبل شروع آپلود
-            await asyncio.sleep(2)  # 2 ثانیه صبر برای شروع دانلود
+            download_result = await download_task
+            if not download_result.get("success"):
+                raise IOError(download_result.get("error", "download failed"))
             
-            # بررسی اینکه آیا فایل شروع به دانلود شده
-            while not os.path.exists(temp_path) or os.path.getsize(temp_path) < 1024*1024:  # 1MB
-                if download_task.done():
-                    break
-                await asyncio.sleep(0.5)
+            upload_result = await send_uploaded_file(
+                client, chat_id, input_file, file_name, media_type, **kwargs
+            )
+            performance_logger.info(
+                f"Pipe buffer stats: in={pipe.bytes_in} out={pipe.bytes_out} "
+                f"backpressure_waits={pipe.producer_waits}"
+            )
+        else:
+            # 💾 Fallback: اندازه نامشخص → دانلود کامل روی دیسک، سپس آپلود
+            logger.info(f"Unknown content length, downloading to disk first: {file_name}")
+            download_result = await download_task
+            if not download_result.get("success"):
+                raise IOError(download_result.get("error", "download failed"))
             
-            # شروع آپلود همزمان با دانلود با throttling
             upload_kwargs = kwargs.copy()
             if progress_callback:
                 upload_kwargs['progress'] = progress_callback
             
-            # 🔥 حذف throttling برای سرعت بالا
-            
-            # تعریف تابع آپلود بدون تأخیر
-            async def perform_concurrent_upload():
-                if media_type == "video":
-                    return await client.send_video(chat_id=chat_id, video=temp_path, **upload_kwargs)
-                elif media_type == "audio":
-                    return await client.send_audio(chat_id=chat_id, audio=temp_path, **upload_kwargs)
-                else:
-                    return await client.send_document(chat_id=chat_id, document=temp_path, **upload_kwargs)
-            
-            # آپلود مستقیم بدون retry اضافی
-            upload_task = asyncio.create_task(perform_concurrent_upload())
-            
-            # انتظار برای تکمیل هر دو عملیات
-            download_result, upload_result = await asyncio.gather(
-                download_task, upload_task, return_exceptions=True
-            )
-            
-            # بررسی نتایج
-            if isinstance(download_result, Exception):
-                raise download_result
-            if isinstance(upload_result, Exception):
-                raise upload_result
-                
-            total_time = time.time() - start_time
-            performance_logger.info(f"Concurrent download/upload completed in {total_time:.2f}s")
-            
-            # حذف فایل موقت
-            try:
-                os.unlink(temp_path)
-            except:
-                pass
-                
-            return {
-                "success": True,
-                "message": upload_result,
-                "download_time": download_result.get("time", 0),
-                "total_time": total_time
-            }
+            if media_type == "video":
+                upload_result = await client.send_video(chat_id=chat_id, video=temp_path, **upload_kwargs)
+            elif media_type == "audio":
+                upload_result = await client.send_audio(chat_id=chat_id, audio=temp_path, **upload_kwargs)
+            else:
+                upload_result = await client.send_document(chat_id=chat_id, document=temp_path, **upload_kwargs)
+        
+        total_time = time.time() - start_time
+        performance_logger.info(f"Concurrent download/upload completed in {total_time:.2f}s")
+        
+        return {
+            "success": True,
+            "message": upload_result,
+            "download_time": download_result.get("time", 0),
+            "total_time": total_time
+        }
             
     except Exception as e:
         logger.error(f"Concurrent download/upload failed: {e}")
+        if download_task and not download_task.done():
+            download_task.cancel()
         return {"success": False, "error": str(e)}
+    finally:
+        # حذف فایل موقت
+        if temp_path:
+            try:
+                os.unlink(temp_path)
+            except Exception:
+                pass
 
 
 async def fast_upload_video(client, chat_id: int, file_path: str, caption: str = "", **kwargs) -> bool:
@@ -1078,45 +984,82 @@ async def fast_upload_video(client, chat_id: int, file_path: str, caption: str =
         return False
 
 
-async def _stream_download_to_file(url: str, file_path: str, progress_callback=None, chunk_size: int = 1024*1024) -> dict:
+async def _stream_download_to_file(url: str, file_path: str, progress_callback=None,
+                                  chunk_size: int = 1024*1024, pipe: Optional[PipeBuffer] = None) -> dict:
     """
     دانلود streaming به فایل با progress callback
+
+    اگر pipe داده شود و Content-Length مشخص باشد، داده به جای فایل در pipe نوشته می‌شود
+    (producer برای آپلود همزمان). در غیر این صورت به file_path نوشته می‌شود.
     """
     start_time = time.time()
     downloaded_size = 0
+    headers = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+    }
     
     try:
-        async with aiohttp.ClientSession(
-            timeout=aiohttp.ClientTimeout(total=3600, connect=30),
-            connector=aiohttp.TCPConnector(limit=10, limit_per_host=5)
-        ) as session:
-            async with session.get(url, headers={
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-            }) as response:
-                response.raise_for_status()
-                
-                total_size = int(response.headers.get('content-length', 0))
-                
-                with open(file_path, 'wb') as f:
-                    async for chunk in response.content.iter_chunked(chunk_size):
-                        f.write(chunk)
-                        downloaded_size += len(chunk)
-                        
-                        # فراخوانی progress callback
-                        if progress_callback and total_size > 0:
-                            progress = (downloaded_size / total_size) * 100
-                            try:
-                                await progress_callback(downloaded_size, total_size)
-                            except:
-                                pass  # ignore callback errors
-                
+        # بدون pipe: فایل‌های بزرگ با چند اتصال Range (در صورت پشتیبانی سرور)
+        if pipe is None:
+            segmented_size = await segmented_downloader.download(
+                url, file_path, headers=headers, progress_callback=progress_callback
+            )
+            if segmented_size:
                 download_time = time.time() - start_time
                 return {
                     "success": True,
-                    "size": downloaded_size,
+                    "size": segmented_size,
                     "time": download_time,
-                    "speed_mbps": (downloaded_size / (1024*1024)) / download_time if download_time > 0 else 0
+                    "speed_mbps": (segmented_size / (1024*1024)) / download_time if download_time > 0 else 0
                 }
-                
+        
+        session = http_client.session()
+        async with session.get(url, headers=headers,
+                               timeout=aiohttp.ClientTimeout(total=3600, connect=30)) as response:
+            response.raise_for_status()
+            
+            total_size = int(response.headers.get('content-length', 0))
+            # فشرده‌سازی در انتقال یعنی Content-Length با اندازه واقعی برابر نیست
+            if response.headers.get('content-encoding', 'identity') not in ('', 'identity'):
+                total_size = 0
+            
+            use_pipe = pipe is not None and total_size > 0
+            if pipe is not None:
+                pipe.set_total_size(total_size if use_pipe else None)
+            
+            f = None if use_pipe else open(file_path, 'wb')
+            try:
+                async for chunk in response.content.iter_chunked(chunk_size):
+                    if use_pipe:
+                        await pipe.write(chunk)
+                    else:
+                        f.write(chunk)
+                    downloaded_size += len(chunk)
+                    
+                    # فراخوانی progress callback
+                    if progress_callback and total_size > 0:
+                        try:
+                            await progress_callback(downloaded_size, total_size)
+                        except:
+                            pass  # ignore callback errors
+            finally:
+                if f:
+                    f.close()
+            
+            if use_pipe:
+                if downloaded_size != total_size:
+                    raise IOError(f"Incomplete download: {downloaded_size}/{total_size} bytes")
+                await pipe.close()
+            
+            download_time = time.time() - start_time
+            return {
+                "success": True,
+                "size": downloaded_size,
+                "time": download_time,
+                "speed_mbps": (downloaded_size / (1024*1024)) / download_time if download_time > 0 else 0
+            }
+            
     except Exception as e:
-        return {"success": False, "error": str(e)}
\ No newline at end of file
+        if pipe is not None:
+            await pipe.close(e)
+        return {"success": False, "error": str(e)}
@@ -0,0 +1,220 @@
+"""
+Transcode Policy - انتخاب stream copy / remux / transcode بر اساس codec
+قبلاً هر درخواست صوتی با FFmpegExtractAudio به mp3 192k تبدیل می‌شد و هر merge ویدیو
+با '-c:a aac -b:a 128k' صدا را دوباره encode می‌کرد، حتی وقتی منبع از قبل m4a/AAC بود.
+
+- صوت: AAC (m4a) و mp3 همان‌طور آپلود می‌شوند، opus فقط به ogg منتقل می‌شود (copy)؛
+  بقیه codec ها به mp3 تبدیل می‌شوند
+- ویدیو: merge بدون encode (کپی stream ها)؛ فقط اگر صدای منبع در MP4 قابل پخش نباشد
+  صدا به AAC تبدیل می‌شود
+- codec از info dict yt-dlp خوانده می‌شود و در نبود آن از ffprobe (media_probe)
+- CPU-seconds صرفه‌جویی‌شده هر job تخمین زده می‌شود؛ هزینه واقعی transcode ها با
+  -benchmark ffmpeg اندازه‌گیری و برای تخمین به‌روز می‌شود
+"""
+
+import os
+import re
+from typing import Dict, Optional
+
+from plugins.logger_config import get_logger, get_performance_logger
+from plugins.ffmpeg_runner import ffmpeg_runner
+from plugins.media_probe import media_probe
+
+try:
+    from config import TRANSCODE_PASSTHROUGH, TRANSCODE_AUDIO_BITRATE, TRANSCODE_MERGE_AUDIO_BITRATE
+except Exception:
+    TRANSCODE_PASSTHROUGH = True
+    TRANSCODE_AUDIO_BITRATE = '192k'
+    TRANSCODE_MERGE_AUDIO_BITRATE = '128k'
+
+logger = get_logger('transcode_policy')
+performance_logger = get_performance_logger()
+
+# انتخاب فرمت صوتی: m4a (AAC) اول تا نیازی به تبدیل نباشد
+AUDIO_FORMAT = 'bestaudio[ext=m4a]/bestaudio/best'
+AUDIO_FALLBACK_FORMATS = ['bestaudio/best', 'best']
+
+# codec صوتی → پسوندی که تلگرام مستقیم پخش می‌کند (فقط جابجایی container)
+AUDIO_PASSTHROUGH = {'aac': 'm4a', 'mp3': 'mp3', 'opus': 'ogg'}
+# codec های صوتی قابل پخش داخل MP4 در کلاینت‌های تلگرام
+MP4_AUDIO_CODECS = ('aac', 'mp3')
+
+# CPU-seconds به ازای هر ثانیه رسانه (مقدار اولیه؛ با اندازه‌گیری واقعی به‌روز می‌شود)
+DEFAULT_CPU_COST = {'audio_mp3': 0.02, 'audio_aac': 0.015}
+COST_EWMA = 0.2
+
+_BENCH_RE = re.compile(r'utime=([\d.]+)s\s+stime=([\d.]+)s')
+
+
+def codec_family(codec: Optional[str]) -> Optional[str]:
+    """نام کلی codec (mp4a.40.2 → aac، opus، mp3، ...)؛ None یعنی نامعلوم یا بدون stream"""
+    codec = (codec or '').lower()
+    if not codec or codec == 'none':
+        return None
+    if codec in ('mp3', 'mp3float', 'mp4a.40.34', 'mp4a.6b'):
+        return 'mp3'
+    if codec.startswith('mp4a') or codec == 'aac':
+        return 'aac'
+    return codec.split('.')[0]
+
+
+def _bench_cpu(stderr_tail: str) -> float:
+    """utime+stime از خروجی -benchmark ffmpeg"""
+    match = _BENCH_RE.search(stderr_tail or '')
+    if not match:
+        return 0.0
+    return float(match.group(1)) + float(match.group(2))
+
+
+def downloaded_path(info: Optional[dict], fallback: Optional[str] = None) -> Optional[str]:
+    """مسیر نهایی فایل از info dict بعد از دانلود yt-dlp"""
+    for item in reversed((info or {}).get('requested_downloads') or []):
+        path = item.get('filepath')
+        if path and os.path.exists(path):
+            return path
+    return fallback
+
+
+class TranscodePolicy:
+    """تصمیم copy/remux/transcode برای خروجی دانلودها + آمار CPU صرفه‌جویی‌شده"""
+
+    def __init__(self, passthrough: bool = TRANSCODE_PASSTHROUGH):
+        self.passthrough = passthrough
+        self.cpu_cost: Dict[str, float] = dict(DEFAULT_CPU_COST)
+        self.stats = {
+            'jobs': 0,
+            'copy': 0,
+            'remux': 0,
+            'transcode': 0,
+            'cpu_spent': 0.0,
+            'cpu_saved': 0.0,
+        }
+        logger.info(f"✅ TranscodePolicy initialized (passthrough={passthrough})")
+
+    # ---------------------------------------------------------------- #
+
+    async def _codecs(self, path: str, info: Optional[dict]) -> dict:
+        info = info or {}
+        acodec, vcodec = info.get('acodec'), info.get('vcodec')
+        if acodec is None and vcodec is None:
+            probed = await media_probe.probe(path)
+            return {
+                'audio': codec_family(probed.get('audio_codec')),
+                'video': codec_family(probed.get('video_codec')),
+                'duration': probed.get('duration') or 0,
+            }
+        return {
+            'audio': codec_family(acodec),
+            'video': codec_family(vcodec),
+            'duration': info.get('duration') or 0,
+        }
+
+    def _record(self, job: str, decision: str, codec: Optional[str], duration: float,
+                saved_kind: Optional[str] = None, cpu_spent: float = 0.0, spent_kind: Optional[str] = None):
+        self.stats['jobs'] += 1
+        self.stats[decision] += 1
+        saved = 0.0
+        if saved_kind and duration:
+            saved = duration * self.cpu_cost[saved_kind]
+            self.stats['cpu_saved'] += saved
+        if cpu_spent:
+            self.stats['cpu_spent'] += cpu_spent
+            if spent_kind and duration:
+                cost = cpu_spent / duration
+                self.cpu_cost[spent_kind] += COST_EWMA * (cost - self.cpu_cost[spent_kind])
+        performance_logger.info(
+            f"[TRANSCODE] {job}: {decision} (audio={codec or '-'}, {duration:.0f}s) "
+            f"cpu spent {cpu_spent:.2f}s, saved ~{saved:.2f}s"
+        )
+
+    async def _ffmpeg(self, args: list, kind: str, dst: str) -> Optional[float]:
+        """اجرای ffmpeg؛ CPU-seconds مصرف‌شده یا None در صورت شکست"""
+        returncode, tail = await ffmpeg_runner.run(['-benchmark', *args], kind=kind, output_path=dst)
+        if returncode != 0 or not os.path.exists(dst) or os.path.getsize(dst) == 0:
+            return None
+        return _bench_cpu(tail)
+
+    @staticmethod
+    def _replace(src: str, dst: str) -> str:
+        if os.path.abspath(src) != os.path.abspath(dst):
+            try:
+                os.unlink(src)
+            except OSError:
+                pass
+        return dst
+
+    # ---------------------------------------------------------------- #
+
+    async def finalize_audio(self, path: str, info: Optional[dict] = None, job: str = 'audio') -> Optional[str]:
+        """
+        فایل صوتی قابل ارسال به تلگرام: copy اگر codec و container مناسب باشند،
+        remux (بدون encode) اگر فقط container عوض شود، در غیر این صورت تبدیل به mp3
+        """
+        codecs = await self._codecs(path, info)
+        codec, duration = codecs['audio'], codecs['duration']
+        stem, ext = os.path.splitext(path)
+        ext = ext.lstrip('.').lower()
+
+        target_ext = AUDIO_PASSTHROUGH.get(codec) if self.passthrough else ('mp3' if codec == 'mp3' else None)
+        if target_ext:
+            if ext == target_ext:
+                self._record(job, 'copy', codec, duration, saved_kind='audio_mp3')
+                return path
+            dst = f"{stem}.{target_ext}"
+            cpu = await self._ffmpeg(['-y', '-i', path, '-vn', '-c:a', 'copy', dst], 'remux_audio', dst)
+            if cpu is not None:
+                self._record(job, 'remux', codec, duration, saved_kind='audio_mp3', cpu_spent=cpu)
+                return self._replace(path, dst)
+            logger.warning(f"⚠️ Audio remux failed ({codec} → {target_ext}), transcoding instead")
+
+        dst = f"{stem}.mp3" if ext != 'mp3' else f"{stem}.transcoded.mp3"
+        cpu = await self._ffmpeg(
+            ['-y', '-i', path, '-vn', '-c:a', 'libmp3lame', '-b:a', TRANSCODE_AUDIO_BITRATE, dst],
+            'transcode_audio', dst
+        )
+        if cpu is None:
+            return None
+        self._record(job, 'transcode', codec, duration, cpu_spent=cpu, spent_kind='audio_mp3')
+        return self._replace(path, dst)
+
+    async def finalize_video(self, path: str, info: Optional[dict] = None, job: str = 'video') -> Optional[str]:
+        """
+        ویدیوی merge شده بدون encode صدا؛ فقط codec صوتی ناسازگار با MP4 به AAC تبدیل می‌شود
+        (merge قبلی همیشه '-c:a aac' اجرا می‌کرد؛ صرفه‌جویی فقط برای فایل‌های merge شده حساب می‌شود)
+        """
+        codecs = await self._codecs(path, info)
+        codec, duration = codecs['audio'], codecs['duration']
+        merged = len((info or {}).get('requested_formats') or []) > 1
+
+        if codec is None or (self.passthrough and codec in MP4_AUDIO_CODECS):
+            self._record(job, 'copy', codec, duration, saved_kind='audio_aac' if merged and codec else None)
+            return path
+
+        stem, ext = os.path.splitext(path)
+        dst = f"{stem}.aac{ext or '.mp4'}"
+        cpu = await self._ffmpeg(
+            ['-y', '-i', path, '-map', '0', '-c:v', 'copy', '-c:a', 'aac',
+             '-b:a', TRANSCODE_MERGE_AUDIO_BITRATE, '-movflags', '+faststart', dst],
+            'transcode_merge_audio', dst
+        )
+        if cpu is None:
+            # ویدیو همچنان قابل ارسال است (ممکن است در بعضی کلاینت‌ها صدا پخش نشود)
+            logger.warning(f"⚠️ Audio transcode failed for {os.path.basename(path)}, sending as is")
+            self._record(job, 'copy', codec, duration)
+            return path
+        self._record(job, 'transcode', codec, duration, cpu_spent=cpu, spent_kind='audio_aac')
+        os.replace(dst, path)
+        return path
+
+    def get_stats(self) -> dict:
+        jobs = self.stats['jobs']
+        return {
+            **self.stats,
+            'passthrough': self.passthrough,
+            'copy_rate': ((self.stats['copy'] + self.stats['remux']) / jobs * 100) if jobs else 0.0,
+            'cpu_cost': dict(self.cpu_cost),
+        }
+
+
+# 🔥 Global instance
+transcode_policy = TranscodePolicy()
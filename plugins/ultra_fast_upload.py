@@ -95,25 +95,44 @@ async def chunked_upload(client: Client, chat_id: int, file_path: str,
         if 'reply_to_message_id' in kwargs:
             upload_kwargs['reply_to_message_id'] = kwargs['reply_to_message_id']
         
-        # آپلود با تنظیمات بهینه
-        if media_type == "video":
-            message = await client.send_video(
-                chat_id=chat_id,
-                video=file_path,
-                **upload_kwargs
+        # ⚡ ارسال همزمان قطعات روی چند اتصال؛ فقط خطای آپلود قطعات به مسیر عادی Pyrogram می‌رود
+        from plugins.part_uploader import upload_file_parts, send_uploaded_file
+        input_file = None
+        try:
+            input_file = await upload_file_parts(
+                client, file_path, upload_kwargs['file_name'], progress=progress_callback
             )
-        elif media_type == "audio":
-            message = await client.send_audio(
-                chat_id=chat_id,
-                audio=file_path,
-                **upload_kwargs
+        except Exception as e:
+            logger.warning(f"⚠️ Parallel part upload failed, falling back: {e}")
+        
+        if input_file is not None:
+            # نتیجه None یعنی پیام ارسال شده (فقط Message در دسترس نیست)
+            await send_uploaded_file(
+                client, chat_id, input_file, upload_kwargs['file_name'], media_type,
+                caption=caption,
+                reply_to_message_id=kwargs.get('reply_to_message_id'),
+                disable_notification=True
             )
         else:
-            message = await client.send_document(
-                chat_id=chat_id,
-                document=file_path,
-                **upload_kwargs
-            )
+            # آپلود با تنظیمات بهینه (fallback)
+            if media_type == "video":
+                await client.send_video(
+                    chat_id=chat_id,
+                    video=file_path,
+                    **upload_kwargs
+                )
+            elif media_type == "audio":
+                await client.send_audio(
+                    chat_id=chat_id,
+                    audio=file_path,
+                    **upload_kwargs
+                )
+            else:
+                await client.send_document(
+                    chat_id=chat_id,
+                    document=file_path,
+                    **upload_kwargs
+                )
         
         upload_time = time.time() - start_time
         speed_mbps = (file_size / (1024*1024)) / upload_time if upload_time > 0 else 0
@@ -1,6 +1,6 @@
 # ✅ Removed duplicate import random
 import asyncio
-import http.client
+import aiohttp
 import json
 import os
 import re
@@ -8,15 +8,12 @@ import random
 import logging
 import requests
 import time
-import subprocess
-import shutil
 from datetime import datetime as _dt
-from collections import deque
 from PIL import Image
 from pyrogram import Client
 from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, InputMediaPhoto, InputMediaVideo
 from pyrogram.errors import FloodWait
-from config import BOT_TOKEN, RAPIDAPI_KEY, RAPIDAPI_RATE_LIMIT, RAPIDAPI_RATE_WINDOW
+from config import BOT_TOKEN
 from plugins.start import (
     SPOTIFY_REGEX, TIKTOK_REGEX, SOUNDCLOUD_REGEX,
     PINTEREST_REGEX, TWITTER_REGEX, THREADS_REGEX, FACEBOOK_REGEX,
@@ -29,8 +26,16 @@ from plugins.stream_utils import download_to_memory_stream, smart_upload_strateg
 from plugins.db_wrapper import DB
 from plugins import constant
 from plugins.caption_builder import build_caption
-from plugins.concurrency import acquire_slot, release_slot, get_queue_stats, reserve_user, release_user, get_user_active
+from plugins.job_cost import job_cost_model, media_size
+from plugins.pipeline_stages import upload_pool
+from plugins.concurrency import acquire_slot, release_slot, get_queue_stats, reserve_user, release_user, get_user_active, gather_items
 from plugins.circuit_breaker import get_instagram_breaker, CircuitBreakerOpenError
+from plugins.delivery_cache import delivery_cache, canonical_media_id
+from plugins.single_flight import SingleFlight
+from plugins.http_client import headers_for, http_client
+from plugins.rapidapi_client import rapidapi_client, rapidapi_limiter, RapidAPIQuotaExceeded
+from plugins.api_cache import api_cache, is_permanent_error
+from plugins.media_probe import media_probe
 
 # ============================================================
 # PHASE 1 SECURITY FIX: ADMIN IDS FROM CONFIG
@@ -64,67 +69,8 @@ _global_executor = concurrent.futures.ThreadPoolExecutor(max_workers=6, thread_n
 # ============================================================
 # PHASE 1 SECURITY FIX: RAPIDAPI RATE LIMITER
 # ============================================================
-class RapidAPIRateLimiter:
-    """
-    Simple rate limiter for RapidAPI calls to prevent quota exhaustion.
-    Uses a sliding window algorithm to track requests.
-    """
-    def __init__(self, max_requests: int = RAPIDAPI_RATE_LIMIT, window_seconds: int = RAPIDAPI_RATE_WINDOW):
-        self.max_requests = max_requests
-        self.window_seconds = window_seconds
-        self.requests = deque()  # (timestamp, success)
-        self._lock = asyncio.Lock()
-        universal_logger.info(f"✅ RapidAPI Rate Limiter initialized: {max_requests} req/{window_seconds}s")
-    
-    async def acquire(self) -> bool:
-        """
-        Try to acquire permission to make an API call.
-        Returns True if allowed, False if rate limit exceeded.
-        """
-        async with self._lock:
-            now = time.time()
-            
-            # Remove old requests outside the window
-            while self.requests and self.requests[0][0] < now - self.window_seconds:
-                self.requests.popleft()
-            
-            # Check if we're at the limit
-            if len(self.requests) >= self.max_requests:
-                oldest = self.requests[0][0]
-                wait_time = self.window_seconds - (now - oldest)
-                universal_logger.warning(f"⏱ Rate limit reached. Need to wait {wait_time:.1f}s")
-                return False
-            
-            # Add this request
-            self.requests.append((now, True))
-            universal_logger.debug(f"✅ API call allowed ({len(self.requests)}/{self.max_requests})")
-            return True
-    
-    async def wait_if_needed(self):
-        """
-        Wait until we can make an API call (blocking version).
-        """
-        while not await self.acquire():
-            now = time.time()
-            oldest = self.requests[0][0] if self.requests else now
-            wait_time = max(1, self.window_seconds - (now - oldest))
-            universal_logger.info(f"⏱ Rate limit: waiting {wait_time:.1f}s...")
-            await asyncio.sleep(wait_time)
-    
-    def get_stats(self) -> dict:
-        """Get current rate limiter statistics."""
-        now = time.time()
-        # Count recent requests
-        recent = [r for r in self.requests if r[0] > now - self.window_seconds]
-        return {
-            'current': len(recent),
-            'limit': self.max_requests,
-            'window': self.window_seconds,
-            'available': self.max_requests - len(recent)
-        }
-
-# Global rate limiter instance
-_api_rate_limiter = RapidAPIRateLimiter()
+# Global rate limiter instance (shared with insta_fetch through rapidapi_client)
+_api_rate_limiter = rapidapi_limiter
 
 
 # Simple helper to log to file and console
@@ -495,21 +441,51 @@ async def expand_short_url(url: str) -> str:
         universal_logger.error(f"Error expanding URL {url}: {e}")
         return url
 
-async def get_universal_data_from_api(url):
+# 🔀 Single-flight: درخواست‌های همزمان برای یک لینک فقط یک API call مصرف می‌کنند
+_api_flight = SingleFlight('universal_api')
+
+
+async def get_universal_data_from_api(url, fresh: bool = False):
+    """
+    Get media data from the universal API (identical concurrent requests share one call)
+    پاسخ‌ها در api_cache نگه داشته می‌شوند؛ fresh=True کش را دور می‌زند (مثلاً بعد از 403 روی لینک CDN)
+    """
+    cache_platform = get_platform_name(url).lower()
+    if fresh:
+        api_cache.invalidate(cache_platform, url)
+    else:
+        cached = api_cache.get(cache_platform, url)
+        if cached is not None:
+            _log(f"[UNIV] API cache {'negative ' if cached['negative'] else ''}hit for {cache_platform}")
+            return cached['data']
+
+    key = url.strip().split('#')[0]
+    result = await _api_flight.do(key, _fetch_universal_data, url, copy_result=True)
+
+    if isinstance(result, dict):
+        if result.get("error"):
+            data = result.get("data")
+            if is_permanent_error(f"{result.get('message', '')} {data.get('message', '') if isinstance(data, dict) else ''}"):
+                api_cache.put_negative(cache_platform, url, result)
+        elif result.get("medias"):
+            api_cache.put(cache_platform, url, result)
+    return result
+
+
+async def _fetch_universal_data(url):
     """Get media data from the universal API for Spotify, TikTok, and SoundCloud with timeout and rate limiting"""
     try:
         # Phase 1 Security Fix: Check rate limit before API call
         stats = _api_rate_limiter.get_stats()
         _log(f"[RATE LIMIT] Current: {stats['current']}/{stats['limit']} (Available: {stats['available']})")
         
-        # Wait if rate limit is reached (non-blocking)
-        await _api_rate_limiter.wait_if_needed()
-        
         # Expand short URLs before sending to API
         expanded_url = await expand_short_url(url)
         
         # افزایش timeout برای Instagram (API کند است)
-        result = await asyncio.wait_for(_api_request_sync(expanded_url), timeout=15.0)
+        # rate limiter داخل rapidapi_client اعمال می‌شود (بر اساس سهمیه واقعی provider)؛
+        # timeout فقط روی خود درخواست HTTP است تا انتظار سهمیه (تا MAX_QUOTA_WAIT) timeout حساب نشود
+        result = await _api_request(expanded_url, timeout=15.0)
         
         # Log rate limiter stats after successful call
         stats = _api_rate_limiter.get_stats()
@@ -519,149 +495,31 @@ async def get_universal_data_from_api(url):
     except asyncio.TimeoutError:
         universal_logger.warning(f"API timeout for URL: {url}")
         return {"error": True, "message": "timeout", "data": {}}
+    except RapidAPIQuotaExceeded as e:
+        universal_logger.warning(f"API quota exhausted for URL {url}: {e}")
+        return {"error": True, "message": "rate limit exceeded", "data": {}}
     except Exception as e:
         universal_logger.error(f"API Error for URL {url}: {e}")
         return {"error": True, "message": str(e), "data": {}}
 
-def _api_request_sync(url):
-    """Synchronous API request wrapped for async execution"""
-    def _make_request():
-        try:
-            # افزایش timeout برای Instagram
-            conn = http.client.HTTPSConnection("social-download-all-in-one.p.rapidapi.com", timeout=12.0)
-            
-            payload = json.dumps({"url": url})
-            
-            headers = {
-                'x-rapidapi-key': RAPIDAPI_KEY,
-                'x-rapidapi-host': "social-download-all-in-one.p.rapidapi.com",
-                'Content-Type': "application/json"
-            }
-            
-            conn.request("POST", "/v1/social/autolink", payload, headers)
-            res = conn.getresponse()
-            data = res.read()
-            
-            conn.close()
-            
-            response_data = json.loads(data.decode("utf-8"))
-            universal_logger.info(f"API Response received for URL: {url}")
-            return response_data
-        except Exception as e:
-            universal_logger.error(f"API request failed for URL {url}: {e}")
-            return {"error": True, "message": f"network error: {str(e)}", "data": {}}
-    
-    # ✅ Use global executor instead of creating new one each time
-    loop = asyncio.get_event_loop()
-    return loop.run_in_executor(_global_executor, _make_request)
+async def _api_request(url, timeout: float = 12.0):
+    """Async API request over the shared keep-alive session"""
+    try:
+        response_data = await rapidapi_client.autolink(url, timeout=timeout)
+        universal_logger.info(f"API Response received for URL: {url}")
+        return response_data
+    except (asyncio.TimeoutError, RapidAPIQuotaExceeded):
+        raise
+    except Exception as e:
+        universal_logger.error(f"API request failed for URL {url}: {e}")
+        return {"error": True, "message": f"network error: {str(e)}", "data": {}}
 
-async def _extract_video_metadata(video_path: str):
+async def _extract_video_metadata(video_path: str, known: dict = None):
     """Extract basic metadata and a small thumbnail for Telegram.
-    Uses ffprobe/ffmpeg when available; keeps lightweight and skips for large files."""
+    Delegates to media_probe (async ffprobe/ffmpeg with a cache); ffprobe is skipped
+    when width/height/duration are already known from the API response."""
     try:
-        if not video_path or not os.path.exists(video_path):
-            return {'width': 0, 'height': 0, 'duration': 0, 'thumbnail': None}
-        
-        # Proceed to metadata extraction without size-based skipping
-        
-        # Locate ffprobe/ffmpeg
-        ffmpeg_path = os.environ.get('FFMPEG_PATH')
-        if not ffmpeg_path:
-            try:
-                from config import FFMPEG_PATH as CFG_FFMPEG
-                ffmpeg_path = CFG_FFMPEG
-            except Exception:
-                ffmpeg_path = None
-        
-        ffprobe_path = None
-        ffmpeg_exe = None
-        if ffmpeg_path and os.path.exists(ffmpeg_path):
-            ffmpeg_exe = ffmpeg_path
-            base_dir = os.path.dirname(ffmpeg_path)
-            if os.name == 'nt':
-                cand = os.path.join(base_dir, 'ffprobe.exe')
-            else:
-                cand = os.path.join(base_dir, 'ffprobe')
-            if os.path.exists(cand):
-                ffprobe_path = cand
-        if not ffprobe_path:
-            ffprobe_path = shutil.which('ffprobe') or 'ffprobe'
-        if not ffmpeg_exe:
-            ffmpeg_exe = shutil.which('ffmpeg') or 'ffmpeg'
-        
-        width = 0
-        height = 0
-        duration = 0
-        thumb_path = None
-        
-        # Probe streams and format (PHASE 2 FIX: async subprocess)
-        try:
-            cmd = [ffprobe_path, '-v', 'error', '-print_format', 'json', '-show_streams', '-show_format', video_path]
-            # Use async subprocess instead of blocking subprocess.run
-            proc = await asyncio.create_subprocess_exec(
-                *cmd,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-            stdout, stderr = await proc.communicate()
-            
-            if proc.returncode == 0 and stdout:
-                data = json.loads(stdout.decode('utf-8', errors='ignore'))
-                # Duration from format
-                fmt = data.get('format') or {}
-                try:
-                    duration = int(float(fmt.get('duration', 0)))
-                except Exception:
-                    duration = 0
-                # Width/height from first video stream
-                for s in data.get('streams', []):
-                    if s.get('codec_type') == 'video':
-                        width = int(s.get('width') or 0)
-                        height = int(s.get('height') or 0)
-                        break
-        except Exception:
-            pass
-        
-        # Generate small Telegram-friendly thumbnail (بهینه‌سازی شده)
-        try:
-            # Only if ffmpeg is available
-            if ffmpeg_exe and isinstance(ffmpeg_exe, str):
-                thumb_path = video_path.rsplit('.', 1)[0] + '_thumb.jpg'
-                
-                # بررسی اینکه آیا thumbnail قبلاً وجود دارد
-                if os.path.exists(thumb_path) and os.path.getsize(thumb_path) > 0:
-                    pass  # از thumbnail موجود استفاده کن
-                else:
-                    # PHASE 2 FIX: Use async subprocess instead of blocking subprocess.run
-                    cmd = [ffmpeg_exe, '-y', '-ss', '1', '-i', video_path, '-vframes', '1', 
-                          '-vf', 'scale=320:-2', '-q:v', '5', '-f', 'image2', thumb_path]
-                    try:
-                        # Run ffmpeg as async subprocess to avoid blocking
-                        proc = await asyncio.create_subprocess_exec(
-                            *cmd,
-                            stdout=asyncio.subprocess.DEVNULL,
-                            stderr=asyncio.subprocess.DEVNULL
-                        )
-                        try:
-                            await asyncio.wait_for(proc.wait(), timeout=6)
-                        except asyncio.TimeoutError:
-                            proc.kill()
-                            await proc.wait()
-                            thumb_path = None
-                    except Exception:
-                        thumb_path = None
-                    
-                    if not os.path.exists(thumb_path) or os.path.getsize(thumb_path) == 0:
-                        thumb_path = None
-        except Exception:
-            thumb_path = None
-        
-        return {
-            'width': width or None,
-            'height': height or None,
-            'duration': duration or 0,
-            'thumbnail': thumb_path
-        }
+        return await media_probe.video_metadata(video_path, known)
     except Exception:
         return {'width': 0, 'height': 0, 'duration': 0, 'thumbnail': None}
 
@@ -728,6 +586,7 @@ async def handle_universal_link(client: Client, message: Message, is_retry: bool
     """Handle downloads for Spotify, TikTok, and SoundCloud links"""
     # ✅ Initialize resource tracking variables at the start
     slot_acquired = False
+    upload_started = None  # زمان گرفتن slot آپلود (upload_pool)
     user_reserved = False
     status_msg = None
     user_id = None
@@ -739,6 +598,8 @@ async def handle_universal_link(client: Client, message: Message, is_retry: bool
         
         # Phase 1 Security Fix: Use ADMIN list from config instead of hardcoded ID
         is_admin = user_id in ADMIN
+        # lane صف slot ها: تلاش مجدد و ادمین قبل از درخواست‌های عادی
+        slot_lane = 'retry' if is_retry else ('admin' if is_admin else 'normal')
         debug_mode = is_admin
         
         # Check if user is in database
@@ -784,6 +645,29 @@ async def handle_universal_link(client: Client, message: Message, is_retry: bool
         
         # Send initial status message
         status_msg = await message.reply_text(f"🔄 در حال پردازش لینک {platform}...")
+        
+        # ⚡ Delivery cache: اگر این لینک قبلاً ارسال شده، با file_id بفرست (بدون API/دانلود)
+        cache_platform = platform.lower()
+        cache_media_id = canonical_media_id(cache_platform, url)
+        if await delivery_cache.deliver(
+            client,
+            chat_id=message.chat.id,
+            platform=cache_platform,
+            media_id=cache_media_id,
+            reply_to_message_id=message.id
+        ):
+            if request_id:
+                db.update_request_status(
+                    request_id=request_id,
+                    status='success',
+                    processing_time=time.perf_counter() - t0
+                )
+            try:
+                db.increment_request(user_id, _dt.now().isoformat(timespec='seconds'))
+            except Exception:
+                pass
+            _log(f"[UNIV] Delivered from cache in {(time.perf_counter() - t0):.2f}s")
+            return
         slot_acquired = False
         stats = get_queue_stats()
         if stats.get('active') >= stats.get('capacity'):
@@ -1194,7 +1078,10 @@ async def handle_universal_link(client: Client, message: Message, is_retry: bool
 
             # Download file - single status message, no updates during retry
             if not slot_acquired:
-                await acquire_slot()
+                await acquire_slot(
+                    cost=job_cost_model.estimate(platform, media_type, media_size(selected_media), duration_sec),
+                    lane=slot_lane,
+                )
                 slot_acquired = True
             await status_msg.edit_text(f"📥 در حال دانلود از {platform}...")
             t_dl_start = time.perf_counter()
@@ -1245,19 +1132,7 @@ async def handle_universal_link(client: Client, message: Message, is_retry: bool
                 # ساخت headers مخصوص Instagram
                 instagram_headers = None
                 if platform == "Instagram":
-                    instagram_headers = {
-                        'User-Agent': 'Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 Mobile/15E148 Safari/604.1',
-                        'Accept': 'video/webm,video/ogg,video/*;q=0.9,application/ogg;q=0.7,audio/*;q=0.6,*/*;q=0.5',
-                        'Accept-Language': 'en-US,en;q=0.9',
-                        'Accept-Encoding': 'gzip, deflate, br',
-                        'DNT': '1',
-                        'Connection': 'keep-alive',
-                        'Sec-Fetch-Dest': 'video',
-                        'Sec-Fetch-Mode': 'no-cors',
-                        'Sec-Fetch-Site': 'cross-site',
-                        'Referer': 'https://www.instagram.com/',
-                        'Origin': 'https://www.instagram.com'
-                    }
+                    instagram_headers = headers_for(profile='instagram')
                 
                 for attempt in range(max_attempts):
                     try:
@@ -1287,7 +1162,7 @@ async def handle_universal_link(client: Client, message: Message, is_retry: bool
                                 _log(f"[UNIV] 403 detected, trying to refresh URL from API")
                                 try:
                                     # دریافت مجدد از API برای URL تازه
-                                    fresh_data = await get_universal_data_from_api(url)
+                                    fresh_data = await get_universal_data_from_api(url, fresh=True)
                                     if fresh_data and not fresh_data.get('error') and fresh_data.get('medias'):
                                         fresh_medias = fresh_data.get('medias', [])
                                         for m in fresh_medias:
@@ -1356,51 +1231,90 @@ async def handle_universal_link(client: Client, message: Message, is_retry: bool
                 memory_buffer = None  # No memory buffer for file downloads
         else:
             # Album download for Instagram: download all supported medias
+            async def _preflight(idx, media):
+                """Timeout پویا و حجم آیتم: HEAD request برای گرفتن سایز"""
+                murl = media.get("url")
+                if not murl or media.get("type") not in ("image", "photo", "video"):
+                    return 60, 0
+                try:
+                    session = http_client.session()
+                    async with session.head(murl, headers=headers_for(murl), allow_redirects=True,
+                                            timeout=aiohttp.ClientTimeout(total=5)) as head_resp:
+                        content_length = head_resp.headers.get('Content-Length')
+                        if content_length:
+                            size = int(content_length)
+                            # 2 ثانیه به ازای هر MB + 30 ثانیه base
+                            return max(60, int(size / (1024 * 1024) * 2) + 30), size
+                    return 60, media_size(media)
+                except Exception as head_error:
+                    _log(f"[UNIV] Item {idx} HEAD failed, using default timeout: {head_error}")
+                    return 120, media_size(media)  # fallback برای حالتی که HEAD fail بشه
+
+            # ⚡ HEAD همه آیتم‌ها به صورت موازی (قبل از گرفتن slot)
+            preflight = await asyncio.gather(
+                *(_preflight(idx, media) for idx, media in enumerate(medias, start=1))
+            )
+            item_timeouts = [timeout for timeout, _ in preflight]
+            album_size = sum(size for _, size in preflight)
+            _log(f"[UNIV] Album preflight: {len(medias)} items, {album_size / (1024 * 1024):.1f}MB total")
             if not slot_acquired:
-                await acquire_slot()
+                album_cost = sum(
+                    job_cost_model.estimate(platform, m.get('type', 'image'), size)
+                    for m, (_, size) in zip(medias, preflight)
+                )
+                await acquire_slot(cost=album_cost, lane=slot_lane)
                 slot_acquired = True
             await status_msg.edit_text(f"📥 در حال دانلود {len(medias)} آیتم از {platform}...")
             album_files = []
+            album_media = {}  # path → آیتم پاسخ API (width/height/duration برای رد کردن ffprobe)
             t_dl_all_start = time.perf_counter()
-            for idx, media in enumerate(medias, start=1):
+
+            async def _download_album_item(idx, media):
                 mtype = media.get("type")
                 if mtype not in ("image", "photo", "video"):
-                    continue
+                    return None
                 murl = media.get("url")
                 if not murl:
-                    continue
+                    return None
                 mext = media.get("extension", "mp4" if mtype == "video" else "jpg")
                 safe_title_src = title or platform
                 mfilename = _safe_filename_with_index(safe_title_src, mext, idx)
-                try:
-                    t_dl_start_i = time.perf_counter()
-                    # Retry per-item download up to 3 times (silent retries)
-                    dl_res = None
-                    per_item_error = None
-                    for attempt in range(3):
-                        try:
-                            dl_res = await download_stream_to_file(murl, mfilename)
-                            break
-                        except Exception as e:
-                            per_item_error = e
-                            _log(f"[UNIV] Item {idx} attempt {attempt+1}/3 failed: {e}")
-                            if attempt < 2:  # Only sleep if not last attempt
-                                delay = _with_jitter(1.5)
-                                await asyncio.sleep(delay)
-                    t_dl_end_i = time.perf_counter()
-                    _log(f"[UNIV] Item {idx} download took {(t_dl_end_i - t_dl_start_i):.2f}s | type={mtype}")
-                    if isinstance(dl_res, tuple):
-                        mp, _ = dl_res
-                    else:
-                        mp = dl_res
-                    if mp and os.path.exists(mp) and os.path.getsize(mp) > 0:
-                        album_files.append((mtype, mp))
-                    else:
-                        if per_item_error:
-                            _log(f"[UNIV] Item {idx} failed after retries: {per_item_error}")
-                except Exception as e:
-                    _log(f"[UNIV] Failed downloading item {idx}: {e}")
-                    continue
+                t_dl_start_i = time.perf_counter()
+                # Retry per-item download up to 3 times (silent retries)
+                dl_res = None
+                per_item_error = None
+                for attempt in range(3):
+                    try:
+                        dl_res = await asyncio.wait_for(
+                            download_stream_to_file(murl, mfilename), timeout=item_timeouts[idx - 1]
+                        )
+                        break
+                    except Exception as e:
+                        per_item_error = e
+                        _log(f"[UNIV] Item {idx} attempt {attempt+1}/3 failed: {e}")
+                        if attempt < 2:  # Only sleep if not last attempt
+                            delay = _with_jitter(1.5)
+                            await asyncio.sleep(delay)
+                t_dl_end_i = time.perf_counter()
+                _log(f"[UNIV] Item {idx} download took {(t_dl_end_i - t_dl_start_i):.2f}s | type={mtype}")
+                if isinstance(dl_res, tuple):
+                    mp, _ = dl_res
+                else:
+                    mp = dl_res
+                if mp and os.path.exists(mp) and os.path.getsize(mp) > 0:
+                    album_media[mp] = media
+                    return (mtype, mp)
+                if per_item_error:
+                    _log(f"[UNIV] Item {idx} failed after retries: {per_item_error}")
+                return None
+
+            # ⚡ دانلود همزمان آیتم‌ها (محدودیت per-request و سراسری)، ترتیب اصلی حفظ می‌شود
+            item_results = await gather_items(_download_album_item, medias)
+            for idx, res in enumerate(item_results, start=1):
+                if isinstance(res, Exception):
+                    _log(f"[UNIV] Failed downloading item {idx}: {res}")
+                elif res:
+                    album_files.append(res)
             t_dl_all_end = time.perf_counter()
             _log(f"[UNIV] All album downloads took {(t_dl_all_end - t_dl_all_start):.2f}s | files={len(album_files)}")
             if not album_files:
@@ -1455,9 +1369,16 @@ async def handle_universal_link(client: Client, message: Message, is_retry: bool
             send_advertisement(client, message.chat.id)
             await asyncio.sleep(1)  # Wait 1 second after advertisement
         
+        # 🔀 پایان مرحله fetch: slot دانلود آزاد و slot آپلود گرفته می‌شود
+        if slot_acquired:
+            release_slot()
+            slot_acquired = False
+        upload_started = await upload_pool.acquire()
+
         # Upload file(s) based on type
         await status_msg.edit_text(f"📤 در حال ارسال {'آلبوم' if is_album else 'فایل'} {platform}...")
         
+        sent_result = None  # پیام(های) ارسال شده برای delivery cache
         try:
             # Decide upload method based on media type and extension
             image_exts = ["jpg", "jpeg", "png", "webp"]
@@ -1476,7 +1397,12 @@ async def handle_universal_link(client: Client, message: Message, is_retry: bool
                     elif mtype == "video":
                         # Extract metadata only for first video, reuse for others
                         if first_video_meta is None:
-                            first_video_meta = _extract_video_metadata(mp)
+                            api_media = album_media.get(mp) or {}
+                            first_video_meta = await _extract_video_metadata(mp, {
+                                'width': api_media.get('width'),
+                                'height': api_media.get('height'),
+                                'duration': api_media.get('duration'),
+                            })
                         
                         # Prepare video parameters safely
                         video_params = {
@@ -1500,7 +1426,7 @@ async def handle_universal_link(client: Client, message: Message, is_retry: bool
                 last_group_error = None
                 for attempt in range(3):
                     try:
-                        await client.send_media_group(
+                        sent_result = await client.send_media_group(
                             chat_id=message.chat.id,
                             media=media_group
                         )
@@ -1527,7 +1453,7 @@ async def handle_universal_link(client: Client, message: Message, is_retry: bool
                     for attempt in range(3):
                         try:
                             if memory_buffer:
-                                await client.send_photo(
+                                sent_result = await client.send_photo(
                                     chat_id=message.chat.id,
                                     photo=memory_buffer,
                                     caption=caption
@@ -1538,6 +1464,7 @@ async def handle_universal_link(client: Client, message: Message, is_retry: bool
                                 )
                                 if not success:
                                     raise Exception("Smart upload failed")
+                                sent_result = success
                             last_upload_error = None
                             break
                         except Exception as e:
@@ -1562,7 +1489,12 @@ async def handle_universal_link(client: Client, message: Message, is_retry: bool
                         video_height = selected_media.get('height')
                         _log(f"[UNIV] Using API metadata: {video_width}x{video_height}")
                     else:
-                        video_meta = _extract_video_metadata(file_path)
+                        api_media = selected_media if hasattr(selected_media, 'get') else {}
+                        video_meta = await _extract_video_metadata(file_path, {
+                            'width': api_media.get('width'),
+                            'height': api_media.get('height'),
+                            'duration': api_media.get('duration') or duration_sec,
+                        })
                         video_width = video_meta.get('width', 0) or None
                         video_height = video_meta.get('height', 0) or None
                         video_duration = video_meta.get('duration', 0) or video_duration
@@ -1598,6 +1530,7 @@ async def handle_universal_link(client: Client, message: Message, is_retry: bool
                             res = await _bot_api_send_async("sendVideo", payload)
                             if res.get("ok"):
                                 bot_api_sent = True
+                                sent_result = res
                                 last_upload_error = None
                                 upload_done = True
                                 _log("[UNIV] Bot API URL send succeeded")
@@ -1629,7 +1562,7 @@ async def handle_universal_link(client: Client, message: Message, is_retry: bool
                                 if video_thumb is not None:
                                     video_params['thumb'] = video_thumb
                                 
-                                await client.send_video(**video_params)
+                                sent_result = await client.send_video(**video_params)
                                 last_upload_error = None
                                 break
                             except Exception as e:
@@ -1644,7 +1577,7 @@ async def handle_universal_link(client: Client, message: Message, is_retry: bool
 
                         if prefer_document_for_large_video and file_size_mb >= fast_upload_threshold_mb:
                             try:
-                                await client.send_document(
+                                sent_result = await client.send_document(
                                     chat_id=message.chat.id,
                                     document=file_path,
                                     caption=_safe_caption(caption, max_len=950)
@@ -1664,6 +1597,8 @@ async def handle_universal_link(client: Client, message: Message, is_retry: bool
                             )
                             if not success:
                                 last_upload_error = Exception("Smart upload strategy failed")
+                            else:
+                                sent_result = success
 
                     if last_upload_error:
                         raise last_upload_error
@@ -1676,7 +1611,7 @@ async def handle_universal_link(client: Client, message: Message, is_retry: bool
                         # Use memory buffer for small audio files
                         for attempt in range(3):
                             try:
-                                await client.send_audio(
+                                sent_result = await client.send_audio(
                                     chat_id=message.chat.id,
                                     audio=memory_buffer,
                                     caption=caption,
@@ -1699,11 +1634,22 @@ async def handle_universal_link(client: Client, message: Message, is_retry: bool
                         )
                         if not success:
                             last_upload_error = Exception("Smart upload strategy failed")
+                        else:
+                            sent_result = success
                     
                     if last_upload_error:
                         raise last_upload_error
                     t_up_end = time.perf_counter()
             _log(f"[UNIV] Upload took {(t_up_end - t_up_start):.2f}s")
+            
+            # 💾 ذخیره file_id ها برای درخواست‌های بعدی همین لینک
+            try:
+                await delivery_cache.remember(
+                    client, cache_platform, cache_media_id, '', sent_result,
+                    caption=caption, media_type=media_type
+                )
+            except Exception as e:
+                _log(f"[UNIV] Delivery cache store failed: {e}")
             try:
                 if slot_acquired:
                     release_slot()
@@ -1824,6 +1770,9 @@ async def handle_universal_link(client: Client, message: Message, is_retry: bool
                 slot_acquired = False
         except Exception:
             pass
+        if upload_started is not None:
+            upload_pool.release(upload_started)
+            upload_started = None
         if ad_enabled and ad_position == 'after':
             await asyncio.sleep(1)  # Wait 1 second after upload
             send_advertisement(client, message.chat.id)
@@ -1903,6 +1852,8 @@ async def handle_universal_link(client: Client, message: Message, is_retry: bool
                 release_slot()
         except Exception as exc:
             universal_logger.debug(f"Failed to release slot: {exc}")
+        if upload_started is not None:
+            upload_pool.release(upload_started)
         
         # آزادسازی رزرو کاربر
         try:
@@ -0,0 +1,313 @@
+"""
+Workspace Manager - پوشه یکتا برای هر job + رزرو فضای دیسک
+دانلودها قبلاً در tempdir مشترک، پوشه جاری (temp_insta_*) و downloads/ نوشته می‌شدند؛
+job های همزمان می‌توانستند فایل‌های هم را پاک یا بازنویسی کنند و حجم دیسک حساب نمی‌شد.
+
+- هر job پوشه WORKSPACE_ROOT/<kind>/<id> دارد که با پایان job حذف می‌شود
+- حجم مورد انتظار (filesize از yt-dlp/API) قبل از شروع رزرو می‌شود؛ بخشی که هنوز
+  نوشته نشده از فضای آزاد کم می‌شود تا job های بعدی دیسک را پر نکنند
+- اگر فضا کافی نباشد job تا WORKSPACE_WAIT_TIMEOUT ثانیه صف می‌ماند و بعد رد می‌شود
+- workspace های keep() شده (مثلاً .part های یوتیوب برای resume) بعد از retention حذف می‌شوند
+"""
+
+import asyncio
+import os
+import shutil
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+
+from plugins.logger_config import get_logger
+
+try:
+    from config import (
+        WORKSPACE_ROOT, WORKSPACE_MIN_FREE_MB,
+        WORKSPACE_DEFAULT_RESERVE_MB, WORKSPACE_WAIT_TIMEOUT,
+    )
+except Exception:
+    import tempfile
+    WORKSPACE_ROOT = os.path.join(tempfile.gettempdir(), 'bot_jobs')
+    WORKSPACE_MIN_FREE_MB = 1024
+    WORKSPACE_DEFAULT_RESERVE_MB = 50
+    WORKSPACE_WAIT_TIMEOUT = 120
+
+logger = get_logger('workspace_manager')
+
+MB = 1024 * 1024
+RECHECK_INTERVAL = 5.0  # فضای آزاد ممکن است بدون release هم تغییر کند
+SWEEP_INTERVAL = 300.0
+ORPHAN_TTL = 3600  # پوشه‌های رها شده (crash) برای kind هایی که retention ندارند
+
+
+class InsufficientDiskSpace(Exception):
+    """فضای دیسک برای رزرو job کافی نیست (بعد از انتظار در صف)"""
+
+
+def _dir_bytes(path: str) -> int:
+    total = 0
+    for dirpath, _dirs, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass
+    return total
+
+
+def _sweep_dir(root: str, kind: str, expire_before: float, active: set) -> int:
+    """(در executor) حذف پوشه‌های kind که قبل از expire_before تغییر نکرده‌اند؛ تعداد حذف‌شده"""
+    kind_dir = os.path.join(root, kind)
+    try:
+        entries = os.listdir(kind_dir)
+    except OSError:
+        return 0
+    swept = 0
+    for name in entries:
+        path = os.path.join(kind_dir, name)
+        if path in active:
+            continue
+        try:
+            if os.path.getmtime(path) < expire_before:
+                shutil.rmtree(path, ignore_errors=True)
+                swept += 1
+                logger.info(f"🧹 Expired workspace removed: {kind}/{name}")
+        except OSError:
+            pass
+    return swept
+
+
+def _resolve(fut: asyncio.Future):
+    if not fut.done():
+        fut.set_result(None)
+
+
+class Workspace:
+    """پوشه اختصاصی یک job"""
+
+    __slots__ = ('id', 'kind', 'path', 'reserved', 'created', 'kept', '_used', '_used_at')
+
+    def __init__(self, kind: str, workspace_id: str, path: str, reserved: int):
+        self.id = workspace_id
+        self.kind = kind
+        self.path = path
+        self.reserved = reserved
+        self.created = time.time()
+        self.kept = False
+        self._used = 0
+        self._used_at = 0.0
+
+    def file(self, name: str) -> str:
+        """مسیر یک فایل داخل workspace (فقط نام فایل، بدون پوشه)"""
+        return os.path.join(self.path, os.path.basename(name))
+
+    def used_bytes(self, max_age: float = 0.0) -> int:
+        """
+        حجم نوشته‌شده؛ با max_age مقدار قبلی تا آن مدت دوباره محاسبه نمی‌شود
+        (دانلود fragment یوتیوب هزاران فایل .part-Frag دارد و os.walk روی event loop است)
+        """
+        now = time.monotonic()
+        if not max_age or now - self._used_at >= max_age:
+            self._used = _dir_bytes(self.path)
+            self._used_at = now
+        return self._used
+
+    def keep(self):
+        """پوشه با release حذف نشود (فقط رزرو آزاد می‌شود)"""
+        self.kept = True
+
+
+class WorkspaceManager:
+    """ساخت workspace ها و کنترل پذیرش بر اساس فضای دیسک"""
+
+    def __init__(self, root: str = WORKSPACE_ROOT, min_free_mb: int = WORKSPACE_MIN_FREE_MB,
+                 default_reserve_mb: int = WORKSPACE_DEFAULT_RESERVE_MB,
+                 wait_timeout: float = WORKSPACE_WAIT_TIMEOUT):
+        self.root = root
+        self.min_free = max(0, min_free_mb) * MB
+        self.default_reserve = max(1, default_reserve_mb) * MB
+        self.wait_timeout = wait_timeout
+        os.makedirs(root, exist_ok=True)
+        self._active: Dict[str, Workspace] = {}  # path -> workspace
+        self._waiters: List[asyncio.Future] = []
+        self._retention: Dict[str, float] = {}
+        self._last_sweep: Dict[str, float] = {}
+        self.stats = {
+            'acquired': 0,
+            'released': 0,
+            'kept': 0,
+            'waited': 0,
+            'rejected': 0,
+            'wait_time_total': 0.0,
+            'swept': 0,
+            'peak_reserved': 0,
+        }
+        logger.info(f"✅ WorkspaceManager initialized (root={root}, min_free={min_free_mb}MB)")
+
+    # ---------------------------------------------------------------- #
+    # حسابداری فضا
+
+    def _outstanding(self) -> int:
+        """بخشی از رزروها که هنوز روی دیسک نوشته نشده"""
+        return sum(max(0, ws.reserved - ws.used_bytes(RECHECK_INTERVAL)) for ws in self._active.values())
+
+    def _headroom(self) -> int:
+        try:
+            free = shutil.disk_usage(self.root).free
+        except OSError:
+            return 0
+        return free - self._outstanding() - self.min_free
+
+    async def _admit(self, nbytes: int, label: str):
+        """تا وقتی nbytes جا شود صبر می‌کند؛ در غیر این صورت InsufficientDiskSpace"""
+        start = time.monotonic()
+        deadline = start + self.wait_timeout
+        waited = False
+        loop = asyncio.get_running_loop()
+        while True:
+            headroom = self._headroom()
+            if nbytes <= headroom:
+                break
+            remaining = deadline - time.monotonic()
+            if not self._active or remaining <= 0:
+                # رزرو دیگری در کار نیست که آزاد شود، یا زمان انتظار تمام شده
+                self.stats['rejected'] += 1
+                logger.warning(f"💾 Rejected {label}: needs {nbytes / MB:.0f}MB, headroom {max(0, headroom) / MB:.0f}MB")
+                raise InsufficientDiskSpace(
+                    f"فضای دیسک سرور موقتاً کافی نیست ({nbytes / MB:.0f}MB لازم است)؛ "
+                    f"لطفاً چند دقیقه بعد دوباره تلاش کنید"
+                )
+            if not waited:
+                waited = True
+                self.stats['waited'] += 1
+                logger.info(f"⏳ {label} waiting for disk: needs {nbytes / MB:.0f}MB, headroom {max(0, headroom) / MB:.0f}MB")
+            fut = loop.create_future()
+            self._waiters.append(fut)
+            try:
+                await asyncio.wait_for(fut, min(remaining, RECHECK_INTERVAL))
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                if fut in self._waiters:
+                    self._waiters.remove(fut)
+        if waited:
+            self.stats['wait_time_total'] += time.monotonic() - start
+
+    def _wake(self):
+        waiters, self._waiters = self._waiters, []
+        for fut in waiters:
+            fut.get_loop().call_soon_threadsafe(_resolve, fut)
+
+    def _note_peak(self):
+        reserved = sum(ws.reserved for ws in self._active.values())
+        if reserved > self.stats['peak_reserved']:
+            self.stats['peak_reserved'] = reserved
+
+    # ---------------------------------------------------------------- #
+    # API
+
+    def fits(self, expected_bytes: int = 0, factor: float = 1.0) -> bool:
+        """آیا رزرو بدون انتظار در صف جا می‌شود (برای کارهای اختیاری مثل prefetch)"""
+        nbytes = int(expected_bytes * factor) if expected_bytes and expected_bytes > 0 else self.default_reserve
+        return nbytes <= self._headroom()
+
+    def set_retention(self, kind: str, seconds: float):
+        """مدت نگهداری workspace های رها شده/keep شده این kind"""
+        self._retention[kind] = seconds
+
+    async def acquire(self, kind: str, expected_bytes: int = 0, workspace_id: Optional[str] = None,
+                      factor: float = 1.0) -> Workspace:
+        """
+        رزرو فضا و ساخت workspace
+            expected_bytes: حجم مورد انتظار (0 = نامعلوم → WORKSPACE_DEFAULT_RESERVE_MB)
+            workspace_id: شناسه ثابت (برای ادامه دانلود)؛ پیش‌فرض یکتا
+            factor: ضریب فضای موقت (مثلاً ویدیو+صدا+فایل merge شده)
+        بعد از پایان job حتماً release() صدا زده شود (یا از job() استفاده شود).
+        """
+        await self._sweep(kind)
+        nbytes = int(expected_bytes * factor) if expected_bytes and expected_bytes > 0 else self.default_reserve
+        await self._admit(nbytes, kind)
+
+        workspace_id = workspace_id or uuid.uuid4().hex[:12]
+        path = os.path.join(self.root, kind, workspace_id)
+        os.makedirs(path, exist_ok=True)
+        ws = Workspace(kind, workspace_id, path, nbytes)
+        self._active[path] = ws
+        self.stats['acquired'] += 1
+        self._note_peak()
+        logger.debug(f"📁 Workspace {kind}/{workspace_id} reserved {nbytes / MB:.1f}MB")
+        return ws
+
+    async def reserve(self, ws: Workspace, total_bytes: int):
+        """افزایش رزرو workspace وقتی حجم واقعی بعداً معلوم می‌شود (مثلاً Content-Length)"""
+        extra = int(total_bytes) - ws.reserved
+        if extra <= 0 or ws.path not in self._active:
+            return
+        # خود این workspace هم در outstanding حساب است؛ فقط مازاد باید جا شود
+        await self._admit(extra, ws.kind)
+        ws.reserved += extra
+        self._note_peak()
+
+    def release(self, ws: Optional[Workspace]):
+        """پایان job: آزاد کردن رزرو و حذف پوشه (مگر keep شده باشد)؛ تکرار آن بی‌اثر است"""
+        if ws is None or self._active.pop(ws.path, None) is None:
+            return
+        self.stats['released'] += 1
+        if ws.kept:
+            self.stats['kept'] += 1
+            try:
+                os.utime(ws.path)  # retention از آخرین استفاده حساب شود
+            except OSError:
+                pass
+        else:
+            shutil.rmtree(ws.path, ignore_errors=True)
+        self._wake()
+
+    def owner(self, path: str) -> Optional[Workspace]:
+        """workspace فعالی که فایل path داخل آن است"""
+        return self._active.get(os.path.dirname(path))
+
+    @asynccontextmanager
+    async def job(self, kind: str, expected_bytes: int = 0, factor: float = 1.0):
+        """
+            async with workspace_manager.job('aparat', filesize) as ws:
+                ... ws.file('video.mp4') ...
+        """
+        ws = await self.acquire(kind, expected_bytes, factor=factor)
+        try:
+            yield ws
+        finally:
+            self.release(ws)
+
+    async def _sweep(self, kind: str):
+        """حذف پوشه‌های غیرفعال قدیمی‌تر از retention (keep شده یا باقی‌مانده از crash) در executor"""
+        now = time.time()
+        if now - self._last_sweep.get(kind, 0.0) < SWEEP_INTERVAL:
+            return
+        self._last_sweep[kind] = now
+        expire_before = now - self._retention.get(kind, ORPHAN_TTL)
+        active = set(self._active)
+        loop = asyncio.get_running_loop()
+        self.stats['swept'] += await loop.run_in_executor(None, _sweep_dir, self.root, kind, expire_before, active)
+
+    def get_stats(self) -> dict:
+        reserved = sum(ws.reserved for ws in self._active.values())
+        try:
+            free = shutil.disk_usage(self.root).free
+        except OSError:
+            free = 0
+        waited = self.stats['waited']
+        return {
+            **self.stats,
+            'active': len(self._active),
+            'queued': len(self._waiters),
+            'reserved_mb': reserved / MB,
+            'outstanding_mb': self._outstanding() / MB,
+            'free_mb': free / MB,
+            'peak_reserved_mb': self.stats['peak_reserved'] / MB,
+            'avg_wait': self.stats['wait_time_total'] / waited if waited else 0.0,
+        }
+
+
+# 🔥 Global instance
+workspace_manager = WorkspaceManager()
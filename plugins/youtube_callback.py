@@ -17,14 +17,26 @@ from pyrogram.enums import ParseMode
 from pyrogram.errors import MessageNotModified, MessageDeleteForbidden, FloodWait
 from plugins.logger_config import get_logger
 from plugins.youtube_handler import video_cache
-from plugins.youtube_downloader import youtube_downloader
+from plugins.youtube_downloader import youtube_downloader, build_output_filename
+from plugins.youtube_prefetch import youtube_prefetcher
 from plugins.youtube_uploader import youtube_uploader
 from plugins.concurrency import acquire_slot, release_slot, get_queue_stats, reserve_user, release_user
 from plugins.sqlite_db_wrapper import DB
 from plugins.media_utils import send_advertisement
+from plugins.delivery_cache import delivery_cache, canonical_media_id
+from plugins.job_cost import job_cost_model
+from plugins.pipeline_stages import upload_pool
+
+try:
+    from config import ADMIN
+except Exception:
+    ADMIN = []
 
 logger = get_logger('youtube_callback')
 
+# 🔀 انتخاب‌های در حال پردازش (user_id, url, quality) برای نادیده گرفتن کلیک‌های تکراری
+_active_selections = set()
+
 def format_size(bytes_size: int) -> str:
     """فرمت کردن حجم فایل"""
     if bytes_size >= 1024 * 1024 * 1024:
@@ -70,6 +82,8 @@ async def handle_quality_selection(client: Client, call: CallbackQuery):
     
     # ✅ مقداردهی اولیه متغیرها برای جلوگیری از UnboundLocalError
     user_reserved = False
+    selection_key = None
+    prefetch_claimed = False
     
     logger.info(f"Quality selection from user {user_id}: {data}")
     
@@ -87,8 +101,8 @@ async def handle_quality_selection(client: Client, call: CallbackQuery):
         # Handle cancel
         if data == 'yt_cancel':
             await call.edit_message_text("❌ دانلود لغو شد.")
-            if user_id in video_cache:
-                del video_cache[user_id]
+            video_cache.remove(user_id)
+            youtube_prefetcher.cancel(user_id)
             return
         
         # Parse quality selection
@@ -107,6 +121,14 @@ async def handle_quality_selection(client: Client, call: CallbackQuery):
             )
             return
         
+        # 🔀 کلیک تکراری روی همان کیفیت: به دانلود در حال اجرا متصل است
+        selection_key = (user_id, video_info['url'], selected_quality)
+        if selection_key in _active_selections:
+            selection_key = None
+            await call.answer("⏳ این دانلود در حال انجام است...")
+            return
+        _active_selections.add(selection_key)
+        
         # Check per-user concurrency
         if not reserve_user(user_id):
             await call.answer(
@@ -118,6 +140,9 @@ async def handle_quality_selection(client: Client, call: CallbackQuery):
         
         user_reserved = True
         
+        # 🔮 اگر همین کیفیت از قبل در حال دانلود حدسی است، دانلود به آن متصل می‌شود
+        prefetch_claimed = youtube_prefetcher.claim(user_id, video_info['url'], selected_quality)
+        
         # Start download process
         await start_download(
             client=client,
@@ -145,6 +170,12 @@ async def handle_quality_selection(client: Client, call: CallbackQuery):
             await call.answer("❌ خطا در پردازش.", show_alert=True)
     
     finally:
+        if selection_key:
+            _active_selections.discard(selection_key)
+        
+        if prefetch_claimed:
+            youtube_prefetcher.release(user_id, video_info['url'], selected_quality)
+        
         # ✅ آزادسازی user در finally برای اطمینان از آزادسازی در هر شرایطی
         if user_reserved:
             try:
@@ -163,6 +194,7 @@ async def start_download(
     """شروع فرآیند دانلود و آپلود - نسخه بهینه شده"""
     # ✅ مقداردهی اولیه متغیرها
     slot_acquired = False
+    upload_started = None  # زمان گرفتن slot آپلود (upload_pool)
     downloaded_file = None
     thumbnail_path = None
     overall_start = time.time()  # ✅ زمان شروع کلی
@@ -183,6 +215,36 @@ async def start_download(
         
         await safe_edit_text(call, initial_msg)
         
+        # ✅ بررسی امن reply_to_message
+        reply_to_id = None
+        if call.message and call.message.reply_to_message:
+            reply_to_id = call.message.reply_to_message.message_id
+        
+        # ⚡ Delivery cache: اگر همین ویدیو/کیفیت قبلاً آپلود شده، با file_id ارسال کن
+        media_id = canonical_media_id('youtube', video_info['url'])
+        cache_hit = await delivery_cache.deliver(
+            client,
+            chat_id=call.message.chat.id,
+            platform='youtube',
+            media_id=media_id,
+            format_id=quality,
+            reply_to_message_id=reply_to_id
+        )
+        if cache_hit:
+            try:
+                if call.message:
+                    await call.message.delete()
+            except Exception as e:
+                logger.debug(f"Failed to delete progress message: {e}")
+            try:
+                db = DB()
+                db.increment_request(user_id, time.strftime('%Y-%m-%d %H:%M:%S'))
+            except Exception as e:
+                logger.warning(f"Database update error: {e}")
+            video_cache.remove(user_id)
+            logger.info(f"🎯 Total (delivery cache): {time.time() - overall_start:.2f}s")
+            return
+        
         # Check queue
         stats = get_queue_stats()
         if stats['active'] >= stats['capacity']:
@@ -194,7 +256,12 @@ async def start_download(
         
         # ✅ Acquire slot با try/except
         try:
-            await acquire_slot()
+            # هزینه تخمینی: منتظرهای کوتاه (صوت/کیفیت پایین) زودتر slot می‌گیرند
+            job_cost = job_cost_model.estimate(
+                'youtube', 'audio' if quality == 'audio' else 'video',
+                quality_info.get('filesize') or 0, video_info.get('duration') or 0
+            )
+            await acquire_slot(cost=job_cost, lane='admin' if user_id in ADMIN else 'normal')
             slot_acquired = True
         except Exception as e:
             logger.error(f"Slot acquire failed: {e}")
@@ -210,29 +277,9 @@ async def start_download(
             f"💡 این مرحله ممکن است 1-2 دقیقه طول بکشد ⌛"
         )
         
-        # Prepare filename (کوتاه و ساده برای جلوگیری از ارسال به عنوان document)
-        safe_title = "".join(
-            c for c in video_info['title'] 
-            if c.isalnum() or c in (' ', '-', '_')
-        ).strip()
-        
-        # محدود کردن طول نام فایل برای جلوگیری از مشکل Telegram
-        max_title_length = 30  # کاهش از 50 به 30
-        if len(safe_title) > max_title_length:
-            safe_title = safe_title[:max_title_length].strip()
-        
-        # اگر نام خیلی کوتاه شد، از نام پیش‌فرض استفاده کن
-        if len(safe_title) < 5:
-            safe_title = "YouTube_Video"
-        
-        if quality == 'audio':
-            # ✅ پیش‌فرض برای ext در صورت نبود
-            ext = quality_info.get('ext', 'mp3')
-            filename = f"{safe_title}.{ext}"
-            media_type = 'audio'
-        else:
-            filename = f"{safe_title}_{quality}p.mp4"
-            media_type = 'video'
+        # Prepare filename (همان نامی که prefetch استفاده می‌کند)
+        filename = build_output_filename(video_info['title'], quality, quality_info)
+        media_type = 'audio' if quality == 'audio' else 'video'
         
         # ✅ لاگ کامل‌تر برای دیباگ
         logger.info(f"📁 Generated filename: {filename} (temp dir: {youtube_downloader.download_dir})")
@@ -244,7 +291,8 @@ async def start_download(
             format_string=quality_info['format_string'],
             output_filename=filename,
             progress_callback=None,  # بدون callback برای سرعت بیشتر
-            is_audio_only=(quality == 'audio')  # مشخص کردن نوع فایل
+            is_audio_only=(quality == 'audio'),  # مشخص کردن نوع فایل
+            expected_bytes=quality_info.get('filesize') or 0  # رزرو فضای دیسک
         )
         download_time = time.time() - download_start
         
@@ -254,6 +302,10 @@ async def start_download(
         file_size = os.path.getsize(downloaded_file)
         logger.info(f"✅ Download: {download_time:.2f}s - {format_size(file_size)}")
         
+        # 🔀 پایان مرحله fetch: slot دانلود آزاد می‌شود تا منتظر آپلود تلگرام نماند
+        release_slot()
+        slot_acquired = False
+        
         # پیام آپلود
         await safe_edit_text(
             call,
@@ -324,12 +376,8 @@ async def start_download(
             except Exception as e:
                 logger.warning(f"Advertisement send failed (before): {e}")
         
-        # 🔥 آپلود با تنظیمات بهینه
-        # ✅ بررسی امن reply_to_message
-        reply_to_id = None
-        if call.message and call.message.reply_to_message:
-            reply_to_id = call.message.reply_to_message.message_id
-        
+        # 🔥 آپلود با تنظیمات بهینه (pool جدای آپلود، ظرفیت = max_concurrent_transmissions)
+        upload_started = await upload_pool.acquire()
         upload_start = time.time()
         success = await youtube_uploader.upload_with_streaming(
             client=client,
@@ -342,15 +390,29 @@ async def start_download(
             performer=video_info['uploader'],
             thumbnail=thumbnail_path,
             progress_callback=optimized_upload_progress,  # Progress بهینه شده
-            reply_to_message_id=reply_to_id  # ✅ استفاده از متغیر امن
+            reply_to_message_id=reply_to_id,  # ✅ استفاده از متغیر امن
+            # ابعاد از yt-dlp؛ در صورت وجود ffprobe اجرا نمی‌شود
+            width=quality_info.get('actual_width') or 0,
+            height=quality_info.get('actual_height') or 0
         )
         upload_time = time.time() - upload_start
+        upload_pool.release(upload_started)
+        upload_started = None
         
         if not success:
             raise Exception("آپلود ناموفق بود")
         
         logger.info(f"✅ Upload: {upload_time:.2f}s")
         
+        # 💾 ذخیره file_id برای درخواست‌های بعدی همین ویدیو/کیفیت
+        try:
+            await delivery_cache.remember(
+                client, 'youtube', media_id, quality, success,
+                caption=caption, media_type=media_type
+            )
+        except Exception as e:
+            logger.warning(f"Delivery cache store failed: {e}")
+        
         # ✅ حذف ایمن پیام progress با FloodWait
         logger.debug("Deleting progress message...")
         try:
@@ -383,8 +445,7 @@ async def start_download(
             logger.warning(f"Database update error: {e}")
         
         # Clean up cache
-        if user_id in video_cache:
-            del video_cache[user_id]
+        video_cache.remove(user_id)
         
         # ✅ محاسبه زمان کلی از overall_start
         total_time = time.time() - overall_start
@@ -408,7 +469,9 @@ async def start_download(
                 logger.debug("Slot released")
             except Exception as e:
                 logger.warning(f"Failed to release slot: {e}")
-        
+        if upload_started is not None:
+            upload_pool.release(upload_started)
+
         # ✅ Release user (این کار در handler اصلی انجام می‌شود)
         # توجه: release_user در finally بلوک handle_quality_selection فراخوانی می‌شود
         
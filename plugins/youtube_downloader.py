@@ -7,17 +7,126 @@ import asyncio
 import tempfile
 import time
 import glob
-from typing import Optional, Callable
+import hashlib
+import threading
+from typing import Optional, Callable, Dict
+from yt_dlp.utils import DownloadCancelled
 from plugins.logger_config import get_logger
-import yt_dlp
+from plugins.single_flight import SingleFlight
+from plugins.ffmpeg_runner import ffmpeg_runner
+from plugins.ytdlp_pool import Backoff
+from plugins.ytdlp_process_pool import ytdlp_process_pool
+from plugins.workspace_manager import workspace_manager, Workspace
+from plugins.transcode_policy import (
+    transcode_policy, downloaded_path, AUDIO_FORMAT, AUDIO_FALLBACK_FORMATS
+)
+
+try:
+    from config import YOUTUBE_PARTIAL_TTL
+except Exception:
+    YOUTUBE_PARTIAL_TTL = 21600
 
 logger = get_logger('youtube_downloader')
 
+# فایل‌های ویدیو و صدا تا پایان merge/تبدیل کنار فایل خروجی روی دیسک می‌مانند
+RESERVE_FACTOR = 2.0
+
+# خطاهایی که با ادامه دانلود (Range) قابل جبران‌اند؛ بقیه قطعی حساب می‌شوند
+TRANSIENT_ERRORS = (
+    'connection reset',
+    'timeout',
+    'timed out',
+    'network',
+    'temporary failure',
+    'did not get any data blocks',
+    'incomplete',
+    'http error 5',
+    'http error 403',
+)
+
+
+def _is_transient_error(error_msg: str) -> bool:
+    error_msg = error_msg.lower()
+    return any(keyword in error_msg for keyword in TRANSIENT_ERRORS)
+
+
+def _partial_bytes(workspace: str) -> int:
+    """حجم فایل‌های نیمه‌کاره (.part و قطعه‌ها) در workspace"""
+    total = 0
+    for path in glob.glob(os.path.join(workspace, '*.part*')):
+        try:
+            total += os.path.getsize(path)
+        except OSError:
+            pass
+    return total
+
+
+def build_output_filename(title: str, quality: str, quality_info: dict) -> str:
+    """نام فایل خروجی (کوتاه و ساده برای جلوگیری از ارسال به عنوان document)"""
+    safe_title = "".join(
+        c for c in (title or '')
+        if c.isalnum() or c in (' ', '-', '_')
+    ).strip()
+    
+    # محدود کردن طول نام فایل برای جلوگیری از مشکل Telegram
+    max_title_length = 30
+    if len(safe_title) > max_title_length:
+        safe_title = safe_title[:max_title_length].strip()
+    
+    # اگر نام خیلی کوتاه شد، از نام پیش‌فرض استفاده کن
+    if len(safe_title) < 5:
+        safe_title = "YouTube_Video"
+    
+    if quality == 'audio':
+        return f"{safe_title}.{quality_info.get('ext', 'mp3')}"
+    return f"{safe_title}_{quality}p.mp4"
+
+
 class YouTubeDownloader:
     """کلاس دانلود از یوتیوب"""
     
     def __init__(self):
         self.download_dir = tempfile.gettempdir()
+        # workspace هر job (از workspace_manager): فایل‌های .part و وضعیت fragment ها
+        # برای ادامه دانلود؛ تا cleanup() آخرین مصرف‌کننده فعال می‌ماند
+        self._workspaces: Dict[str, Workspace] = {}  # file path -> workspace
+        workspace_manager.set_retention('youtube', YOUTUBE_PARTIAL_TTL)
+        # 🔀 Single-flight: یک دانلود برای هر (url, format) در حال اجرا
+        self._flight = SingleFlight('youtube_download')
+        # شمارنده مصرف‌کننده‌های هر فایل (فایل تا آزاد شدن همه حذف نمی‌شود)
+        self._file_refs: Dict[str, int] = {}
+        self._ready_files: Dict[str, str] = {}  # flight key -> path
+        # درخواست لغو دانلودهای در حال اجرا (prefetch رد شده)؛ کلید: workspace id
+        self._cancel_events: Dict[str, threading.Event] = {}
+    
+    @staticmethod
+    def _flight_key(url: str, format_string: str, is_audio_only: bool) -> str:
+        from plugins.youtube_handler import normalize_youtube_url
+        try:
+            url = normalize_youtube_url(url)
+        except Exception:
+            pass
+        return f"{url}|{'audio' if is_audio_only else format_string}"
+    
+    @staticmethod
+    def _workspace_id(key: str) -> str:
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()[:8]
+    
+    def abort(self, url: str, format_string: str, is_audio_only: bool = False) -> bool:
+        """
+        لغو دانلود در حال اجرا اگر فقط یک منتظر (همان فراخواننده) داشته باشد
+        
+        لغو همکارانه است: yt-dlp در progress hook بعدی متوقف می‌شود (در حالت thread)؛
+        در process pool دانلود تا پایان اجرا و نتیجه آن دور ریخته می‌شود.
+        فراخواننده همچنان download() خود را await می‌کند و None می‌گیرد.
+        """
+        key = self._flight_key(url, format_string, is_audio_only)
+        event = self._cancel_events.get(self._workspace_id(key))
+        if event is None or self._flight.waiters(key) > 1:
+            return False
+        event.set()
+        logger.info(f"🛑 Download abort requested: {key}")
+        return True
     
     async def download(
         self,
@@ -25,7 +134,56 @@ class YouTubeDownloader:
         format_string: str,
         output_filename: str,
         progress_callback: Optional[Callable] = None,
-        is_audio_only: bool = False
+        is_audio_only: bool = False,
+        expected_bytes: int = 0
+    ) -> Optional[str]:
+        """
+        دانلود با ادغام درخواست‌های همزمان یکسان (single-flight)
+        
+        درخواست‌های همزمان برای همان ویدیو و فرمت به یک دانلود متصل می‌شوند
+        و همه همان مسیر فایل را دریافت می‌کنند. هر فراخواننده باید بعد از
+        استفاده cleanup() را صدا بزند؛ فایل با آزاد شدن آخرین مصرف‌کننده حذف می‌شود.
+        progress_callback فقط برای فراخواننده‌ای که دانلود را شروع کرده اجرا می‌شود.
+        expected_bytes (filesize فرمت) قبل از شروع روی دیسک رزرو می‌شود؛ اگر فضا
+        کافی نباشد InsufficientDiskSpace بالا می‌رود.
+        """
+        key = self._flight_key(url, format_string, is_audio_only)
+        
+        # نام فایل یکتا برای هر (ویدیو، فرمت) تا دو ویدیو با عنوان یکسان روی هم ننویسند
+        stem, ext = os.path.splitext(output_filename)
+        suffix = self._workspace_id(key)
+        output_filename = f"{stem}_{suffix}{ext}"
+        
+        # دانلودی که در حال لغو است به منتظر جدید داده نمی‌شود؛ بعد از پایانش از نو شروع می‌شود
+        event = self._cancel_events.get(suffix)
+        if event is not None and event.is_set():
+            await self._flight.wait(key)
+        
+        # فایل قبلاً دانلود شده و هنوز توسط کاربر دیگری در حال آپلود است
+        ready_path = self._ready_files.get(key)
+        if ready_path and self._file_refs.get(ready_path, 0) > 0 and os.path.exists(ready_path):
+            self._file_refs[ready_path] += 1
+            logger.info(f"♻️ Reusing downloaded file still in use: {ready_path}")
+            return ready_path
+        
+        result_path = await self._flight.do(
+            key, self._download,
+            url, format_string, output_filename, progress_callback, is_audio_only, suffix, expected_bytes
+        )
+        if result_path:
+            self._file_refs[result_path] = self._file_refs.get(result_path, 0) + 1
+            self._ready_files[key] = result_path
+        return result_path
+    
+    async def _download(
+        self,
+        url: str,
+        format_string: str,
+        output_filename: str,
+        progress_callback: Optional[Callable] = None,
+        is_audio_only: bool = False,
+        workspace_id: Optional[str] = None,
+        expected_bytes: int = 0
     ) -> Optional[str]:
         """
         دانلود ویدیو با yt-dlp
@@ -35,14 +193,29 @@ class YouTubeDownloader:
             format_string: فرمت مورد نظر (مثل "137+140" یا "251")
             output_filename: نام فایل خروجی
             progress_callback: تابع callback برای نمایش پیشرفت
+            workspace_id: شناسه workspace؛ فایل‌های نیمه‌کاره بین تلاش‌ها (و درخواست‌های بعدی) حفظ می‌شوند
+            expected_bytes: حجم مورد انتظار برای رزرو فضای دیسک
         
         Returns:
             مسیر فایل دانلود شده یا None در صورت خطا
         """
+        cancel_event = threading.Event()
+        if workspace_id:
+            self._cancel_events[workspace_id] = cancel_event
+        try:
+            ws = await workspace_manager.acquire(
+                'youtube', expected_bytes, workspace_id=workspace_id, factor=RESERVE_FACTOR
+            )
+        except BaseException:
+            self._cancel_events.pop(workspace_id, None)
+            raise
+        workspace = ws.path
+        result_path = None
         try:
-            output_path = os.path.join(self.download_dir, output_filename)
+            output_path = os.path.join(workspace, output_filename)
             
-            # Remove existing file
+            # فایل نهایی قبلی معتبر نیست (ممکن است postprocess آن ناقص مانده باشد)؛
+            # فایل‌های .part برای ادامه دانلود نگه داشته می‌شوند
             if os.path.exists(output_path):
                 try:
                     os.unlink(output_path)
@@ -51,6 +224,8 @@ class YouTubeDownloader:
             
             # Progress hook for yt-dlp
             def progress_hook(d):
+                if cancel_event.is_set():
+                    raise DownloadCancelled('download aborted')
                 if progress_callback and callable(progress_callback) and d['status'] == 'downloading':
                     try:
                         downloaded = d.get('downloaded_bytes', 0)
@@ -78,7 +253,7 @@ class YouTubeDownloader:
                 'outtmpl': output_path,
                 'quiet': True,
                 'no_warnings': True,
-                'progress_hooks': [progress_hook] if progress_callback else [],
+                'progress_hooks': [progress_hook],
                 
                 # 🔥 PERFORMANCE: Speed optimizations
                 'concurrent_fragment_downloads': 4,  # 4 fragments همزمان (متعادل)
@@ -89,8 +264,8 @@ class YouTubeDownloader:
                 'retries': 10,
                 'fragment_retries': 15,
                 'retry_sleep_functions': {
-                    'http': lambda n: min(2 * (2 ** n), 20),
-                    'fragment': lambda n: min(1 * (2 ** n), 10),
+                    'http': Backoff(2, 20),
+                    'fragment': Backoff(1, 10),
                 },
                 'socket_timeout': 45,
                 'read_timeout': 45,
@@ -101,6 +276,9 @@ class YouTubeDownloader:
                 # 🤖 Bot Detection Prevention (Updated to Chrome 124)
                 'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36',
                 
+                # ⏯️ RESUME: ادامه از .part با Range request در تلاش بعدی
+                'continuedl': True,
+                
                 # 🧹 CLEANUP: File management
                 'keepvideo': False,
                 'ignoreerrors': False,
@@ -108,35 +286,19 @@ class YouTubeDownloader:
             
             # تنظیمات مخصوص فایل‌های صوتی
             if is_audio_only:
-                # برای audio، نام فایل را بدون پسوند تنظیم می‌کنیم
-                # چون FFmpeg خودش .mp3 اضافه می‌کند
-                if output_path.endswith('.mp3'):
-                    output_path_no_ext = output_path[:-4]
-                else:
-                    output_path_no_ext = os.path.splitext(output_path)[0]
-                
-                ydl_opts['outtmpl'] = output_path_no_ext
+                # پسوند از فرمت انتخاب‌شده می‌آید (m4a/webm/...)؛ تبدیل فقط در صورت نیاز
+                # توسط transcode_policy بعد از دانلود انجام می‌شود
+                output_path_no_ext = os.path.splitext(output_path)[0]
                 ydl_opts.update({
-                    # استفاده از format selector عمومی‌تر برای صوت
-                    'format': 'bestaudio/best',  # بهترین صوت موجود
-                    'postprocessors': [{
-                        'key': 'FFmpegExtractAudio',
-                        'preferredcodec': 'mp3',
-                        'preferredquality': '192',
-                    }],
-                    'merge_output_format': 'mp3',
+                    'outtmpl': output_path_no_ext + '.%(ext)s',
+                    'format': AUDIO_FORMAT,  # m4a (AAC) اول → بدون encode
                 })
-                # فایل نهایی با .mp3 خواهد بود
-                output_path = output_path_no_ext + '.mp3'
+                output_path = output_path_no_ext + '.m4a'
             else:
-                # تنظیمات مخصوص ویدیو
+                # تنظیمات مخصوص ویدیو: merge فقط با کپی stream ها؛ صدای ناسازگار با MP4
+                # بعد از دانلود توسط transcode_policy تبدیل می‌شود
                 ydl_opts.update({
                     'merge_output_format': 'mp4',
-                    'postprocessor_args': [
-                        '-c:v', 'copy',
-                        '-c:a', 'aac',
-                        '-b:a', '128k'
-                    ],
                 })
             
             # Add cookies if available
@@ -156,21 +318,29 @@ class YouTubeDownloader:
                 max_attempts = 3
                 # ✅ لیست fallback برای format (در صورت نیاز)
                 format_fallbacks = ['bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best', 'bestvideo+bestaudio/best', 'best']
+                if is_audio_only:
+                    format_fallbacks = AUDIO_FALLBACK_FORMATS
                 
                 # 🔥 Track if we need to use bot detection bypass
                 use_bot_bypass = False
                 
                 for attempt in range(max_attempts):
+                    if cancel_event.is_set():
+                        raise DownloadCancelled('download aborted')
                     try:
                         logger.info(f"Download attempt {attempt + 1}/{max_attempts}")
                         
-                        # Remove partial file if exists
+                        # فقط فایل نهایی ناقص حذف می‌شود؛ .part ها ادامه داده می‌شوند
                         if os.path.exists(output_path):
                             try:
                                 os.unlink(output_path)
                             except:
                                 pass
                         
+                        partial = _partial_bytes(workspace)
+                        if partial:
+                            logger.info(f"⏯️ Resuming download with {partial / (1024 * 1024):.1f} MB already on disk")
+                        
                         # استفاده از format fallback در صورت خطا
                         current_opts = ydl_opts.copy()
                         
@@ -190,13 +360,16 @@ class YouTubeDownloader:
                             logger.warning(f"Attempt {attempt + 1}: Using fallback format: {fallback_format}")
                             current_opts['format'] = fallback_format
                         
-                        with yt_dlp.YoutubeDL(current_opts) as ydl:
-                            ydl.download([url])
+                        # merge/extract-audio از pool مشترک ffmpeg slot می‌گیرند
+                        with ffmpeg_runner.postprocessor_gate() as gate:
+                            current_opts['postprocessor_hooks'] = [gate.hook]
+                            info = ytdlp_process_pool.download(url, current_opts, name='youtube_download')
                         
                         # Check if file was created successfully
-                        if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
+                        final_path = downloaded_path(info, output_path)
+                        if os.path.exists(final_path) and os.path.getsize(final_path) > 0:
                             logger.info(f"Download successful on attempt {attempt + 1}")
-                            return output_path
+                            return final_path, info
                         else:
                             raise Exception("Downloaded file is empty or missing")
                     
@@ -204,7 +377,11 @@ class YouTubeDownloader:
                         # ✅ مدیریت KeyboardInterrupt جداگانه
                         logger.warning("Download interrupted by user")
                         raise
+                    except DownloadCancelled:
+                        raise
                     except Exception as e:
+                        if cancel_event.is_set():
+                            raise DownloadCancelled('download aborted')
                         error_msg = str(e).lower()
                         logger.warning(f"Download attempt {attempt + 1} failed: {e}")
                         
@@ -234,29 +411,12 @@ class YouTubeDownloader:
                             
                             if attempt < max_attempts - 1:
                                 wait_time = (attempt + 1) * 3  # 3, 6, 9 seconds
-                                logger.info(f"Waiting {wait_time} seconds before retry...")
+                                logger.info(f"Waiting {wait_time} seconds before retry (resuming fragments)...")
                                 time.sleep(wait_time)
-                                
-                                # ✅ پاک کردن تمام فایل‌های موقت با try/except
-                                try:
-                                    temp_files = glob.glob(f"{output_path}.*")
-                                    for temp_file in temp_files:
-                                        try:
-                                            os.unlink(temp_file)
-                                            logger.info(f"Cleaned up temp file: {temp_file}")
-                                        except:
-                                            pass
-                                except Exception as cleanup_error:
-                                    logger.debug(f"Cleanup error: {cleanup_error}")
                                 continue
                         
                         # Check for other retryable errors
-                        elif any(keyword in error_msg for keyword in [
-                            'connection reset',
-                            'timeout',
-                            'network',
-                            'temporary failure'
-                        ]):
+                        elif _is_transient_error(error_msg):
                             if attempt < max_attempts - 1:
                                 wait_time = (attempt + 1) * 2  # 2, 4, 6 seconds
                                 logger.info(f"Retrying in {wait_time} seconds...")
@@ -272,11 +432,20 @@ class YouTubeDownloader:
             
             # ✅ استفاده از time که در بالا import شده
             download_start = time.time()
-            result_path = await loop.run_in_executor(None, _download_with_retry)
+            result_path, info = await loop.run_in_executor(None, _download_with_retry)
             download_time = time.time() - download_start
+            if cancel_event.is_set():
+                # process pool: دانلود تا پایان اجرا شد ولی دیگر مصرف‌کننده‌ای ندارد
+                raise DownloadCancelled('download aborted')
+            
+            # 🎛️ stream copy اگر codec ها مناسب تلگرام باشند، در غیر این صورت transcode
+            if is_audio_only:
+                result_path = await transcode_policy.finalize_audio(result_path, info, job='youtube_audio')
+            else:
+                result_path = await transcode_policy.finalize_video(result_path, info, job='youtube_video')
             
             # Verify file exists
-            if os.path.exists(result_path) and os.path.getsize(result_path) > 0:
+            if result_path and os.path.exists(result_path) and os.path.getsize(result_path) > 0:
                 file_size_mb = os.path.getsize(result_path) / (1024 * 1024)
                 speed_mbps = file_size_mb / download_time if download_time > 0 else 0
                 logger.info(f"✅ Download completed: {file_size_mb:.2f} MB in {download_time:.2f}s ({speed_mbps:.2f} MB/s)")
@@ -284,6 +453,7 @@ class YouTubeDownloader:
                 # ✅ ثبت موفقیت استفاده از کوکی
                 mark_cookie_success()
                 
+                self._workspaces[result_path] = ws
                 return result_path
             else:
                 logger.error(f"Download failed: file not found or empty")
@@ -291,17 +461,6 @@ class YouTubeDownloader:
                 # ❌ ثبت شکست استفاده از کوکی
                 mark_cookie_failure()
                 
-                # ✅ پاک کردن فایل‌های موقت در صورت شکست
-                try:
-                    temp_files = glob.glob(f"{output_path}.*")
-                    for temp_file in temp_files:
-                        try:
-                            os.unlink(temp_file)
-                            logger.debug(f"Cleaned up temp file: {temp_file}")
-                        except:
-                            pass
-                except:
-                    pass
                 return None
                 
         except KeyboardInterrupt:
@@ -309,32 +468,45 @@ class YouTubeDownloader:
             logger.warning("Download interrupted by user at top level")
             mark_cookie_failure()  # ثبت شکست
             raise
+        except DownloadCancelled:
+            logger.info(f"🛑 Download aborted: {url} ({format_string})")
+            return None
         except Exception as e:
             logger.error(f"Download error: {e}")
             
             # ❌ ثبت شکست استفاده از کوکی
             mark_cookie_failure()
             
-            # ✅ پاک کردن فایل‌های موقت در صورت exception با بررسی امن
-            try:
-                if 'output_path' in locals():
-                    temp_files = glob.glob(f"{output_path}.*")
-                    for temp_file in temp_files:
-                        try:
-                            os.unlink(temp_file)
-                            logger.debug(f"Cleaned up temp file: {temp_file}")
-                        except:
-                            pass
-            except Exception as cleanup_error:
-                logger.debug(f"Final cleanup error: {cleanup_error}")
+            # خطای موقت: .part ها برای درخواست بعدی همین (ویدیو، فرمت) می‌مانند
+            if _is_transient_error(str(e)) and _partial_bytes(workspace):
+                logger.info(f"⏯️ Keeping partial download for resume: {workspace}")
+                ws.keep()
             return None
+        finally:
+            if self._cancel_events.get(workspace_id) is cancel_event:
+                self._cancel_events.pop(workspace_id, None)
+            if result_path not in self._workspaces:
+                # شکست یا لغو: رزرو آزاد و workspace حذف می‌شود (مگر برای resume نگه داشته شده باشد)
+                workspace_manager.release(ws)
     
     def cleanup(self, file_path: str):
-        """حذف فایل دانلود شده"""
+        """حذف فایل دانلود شده (پس از آزاد شدن توسط همه مصرف‌کننده‌ها)"""
+        refs = self._file_refs.get(file_path, 0) - 1
+        if refs > 0:
+            self._file_refs[file_path] = refs
+            logger.info(f"File still in use by {refs} request(s), keeping: {file_path}")
+            return
+        self._file_refs.pop(file_path, None)
+        for key, path in list(self._ready_files.items()):
+            if path == file_path:
+                self._ready_files.pop(key, None)
+        
         try:
             if file_path and os.path.exists(file_path):
                 os.unlink(file_path)
                 logger.info(f"Cleaned up: {file_path}")
+            # workspace (thumbnail و قطعه‌های فرمت‌های fallback) هم حذف و رزرو آزاد می‌شود
+            workspace_manager.release(self._workspaces.pop(file_path, None))
         except Exception as e:
             logger.warning(f"Cleanup error: {e}")
 
@@ -0,0 +1,180 @@
+"""
+YouTube Format Selector - انتخاب فرمت با یک بار پیمایش
+لیست formats از info dict یوتیوب یک بار ایندکس می‌شود (bucket بر اساس ارتفاع و نوع:
+combined / video-only / audio-only) و سپس برای هر کیفیت فقط bucket های مربوط بررسی می‌شوند.
+
+قوانین انتخاب همان منطق قبلی extract_video_info است:
+ارتفاع دقیق → ±10px → نگاشت portrait، ابتدا قالب ترکیبی و سپس video+audio جداگانه؛
+بین کاندیداها بیشترین (fps, tbr) و در تساوی، اولی در لیست اصلی.
+برای صدا m4a (AAC) مقدم است تا merge و ارسال صوت بدون encode انجام شود (transcode_policy).
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+from plugins.logger_config import get_logger
+
+logger = get_logger('youtube_format_selector')
+
+# کیفیت‌های پشتیبانی‌شده
+SUPPORTED_QUALITIES = ['360', '480', '720', '1080']
+
+VIDEO_EXTS = ('mp4', 'webm')
+SEPARATE_AUDIO_EXTS = ('m4a', 'webm')
+FALLBACK_AUDIO_EXTS = ('mp4', 'webm', 'm4a')
+HEIGHT_TOLERANCE = 10
+
+# شورت‌س (portrait) → نگاشت به landscape
+PORTRAIT_MAP = {
+    360: [640, 426, 256],
+    480: [854, 640, 426],
+    720: [1280, 854],
+    1080: [1920, 1280],
+}
+
+
+def _video_rank(item: Tuple[int, dict]) -> tuple:
+    idx, f = item
+    return (f.get('fps', 0) or 0, f.get('tbr', 0) or 0, -idx)
+
+
+def _is_aac(f: dict) -> bool:
+    return f.get('ext') == 'm4a' or (f.get('acodec') or '').startswith('mp4a')
+
+
+class FormatIndex:
+    """ایندکس formats بر اساس نوع و ارتفاع (یک بار پیمایش)"""
+
+    def __init__(self, formats: List[dict]):
+        # height -> [(idx, format)] به ترتیب لیست اصلی
+        self.combined: Dict[object, List[Tuple[int, dict]]] = {}
+        self.video_only: Dict[object, List[Tuple[int, dict]]] = {}
+        self.audio_only: List[Tuple[int, dict]] = []
+        self.separate_audio: List[Tuple[int, dict]] = []
+        self.fallback_audio: List[Tuple[int, dict]] = []
+
+        for idx, f in enumerate(formats):
+            vcodec = f.get('vcodec')
+            acodec = f.get('acodec')
+            ext = f.get('ext')
+            has_video = vcodec != 'none'
+            has_audio = acodec != 'none'
+
+            if has_video and ext in VIDEO_EXTS:
+                height = f.get('height')
+                if height is not None:
+                    bucket = self.combined if has_audio else self.video_only
+                    bucket.setdefault(height, []).append((idx, f))
+
+            if has_audio:
+                if vcodec == 'none':
+                    self.audio_only.append((idx, f))
+                    if ext in SEPARATE_AUDIO_EXTS:
+                        self.separate_audio.append((idx, f))
+                if ext in FALLBACK_AUDIO_EXTS:
+                    self.fallback_audio.append((idx, f))
+
+    @staticmethod
+    def _near(bucket: Dict[object, List[Tuple[int, dict]]], target: int) -> List[Tuple[int, dict]]:
+        """کاندیداهای ±HEIGHT_TOLERANCE (فقط ارتفاع‌های عددی)"""
+        found = []
+        for height, items in bucket.items():
+            if isinstance(height, (int, float)) and abs(int(height) - target) <= HEIGHT_TOLERANCE:
+                found.extend(items)
+        return found
+
+    def best_video(self, bucket: Dict[object, List[Tuple[int, dict]]], target: int,
+                   kind: str) -> Optional[dict]:
+        """بهترین فرمت برای ارتفاع هدف: دقیق → ±10px → portrait"""
+        candidates = bucket.get(target)
+        if not candidates:
+            candidates = self._near(bucket, target)
+        if not candidates:
+            for ph in PORTRAIT_MAP.get(target, ()):
+                candidates = bucket.get(ph)
+                if candidates:
+                    logger.debug(f"Portrait {kind} mapped: {target}p → {ph}p")
+                    break
+        if not candidates:
+            return None
+        return max(candidates, key=_video_rank)[1]
+
+    def best_separate_audio(self) -> Optional[dict]:
+        if not self.separate_audio:
+            return None
+        return max(self.separate_audio, key=lambda item: (_is_aac(item[1]), item[1].get('abr', 0) or 0, -item[0]))[1]
+
+    def best_audio(self) -> Optional[dict]:
+        pool = self.audio_only or self.fallback_audio
+        if not pool:
+            return None
+        return max(pool, key=lambda item: (_is_aac(item[1]), item[1].get('abr', 0) or item[1].get('tbr', 0) or 0, -item[0]))[1]
+
+
+def select_qualities(formats: List[dict], qualities: List[str] = SUPPORTED_QUALITIES) -> dict:
+    """
+    ساخت available_qualities برای کیبورد انتخاب کیفیت
+    خروجی: {'360': {...}, ..., 'audio': {...}}
+    """
+    index = FormatIndex(formats or [])
+    available_qualities: dict = {}
+    best_audio_for_video = index.best_separate_audio()
+
+    for quality in qualities:
+        target_height = int(quality)
+
+        best = index.best_video(index.combined, target_height, 'combined')
+        if best is not None:
+            available_qualities[quality] = {
+                'format_string': best['format_id'],
+                'filesize': best.get('filesize', 0) or 0,
+                'fps': best.get('fps', 30),
+                'ext': best.get('ext', 'mp4'),
+                'type': 'combined',
+                'actual_height': best.get('height'),
+                'actual_width': best.get('width')
+            }
+            logger.debug(f"Combined {quality}p → {best['format_id']} (h={best.get('height')})")
+            continue
+
+        best_video = index.best_video(index.video_only, target_height, 'video')
+        if best_video is None or best_audio_for_video is None:
+            # هیچ فایلی یافت نشد (یا صدای جداگانه نداشت) → کیفیت بعدی
+            continue
+
+        available_qualities[quality] = {
+            'video_id': best_video['format_id'],
+            'audio_id': best_audio_for_video['format_id'],
+            'format_string': f"{best_video['format_id']}+{best_audio_for_video['format_id']}",
+            'filesize': (best_video.get('filesize', 0) or 0) +
+                        (best_audio_for_video.get('filesize', 0) or 0),
+            'fps': best_video.get('fps', 30),
+            'ext': 'mp4',
+            'type': 'separate',
+            'actual_height': best_video.get('height'),
+            'actual_width': best_video.get('width')
+        }
+        logger.debug(
+            f"Separate {quality}p → v:{best_video['format_id']} a:{best_audio_for_video['format_id']} "
+            f"(h={best_video.get('height')})"
+        )
+
+    # گزینهٔ فقط صدا
+    best_audio = index.best_audio()
+    if best_audio is not None:
+        available_qualities['audio'] = {
+            'format_string': 'bestaudio',
+            'filesize': best_audio.get('filesize', 0) or 0,
+            'ext': 'm4a' if _is_aac(best_audio) else 'mp3',  # بدون تبدیل اگر AAC باشد
+            'type': 'audio_only'
+        }
+        logger.debug(f"Audio only → {best_audio['format_id']}")
+    else:
+        available_qualities['audio'] = {
+            'format_string': 'best',
+            'filesize': 0,
+            'ext': 'mp3',
+            'type': 'audio_only'
+        }
+        logger.warning("No audio formats found – falling back to 'best'")
+
+    return available_qualities
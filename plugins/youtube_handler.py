@@ -4,6 +4,7 @@ YouTube Handler - سیستم جدید و بهینه دانلود از یوتیو
 """
 
 import os
+import copy
 import time
 import asyncio
 import html
@@ -18,12 +19,30 @@ from pyrogram.types import (
     Message, InlineKeyboardMarkup, InlineKeyboardButton
 )
 from pyrogram.enums import ParseMode
-from pyrogram.errors import MessageIdInvalid
 
 from plugins.db_wrapper import DB
 from plugins.logger_config import get_logger
+from plugins.http_client import http_client
+from plugins.single_flight import SingleFlight
+from plugins.simple_metrics import metrics
+from plugins.youtube_format_selector import SUPPORTED_QUALITIES, select_qualities
 from plugins.start import join  # 🔒 Import فیلتر عضویت اسپانسری
-import yt_dlp
+from plugins.ytdlp_process_pool import ytdlp_process_pool
+from plugins.youtube_prefetch import youtube_prefetcher
+
+try:
+    from config import YOUTUBE_INFO_CACHE_TTL, YOUTUBE_INFO_STALE_TTL, YOUTUBE_INFO_EXPIRY_MARGIN
+except Exception:
+    YOUTUBE_INFO_CACHE_TTL = 1800
+    YOUTUBE_INFO_STALE_TTL = 3600
+    YOUTUBE_INFO_EXPIRY_MARGIN = 900
+
+try:
+    from config import YOUTUBE_PREVIEW_ENABLED, YOUTUBE_PREVIEW_TIMEOUT, YOUTUBE_PREVIEW_CACHE_TTL
+except Exception:
+    YOUTUBE_PREVIEW_ENABLED = True
+    YOUTUBE_PREVIEW_TIMEOUT = 3.0
+    YOUTUBE_PREVIEW_CACHE_TTL = 86400
 
 # ------------------------------------------------------------------- #
 # Logger
@@ -38,34 +57,61 @@ class TTLCache:
     """
     Simple Time-To-Live cache with automatic cleanup.
     Prevents memory leaks by removing expired entries.
+    
+    با stale_seconds > 0 هر entry بعد از انقضا تا مدتی به صورت stale قابل
+    دریافت است (get_with_state) تا بتوان آن را در پس‌زمینه تازه کرد.
     """
-    def __init__(self, ttl_seconds: int = 600):
-        self.cache: dict[int, dict] = {}
+    def __init__(self, ttl_seconds: int = 600, stale_seconds: int = 0):
+        self.cache: dict = {}
         self.ttl = ttl_seconds
+        self.stale_ttl = stale_seconds
         self._cleanup_task = None
-        logger.info(f"✅ TTL Cache initialized (TTL: {ttl_seconds}s)")
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        logger.info(f"✅ TTL Cache initialized (TTL: {ttl_seconds}s, stale: {stale_seconds}s)")
     
-    def set(self, key: int, value: dict):
+    def set(self, key, value: dict, ttl: int = None, stale_until: float = None):
         """Set a cache entry with expiration timestamp"""
+        now = time.time()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        if stale_until is None:
+            stale_until = expires_at + self.stale_ttl
         self.cache[key] = {
             'data': value,
-            'expires_at': time.time() + self.ttl
+            'expires_at': expires_at,
+            'stale_until': max(expires_at, stale_until)
         }
     
-    def get(self, key: int):
+    def get(self, key):
         """Get a cache entry if not expired"""
-        if key not in self.cache:
-            return None
-        
-        entry = self.cache[key]
-        if time.time() > entry['expires_at']:
+        data, stale = self.get_with_state(key, allow_stale=False)
+        return data
+    
+    def get_with_state(self, key, allow_stale: bool = True):
+        """
+        Returns (data, is_stale); (None, False) for a miss.
+        stale entries are only returned when allow_stale is True.
+        """
+        entry = self.cache.get(key)
+        now = time.time()
+        if entry is not None and now > entry['stale_until']:
             # Expired - remove it
             del self.cache[key]
-            return None
+            entry = None
+        
+        if entry is None or (now > entry['expires_at'] and not allow_stale):
+            self.misses += 1
+            return None, False
+        
+        if now > entry['expires_at']:
+            self.stale_hits += 1
+            return entry['data'], True
         
-        return entry['data']
+        self.hits += 1
+        return entry['data'], False
     
-    def remove(self, key: int):
+    def remove(self, key):
         """Remove a specific cache entry"""
         self.cache.pop(key, None)
     
@@ -74,7 +120,7 @@ class TTLCache:
         now = time.time()
         expired_keys = [
             k for k, v in self.cache.items()
-            if now > v['expires_at']
+            if now > v['stale_until']
         ]
         for k in expired_keys:
             del self.cache[k]
@@ -106,16 +152,32 @@ class TTLCache:
         """Get cache statistics"""
         now = time.time()
         active = sum(1 for v in self.cache.values() if now <= v['expires_at'])
-        expired = len(self.cache) - active
+        stale = sum(1 for v in self.cache.values() if v['expires_at'] < now <= v['stale_until'])
+        expired = len(self.cache) - active - stale
+        lookups = self.hits + self.stale_hits + self.misses
         return {
             'total': len(self.cache),
             'active': active,
-            'expired': expired
+            'stale': stale,
+            'expired': expired,
+            'hits': self.hits,
+            'stale_hits': self.stale_hits,
+            'misses': self.misses,
+            'hit_rate': ((self.hits + self.stale_hits) / lookups * 100) if lookups else 0.0
         }
 
 # Global TTL cache instance
 video_cache = TTLCache(ttl_seconds=600)  # 10 minutes TTL
 
+# کش اطلاعات ویدیو مشترک بین کاربران (کلید: video id یازده‌کاراکتری)
+youtube_info_cache = TTLCache(ttl_seconds=YOUTUBE_INFO_CACHE_TTL, stale_seconds=YOUTUBE_INFO_STALE_TTL)
+_info_flight = SingleFlight('youtube_info')
+_info_refresh_tasks: dict = {}
+
+# پیش‌نمایش oEmbed (عنوان/کانال/thumbnail) برای مرحله اول پاسخ
+youtube_preview_cache = TTLCache(ttl_seconds=YOUTUBE_PREVIEW_CACHE_TTL)
+_preview_flight = SingleFlight('youtube_preview')
+
 # Start cleanup task when module is imported
 # (will be called when bot starts)
 def init_cache_cleanup():
@@ -123,6 +185,8 @@ def init_cache_cleanup():
     try:
         loop = asyncio.get_event_loop()
         loop.create_task(video_cache.start_cleanup_task(interval_seconds=300))
+        loop.create_task(youtube_info_cache.start_cleanup_task(interval_seconds=300))
+        loop.create_task(youtube_preview_cache.start_cleanup_task(interval_seconds=300))
     except RuntimeError:
         # Event loop not running yet - will be started later
         pass
@@ -133,9 +197,6 @@ try:
 except Exception:
     pass
 
-# ------------------------------------------------------------------- #
-# کیفیت‌های پشتیبانی‌شده (به‌درخواست شما محدود به 4 بود)
-SUPPORTED_QUALITIES = ['360', '480', '720', '1080']
 
 # ------------------------------------------------------------------- #
 # یک ThreadPoolExecutor سراسری (همانند universal_downloader)
@@ -196,7 +257,85 @@ def normalize_youtube_url(url: str) -> str:
         return url
 
 # ------------------------------------------------------------------- #
-async def extract_video_info(url: str) -> dict | None:
+def get_youtube_video_id(url: str) -> str | None:
+    """شناسه یازده‌کاراکتری ویدیو از URL نرمال شده (یا None)"""
+    match = re.search(r'[?&]v=([a-zA-Z0-9_-]{11})', normalize_youtube_url(url))
+    return match.group(1) if match else None
+
+
+def _signed_url_expiry(formats: list) -> float | None:
+    """زودترین زمان انقضای لینک‌های امضا شده googlevideo (پارامتر expire)"""
+    expiries = []
+    for f in formats:
+        try:
+            expire = parse_qs(urlparse(f.get('url') or '').query).get('expire')
+            if expire:
+                expiries.append(float(expire[0]))
+        except (TypeError, ValueError):
+            continue
+    return min(expiries) if expiries else None
+
+
+async def extract_video_info(url: str, force_refresh: bool = False) -> dict | None:
+    """
+    اطلاعات ویدیو از کش مشترک (کلید: video id) یا yt-dlp
+    
+    - entry تازه: بدون استخراج برگردانده می‌شود
+    - entry stale: فوراً برگردانده و در پس‌زمینه تازه می‌شود
+    - عمر entry از انقضای لینک‌های امضا شده فرمت‌ها بیشتر نمی‌شود
+    هر فراخواننده یک کپی مستقل دریافت می‌کند.
+    """
+    video_id = get_youtube_video_id(url)
+    if not video_id:
+        return await _extract_video_info(url)
+    
+    if not force_refresh:
+        cached, stale = youtube_info_cache.get_with_state(video_id)
+        metrics.log_cache('youtube_info', hit=cached is not None)
+        if cached is not None:
+            logger.info(f"♻️ YouTube info cache {'stale ' if stale else ''}hit: {video_id}")
+            if stale:
+                _schedule_info_refresh(video_id, url)
+            return copy.deepcopy(cached)
+    
+    return await _info_flight.do(video_id, _extract_and_cache_info, video_id, url, copy_result=True)
+
+
+async def _extract_and_cache_info(video_id: str, url: str) -> dict | None:
+    info = await _extract_video_info(url)
+    if info and info.get('qualities'):
+        now = time.time()
+        ttl = YOUTUBE_INFO_CACHE_TTL
+        stale_until = now + YOUTUBE_INFO_CACHE_TTL + YOUTUBE_INFO_STALE_TTL
+        url_expires_at = info.get('url_expires_at')
+        if url_expires_at:
+            usable_until = url_expires_at - YOUTUBE_INFO_EXPIRY_MARGIN
+            ttl = max(0, min(ttl, int(usable_until - now)))
+            stale_until = min(stale_until, usable_until)
+        if ttl > 0:
+            youtube_info_cache.set(video_id, info, ttl=ttl, stale_until=stale_until)
+            logger.info(f"💾 Cached YouTube info for {video_id} (ttl={ttl}s)")
+    return info
+
+
+def _schedule_info_refresh(video_id: str, url: str):
+    """تازه‌سازی entry stale در پس‌زمینه (هر video id حداکثر یک refresh همزمان)"""
+    task = _info_refresh_tasks.get(video_id)
+    if task is not None and not task.done():
+        return
+    
+    async def _refresh():
+        try:
+            await _info_flight.do(video_id, _extract_and_cache_info, video_id, url)
+        except Exception as e:
+            logger.warning(f"Background info refresh failed for {video_id}: {e}")
+        finally:
+            _info_refresh_tasks.pop(video_id, None)
+    
+    _info_refresh_tasks[video_id] = asyncio.create_task(_refresh())
+
+
+async def _extract_video_info(url: str) -> dict | None:
     """استخراج اطلاعات ویدیو با yt‑dlp (به صورت async) با fallback strategy"""
     try:
         # استفاده از کوکی از دیتابیس
@@ -242,8 +381,8 @@ async def extract_video_info(url: str) -> dict | None:
         loop = asyncio.get_running_loop()
 
         def _extract_with_options(opts):
-            with yt_dlp.YoutubeDL(opts) as ydl:
-                return ydl.extract_info(url, download=False)
+            # CPU-bound: در صورت فعال بودن در worker process اجرا می‌شود
+            return ytdlp_process_pool.extract(url, opts, name='youtube_info')
 
         # 🔥 تلاش 1: با تنظیمات پیش‌فرض (همه کیفیت‌ها)
         try:
@@ -284,203 +423,11 @@ async def extract_video_info(url: str) -> dict | None:
             return None
 
         formats = info.get('formats', [])
-        available_qualities: dict = {}
-
-        # ------------------------------------------------------------------- #
-        # بررسی کیفیت‌های درخواست‌شده
-        for quality in SUPPORTED_QUALITIES:
-            target_height = int(quality)
-
-            # 1️⃣  قالب ترکیبی (video + audio در یک فایل)
-            combined_formats = [
-                f for f in formats
-                if f.get('vcodec') != 'none'
-                and f.get('acodec') != 'none'
-                and f.get('height') == target_height
-                and f.get('ext') in ['mp4', 'webm']
-            ]
-
-            # انعطاف‑پذیری ±10px
-            if not combined_formats:
-                combined_formats = [
-                    f for f in formats
-                    if f.get('vcodec') != 'none'
-                    and f.get('acodec') != 'none'
-                    and f.get('height') is not None
-                    and isinstance(f.get('height'), (int, float))
-                    and abs(int(f.get('height')) - target_height) <= 10
-                    and f.get('ext') in ['mp4', 'webm']
-                ]
-
-            # شورت‌س (portrait) → نگاشت به landscape
-            if not combined_formats:
-                portrait_map = {
-                    360: [640, 426, 256],
-                    480: [854, 640, 426],
-                    720: [1280, 854],
-                    1080: [1920, 1280],
-                }
-                if target_height in portrait_map:
-                    for ph in portrait_map[target_height]:
-                        combined_formats = [
-                            f for f in formats
-                            if f.get('vcodec') != 'none'
-                            and f.get('acodec') != 'none'
-                            and f.get('height') == ph
-                            and f.get('ext') in ['mp4', 'webm']
-                        ]
-                        if combined_formats:
-                            logger.info(
-                                f"Portrait format mapped: {quality}p → {ph}p"
-                            )
-                            break
-
-            # ----------------------------------------------------------- #
-            if combined_formats:
-                combined_formats.sort(
-                    key=lambda x: (x.get('fps', 0) or 0,
-                                   x.get('tbr', 0) or 0),
-                    reverse=True
-                )
-                best = combined_formats[0]
-                available_qualities[quality] = {
-                    'format_string': best['format_id'],
-                    'filesize': best.get('filesize', 0) or 0,
-                    'fps': best.get('fps', 30),
-                    'ext': best.get('ext', 'mp4'),
-                    'type': 'combined',
-                    'actual_height': best.get('height')
-                }
-                logger.info(
-                    f"Combined {quality}p → {best['format_id']} (h={best.get('height')})"
-                )
-                continue
-
-            # 2️⃣  قالب جداگانه (video + audio)
-            #   ↳ اینجا بود که در نسخهٔ قبلی متغیر `height` تعریف نشده بود
-            video_formats = [
-                f for f in formats
-                if f.get('vcodec') != 'none'
-                and f.get('acodec') == 'none'
-                and f.get('height') == target_height
-                and f.get('ext') in ['mp4', 'webm']
-            ]
-
-            # ±10px برای video‑only
-            if not video_formats:
-                video_formats = [
-                    f for f in formats
-                    if f.get('vcodec') != 'none'
-                    and f.get('acodec') == 'none'
-                    and f.get('height') is not None
-                    and isinstance(f.get('height'), (int, float))
-                    and abs(int(f.get('height')) - target_height) <= 10
-                    and f.get('ext') in ['mp4', 'webm']
-                ]
-
-            # Portrait‑mapping برای video‑only
-            if not video_formats:
-                portrait_map = {
-                    360: [640, 426, 256],
-                    480: [854, 640, 426],
-                    720: [1280, 854],
-                    1080: [1920, 1280],
-                }
-                if target_height in portrait_map:
-                    for ph in portrait_map[target_height]:
-                        video_formats = [
-                            f for f in formats
-                            if f.get('vcodec') != 'none'
-                            and f.get('acodec') == 'none'
-                            and f.get('height') == ph
-                            and f.get('ext') in ['mp4', 'webm']
-                        ]
-                        if video_formats:
-                            logger.info(
-                                f"Portrait video mapped: {quality}p → {ph}p"
-                            )
-                            break
-
-            if not video_formats:
-                # هیچ فایلی یافت نشد → به کیفیت‌های دیگر می‌رویم
-                continue
-
-            # پیدا کردن بهترین صدا برای این ویدیو
-            audio_formats = [
-                f for f in formats
-                if f.get('acodec') != 'none'
-                and f.get('vcodec') == 'none'
-                and f.get('ext') in ['m4a', 'webm']
-            ]
-
-            if not audio_formats:
-                # اگر صدا جداگانه نداشت، شاید در قالب ترکیبی باشد؛ پس ادامه می‌دهیم
-                continue
-
-            video_formats.sort(
-                key=lambda x: (x.get('fps', 0) or 0,
-                               x.get('tbr', 0) or 0),
-                reverse=True
-            )
-            audio_formats.sort(
-                key=lambda x: x.get('abr', 0) or 0,
-                reverse=True
-            )
-            best_video = video_formats[0]
-            best_audio = audio_formats[0]
-
-            available_qualities[quality] = {
-                'video_id': best_video['format_id'],
-                'audio_id': best_audio['format_id'],
-                'format_string': f"{best_video['format_id']}+{best_audio['format_id']}",
-                'filesize': (best_video.get('filesize', 0) or 0) +
-                            (best_audio.get('filesize', 0) or 0),
-                'fps': best_video.get('fps', 30),
-                'ext': 'mp4',
-                'type': 'separate',
-                'actual_height': best_video.get('height')
-            }
-            logger.info(
-                f"Separate {quality}p → v:{best_video['format_id']} a:{best_audio['format_id']} "
-                f"(h={best_video.get('height')})"
-            )
-
-        # ------------------------------------------------------------------- #
-        # گزینهٔ فقط صدا
-        audio_formats = [
-            f for f in formats
-            if f.get('acodec') != 'none' and f.get('vcodec') == 'none'
-        ]
-
-        if not audio_formats:
-            audio_formats = [
-                f for f in formats
-                if f.get('acodec') != 'none' and f.get('ext') in ['mp4', 'webm', 'm4a']
-            ]
-
-        if audio_formats:
-            audio_formats.sort(
-                key=lambda x: x.get('abr', 0) or x.get('tbr', 0) or 0,
-                reverse=True
-            )
-            best_audio = audio_formats[0]
-            available_qualities['audio'] = {
-                'format_string': 'bestaudio',
-                'filesize': best_audio.get('filesize', 0) or 0,
-                'ext': 'mp3',      # خروجی نهایی تبدیل به mp3 خواهد شد
-                'type': 'audio_only'
-            }
-            logger.info(
-                f"Audio only → {best_audio['format_id']}"
-            )
-        else:
-            available_qualities['audio'] = {
-                'format_string': 'best',
-                'filesize': 0,
-                'ext': 'mp3',
-                'type': 'audio_only'
-            }
-            logger.warning("No audio formats found – falling back to 'best'")
+        select_start = time.perf_counter()
+        available_qualities = select_qualities(formats)
+        logger.info(f"Format selection took {(time.perf_counter() - select_start) * 1000:.1f}ms")
+        for quality, qinfo in available_qualities.items():
+            logger.info(f"{quality} → {qinfo['format_string']} ({qinfo['type']}, h={qinfo.get('actual_height')})")
 
         # ------------------------------------------------------------------- #
         logger.info(f"Total formats discovered: {len(formats)}")
@@ -501,7 +448,8 @@ async def extract_video_info(url: str) -> dict | None:
             'uploader': info.get('uploader', 'Unknown'),
             'view_count': info.get('view_count', 0),
             'url': url,
-            'qualities': available_qualities
+            'qualities': available_qualities,
+            'url_expires_at': _signed_url_expiry(formats)
         }
 
     except Exception as exc:
@@ -569,16 +517,16 @@ def create_quality_keyboard(qualities: dict) -> InlineKeyboardMarkup:
 async def download_thumbnail(url: str) -> str | None:
     """بارگیری thumbnail و برگرداندن مسیر موقت"""
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, timeout=10) as resp:
-                if resp.status == 200:
-                    data = await resp.read()
-                    tmp = tempfile.NamedTemporaryFile(
-                        suffix=".jpg", delete=False
-                    )
-                    tmp.write(data)
-                    tmp.close()
-                    return tmp.name
+        session = http_client.session()
+        async with session.get(url, timeout=aiohttp.ClientTimeout(total=10)) as resp:
+            if resp.status == 200:
+                data = await resp.read()
+                tmp = tempfile.NamedTemporaryFile(
+                    suffix=".jpg", delete=False
+                )
+                tmp.write(data)
+                tmp.close()
+                return tmp.name
         return None
     except aiohttp.ClientError as ce:
         logger.error(f"Thumbnail download failed (client error): {ce}")
@@ -587,6 +535,82 @@ async def download_thumbnail(url: str) -> str | None:
     return None
 
 
+# ------------------------------------------------------------------- #
+# پیش‌نمایش سریع (مرحله اول پاسخ): oEmbed + thumbnail با video id، بدون yt-dlp
+YOUTUBE_OEMBED_URL = 'https://www.youtube.com/oembed'
+
+
+def youtube_thumbnail_url(video_id: str) -> str:
+    """thumbnail ثابت i.ytimg.com (hqdefault برای همه ویدیوها وجود دارد)"""
+    return f"https://i.ytimg.com/vi/{video_id}/hqdefault.jpg"
+
+
+async def _fetch_preview(video_id: str) -> dict | None:
+    try:
+        session = http_client.session()
+        params = {'url': f'https://www.youtube.com/watch?v={video_id}', 'format': 'json'}
+        async with session.get(
+            YOUTUBE_OEMBED_URL, params=params,
+            timeout=aiohttp.ClientTimeout(total=YOUTUBE_PREVIEW_TIMEOUT)
+        ) as resp:
+            if resp.status != 200:
+                # ویدیوی خصوصی/حذف شده یا embed غیرفعال: فقط مرحله دوم
+                logger.info(f"oEmbed unavailable for {video_id}: HTTP {resp.status}")
+                return None
+            data = await resp.json(content_type=None)
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+        logger.debug(f"oEmbed failed for {video_id}: {e}")
+        return None
+
+    preview = {
+        'title': data.get('title') or 'Unknown',
+        'uploader': data.get('author_name') or 'Unknown',
+        'thumbnail': youtube_thumbnail_url(video_id),
+        'photo_file_id': None,  # بعد از اولین ارسال، thumbnail با file_id فرستاده می‌شود
+    }
+    youtube_preview_cache.set(video_id, preview)
+    return preview
+
+
+async def get_youtube_preview(video_id: str) -> dict | None:
+    """عنوان، کانال و thumbnail ویدیو از oEmbed (کش شده؛ entry مشترک است و کپی نمی‌شود)"""
+    cached = youtube_preview_cache.get(video_id)
+    metrics.log_cache('youtube_preview', hit=cached is not None)
+    if cached is not None:
+        return cached
+    return await _preview_flight.do(video_id, _fetch_preview, video_id)
+
+
+async def _send_preview_card(message: Message, preview: dict) -> Message | None:
+    """ارسال کارت عنوان/thumbnail؛ None اگر تلگرام thumbnail را نپذیرد"""
+    caption = (
+        f"🎬 <b>{html.escape(preview['title'])}</b>\n\n"
+        f"👤 <b>کانال:</b> {html.escape(preview['uploader'])}\n\n"
+        f"⏳ در حال دریافت کیفیت‌ها…"
+    )
+    for photo in (preview.get('photo_file_id'), preview['thumbnail']):
+        if not photo:
+            continue
+        try:
+            card = await message.reply_photo(photo=photo, caption=caption, parse_mode=ParseMode.HTML)
+        except Exception as e:
+            logger.debug(f"Preview card send failed ({photo[:60]}): {e}")
+            continue
+        if card.photo:
+            preview['photo_file_id'] = card.photo.file_id
+        return card
+    return None
+
+
+async def _show_response(message: Message, card, status_msg, text: str, parse_mode, reply_markup=None):
+    """نمایش متن روی پیام مرحله اول (caption کارت یا پیام وضعیت) یا در پیام جدید"""
+    if card is not None:
+        return await card.edit_caption(caption=text, parse_mode=parse_mode, reply_markup=reply_markup)
+    if status_msg is not None:
+        return await status_msg.edit_text(text=text, parse_mode=parse_mode, reply_markup=reply_markup)
+    return await message.reply_text(text, parse_mode=parse_mode, reply_markup=reply_markup)
+
+
 # ------------------------------------------------------------------- #
 @Client.on_message(
     filters.regex(
@@ -628,16 +652,39 @@ async def handle_youtube_link(client: Client, message: Message):
     request_id = db.log_request(user_id=user_id, platform='youtube', url=url, status='pending')
     logger.info(f"Request logged with ID: {request_id}")
 
-    # پیام وضعیت اولیه
-    logger.info(f"Sending status message to user...")
-    status_msg = await message.reply_text(
-        "🔄 در حال پردازش لینک یوتیوب…\n⏳ لطفاً چند لحظه صبر کنید…"
-    )
-    logger.info(f"Status message sent")
+    # ------------------------------------------------------------------- #
+    # مرحله اول: کارت پیش‌نمایش (oEmbed + thumbnail) همزمان با استخراج کامل؛
+    # مرحله دوم: کیبورد کیفیت‌ها روی همان پیام بعد از پایان استخراج
+    card = None        # پیام عکس‌دار مرحله اول
+    status_msg = None  # پیام وضعیت ساده (وقتی پیش‌نمایش در دسترس نیست)
+    first_response = None
+    extract_task = asyncio.create_task(extract_video_info(url))
 
     try:
+        video_id = get_youtube_video_id(url)
+        if YOUTUBE_PREVIEW_ENABLED and video_id:
+            preview_task = asyncio.create_task(get_youtube_preview(video_id))
+            await asyncio.wait(
+                {extract_task, preview_task},
+                timeout=YOUTUBE_PREVIEW_TIMEOUT,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            # اگر استخراج زودتر تمام شد (کش)، مستقیم کیبورد نمایش داده می‌شود
+            if not extract_task.done() and preview_task.done() and not preview_task.exception():
+                preview = preview_task.result()
+                if preview:
+                    card = await _send_preview_card(message, preview)
+
+        if card is None and not extract_task.done():
+            status_msg = await message.reply_text(
+                "🔄 در حال پردازش لینک یوتیوب…\n⏳ لطفاً چند لحظه صبر کنید…"
+            )
+        if card is not None or status_msg is not None:
+            first_response = time.time() - start
+            logger.info(f"First response ({'preview card' if card else 'status'}) in {first_response:.2f}s")
+
         # استخراج اطلاعات ویدیو
-        video_info = await extract_video_info(url)
+        video_info = await extract_task
 
         if not video_info or not video_info.get('qualities'):
             # به‌روزرسانی وضعیت به failed
@@ -649,7 +696,8 @@ async def handle_youtube_link(client: Client, message: Message):
                 error_message='امکان دریافت اطلاعات ویدیو وجود ندارد'
             )
             
-            await status_msg.edit_text(
+            await _show_response(
+                message, card, status_msg,
                 "❌ **خطا در پردازش ویدیو**\n\n"
                 "امکان دریافت اطلاعات ویدیو وجود ندارد.\n"
                 "لطفاً موارد زیر را بررسی کنید:\n"
@@ -681,33 +729,49 @@ async def handle_youtube_link(client: Client, message: Message):
         # کیبورد کیفیت‌ها
         kb = create_quality_keyboard(video_info['qualities'])
 
-        # دریافت و ارسال thumbnail (اگر موجود باشد)
-        thumbnail_path = None
-        if video_info.get('thumbnail'):
-            thumbnail_path = await download_thumbnail(video_info['thumbnail'])
-
-        if thumbnail_path and os.path.exists(thumbnail_path):
-            # ✅ ارسال تصویر و سپس حذف پیام وضعیت
-            await message.reply_photo(
-                photo=thumbnail_path,
-                caption=info_text,
-                parse_mode=ParseMode.HTML,
-                reply_markup=kb
-            )
-            # حذف پیام وضعیت فقط پس از موفقیت
-            await status_msg.delete()
-            # پاک‌سازی فایل موقت thumbnail
-            try:
-                os.unlink(thumbnail_path)
-            except Exception:
-                pass
+        if card is not None:
+            # کارت پیش‌نمایش از قبل thumbnail دارد؛ فقط caption و کیبورد اضافه می‌شود
+            await card.edit_caption(caption=info_text, parse_mode=ParseMode.HTML, reply_markup=kb)
         else:
-            # اگر thumbnail موجود نیست، فقط متن را ویرایش می‌کنیم
-            await status_msg.edit_text(
-                text=info_text,
-                parse_mode=ParseMode.HTML,
-                reply_markup=kb
-            )
+            # دریافت و ارسال thumbnail (اگر موجود باشد)
+            thumbnail_path = None
+            if video_info.get('thumbnail'):
+                thumbnail_path = await download_thumbnail(video_info['thumbnail'])
+
+            if thumbnail_path and os.path.exists(thumbnail_path):
+                # ✅ ارسال تصویر و سپس حذف پیام وضعیت
+                await message.reply_photo(
+                    photo=thumbnail_path,
+                    caption=info_text,
+                    parse_mode=ParseMode.HTML,
+                    reply_markup=kb
+                )
+                # حذف پیام وضعیت فقط پس از موفقیت
+                if status_msg is not None:
+                    await status_msg.delete()
+                    status_msg = None
+                # پاک‌سازی فایل موقت thumbnail
+                try:
+                    os.unlink(thumbnail_path)
+                except Exception:
+                    pass
+            else:
+                # اگر thumbnail موجود نیست، فقط متن را ویرایش می‌کنیم
+                await _show_response(message, None, status_msg, info_text,
+                                     parse_mode=ParseMode.HTML, reply_markup=kb)
+
+        # ⏱ زمان اولین پاسخ و زمان نمایش کیبورد جداگانه ثبت می‌شوند
+        keyboard_time = time.time() - start
+        if first_response is None:
+            first_response = keyboard_time
+        metrics.log_latency('youtube_first_response', first_response)
+        metrics.log_latency('youtube_keyboard', keyboard_time)
+
+        # 🔮 تا کاربر کیفیت را انتخاب کند، دانلود محتمل‌ترین کیفیت شروع می‌شود
+        try:
+            await youtube_prefetcher.start(user_id, video_info, ttl=video_cache.ttl, db=db)
+        except Exception as e:
+            logger.debug(f"Prefetch start failed: {e}")
 
         # به‌روزرسانی وضعیت به success (نمایش کیفیت‌ها موفق بود)
         processing_time = time.time() - start
@@ -717,8 +781,10 @@ async def handle_youtube_link(client: Client, message: Message):
             processing_time=processing_time
         )
         
-        elapsed = time.time() - start
-        logger.info(f"Quality selection shown in {elapsed:.2f}s برای کاربر {user_id}")
+        logger.info(
+            f"Quality selection shown in {keyboard_time:.2f}s "
+            f"(first response {first_response:.2f}s) برای کاربر {user_id}"
+        )
 
     except Exception as exc:
         # به‌روزرسانی وضعیت به failed
@@ -731,17 +797,17 @@ async def handle_youtube_link(client: Client, message: Message):
         )
         
         logger.error(f"Error handling YouTube link (user {user_id}): {exc}")
-        await status_msg.edit_text(
-            f"❌ **خطا در پردازش ویدیو**\n\nخطا: {str(exc)[:150]}\n\nلطفاً دوباره تلاش کنید.",
-            parse_mode=ParseMode.MARKDOWN
-        )
-    finally:
-        # اگر به هر دلیلی پیام وضعیت باقی مانده بود، سعی می‌کنیم حذفش کنیم
         try:
-            if status_msg and not status_msg.deleted:
-                await status_msg.delete()
-        except (MessageIdInvalid, Exception):
-            pass
+            await _show_response(
+                message, card, status_msg,
+                f"❌ **خطا در پردازش ویدیو**\n\nخطا: {str(exc)[:150]}\n\nلطفاً دوباره تلاش کنید.",
+                parse_mode=ParseMode.MARKDOWN
+            )
+        except Exception as e:
+            logger.debug(f"Failed to report error to user {user_id}: {e}")
+    finally:
+        if not extract_task.done():
+            extract_task.cancel()
         # (در این handler ما هنوز دانلود نهایی را انجام نمی‌دهیم؛ این کار در
         # هندلر callbackهای quality انجام می‌شود، بنابراین در اینجا کش را
         # تمیز نمی‌کنیم؛ ولی می‌توانید با یک TTL یا پس از دانلود حذف کنید.)
@@ -0,0 +1,322 @@
+"""
+YouTube Prefetch - دانلود حدسی محتمل‌ترین کیفیت هنگام نمایش کیبورد
+کاربر معمولاً چند ثانیه تا انتخاب کیفیت فکر می‌کند؛ در این فاصله دانلود کیفیت محتمل
+شروع می‌شود و اگر همان انتخاب شد، دانلود کاربر به آن متصل می‌شود (single-flight).
+
+- پیش‌بینی: کیفیت ذخیره‌شده کاربر (user_settings)، سپس آخرین انتخاب همین کاربر،
+  سپس پرتکرارترین انتخاب سراسری (اگر سهم آن از YOUTUBE_PREFETCH_MIN_SHARE کمتر نباشد)
+- بودجه: حداکثر YOUTUBE_PREFETCH_MAX_ACTIVE دانلود همزمان، حجم حداکثر YOUTUBE_PREFETCH_MAX_MB،
+  فقط وقتی slot دانلود آزاد است و workspace بدون انتظار جا می‌شود
+- انتخاب کیفیت دیگر، لغو یا انقضای کش ویدیو → دانلود لغو و فایل آزاد می‌شود
+"""
+
+import asyncio
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from plugins.logger_config import get_logger, get_performance_logger
+from plugins.concurrency import get_queue_stats
+from plugins.delivery_cache import delivery_cache, canonical_media_id
+from plugins.workspace_manager import workspace_manager
+from plugins.youtube_downloader import youtube_downloader, build_output_filename, RESERVE_FACTOR
+
+try:
+    from config import (
+        YOUTUBE_PREFETCH_ENABLED, YOUTUBE_PREFETCH_MAX_ACTIVE,
+        YOUTUBE_PREFETCH_MAX_MB, YOUTUBE_PREFETCH_MIN_SHARE,
+    )
+except Exception:
+    YOUTUBE_PREFETCH_ENABLED = False
+    YOUTUBE_PREFETCH_MAX_ACTIVE = 2
+    YOUTUBE_PREFETCH_MAX_MB = 150
+    YOUTUBE_PREFETCH_MIN_SHARE = 0.5
+
+logger = get_logger('youtube_prefetch')
+performance_logger = get_performance_logger()
+
+MB = 1024 * 1024
+CHOICES_SETTING_KEY = 'youtube_quality_choices'
+MIN_GLOBAL_SAMPLES = 20   # قبل از این تعداد انتخاب، آمار سراسری قابل اعتماد نیست
+FLUSH_EVERY = 10          # ذخیره شمارنده‌ها در bot_settings هر چند انتخاب
+MAX_USER_HISTORY = 5000
+
+
+class _Prefetch:
+    """یک دانلود حدسی برای یک کاربر"""
+
+    __slots__ = ('url', 'quality', 'format_string', 'is_audio', 'source',
+                 'task', 'timer', 'claimed', 'dropped', 'started', 'finished')
+
+    def __init__(self, url: str, quality: str, format_string: str, source: str):
+        self.url = url
+        self.quality = quality
+        self.format_string = format_string
+        self.is_audio = quality == 'audio'
+        self.source = source
+        self.task: Optional[asyncio.Task] = None
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.claimed = False
+        self.dropped = False
+        self.started = time.time()
+        self.finished = 0.0
+
+
+class YouTubePrefetcher:
+    """پیش‌بینی کیفیت و مدیریت دانلودهای حدسی (یکی برای هر کاربر)"""
+
+    def __init__(self, enabled: bool = YOUTUBE_PREFETCH_ENABLED, max_active: int = YOUTUBE_PREFETCH_MAX_ACTIVE,
+                 max_mb: int = YOUTUBE_PREFETCH_MAX_MB, min_share: float = YOUTUBE_PREFETCH_MIN_SHARE):
+        self.enabled = enabled
+        self.max_active = max(1, max_active)
+        self.max_bytes = max_mb * MB
+        self.min_share = min_share
+        self._entries: Dict[int, _Prefetch] = {}  # user_id -> prefetch
+        self._last_choice: 'OrderedDict[int, str]' = OrderedDict()
+        self._choice_counts: Optional[Dict[str, int]] = None  # lazy از bot_settings
+        self._unsaved = 0
+        self.stats = {
+            'started': 0,
+            'skipped': 0,
+            'hits': 0,
+            'misses': 0,
+            'cancelled': 0,
+            'expired': 0,
+            'aborted': 0,
+            'completed': 0,
+            'failed': 0,
+            'wasted_bytes': 0,
+            'saved_seconds': 0.0,
+        }
+        self.skip_reasons: Dict[str, int] = {}
+        logger.info(f"✅ YouTubePrefetcher initialized (enabled={enabled}, max_active={max_active}, max={max_mb}MB)")
+
+    # ---------------------------------------------------------------- #
+    # پیش‌بینی
+
+    def _counts(self) -> Dict[str, int]:
+        if self._choice_counts is None:
+            self._choice_counts = {}
+            try:
+                from plugins.db_wrapper import DB
+                raw = DB().get_bot_setting(CHOICES_SETTING_KEY)
+                if raw:
+                    self._choice_counts = {str(k): int(v) for k, v in json.loads(raw).items()}
+            except Exception as e:
+                logger.debug(f"Failed to load quality choice counts: {e}")
+        return self._choice_counts
+
+    def _flush_counts(self):
+        self._unsaved = 0
+        try:
+            from plugins.db_wrapper import DB
+            DB().set_bot_setting(CHOICES_SETTING_KEY, json.dumps(self._counts()))
+        except Exception as e:
+            logger.debug(f"Failed to save quality choice counts: {e}")
+
+    def record_choice(self, user_id: int, quality: str):
+        """ثبت انتخاب کاربر برای پیش‌بینی‌های بعدی"""
+        self._last_choice[user_id] = quality
+        self._last_choice.move_to_end(user_id)
+        while len(self._last_choice) > MAX_USER_HISTORY:
+            self._last_choice.popitem(last=False)
+        counts = self._counts()
+        counts[quality] = counts.get(quality, 0) + 1
+        self._unsaved += 1
+        if self._unsaved >= FLUSH_EVERY:
+            self._flush_counts()
+
+    def predict(self, user_id: int, qualities: dict, db=None) -> Tuple[Optional[str], str]:
+        """(کیفیت محتمل، منبع پیش‌بینی) یا (None, '') اگر پیش‌بینی قابل اعتماد نباشد"""
+        try:
+            if db is None:
+                from plugins.db_wrapper import DB
+                db = DB()
+            saved = str(db.get_user_settings(user_id).get('quality') or 'auto').lower().rstrip('p')
+        except Exception:
+            saved = 'auto'
+        if saved != 'auto' and saved in qualities:
+            return saved, 'setting'
+
+        last = self._last_choice.get(user_id)
+        if last in qualities:
+            return last, 'history'
+
+        counts = {q: n for q, n in self._counts().items() if q in qualities}
+        total = sum(counts.values())
+        if total >= MIN_GLOBAL_SAMPLES:
+            quality, count = max(counts.items(), key=lambda item: item[1])
+            if count / total >= self.min_share:
+                return quality, 'global'
+        return None, ''
+
+    # ---------------------------------------------------------------- #
+    # بودجه
+
+    def _active(self) -> int:
+        return sum(1 for e in self._entries.values() if e.task is not None and not e.task.done())
+
+    def _budget_block(self, quality: str, size: int) -> Optional[str]:
+        if self._active() >= self.max_active:
+            return 'busy'
+        if size > self.max_bytes:
+            return 'too_large'
+        if not size and quality != 'audio':
+            return 'unknown_size'
+        queue = get_queue_stats()
+        if queue['waiting'] or not queue['available']:
+            # پهنای باند متعلق به دانلودهای واقعی است
+            return 'slots_busy'
+        if not workspace_manager.fits(size, factor=RESERVE_FACTOR):
+            return 'disk'
+        return None
+
+    def _skip(self, reason: str):
+        self.stats['skipped'] += 1
+        self.skip_reasons[reason] = self.skip_reasons.get(reason, 0) + 1
+
+    # ---------------------------------------------------------------- #
+    # API
+
+    async def start(self, user_id: int, video_info: dict, ttl: float, db=None):
+        """شروع دانلود حدسی بعد از نمایش کیبورد (ttl = عمر کش ویدیو)"""
+        if not self.enabled:
+            return
+        self.cancel(user_id, reason='replaced')
+
+        qualities = video_info.get('qualities') or {}
+        quality, source = self.predict(user_id, qualities, db)
+        if not quality:
+            self._skip('no_prediction')
+            return
+        quality_info = qualities[quality]
+        size = quality_info.get('filesize') or 0
+        reason = self._budget_block(quality, size)
+        if reason:
+            self._skip(reason)
+            logger.debug(f"Prefetch skipped for user {user_id} ({quality}): {reason}")
+            return
+
+        url = video_info['url']
+        if delivery_cache.get('youtube', canonical_media_id('youtube', url), quality):
+            self._skip('cached')
+            return
+
+        entry = _Prefetch(url, quality, quality_info['format_string'], source)
+        filename = build_output_filename(video_info.get('title'), quality, quality_info)
+        entry.task = asyncio.create_task(self._run(entry, filename, size))
+        entry.timer = asyncio.get_running_loop().call_later(ttl, self._expire, user_id, entry)
+        self._entries[user_id] = entry
+        self.stats['started'] += 1
+        logger.info(f"🔮 Prefetching {quality} for user {user_id} ({source}, {size / MB:.1f}MB)")
+
+    async def _run(self, entry: _Prefetch, filename: str, size: int) -> Optional[str]:
+        try:
+            path = await youtube_downloader.download(
+                url=entry.url,
+                format_string=entry.format_string,
+                output_filename=filename,
+                progress_callback=None,
+                is_audio_only=entry.is_audio,
+                expected_bytes=size
+            )
+        except Exception as e:
+            logger.debug(f"Prefetch download failed: {e}")
+            path = None
+        entry.finished = time.time()
+        if path:
+            self.stats['completed'] += 1
+            performance_logger.info(f"[PREFETCH] {entry.quality} ready in {entry.finished - entry.started:.1f}s")
+        elif not entry.dropped:
+            self.stats['failed'] += 1
+        return path
+
+    def claim(self, user_id: int, url: str, quality: str) -> bool:
+        """
+        انتخاب کاربر: اگر با prefetch یکی باشد True (download() کاربر به آن متصل می‌شود
+        و بعد از پایان کار release() صدا زده شود)، در غیر این صورت prefetch لغو می‌شود
+        """
+        self.record_choice(user_id, quality)
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return False
+        if entry.url != url or entry.quality != quality:
+            self.stats['misses'] += 1
+            self.cancel(user_id, reason='miss')
+            return False
+        entry.claimed = True
+        if entry.timer:
+            entry.timer.cancel()
+        saved = (entry.finished or time.time()) - entry.started
+        self.stats['hits'] += 1
+        self.stats['saved_seconds'] += saved
+        logger.info(f"🎯 Prefetch hit for user {user_id} ({quality}, {entry.source}): ~{saved:.1f}s ahead")
+        return True
+
+    def release(self, user_id: int, url: str, quality: str):
+        """آزاد کردن مرجع prefetch بعد از اینکه دانلود کاربر فایل را گرفته است"""
+        entry = self._entries.get(user_id)
+        if entry is None or not entry.claimed or entry.url != url or entry.quality != quality:
+            return
+        self._entries.pop(user_id, None)
+        self._drop(entry, wasted=False)
+
+    def cancel(self, user_id: int, reason: str = 'cancelled'):
+        """لغو prefetch کاربر (کیفیت دیگر، لغو، لینک جدید یا انقضا)"""
+        entry = self._entries.pop(user_id, None)
+        if entry is None:
+            return
+        if entry.claimed:
+            # دانلود کاربر مرجع خودش را دارد؛ فقط مرجع prefetch آزاد می‌شود
+            self._drop(entry, wasted=False)
+            return
+        if reason != 'miss':
+            self.stats['expired' if reason == 'expired' else 'cancelled'] += 1
+        if not entry.task.done() and youtube_downloader.abort(entry.url, entry.format_string, entry.is_audio):
+            self.stats['aborted'] += 1
+        logger.info(f"🛑 Prefetch {entry.quality} for user {user_id} dropped ({reason})")
+        self._drop(entry, wasted=True)
+
+    def _expire(self, user_id: int, entry: _Prefetch):
+        if self._entries.get(user_id) is entry and not entry.claimed:
+            self.cancel(user_id, reason='expired')
+
+    def _drop(self, entry: _Prefetch, wasted: bool):
+        entry.dropped = True
+        if entry.timer:
+            entry.timer.cancel()
+
+        def _release(task: asyncio.Task):
+            path = None if task.cancelled() else task.result()
+            if not path:
+                return
+            if wasted:
+                try:
+                    self.stats['wasted_bytes'] += os.path.getsize(path)
+                except OSError:
+                    pass
+            youtube_downloader.cleanup(path)
+
+        if entry.task.done():
+            _release(entry.task)
+        else:
+            entry.task.add_done_callback(_release)
+
+    def get_stats(self) -> dict:
+        decided = self.stats['hits'] + self.stats['misses']
+        return {
+            **self.stats,
+            'enabled': self.enabled,
+            'active': self._active(),
+            'pending': len(self._entries),
+            'hit_rate': (self.stats['hits'] / decided * 100) if decided else 0.0,
+            'wasted_mb': self.stats['wasted_bytes'] / MB,
+            'skip_reasons': dict(self.skip_reasons),
+            'samples': sum(self._choice_counts.values()) if self._choice_counts else 0,
+        }
+
+
+# 🔥 Global instance
+youtube_prefetcher = YouTubePrefetcher()
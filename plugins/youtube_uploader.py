@@ -6,10 +6,17 @@ YouTube Uploader - آپلود فوق‌سریع با تنظیمات بهینه
 import os
 import time
 import asyncio
-from typing import Optional, Callable
+from typing import Optional, Callable, Union
 from pyrogram import Client
+from pyrogram.types import Message
 from plugins.logger_config import get_logger
 
+try:
+    from config import PARALLEL_UPLOAD_ENABLED, PARALLEL_UPLOAD_MIN_SIZE_MB
+except Exception:
+    PARALLEL_UPLOAD_ENABLED = True
+    PARALLEL_UPLOAD_MIN_SIZE_MB = 20
+
 logger = get_logger('youtube_uploader')
 
 # 🔥 CRITICAL: Chunk size optimization for high-speed servers
@@ -35,10 +42,13 @@ class YouTubeUploader:
         duration: int = 0,
         thumbnail: Optional[str] = None,
         progress_callback: Optional[Callable] = None,
-        reply_to_message_id: Optional[int] = None
-    ) -> bool:
+        reply_to_message_id: Optional[int] = None,
+        width: int = 0,
+        height: int = 0
+    ) -> Union[Message, bool]:
         """
         آپلود ویدیو با سرعت فوق‌العاده
+        width/height/duration از info dict yt-dlp در صورت وجود جلوی اجرای ffprobe را می‌گیرند
         """
         try:
             file_size = os.path.getsize(file_path)
@@ -127,6 +137,11 @@ class YouTubeUploader:
                     'disable_notification': True
                 }
                 
+                # ابعاد از yt-dlp (بدون ffprobe برای فایل‌های بزرگ)
+                if width and height:
+                    video_kwargs['width'] = width
+                    video_kwargs['height'] = height
+                
                 # اضافه کردن thumbnail اگر موجود باشد
                 temp_thumb = None
                 if thumbnail and os.path.exists(thumbnail):
@@ -138,7 +153,7 @@ class YouTubeUploader:
                     print("🖼️ Generating thumbnail...")
                     try:
                         from plugins.stream_utils import generate_thumbnail
-                        quick_thumb = generate_thumbnail(file_path)
+                        quick_thumb = await generate_thumbnail(file_path)
                         if quick_thumb:
                             video_kwargs['thumb'] = quick_thumb
                             temp_thumb = quick_thumb  # ذخیره برای پاکسازی بعدی
@@ -195,7 +210,7 @@ class YouTubeUploader:
                     # ساخت thumbnail برای فایل‌های کوچک
                     try:
                         from plugins.stream_utils import generate_thumbnail
-                        quick_thumb = generate_thumbnail(file_path)
+                        quick_thumb = await generate_thumbnail(file_path)
                         if quick_thumb:
                             video_kwargs['thumb'] = quick_thumb
                             temp_thumb = quick_thumb  # ذخیره برای پاکسازی بعدی
@@ -206,7 +221,9 @@ class YouTubeUploader:
                 # استخراج metadata برای فایل‌های کوچک
                 try:
                     from plugins.stream_utils import extract_video_metadata
-                    metadata = extract_video_metadata(file_path)
+                    metadata = await extract_video_metadata(
+                        file_path, {'width': width, 'height': height, 'duration': duration}
+                    )
                     if metadata:
                         if metadata.get('width') and metadata.get('height'):
                             video_kwargs['width'] = metadata['width']
@@ -255,7 +272,8 @@ class YouTubeUploader:
                 logger.warning("Check: Network bandwidth, Server CPU, Telegram API limits")
                 print(f"⚠️ Slow upload speed: {upload_speed:.2f} MB/s")
             
-            return True
+            # پیام ارسال شده برگردانده می‌شود تا file_id در delivery cache ذخیره شود
+            return sent or True
             
         except Exception as e:
             logger.error(f"❌ Upload FAILED: {e}")
@@ -273,7 +291,7 @@ class YouTubeUploader:
         thumbnail: Optional[str] = None,
         progress_callback: Optional[Callable] = None,
         reply_to_message_id: Optional[int] = None
-    ) -> bool:
+    ) -> Union[Message, bool]:
         """آپلود فایل صوتی با سرعت بالا"""
         try:
             file_size = os.path.getsize(file_path)
@@ -320,12 +338,88 @@ class YouTubeUploader:
             upload_time = time.time() - upload_start
             logger.info(f"✅ Audio upload completed in {upload_time:.2f}s")
             
-            return True
+            return sent or True
             
         except Exception as e:
             logger.error(f"❌ Audio upload failed: {e}")
             return False
     
+    async def upload_parallel(
+        self,
+        client: Client,
+        chat_id: int,
+        file_path: str,
+        media_type: str,
+        caption: str,
+        duration: int = 0,
+        title: str = "Unknown",
+        performer: str = "Unknown",
+        thumbnail: Optional[str] = None,
+        progress_callback: Optional[Callable] = None,
+        reply_to_message_id: Optional[int] = None,
+        width: int = 0,
+        height: int = 0
+    ) -> Union[Message, bool]:
+        """
+        آپلود با ارسال همزمان قطعات (saveBigFilePart) روی pool اتصال‌های media
+        اگر آپلود قطعات شکست بخورد False برمی‌گرداند تا مسیر عادی Pyrogram استفاده شود؛
+        خطای مرحله ارسال پیام بالا می‌رود (fallback یعنی آپلود دوباره و شاید پیام تکراری)
+        """
+        from plugins.part_uploader import upload_file_parts, send_uploaded_file
+        
+        try:
+            
+            file_size_mb = os.path.getsize(file_path) / (1024*1024)
+            logger.info(f"⚡ Starting PARALLEL upload: {file_size_mb:.2f} MB")
+            upload_start = time.time()
+            
+            send_kwargs = {
+                'duration': duration,
+                'reply_to_message_id': reply_to_message_id,
+                'disable_notification': True,
+            }
+            if media_type == 'audio':
+                send_kwargs.update(title=title, performer=performer, thumb=thumbnail)
+            elif file_size_mb > 500:
+                # هماهنگ با upload_video: فایل‌های خیلی بزرگ به صورت document
+                media_type = 'document'
+                caption = f"🎬 {caption}"
+            else:
+                media_type = 'video'
+                send_kwargs['thumb'] = thumbnail
+                try:
+                    from plugins.stream_utils import extract_video_metadata
+                    metadata = await extract_video_metadata(
+                        file_path, {'width': width, 'height': height, 'duration': duration}
+                    )
+                    if metadata:
+                        send_kwargs['width'] = metadata.get('width') or 0
+                        send_kwargs['height'] = metadata.get('height') or 0
+                        if metadata.get('duration') and not duration:
+                            send_kwargs['duration'] = metadata['duration']
+                except Exception as e:
+                    logger.warning(f"⚠️ Metadata extraction failed: {e}")
+            
+            input_file = await upload_file_parts(client, file_path, progress=progress_callback)
+            
+        except Exception as e:
+            logger.error(f"❌ Parallel upload failed: {e}")
+            return False
+        
+        # قطعات روی سرور هستند؛ فقط SendMedia (با retry داخلی) با همان input_file
+        sent = await send_uploaded_file(
+            client, chat_id, input_file, os.path.basename(file_path), media_type,
+            caption=caption, **send_kwargs
+        )
+        
+        upload_time = time.time() - upload_start
+        upload_speed = file_size_mb / upload_time if upload_time > 0 else 0
+        logger.info(f"✅ Parallel upload SUCCESS in {upload_time:.2f}s ({upload_speed:.2f} MB/s)")
+        print(f"✅ Upload completed in {upload_time:.2f}s")
+        print(f"⚡ Upload speed: {upload_speed:.2f} MB/s")
+        
+        return sent or True
+    
     async def upload_with_streaming(
         self,
         client: Client,
@@ -338,11 +432,14 @@ class YouTubeUploader:
         performer: str = "Unknown",
         thumbnail: Optional[str] = None,
         progress_callback: Optional[Callable] = None,
-        reply_to_message_id: Optional[int] = None
-    ) -> bool:
+        reply_to_message_id: Optional[int] = None,
+        width: int = 0,
+        height: int = 0
+    ) -> Union[Message, bool]:
         """
         آپلود با streaming (انتخاب خودکار)
         🔥 این متد اصلی است که از youtube_callback.py صدا زده می‌شود
+        width/height: ابعاد فرمت انتخاب شده از yt-dlp (برای رد کردن ffprobe)
         """
         try:
             # 🔥 اعمال chunk size به session (در صورت امکان)
@@ -355,6 +452,27 @@ class YouTubeUploader:
             except Exception:
                 pass
             
+            # ⚡ فایل‌های بزرگ: آپلود قطعات به صورت همزمان روی چند اتصال
+            if PARALLEL_UPLOAD_ENABLED and os.path.getsize(file_path) >= PARALLEL_UPLOAD_MIN_SIZE_MB * 1024 * 1024:
+                sent = await self.upload_parallel(
+                    client=client,
+                    chat_id=chat_id,
+                    file_path=file_path,
+                    media_type=media_type,
+                    caption=caption,
+                    duration=duration,
+                    title=title,
+                    performer=performer,
+                    thumbnail=thumbnail,
+                    progress_callback=progress_callback,
+                    reply_to_message_id=reply_to_message_id,
+                    width=width,
+                    height=height
+                )
+                if sent:
+                    return sent
+                logger.warning("⚠️ Parallel upload failed, falling back to standard upload")
+            
             if media_type == 'audio':
                 return await self.upload_audio(
                     client=client,
@@ -377,7 +495,9 @@ class YouTubeUploader:
                     duration=duration,
                     thumbnail=thumbnail,
                     progress_callback=progress_callback,
-                    reply_to_message_id=reply_to_message_id
+                    reply_to_message_id=reply_to_message_id,
+                    width=width,
+                    height=height
                 )
                 
         except Exception as e:
@@ -0,0 +1,325 @@
+"""
+yt-dlp Pool - نگهداری نمونه‌های گرم YoutubeDL
+ساخت YoutubeDL برای هر درخواست extractor ها، cookie jar و کش player JS را دوباره بار می‌کند.
+این pool نمونه‌ها را بر اساس profile گزینه‌ها (کوکی، player_client، سیاست فرمت و ...)
+نگه می‌دارد و برای هر job به صورت انحصاری checkout می‌کند.
+
+- گزینه‌های مخصوص هر job (outtmpl، format، progress/postprocessor hooks) روی نمونه
+  گرم اعمال و بعد از job پاک می‌شوند
+- تغییر فایل کوکی از بیرون (mtime) یعنی profile جدید؛ ذخیره کوکی توسط خود pool حساب نمی‌شود
+- کش player/signature در YTDLP_CACHE_DIR روی دیسک ماندگار است
+- نمونه بعد از YTDLP_POOL_MAX_USES استفاده یا YTDLP_POOL_MAX_AGE ثانیه بازیافت می‌شود
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+import yt_dlp
+from plugins.logger_config import get_logger
+
+try:
+    from config import (
+        YTDLP_POOL_ENABLED, YTDLP_POOL_MAX_IDLE, YTDLP_POOL_MAX_USES,
+        YTDLP_POOL_MAX_AGE, YTDLP_CACHE_DIR,
+    )
+except Exception:
+    YTDLP_POOL_ENABLED = True
+    YTDLP_POOL_MAX_IDLE = 4
+    YTDLP_POOL_MAX_USES = 50
+    YTDLP_POOL_MAX_AGE = 1800
+    YTDLP_CACHE_DIR = './data/yt-dlp-cache'
+
+logger = get_logger('ytdlp_pool')
+
+# گزینه‌هایی که برای هر job متفاوت‌اند و جزو profile نیستند
+JOB_KEYS = ('outtmpl', 'format', 'progress_hooks', 'postprocessor_hooks')
+
+
+def _stable(value):
+    """نمایش پایدار گزینه‌ها برای ساخت کلید profile (lambda ها با محل تعریفشان)"""
+    if callable(value):
+        code = getattr(value, '__code__', None)
+        if code is not None:
+            return f"{code.co_filename}:{code.co_firstlineno}:{getattr(value, '__qualname__', '')}"
+        return repr(value)
+    if isinstance(value, dict):
+        return {str(k): _stable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_stable(v) for v in value]
+    return value
+
+
+class Backoff:
+    """
+    تابع retry_sleep قابل pickle (برای ارسال گزینه‌ها به worker process)
+    Backoff(2, 20) ≡ lambda n: min(2 * (2 ** n), 20)
+    """
+
+    __slots__ = ('base', 'cap')
+
+    def __init__(self, base: float, cap: float):
+        self.base = base
+        self.cap = cap
+
+    def __call__(self, n: int) -> float:
+        return min(self.base * (2 ** n), self.cap)
+
+    def __repr__(self) -> str:
+        return f"Backoff({self.base}, {self.cap})"
+
+
+def _mtime(path: Optional[str]) -> Optional[float]:
+    if not path:
+        return None
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+def _profile_key(profile: dict, cookie_generation: int = 0) -> str:
+    data = _stable(profile)
+    data['__cookie_generation'] = cookie_generation
+    raw = json.dumps(data, sort_keys=True, default=repr)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:16]
+
+
+def _apply_job(ydl, job: dict) -> bool:
+    """
+    اعمال گزینه‌های job روی نمونه گرم (یا پاک کردن آن‌ها با job خالی)
+    اگر ساختار داخلی نسخه نصب شده yt-dlp پشتیبانی نشود False برمی‌گرداند.
+    """
+    try:
+        outtmpl = job.get('outtmpl')
+        ydl.params['outtmpl'] = dict(outtmpl) if isinstance(outtmpl, dict) else ({'default': outtmpl} if outtmpl else {})
+        ydl._parse_outtmpl()
+
+        fmt = job.get('format')
+        ydl.params['format'] = fmt
+        ydl.format_selector = fmt if fmt in (None, '-') or callable(fmt) else ydl.build_format_selector(fmt)
+
+        ydl._progress_hooks[:] = list(job.get('progress_hooks') or [])
+        pp_hooks = list(job.get('postprocessor_hooks') or [])
+        ydl._postprocessor_hooks[:] = pp_hooks
+        for pps in ydl._pps.values():
+            for pp in pps:
+                pp._progress_hooks[:] = pp_hooks
+        return True
+    except AttributeError as e:
+        logger.warning(f"yt-dlp instance reuse not supported by this version: {e}")
+        return False
+
+
+class _Entry:
+    __slots__ = ('ydl', 'created', 'uses')
+
+    def __init__(self, ydl):
+        self.ydl = ydl
+        self.created = time.time()
+        self.uses = 0
+
+
+class YtdlpPool:
+    """pool نمونه‌های YoutubeDL بر اساس profile (thread-safe، checkout انحصاری)"""
+
+    def __init__(self, enabled: bool = YTDLP_POOL_ENABLED, max_idle: int = YTDLP_POOL_MAX_IDLE,
+                 max_uses: int = YTDLP_POOL_MAX_USES, max_age: float = YTDLP_POOL_MAX_AGE,
+                 cache_dir: Optional[str] = YTDLP_CACHE_DIR):
+        self.enabled = enabled
+        self.max_idle = max(1, max_idle)
+        self.max_uses = max(1, max_uses)
+        self.max_age = max_age
+        self.cache_dir = cache_dir
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        self._idle: Dict[str, List[_Entry]] = {}
+        # cookiefile -> (آخرین mtime شناخته‌شده، generation)
+        self._cookie_state: Dict[str, tuple] = {}
+        # profile key -> cookiefile (برای حذف نمونه‌های generation قدیمی)
+        self._key_cookie: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self.stats = {
+            'checkouts': 0,
+            'warm_hits': 0,
+            'created': 0,
+            'recycled': 0,
+            'discarded': 0,
+            'unsupported': 0,
+        }
+        self.name_stats: Dict[str, dict] = {}
+        logger.info(f"✅ YtdlpPool initialized (enabled={enabled}, max_idle={self.max_idle}, "
+                    f"max_uses={self.max_uses}, cache_dir={cache_dir})")
+
+    def _split(self, opts: dict):
+        profile = {k: v for k, v in opts.items() if k not in JOB_KEYS}
+        job = {k: opts[k] for k in JOB_KEYS if k in opts}
+        if self.cache_dir and 'cachedir' not in profile:
+            profile['cachedir'] = self.cache_dir
+        return profile, job
+
+    def _cookie_generation(self, cookie_file: Optional[str]) -> int:
+        """generation فایل کوکی؛ فقط با تغییر بیرونی (مثلاً cookie_manager) افزایش می‌یابد"""
+        if not cookie_file:
+            return 0
+        mtime = _mtime(cookie_file)
+        stale: List[_Entry] = []
+        with self._lock:
+            state = self._cookie_state.get(cookie_file)
+            if state is None:
+                state = (mtime, 0)
+            elif state[0] != mtime:
+                state = (mtime, state[1] + 1)
+                for key in [k for k, f in self._key_cookie.items() if f == cookie_file]:
+                    del self._key_cookie[key]
+                    stale.extend(self._idle.pop(key, []))
+            self._cookie_state[cookie_file] = state
+        for entry in stale:
+            self.stats['recycled'] += 1
+            self._close(entry, save_cookies=False)
+        if stale:
+            logger.info(f"🍪 Cookie file changed, dropped {len(stale)} idle yt-dlp instances: {cookie_file}")
+        return state[1]
+
+    def _take(self, key: str) -> Optional[_Entry]:
+        now = time.time()
+        found = None
+        expired: List[_Entry] = []
+        with self._lock:
+            idle = self._idle.get(key)
+            while idle:
+                entry = idle.pop()
+                if now - entry.created <= self.max_age:
+                    found = entry
+                    break
+                expired.append(entry)
+        for entry in expired:
+            self.stats['recycled'] += 1
+            self._close(entry)
+        return found
+
+    def _give_back(self, key: str, entry: _Entry, cookie_file: Optional[str] = None):
+        expired = entry.uses >= self.max_uses or time.time() - entry.created > self.max_age
+        with self._lock:
+            if cookie_file:
+                self._key_cookie[key] = cookie_file
+            idle = self._idle.setdefault(key, [])
+            if not expired and len(idle) < self.max_idle:
+                idle.append(entry)
+                return
+        self.stats['recycled'] += 1
+        self._close(entry)
+
+    def _close(self, entry: _Entry, save_cookies: bool = True):
+        """بستن نمونه؛ close() کوکی‌ها را ذخیره می‌کند که نباید profile را عوض کند"""
+        cookie_file = entry.ydl.params.get('cookiefile')
+        if not save_cookies and cookie_file:
+            # jar قدیمی نباید فایل کوکی جدید را بازنویسی کند
+            entry.ydl.params['cookiefile'] = None
+            cookie_file = None
+        before = _mtime(cookie_file)
+        try:
+            entry.ydl.close()
+        except Exception:
+            pass
+        if cookie_file:
+            with self._lock:
+                state = self._cookie_state.get(cookie_file)
+                if state is not None and state[0] == before:
+                    self._cookie_state[cookie_file] = (_mtime(cookie_file), state[1])
+
+    def _record(self, name: str, warm: bool):
+        self.stats['checkouts'] += 1
+        ns = self.name_stats.setdefault(name, {'checkouts': 0, 'warm_hits': 0})
+        ns['checkouts'] += 1
+        if warm:
+            self.stats['warm_hits'] += 1
+            ns['warm_hits'] += 1
+
+    @contextmanager
+    def checkout(self, opts: dict, name: str = 'default'):
+        """
+        دریافت انحصاری یک YoutubeDL برای این job (داخل thread اجرا شود)
+            with ytdlp_pool.checkout(ydl_opts, name='youtube_info') as ydl:
+                info = ydl.extract_info(url, download=False)
+        در صورت خطا نمونه دور انداخته می‌شود.
+        """
+        if not self.enabled:
+            self._record(name, warm=False)
+            with yt_dlp.YoutubeDL(opts) as ydl:
+                yield ydl
+            return
+
+        profile, job = self._split(opts)
+        cookie_file = profile.get('cookiefile')
+        generation = self._cookie_generation(cookie_file)
+        key = _profile_key(profile, generation)
+
+        entry = self._take(key)
+        warm = entry is not None
+        if entry is None:
+            entry = _Entry(yt_dlp.YoutubeDL(profile))
+            self.stats['created'] += 1
+
+        try:
+            applied = _apply_job(entry.ydl, job)
+        except Exception:
+            # مثلاً format نامعتبر → همان خطای YoutubeDL(opts)
+            self._close(entry)
+            raise
+
+        if not applied:
+            # نسخه yt-dlp اجازه تغییر گزینه‌های job را نمی‌دهد → نمونه تازه با همه گزینه‌ها
+            self.stats['unsupported'] += 1
+            self._close(entry)
+            self._record(name, warm=False)
+            with yt_dlp.YoutubeDL({**profile, **job}) as ydl:
+                yield ydl
+            return
+
+        self._record(name, warm)
+        try:
+            yield entry.ydl
+        except BaseException:
+            self.stats['discarded'] += 1
+            self._close(entry)
+            raise
+        entry.uses += 1
+        if cookie_file and self._cookie_state.get(cookie_file, (None, generation))[1] != generation:
+            # فایل کوکی در طول job عوض شده است
+            self.stats['recycled'] += 1
+            self._close(entry, save_cookies=False)
+        elif _apply_job(entry.ydl, {}):
+            # hook ها و closure های این job نگه داشته نشوند
+            self._give_back(key, entry, cookie_file)
+        else:
+            self._close(entry)
+
+    def close_all(self):
+        with self._lock:
+            entries = [e for idle in self._idle.values() for e in idle]
+            self._idle.clear()
+        for entry in entries:
+            self._close(entry)
+        logger.info(f"🔌 YtdlpPool closed ({len(entries)} idle instances)")
+
+    def get_stats(self) -> dict:
+        checkouts = self.stats['checkouts']
+        with self._lock:
+            idle = sum(len(v) for v in self._idle.values())
+            profiles = len(self._idle)
+        return {
+            **self.stats,
+            'idle': idle,
+            'profiles': profiles,
+            'warm_rate': (self.stats['warm_hits'] / checkouts * 100) if checkouts else 0.0,
+            'by_name': dict(self.name_stats),
+        }
+
+
+# 🔥 Global instance
+ytdlp_pool = YtdlpPool()
@@ -0,0 +1,316 @@
+"""
+yt-dlp Process Pool - اجرای extract/download در worker process های گرم
+استخراج yt-dlp (حل signature/JS، پارس JSON) CPU-bound است و در thread با event loop
+Pyrogram سر GIL رقابت می‌کند؛ حافظه‌ای که yt-dlp نگه می‌دارد هم هرگز آزاد نمی‌شود.
+
+- API مسدودکننده (extract/download) که از داخل همان thread های executor فعلی صدا زده می‌شود
+- هر worker بعد از YTDLP_PROCESS_MAX_JOBS کار بازیافت می‌شود (max_tasks_per_child)
+- داخل worker همان ytdlp_pool (نمونه‌های گرم YoutubeDL) استفاده می‌شود
+- progress دانلود از طریق multiprocessing.Queue به پروسه اصلی برمی‌گردد و hook های
+  progress_hooks اصلی را صدا می‌زند
+- postprocessor های ffmpeg در worker ها با یک semaphore مشترک محدود می‌شوند؛ postprocessor_hooks
+  به worker نمی‌رسد، پس FFMPEG_MAX_CONCURRENT تقسیم می‌شود: YTDLP_PROCESS_FFMPEG_SLOTS برای
+  worker ها و باقی برای FFmpegRunner پروسه اصلی (جمع هر دو همان سقف CPU است)
+- اگر pool خراب شود (BrokenProcessPool، خطای راه‌اندازی) تا YTDLP_PROCESS_COOLDOWN ثانیه
+  کارها در همان thread اجرا می‌شوند؛ گزینه‌های غیرقابل pickle هم همیشه در thread اجرا می‌شوند
+"""
+
+import itertools
+import multiprocessing
+import os
+import pickle
+import signal
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, List, Optional
+
+from plugins.logger_config import get_logger
+
+try:
+    from config import (
+        YTDLP_PROCESS_POOL_ENABLED, YTDLP_PROCESS_WORKERS,
+        YTDLP_PROCESS_MAX_JOBS, YTDLP_PROCESS_COOLDOWN,
+    )
+except Exception:
+    YTDLP_PROCESS_POOL_ENABLED = False
+    YTDLP_PROCESS_WORKERS = 2
+    YTDLP_PROCESS_MAX_JOBS = 25
+    YTDLP_PROCESS_COOLDOWN = 60
+
+try:
+    from config import YTDLP_PROCESS_FFMPEG_SLOTS
+except Exception:
+    YTDLP_PROCESS_FFMPEG_SLOTS = max(1, (os.cpu_count() or 2) // 4)
+
+logger = get_logger('ytdlp_process_pool')
+
+# hook هایی که در پروسه اصلی می‌مانند و به worker ارسال نمی‌شوند
+LOCAL_HOOK_KEYS = ('progress_hooks', 'postprocessor_hooks')
+PROGRESS_FIELDS = (
+    'status', 'downloaded_bytes', 'total_bytes', 'total_bytes_estimate',
+    'speed', 'eta', 'elapsed', 'filename', 'fragment_index', 'fragment_count',
+)
+PROGRESS_INTERVAL = 0.5  # seconds between forwarded 'downloading' events
+
+# ------------------------------------------------------------------- #
+# سمت worker
+
+_progress_queue = None
+_pp_semaphore = None
+
+
+class YtdlpWorkerError(Exception):
+    """خطای yt-dlp در worker (فقط پیام و نوع اصلی؛ traceback قابل pickle نیست)"""
+
+    def __init__(self, message: str, kind: str = ''):
+        super().__init__(message)
+        self.kind = kind
+
+    def __reduce__(self):
+        return (YtdlpWorkerError, (str(self), self.kind))
+
+
+def _worker_init(progress_queue, pp_semaphore):
+    global _progress_queue, _pp_semaphore
+    _progress_queue = progress_queue
+    _pp_semaphore = pp_semaphore
+    # Ctrl+C فقط به پروسه اصلی مربوط است؛ worker ها با shutdown executor بسته می‌شوند
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class _WorkerProgress:
+    """ارسال progress (با محدودیت نرخ) به پروسه اصلی"""
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.last_sent = 0.0
+
+    def hook(self, d: dict):
+        status = d.get('status')
+        now = time.time()
+        if status == 'downloading' and now - self.last_sent < PROGRESS_INTERVAL:
+            return
+        self.last_sent = now
+        try:
+            _progress_queue.put_nowait((self.job_id, {k: d.get(k) for k in PROGRESS_FIELDS}))
+        except Exception:
+            pass
+
+
+class _WorkerPostprocessorGate:
+    """معادل ffmpeg_runner.postprocessor_gate برای worker ها (semaphore بین پروسه‌ای)"""
+
+    def __init__(self):
+        self.held = False
+
+    def hook(self, d: dict):
+        from plugins.ffmpeg_runner import YTDLP_FFMPEG_POSTPROCESSORS
+        if (d.get('postprocessor') or '') not in YTDLP_FFMPEG_POSTPROCESSORS:
+            return
+        status = d.get('status')
+        if status == 'started' and not self.held:
+            _pp_semaphore.acquire()
+            self.held = True
+        elif status == 'finished' and self.held:
+            self.close()
+
+    def close(self):
+        if self.held:
+            self.held = False
+            _pp_semaphore.release()
+
+
+def _worker_run(job_id: Optional[str], url: str, opts: dict, download: bool, name: str):
+    from plugins.ytdlp_pool import ytdlp_pool
+
+    opts = dict(opts)
+    gate = None
+    if download:
+        gate = _WorkerPostprocessorGate()
+        opts['progress_hooks'] = [_WorkerProgress(job_id).hook]
+        opts['postprocessor_hooks'] = [gate.hook]
+    try:
+        with ytdlp_pool.checkout(opts, name=name) as ydl:
+            info = ydl.extract_info(url, download=download)
+            return ydl.sanitize_info(info)
+    except Exception as e:
+        raise YtdlpWorkerError(str(e), type(e).__name__) from None
+    finally:
+        if gate is not None:
+            gate.close()
+
+
+# ------------------------------------------------------------------- #
+# سمت پروسه اصلی
+
+def _run_local(url: str, opts: dict, download: bool, name: str):
+    from plugins.ytdlp_pool import ytdlp_pool
+
+    with ytdlp_pool.checkout(opts, name=name) as ydl:
+        return ydl.extract_info(url, download=download)
+
+
+class YtdlpProcessPool:
+    """backend اختیاری process pool برای yt-dlp با fallback به thread"""
+
+    def __init__(self, enabled: bool = YTDLP_PROCESS_POOL_ENABLED, workers: int = YTDLP_PROCESS_WORKERS,
+                 max_jobs: int = YTDLP_PROCESS_MAX_JOBS, cooldown: float = YTDLP_PROCESS_COOLDOWN):
+        self.enabled = enabled
+        self.workers = max(1, workers)
+        self.max_jobs = max(1, max_jobs)
+        self.cooldown = cooldown
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._queue = None
+        self._reader: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._listeners: Dict[str, List[Callable]] = {}
+        self._job_ids = itertools.count(1)
+        self._unhealthy_until = 0.0
+        self.last_error: Optional[str] = None
+        self.stats = {
+            'process_jobs': 0,
+            'thread_jobs': 0,
+            'failed': 0,
+            'not_picklable': 0,
+            'pool_restarts': 0,
+            'progress_events': 0,
+            'process_time_total': 0.0,
+        }
+        if enabled:
+            logger.info(f"✅ YtdlpProcessPool enabled (workers={self.workers}, max_jobs/worker={self.max_jobs})")
+
+    @property
+    def available(self) -> bool:
+        return self.enabled and time.time() >= self._unhealthy_until
+
+    def _ensure_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is not None:
+                return self._executor
+            ctx = multiprocessing.get_context('spawn')
+            self._queue = ctx.Queue()
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=ctx,
+                initializer=_worker_init,
+                initargs=(self._queue, ctx.BoundedSemaphore(max(1, YTDLP_PROCESS_FFMPEG_SLOTS))),
+                max_tasks_per_child=self.max_jobs,
+            )
+            self._reader = threading.Thread(
+                target=self._read_progress, args=(self._queue,),
+                name='ytdlp_progress_reader', daemon=True
+            )
+            self._reader.start()
+            logger.info(f"🚀 Started yt-dlp worker pool ({self.workers} processes)")
+            return self._executor
+
+    def _read_progress(self, queue):
+        """پخش progress های رسیده از worker ها به hook های اصلی"""
+        while True:
+            try:
+                item = queue.get()
+            except (EOFError, OSError):
+                return
+            if item is None:
+                return
+            job_id, payload = item
+            self.stats['progress_events'] += 1
+            for hook in self._listeners.get(job_id, ()):
+                try:
+                    hook(payload)
+                except Exception as e:
+                    logger.debug(f"Progress hook error: {e}")
+
+    def _mark_unhealthy(self, error: Exception):
+        self.last_error = f"{type(error).__name__}: {error}"
+        self._unhealthy_until = time.time() + self.cooldown
+        logger.error(f"❌ yt-dlp worker pool unhealthy, using threads for {self.cooldown}s: {self.last_error}")
+        self._shutdown(wait=False)
+        self.stats['pool_restarts'] += 1
+
+    def _shutdown(self, wait: bool):
+        with self._lock:
+            executor, queue = self._executor, self._queue
+            self._executor = None
+            self._queue = None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+        if queue is not None:
+            try:
+                queue.put_nowait(None)
+            except Exception:
+                pass
+
+    def _run(self, url: str, opts: dict, download: bool, name: str):
+        if not self.available:
+            self.stats['thread_jobs'] += 1
+            return _run_local(url, opts, download, name)
+
+        wire_opts = {k: v for k, v in opts.items() if k not in LOCAL_HOOK_KEYS}
+        try:
+            pickle.dumps(wire_opts)
+        except Exception as e:
+            self.stats['not_picklable'] += 1
+            self.stats['thread_jobs'] += 1
+            logger.debug(f"Options not picklable ({e}), running {name} in thread")
+            return _run_local(url, opts, download, name)
+
+        job_id = f"{name}-{next(self._job_ids)}" if download else None
+        if job_id:
+            self._listeners[job_id] = list(opts.get('progress_hooks') or [])
+
+        start = time.time()
+        try:
+            future = self._ensure_executor().submit(_worker_run, job_id, url, wire_opts, download, name)
+            result = future.result()
+        except YtdlpWorkerError:
+            self.stats['failed'] += 1
+            raise
+        except (BrokenProcessPool, OSError, RuntimeError) as e:
+            # خرابی خود pool (نه خطای yt-dlp) → اجرای همین کار در thread
+            self._mark_unhealthy(e)
+            self.stats['thread_jobs'] += 1
+            return _run_local(url, opts, download, name)
+        finally:
+            if job_id:
+                self._listeners.pop(job_id, None)
+
+        self.stats['process_jobs'] += 1
+        self.stats['process_time_total'] += time.time() - start
+        return result
+
+    def extract(self, url: str, opts: dict, name: str = 'process_extract') -> Optional[dict]:
+        """
+        extract_info(url, download=False) - مسدودکننده، داخل thread executor صدا زده شود
+        خروجی در حالت process همان info dict پاکسازی‌شده (sanitize_info) است.
+        """
+        return self._run(url, opts, False, name)
+
+    def download(self, url: str, opts: dict, name: str = 'process_download') -> Optional[dict]:
+        """
+        extract_info(url, download=True) - مسدودکننده، داخل thread executor صدا زده شود
+        progress_hooks در پروسه اصلی (thread خواننده صف) صدا زده می‌شوند؛
+        postprocessor_hooks محلی فقط در حالت thread اجرا می‌شوند.
+        """
+        return self._run(url, opts, True, name)
+
+    def close(self):
+        self._shutdown(wait=False)
+
+    def get_stats(self) -> dict:
+        jobs = self.stats['process_jobs']
+        return {
+            **self.stats,
+            'enabled': self.enabled,
+            'healthy': self.available,
+            'running': self._executor is not None,
+            'workers': self.workers,
+            'avg_process_time': self.stats['process_time_total'] / jobs if jobs else 0.0,
+            'last_error': self.last_error,
+        }
+
+
+# 🔥 Global instance
+ytdlp_process_pool = YtdlpProcessPool()
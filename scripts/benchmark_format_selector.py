@@ -0,0 +1,437 @@
+#!/usr/bin/env python3
+"""
+بنچمارک انتخاب فرمت یوتیوب (replay)
+info dict های ضبط شده yt-dlp را روی پیاده‌سازی قبلی (چند بار پیمایش formats)
+و youtube_format_selector (ایندکس یک‌باره) اجرا می‌کند، خروجی‌ها را مقایسه و زمان را گزارش می‌دهد.
+
+استفاده:
+    # ضبط info dict ها (نیاز به yt-dlp و اینترنت)
+    python scripts/benchmark_format_selector.py --record URL [URL ...] --out scripts/format_fixtures
+    # اجرای بنچمارک روی فایل‌ها یا پوشه‌ها (.json / .jsonl خروجی yt-dlp --dump-json)
+    python scripts/benchmark_format_selector.py scripts/format_fixtures --iterations 200
+    # بدون fixture: info dict های مصنوعی
+    python scripts/benchmark_format_selector.py --synthetic 20
+
+در صورت تفاوت خروجی دو پیاده‌سازی، با کد 1 خارج می‌شود؛ فقط تفاوت‌های عمدی فهرست
+INTENDED_DIFFERENCES (ترجیح AAC، transcode_policy) جدا شمرده می‌شوند و خطا نیستند.
+"""
+
+import argparse
+import glob
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import time
+from typing import Optional
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from plugins.youtube_format_selector import SUPPORTED_QUALITIES, select_qualities  # noqa: E402
+
+logging.getLogger('youtube_format_selector').disabled = True
+
+
+# ------------------------------------------------------------------- #
+# پیاده‌سازی مرجع (حلقه قبلی extract_video_info)
+def legacy_select_qualities(formats: list) -> dict:
+    available_qualities: dict = {}
+
+    # ------------------------------------------------------------------- #
+    # بررسی کیفیت‌های درخواست‌شده
+    for quality in SUPPORTED_QUALITIES:
+        target_height = int(quality)
+
+        # 1️⃣  قالب ترکیبی (video + audio در یک فایل)
+        combined_formats = [
+            f for f in formats
+            if f.get('vcodec') != 'none'
+            and f.get('acodec') != 'none'
+            and f.get('height') == target_height
+            and f.get('ext') in ['mp4', 'webm']
+        ]
+
+        # انعطاف‑پذیری ±10px
+        if not combined_formats:
+            combined_formats = [
+                f for f in formats
+                if f.get('vcodec') != 'none'
+                and f.get('acodec') != 'none'
+                and f.get('height') is not None
+                and isinstance(f.get('height'), (int, float))
+                and abs(int(f.get('height')) - target_height) <= 10
+                and f.get('ext') in ['mp4', 'webm']
+            ]
+
+        # شورت‌س (portrait) → نگاشت به landscape
+        if not combined_formats:
+            portrait_map = {
+                360: [640, 426, 256],
+                480: [854, 640, 426],
+                720: [1280, 854],
+                1080: [1920, 1280],
+            }
+            if target_height in portrait_map:
+                for ph in portrait_map[target_height]:
+                    combined_formats = [
+                        f for f in formats
+                        if f.get('vcodec') != 'none'
+                        and f.get('acodec') != 'none'
+                        and f.get('height') == ph
+                        and f.get('ext') in ['mp4', 'webm']
+                    ]
+                    if combined_formats:
+                        break
+
+        # ----------------------------------------------------------- #
+        if combined_formats:
+            combined_formats.sort(
+                key=lambda x: (x.get('fps', 0) or 0,
+                               x.get('tbr', 0) or 0),
+                reverse=True
+            )
+            best = combined_formats[0]
+            available_qualities[quality] = {
+                'format_string': best['format_id'],
+                'filesize': best.get('filesize', 0) or 0,
+                'fps': best.get('fps', 30),
+                'ext': best.get('ext', 'mp4'),
+                'type': 'combined',
+                'actual_height': best.get('height'),
+                'actual_width': best.get('width')
+            }
+            continue
+
+        # 2️⃣  قالب جداگانه (video + audio)
+        #   ↳ اینجا بود که در نسخهٔ قبلی متغیر `height` تعریف نشده بود
+        video_formats = [
+            f for f in formats
+            if f.get('vcodec') != 'none'
+            and f.get('acodec') == 'none'
+            and f.get('height') == target_height
+            and f.get('ext') in ['mp4', 'webm']
+        ]
+
+        # ±10px برای video‑only
+        if not video_formats:
+            video_formats = [
+                f for f in formats
+                if f.get('vcodec') != 'none'
+                and f.get('acodec') == 'none'
+                and f.get('height') is not None
+                and isinstance(f.get('height'), (int, float))
+                and abs(int(f.get('height')) - target_height) <= 10
+                and f.get('ext') in ['mp4', 'webm']
+            ]
+
+        # Portrait‑mapping برای video‑only
+        if not video_formats:
+            portrait_map = {
+                360: [640, 426, 256],
+                480: [854, 640, 426],
+                720: [1280, 854],
+                1080: [1920, 1280],
+            }
+            if target_height in portrait_map:
+                for ph in portrait_map[target_height]:
+                    video_formats = [
+                        f for f in formats
+                        if f.get('vcodec') != 'none'
+                        and f.get('acodec') == 'none'
+                        and f.get('height') == ph
+                        and f.get('ext') in ['mp4', 'webm']
+                    ]
+                    if video_formats:
+                        break
+
+        if not video_formats:
+            # هیچ فایلی یافت نشد → به کیفیت‌های دیگر می‌رویم
+            continue
+
+        # پیدا کردن بهترین صدا برای این ویدیو
+        audio_formats = [
+            f for f in formats
+            if f.get('acodec') != 'none'
+            and f.get('vcodec') == 'none'
+            and f.get('ext') in ['m4a', 'webm']
+        ]
+
+        if not audio_formats:
+            # اگر صدا جداگانه نداشت، شاید در قالب ترکیبی باشد؛ پس ادامه می‌دهیم
+            continue
+
+        video_formats.sort(
+            key=lambda x: (x.get('fps', 0) or 0,
+                           x.get('tbr', 0) or 0),
+            reverse=True
+        )
+        audio_formats.sort(
+            key=lambda x: x.get('abr', 0) or 0,
+            reverse=True
+        )
+        best_video = video_formats[0]
+        best_audio = audio_formats[0]
+
+        available_qualities[quality] = {
+            'video_id': best_video['format_id'],
+            'audio_id': best_audio['format_id'],
+            'format_string': f"{best_video['format_id']}+{best_audio['format_id']}",
+            'filesize': (best_video.get('filesize', 0) or 0) +
+                        (best_audio.get('filesize', 0) or 0),
+            'fps': best_video.get('fps', 30),
+            'ext': 'mp4',
+            'type': 'separate',
+            'actual_height': best_video.get('height'),
+            'actual_width': best_video.get('width')
+        }
+
+    # ------------------------------------------------------------------- #
+    # گزینهٔ فقط صدا
+    audio_formats = [
+        f for f in formats
+        if f.get('acodec') != 'none' and f.get('vcodec') == 'none'
+    ]
+
+    if not audio_formats:
+        audio_formats = [
+            f for f in formats
+            if f.get('acodec') != 'none' and f.get('ext') in ['mp4', 'webm', 'm4a']
+        ]
+
+    if audio_formats:
+        audio_formats.sort(
+            key=lambda x: x.get('abr', 0) or x.get('tbr', 0) or 0,
+            reverse=True
+        )
+        best_audio = audio_formats[0]
+        available_qualities['audio'] = {
+            'format_string': 'bestaudio',
+            'filesize': best_audio.get('filesize', 0) or 0,
+            'ext': 'mp3',      # خروجی نهایی تبدیل به mp3 خواهد شد
+            'type': 'audio_only'
+        }
+    else:
+        available_qualities['audio'] = {
+            'format_string': 'best',
+            'filesize': 0,
+            'ext': 'mp3',
+            'type': 'audio_only'
+        }
+
+    return available_qualities
+
+
+# ------------------------------------------------------------------- #
+# تفاوت‌های عمدی با مرجع (مرجع دست نمی‌خورد تا واگرایی ناخواسته دیده شود)
+INTENDED_DIFFERENCES = (
+    "separate: audio_id = بهترین صدای AAC (m4a / mp4a) وقتی انتخاب مرجع AAC نیست؛ "
+    "format_string و filesize تابع همین صدا",
+    "audio: ext = 'm4a' وقتی بهترین صدا AAC است (مرجع همیشه 'mp3')؛ filesize همان صدای AAC",
+)
+
+
+def _is_aac(f: Optional[dict]) -> bool:
+    return bool(f) and (f.get('ext') == 'm4a' or (f.get('acodec') or '').startswith('mp4a'))
+
+
+def _best_aac(candidates: list, rate) -> Optional[dict]:
+    """بهترین صدای AAC با همان قاعده مرجع (بیشترین rate، در تساوی اولی در لیست)"""
+    aac = sorted((f for f in candidates if _is_aac(f)), key=rate, reverse=True)
+    return aac[0] if aac else None
+
+
+def expected_aac_audio(formats: list) -> Optional[dict]:
+    """صدای مورد انتظار برای قالب‌های separate (استخر صدای مرجع، فقط AAC)"""
+    pool = [f for f in formats
+            if f.get('acodec') != 'none' and f.get('vcodec') == 'none' and f.get('ext') in ['m4a', 'webm']]
+    return _best_aac(pool, lambda x: x.get('abr', 0) or 0)
+
+
+def expected_aac_audio_only(formats: list) -> Optional[dict]:
+    """صدای مورد انتظار برای گزینه audio (استخر صدای مرجع، فقط AAC)"""
+    pool = [f for f in formats if f.get('acodec') != 'none' and f.get('vcodec') == 'none']
+    if not pool:
+        pool = [f for f in formats if f.get('acodec') != 'none' and f.get('ext') in ['mp4', 'webm', 'm4a']]
+    return _best_aac(pool, lambda x: x.get('abr', 0) or x.get('tbr', 0) or 0)
+
+
+def is_intended_difference(quality: str, legacy: Optional[dict], actual: Optional[dict], formats: list) -> bool:
+    """
+    آیا تفاوت این کیفیت دقیقاً یکی از INTENDED_DIFFERENCES است؟
+    صدای AAC مورد انتظار از formats محاسبه می‌شود؛ هر AAC دیگری (مثلاً بدترین m4a) mismatch است.
+    """
+    if not legacy or not actual:
+        return False
+    if quality == 'audio':
+        aac = expected_aac_audio_only(formats)
+        return aac is not None and actual == {**legacy, 'ext': 'm4a', 'filesize': aac.get('filesize', 0) or 0}
+    if legacy.get('type') != 'separate' or actual.get('type') != 'separate':
+        return False
+    by_id = {f.get('format_id'): f for f in formats}
+    aac = expected_aac_audio(formats)
+    if aac is None or _is_aac(by_id.get(legacy.get('audio_id'))):
+        return False
+    video = by_id.get(legacy.get('video_id')) or {}
+    return actual == {
+        **legacy,
+        'audio_id': aac['format_id'],
+        'format_string': f"{legacy['video_id']}+{aac['format_id']}",
+        'filesize': (video.get('filesize', 0) or 0) + (aac.get('filesize', 0) or 0),
+    }
+
+
+# ------------------------------------------------------------------- #
+def load_info_dicts(paths: list) -> list:
+    """خواندن info dict ها از فایل‌های .json/.jsonl یا پوشه‌ها → [(name, info)]"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(glob.glob(os.path.join(path, '*.json')) + glob.glob(os.path.join(path, '*.jsonl')))
+        else:
+            files.append(path)
+
+    infos = []
+    for file_path in files:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            if file_path.endswith('.jsonl'):
+                for n, line in enumerate(f, 1):
+                    if line.strip():
+                        infos.append((f"{os.path.basename(file_path)}:{n}", json.loads(line)))
+            else:
+                data = json.load(f)
+                for n, info in enumerate(data if isinstance(data, list) else [data], 1):
+                    infos.append((os.path.basename(file_path) if not isinstance(data, list)
+                                  else f"{os.path.basename(file_path)}:{n}", info))
+    return infos
+
+
+def record(urls: list, out_dir: str):
+    """ضبط info dict های yt-dlp برای replay"""
+    import yt_dlp
+
+    os.makedirs(out_dir, exist_ok=True)
+    opts = {'quiet': True, 'no_warnings': True, 'skip_download': True}
+    cookie_file = os.environ.get('YTDLP_COOKIE_FILE')
+    if cookie_file:
+        opts['cookiefile'] = cookie_file
+    with yt_dlp.YoutubeDL(opts) as ydl:
+        for url in urls:
+            try:
+                info = ydl.sanitize_info(ydl.extract_info(url, download=False))
+            except Exception as e:
+                print(f"❌ {url}: {e}")
+                continue
+            out_path = os.path.join(out_dir, f"{info.get('id', 'video')}.json")
+            with open(out_path, 'w', encoding='utf-8') as f:
+                json.dump({'id': info.get('id'), 'title': info.get('title'),
+                           'formats': info.get('formats', [])}, f, ensure_ascii=False)
+            print(f"💾 {url} → {out_path} ({len(info.get('formats', []))} formats)")
+
+
+def synthetic_info(seed: int) -> dict:
+    """info dict مصنوعی شبیه یوتیوب (landscape/portrait، combined/video-only/audio-only)"""
+    rnd = random.Random(seed)
+    portrait = rnd.random() < 0.25
+    heights = [144, 240, 360, 480, 720, 1080, 1440, 2160]
+    formats = []
+    fid = 100
+    for ext, acodec in (('m4a', 'mp4a.40.2'), ('webm', 'opus'), ('m4a', 'mp4a.40.5'), ('webm', 'opus')):
+        fid += 1
+        formats.append({'format_id': str(fid), 'ext': ext, 'vcodec': 'none', 'acodec': acodec,
+                        'abr': rnd.choice([48, 64, 128, 160]), 'filesize': rnd.randint(1, 9) * 10 ** 6})
+    for h in heights:
+        for ext, vcodec in (('mp4', 'avc1.4d401f'), ('webm', 'vp9'), ('mp4', 'av01.0.05M.08')):
+            fid += 1
+            height = int(h * 16 / 9) if portrait else h + rnd.choice([0, 0, 0, -4, 6])
+            formats.append({'format_id': str(fid), 'ext': ext, 'vcodec': vcodec, 'acodec': 'none',
+                            'height': height, 'width': h if portrait else int(h * 16 / 9),
+                            'fps': rnd.choice([24, 30, 60]), 'tbr': round(rnd.uniform(100, 9000), 1),
+                            'filesize': rnd.choice([None, rnd.randint(5, 900) * 10 ** 6])})
+    fid += 1
+    formats.append({'format_id': '18', 'ext': 'mp4', 'vcodec': 'avc1.42001E', 'acodec': 'mp4a.40.2',
+                    'height': 640 if portrait else 360, 'width': 360 if portrait else 640,
+                    'fps': 30, 'tbr': 500.0})
+    formats.append({'format_id': 'sb0', 'ext': 'mhtml', 'vcodec': 'none', 'acodec': 'none'})
+    rnd.shuffle(formats)
+    return {'id': f"synthetic{seed}", 'formats': formats}
+
+
+def _time_call(func, formats: list, iterations: int) -> list:
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func(formats)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def _p95(samples: list) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+
+def run_benchmark(infos: list, iterations: int) -> int:
+    mismatches = 0
+    intended = 0
+    legacy_all, indexed_all = [], []
+
+    print(f"{'fixture':<28}{'formats':>8}{'legacy µs':>12}{'indexed µs':>12}{'speedup':>9}  match")
+    for name, info in infos:
+        formats = info.get('formats') or []
+        expected = legacy_select_qualities(formats)
+        actual = select_qualities(formats)
+        diffs = [q for q in list(SUPPORTED_QUALITIES) + ['audio'] if expected.get(q) != actual.get(q)]
+        unintended = [q for q in diffs if not is_intended_difference(q, expected.get(q), actual.get(q), formats)]
+        if unintended:
+            mismatches += 1
+        elif diffs:
+            intended += 1
+
+        legacy = _time_call(legacy_select_qualities, formats, iterations)
+        indexed = _time_call(select_qualities, formats, iterations)
+        legacy_all += legacy
+        indexed_all += indexed
+        legacy_mean = statistics.mean(legacy) * 1e6
+        indexed_mean = statistics.mean(indexed) * 1e6
+        speedup = legacy_mean / indexed_mean if indexed_mean else 0.0
+        print(f"{name[:27]:<28}{len(formats):>8}{legacy_mean:>12.1f}{indexed_mean:>12.1f}{speedup:>8.1f}x  "
+              f"{'❌' if unintended else '✅*' if diffs else '✅'}")
+        for q in unintended:
+            print(f"    {q}: legacy={expected.get(q)}")
+            print(f"    {q}: indexed={actual.get(q)}")
+
+    if legacy_all:
+        print("-" * 75)
+        print(f"legacy : mean {statistics.mean(legacy_all) * 1e6:.1f}µs  p95 {_p95(legacy_all) * 1e6:.1f}µs")
+        print(f"indexed: mean {statistics.mean(indexed_all) * 1e6:.1f}µs  p95 {_p95(indexed_all) * 1e6:.1f}µs")
+    print(f"fixtures: {len(infos)}, mismatches: {mismatches}, intended differences (✅*): {intended}")
+    if intended:
+        for rule in INTENDED_DIFFERENCES:
+            print(f"  * {rule}")
+    return 1 if mismatches else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay benchmark for the YouTube format selector")
+    parser.add_argument('paths', nargs='*', help="info dict files (.json/.jsonl) or directories")
+    parser.add_argument('--iterations', type=int, default=100)
+    parser.add_argument('--synthetic', type=int, default=0, help="add N synthetic info dicts")
+    parser.add_argument('--record', nargs='+', metavar='URL', help="record info dicts with yt-dlp and exit")
+    parser.add_argument('--out', default='scripts/format_fixtures', help="output directory for --record")
+    args = parser.parse_args()
+
+    if args.record:
+        record(args.record, args.out)
+        return 0
+
+    infos = load_info_dicts(args.paths)
+    infos += [(f"synthetic-{i}", synthetic_info(i)) for i in range(args.synthetic)]
+    if not infos:
+        parser.error("no fixtures: pass paths, or --synthetic N")
+    return run_benchmark(infos, max(1, args.iterations))
+
+
+if __name__ == '__main__':
+    sys.exit(main())